@@ -1,8 +1,11 @@
 use clap::{ArgAction, Parser, Subcommand};
 use directories::ProjectDirs;
-use std::{collections::HashMap, fs::File, path::PathBuf};
+use std::{collections::HashMap, fs::File, path::{Path, PathBuf}};
 
-use tagcore::Workspace;
+use tagcore::{Durability, Profiler, Retag, TagFileFormat, Workspace};
+
+/// Most tag files kept in memory at once, while a command works on single files
+const LAZY_TAGFILES: usize = 64;
 
 #[derive(Parser)]
 #[command(name = "tag-cli")]
@@ -10,6 +13,18 @@ use tagcore::Workspace;
 struct Cli {
     #[command(subcommand)]
     command: Commands,
+
+    #[arg(short = 'j', long, global = true, default_value_t = 1, help = "Threads used to scan the workspace for tag files (0 = one per core)")]
+    threads: usize,
+
+    #[arg(long, global = true, default_value = "none", help = "Whether writes to tag files are fsynced: none, file or file-and-dir")]
+    durability: Durability,
+
+    #[arg(long, global = true, help = "Print the time spent in each phase (scan, parse, query, save...) to stderr once done")]
+    profile: bool,
+
+    #[arg(long, global = true, value_name = "FILE", help = "Also write every timed span to FILE, as a Chrome trace (chrome://tracing or ui.perfetto.dev). Implies --profile")]
+    profile_trace: Option<PathBuf>,
 }
 
 #[derive(Subcommand)]
@@ -26,16 +41,22 @@ enum Commands {
         name: String
     },
 
-    #[command(about = "Adds listed tags to a file")]
+    #[command(about = "Adds listed tags to a file, or to many files with --glob or --stdin")]
     Add {
-        #[arg(required = true, help = "The file to add tags to")]
-        file_name: String,
+        #[arg(required_unless_present_any = ["glob", "stdin"], help = "The file to add tags to. With --glob or --stdin, the first tag instead")]
+        file_name: Option<String>,
 
         #[arg(required = false, num_args = 1, help = "Tags to add (defaults to Simple tags)")]
         simple: Vec<String>,
 
         #[arg(short, long, required = false, num_args = 2, value_names = &["KEY", "VALUE"], help = "Specified next two entries are a Key-Value pair")]
-        kv: Vec<String>
+        kv: Vec<String>,
+
+        #[arg(short, long, value_name = "PATTERN", help = "Adds the tags to every file matching a pattern, such as 'assets/**/*.png' (quote it so the shell does not expand it)")]
+        glob: Option<String>,
+
+        #[arg(long, action = ArgAction::SetTrue, help = "Adds the tags to every file listed on stdin, one path per line")]
+        stdin: bool
     },
 
     #[command(about = "Removes specified tags from files")]
@@ -65,6 +86,50 @@ enum Commands {
     #[command(about = "Outputs the name of the current-open workspace")]
     Name {
 
+    },
+
+    #[command(about = "Rewrites every tag file in the workspace in the given format. Either format can always be read")]
+    Migrate {
+        #[arg(required = true, help = "The format to convert tag files to: toml or binary")]
+        format: TagFileFormat
+    },
+
+    #[command(about = "Moves or renames a file, keeping its tags")]
+    Mv {
+        #[arg(required = true, help = "The file to move")]
+        from: String,
+
+        #[arg(required = true, help = "Where to move it to, within the workspace")]
+        to: String
+    },
+
+    #[command(about = "Finds tagged files that were moved or renamed by other programs, and moves their tags along")]
+    Reconcile {
+
+    },
+
+    #[command(about = "Lists every tag in the workspace with the number of files carrying it, or the most used tags starting with a prefix")]
+    Tags {
+        #[arg(required = false, help = "Only list tags starting with this text (ignoring case), most used first. 'Key:' lists the values of Key")]
+        prefix: Option<String>,
+
+        #[arg(short = 'n', long, default_value_t = 20, help = "Most tags listed when a prefix is given")]
+        limit: usize
+    },
+
+    #[command(about = "Renames, merges or deletes tags on every file of the workspace, rewriting only the tag files that change")]
+    Retag {
+        #[arg(required = true, help = "The tags to change, as Simple or Key:Value (keys with --key). Several tags renamed --to the same one are merged")]
+        from: Vec<String>,
+
+        #[arg(short, long, value_name = "TAG", required_unless_present = "delete", help = "What to rename them to, written the same way")]
+        to: Option<String>,
+
+        #[arg(short, long, action = ArgAction::SetTrue, conflicts_with = "to", help = "Removes them from every file instead")]
+        delete: bool,
+
+        #[arg(long, action = ArgAction::SetTrue, help = "Changes keys instead: every Key:Value tag using them, keeping the values")]
+        key: bool
     }
 }
 
@@ -85,7 +150,10 @@ struct SearchArgs {
     #[arg(short, help="Include Values from Key-Value tags")]
     values_on: bool,
 
-    #[arg(required = true)]
+    #[arg(long, conflicts_with_all = ["exact", "fuzzy", "simple_on", "key_on", "values_on", "tags"], help = "Search with a query instead, such as 'Texture:Verso AND NOT Due:Today OR Personal'. Terms: Simple, Key:Value, Key:*, *:Value")]
+    expr: Option<String>,
+
+    #[arg(required_unless_present = "expr")]
     tags: Vec<String>
 }
 
@@ -101,25 +169,49 @@ impl SearchArgs {
 }
 
 fn main() {
+    let cli = Cli::parse();
+    if cli.profile || cli.profile_trace.is_some() {
+        Profiler::enable(cli.profile_trace.is_some());
+    }
+
     let mut workspace = load_workspace_from_storage();
     if let Some(ref mut w) = workspace {
-        w.scan_for_tagfiles();
+        // Commands on single files only load the tag files they touch. Searches load all of them.
+        w.set_scan_threads(cli.threads);
+        w.set_durability(cli.durability);
+        let _ = w.enable_lazy_loading(LAZY_TAGFILES); // Cannot fail, nothing was changed yet
     }
 
-    let cli = Cli::parse();
-
     match cli.command {
         Commands::Open { name } => set_open_workspace_file(&name),
         Commands::Create { name  } => create_set_workspace_file(&name),
-        Commands::Add { file_name, simple, kv } => add_tags_to_file(&mut workspace, &file_name, &simple, &kv),
+        Commands::Add { file_name, simple, kv, glob, stdin } => {
+            if glob.is_some() || stdin {
+                // Every positional argument is a tag
+                let simple: Vec<String> = file_name.into_iter().chain(simple).collect();
+                add_tags_to_files(&mut workspace, glob.as_deref(), stdin, &simple, &kv);
+            } else if let Some(file_name) = file_name {
+                add_tags_to_file(&mut workspace, &file_name, &simple, &kv);
+            }
+        },
         Commands::Remove { file_name, all_remove, simple, kv } => remove_tags_from_file(&mut workspace, all_remove, &file_name, &simple, &kv),
-        Commands::Show { file_names  } => show_tags_for_file(&workspace, &file_names),
+        Commands::Show { file_names  } => show_tags_for_file(&mut workspace, &file_names),
         Commands::Search(search_args) => {
             let search_args: SearchArgs = search_args.normalize();
-            search(&workspace, &search_args);
+            search(&mut workspace, &search_args);
         },
         Commands::Name {  } => show_workspace_name(&workspace),
+        Commands::Migrate { format } => migrate_tagfiles(&mut workspace, format),
+        Commands::Mv { from, to } => move_file(&mut workspace, &from, &to),
+        Commands::Reconcile {  } => reconcile(&mut workspace),
+        Commands::Tags { prefix, limit } => list_tags(&mut workspace, prefix.as_deref(), limit),
+        Commands::Retag { from, to, delete: _, key } => retag(&mut workspace, &from, to.as_deref(), key),
     };
+
+    if Profiler::is_enabled() {
+        drop(workspace); // Includes any writes made when the workspace is dropped
+        print_profile(cli.profile_trace.as_deref());
+    }
 }
 
 fn load_workspace_from_storage() -> Option<Workspace> {
@@ -243,6 +335,8 @@ fn add_tags_to_file(workspace: &mut Option<Workspace>, file_name: &String, simpl
         // TODO - validate?
     }
 
+    // Every tag is added in memory, then the tag file is written once
+    workspace.begin_batch();
     for simple_tag in simple {
         match workspace.add_tag_to_file(path.clone(), simple_tag.clone(), None) {
             Ok(_) => (),
@@ -265,6 +359,45 @@ fn add_tags_to_file(workspace: &mut Option<Workspace>, file_name: &String, simpl
             }
         }
     }
+    if let Err(error) = workspace.commit_batch() {
+        println!("ERROR when saving tags: {}", error.to_string());
+    }
+}
+
+fn add_tags_to_files(workspace: &mut Option<Workspace>, glob: Option<&str>, stdin: bool, simple: &Vec<String>, kv: &Vec<String>) {
+    let Some(workspace) = workspace else {
+        // TODO - error out
+        return;
+    };
+
+    let mut paths: Vec<PathBuf> = Vec::new();
+    if let Some(pattern) = glob {
+        match workspace.find_files(Path::new("."), pattern) {
+            Ok(found) => paths.extend(found),
+            Err(error) => {
+                println!("ERROR when finding files: {}", error.to_string());
+                return;
+            }
+        }
+    }
+    if stdin {
+        for line in std::io::stdin().lines().map_while(Result::ok) {
+            let line = line.trim();
+            if !line.is_empty() {
+                paths.push(PathBuf::from(".").join(line));
+            }
+        }
+    }
+
+    let tags: Vec<tagcore::Tag> = simple.iter()
+        .map(|s| tagcore::Tag::Simple(s.clone()))
+        .chain(kv.chunks_exact(2).map(|chunk| tagcore::Tag::KV(chunk[0].clone(), chunk[1].clone())))
+        .collect();
+    let file_count = paths.len();
+    match workspace.apply_bulk(paths.into_iter().map(|path| (path, tags.clone())).collect()) {
+        Ok(changed) => println!("Tagged {} file(s), {} changed", file_count, changed),
+        Err(error) => println!("ERROR when adding tags: {}", error.to_string()),
+    }
 }
 
 fn remove_tags_from_file(workspace: &mut Option<Workspace>, all_remove: bool, file_name: &String, simple: &Vec<String>, kv: &Vec<String>) {
@@ -277,6 +410,15 @@ fn remove_tags_from_file(workspace: &mut Option<Workspace>, all_remove: bool, fi
         // TODO - validate?
     }
 
+    // Every tag is removed in memory, then the tag file is written once
+    workspace.begin_batch();
+    remove_tags_in_batch(workspace, all_remove, &path, simple, kv);
+    if let Err(error) = workspace.commit_batch() {
+        println!("ERROR when saving tags: {}", error.to_string());
+    }
+}
+
+fn remove_tags_in_batch(workspace: &mut Workspace, all_remove: bool, path: &PathBuf, simple: &Vec<String>, kv: &Vec<String>) {
     if all_remove {
         let Ok(vec) = workspace.get_tags_for_file_name(path.clone()) else {
             return; //TODO - error out
@@ -321,7 +463,7 @@ fn remove_tags_from_file(workspace: &mut Option<Workspace>, all_remove: bool, fi
     }
 }
 
-fn show_tags_for_file(workspace: &Option<Workspace>, file_names: &Vec<String>) {
+fn show_tags_for_file(workspace: &mut Option<Workspace>, file_names: &Vec<String>) {
     let Some(workspace) = workspace else {
         // TODO - error out
         return;
@@ -359,14 +501,23 @@ fn show_tags_for_file(workspace: &Option<Workspace>, file_names: &Vec<String>) {
     }
 }
 
-fn search(workspace: &Option<Workspace>, search_args: &SearchArgs) {
+fn search(workspace: &mut Option<Workspace>, search_args: &SearchArgs) {
     let Some(workspace) = workspace else {
         // TODO - error out
         return;
     };
 
     let mut map = HashMap::<String, Vec<tagcore::Tag>>::new();
-    if search_args.exact {
+    if let Some(expr) = &search_args.expr {
+        match workspace.query(expr) {
+            Ok(result) => map = result,
+            Err(error) => {
+                println!("ERROR in query: {}", error.to_string());
+                return;
+            }
+        }
+    }
+    else if search_args.exact {
         for arg in &search_args.tags {
             let result = workspace.query_exact(&arg, search_args.simple_on, search_args.key_on, search_args.values_on);
             map.extend(result);
@@ -401,4 +552,109 @@ fn show_workspace_name(workspace: &Option<Workspace>) {
         Some(w) => println!("{}", w.get_name()),
         None => println!("No workspace opened"),
     }
-}
\ No newline at end of file
+}
+
+fn migrate_tagfiles(workspace: &mut Option<Workspace>, format: TagFileFormat) {
+    let Some(workspace) = workspace else {
+        // TODO - error out
+        return;
+    };
+
+    match workspace.migrate_tagfiles(format) {
+        Ok(converted) => println!("Converted {} tag file(s) to {}", converted, format),
+        Err(error) => println!("ERROR when converting tag files: {}", error.to_string()),
+    }
+}
+
+fn move_file(workspace: &mut Option<Workspace>, from: &String, to: &String) {
+    let Some(workspace) = workspace else {
+        // TODO - error out
+        return;
+    };
+
+    let mut to = PathBuf::from(".").join(to);
+    if to.is_dir() {
+        if let Some(file_name) = Path::new(from).file_name() {
+            to = to.join(file_name);
+        }
+    }
+    match workspace.move_file(PathBuf::from(".").join(from), to) {
+        Ok(_) => (),
+        Err(error) => println!("ERROR when moving file: {}", error.to_string()),
+    }
+}
+
+fn reconcile(workspace: &mut Option<Workspace>) {
+    let Some(workspace) = workspace else {
+        // TODO - error out
+        return;
+    };
+
+    match workspace.reconcile() {
+        Ok(relinked) => {
+            for (from, to) in &relinked {
+                println!("{} -> {}", from.display(), to.display());
+            }
+            println!("Moved the tags of {} file(s)", relinked.len());
+        },
+        Err(error) => println!("ERROR when reconciling tags: {}", error.to_string()),
+    }
+}
+
+fn list_tags(workspace: &mut Option<Workspace>, prefix: Option<&str>, limit: usize) {
+    let Some(workspace) = workspace else {
+        // TODO - error out
+        return;
+    };
+
+    if let Some(prefix) = prefix {
+        for (text, count) in workspace.suggest(prefix, limit) {
+            println!("{} -- {}", text, count);
+        }
+        return;
+    }
+    for (tag, count) in workspace.tag_counts() {
+        let text: String = match tag {
+            tagcore::Tag::Simple(s) => s,
+            tagcore::Tag::KV(k,v) => k + ": " + &v,
+        };
+        println!("[{}] -- {}", text, count);
+    }
+}
+
+fn retag(workspace: &mut Option<Workspace>, from: &Vec<String>, to: Option<&str>, key: bool) {
+    let Some(workspace) = workspace else {
+        // TODO - error out
+        return;
+    };
+
+    // A tag is written Key:Value, or Simple without a colon
+    let parse_tag = |text: &str| match text.split_once(':') {
+        Some((k, v)) => tagcore::Tag::KV(k.to_string(), v.to_string()),
+        None => tagcore::Tag::Simple(text.to_string()),
+    };
+    let rules: Vec<Retag> = from.iter()
+        // Without --to, --delete was given
+        .map(|from| match (key, to) {
+            (true, Some(to)) => Retag::RenameKey(from.clone(), to.to_string()),
+            (true, None) => Retag::DeleteKey(from.clone()),
+            (false, Some(to)) => Retag::Rename(parse_tag(from), parse_tag(to)),
+            (false, None) => Retag::Delete(parse_tag(from)),
+        })
+        .collect();
+    match workspace.retag(&rules) {
+        Ok(report) => println!("Changed the tags of {} file(s), in {} tag file(s)", report.files, report.tagfiles),
+        Err(error) => println!("ERROR when changing tags: {}", error.to_string()),
+    }
+}
+
+fn print_profile(path_to_trace: Option<&Path>) {
+    // On stderr, so that the output of the command itself can still be piped
+    eprint!("{}", Profiler::stats());
+    if let Some(path_to_trace) = path_to_trace {
+        match Profiler::write_chrome_trace(path_to_trace) {
+            Ok(_) => eprintln!("Trace written to {}", path_to_trace.display()),
+            Err(error) => eprintln!("ERROR when writing trace: {}", error.to_string()),
+        }
+    }
+}
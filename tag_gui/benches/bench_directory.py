@@ -0,0 +1,34 @@
+"""Where the time of showing a directory goes: reading its tags in Rust, as Tag objects or as strings, through TagModel, and in the Qt file explorer model."""
+import os
+
+import pytest
+
+@pytest.fixture
+def directory(synthetic):
+    _, _, directories = synthetic
+    return directories[1]
+
+@pytest.mark.benchmark(group="directory")
+def bench_tag_objects(workspace, directory, measured):
+    measured(workspace.get_tags_for_directory, directory)
+
+@pytest.mark.benchmark(group="directory")
+def bench_tag_strings(workspace, directory, measured):
+    measured(workspace.get_tag_strings_for_directory, directory)
+
+@pytest.mark.benchmark(group="directory")
+def bench_tag_model(tag_model, directory, measured):
+    measured(tag_model.get_tag_mapping_in_dir_as_strings, directory)
+
+@pytest.mark.benchmark(group="directory")
+def bench_qt_model(qapp, tag_model, directory, measured):
+    from model.file_explorer_model import FileExplorerModel
+    fs_model = FileExplorerModel(directory)
+    file_names = sorted(name for name in os.listdir(directory) if not name.startswith("."))
+
+    def show_directory():
+        # As the controller does on entering a directory, then the tags column of every row
+        fs_model.set_directory(directory, tag_model.get_tag_mapping_in_dir_as_strings(directory))
+        for file_name in file_names:
+            fs_model.index(os.path.join(directory, file_name), 1).data()
+    measured(show_directory)
@@ -0,0 +1,46 @@
+"""Time to open a workspace through rs_tags, as the GUI does: cold (walking and parsing every tag file), warm (from an up-to-date snapshot),
+and lazily, reading a single file's tags the way tag-cli does."""
+import os
+
+import pytest
+
+from harness import WORKSPACE_NAME
+
+@pytest.fixture
+def one_file(synthetic):
+    _, _, directories = synthetic
+    return os.path.join(directories[1], "file0.txt")
+
+@pytest.mark.benchmark(group="open")
+def bench_open_cold(synthetic, measured):
+    import rs_tags
+    root, _, _ = synthetic
+
+    def open_cold():
+        ws = rs_tags.TagWorkspace.open_workspace(root, WORKSPACE_NAME)
+        ws.scan_for_tagfiles()
+        return ws
+    measured(open_cold)
+
+@pytest.mark.benchmark(group="open")
+def bench_open_warm(synthetic, measured):
+    import rs_tags
+    root, _, _ = synthetic
+
+    def open_warm():
+        ws = rs_tags.TagWorkspace.open_workspace(root, WORKSPACE_NAME)
+        ws.scan_for_tagfiles_cached()
+        return ws
+    open_warm() # Writes the snapshot the measured runs start from
+    measured(open_warm)
+
+@pytest.mark.benchmark(group="open")
+def bench_open_lazy_one_file(synthetic, one_file, measured):
+    import rs_tags
+    root, _, _ = synthetic
+
+    def open_and_show():
+        ws = rs_tags.TagWorkspace.open_workspace(root, WORKSPACE_NAME)
+        ws.enable_lazy_loading(64)
+        return ws.get_tags_for_file_name(one_file)
+    measured(open_and_show)
@@ -0,0 +1,74 @@
+"""Where the time of a query goes, stage by stage: the query in Rust, converting the results to Python Tag objects, formatting them as strings, and filling the Qt results model."""
+import pytest
+
+from harness import Shape
+
+@pytest.fixture(params=["popular", "middle"])
+def text(request, synthetic):
+    _, shape, _ = synthetic
+    return Shape.word(0 if request.param == "popular" else shape.vocabulary // 10)
+
+def fill_query_model(model, cursor):
+    """Fetches every result into the model, then reads what a view paints: both columns of the first screenful of rows"""
+    model.set_cursor(cursor)
+    while model.canFetchMore():
+        model.fetchMore()
+    for row in range(min(50, model.rowCount())):
+        for column in range(2):
+            model.index(row, column).data()
+
+@pytest.mark.benchmark(group="query_exact")
+def bench_rust_query(workspace, text, measured):
+    measured(workspace.query_exact_cursor, text, True, True, True)
+
+@pytest.mark.benchmark(group="query_exact")
+def bench_convert_tags(workspace, text, measured):
+    measured(lambda cursor: cursor.fetch(len(cursor)),
+             setup=lambda: (workspace.query_exact_cursor(text, True, True, True),))
+
+@pytest.mark.benchmark(group="query_exact")
+def bench_format_strings(workspace, text, measured):
+    measured(lambda cursor: cursor.fetch_strings(len(cursor)),
+             setup=lambda: (workspace.query_exact_cursor(text, True, True, True),))
+
+@pytest.mark.benchmark(group="query_exact")
+def bench_query_dict(workspace, text, measured):
+    # Every result converted at once, as a dict of Tag objects
+    measured(workspace.query_exact, text, True, True, True)
+
+@pytest.mark.benchmark(group="query_exact")
+def bench_qt_model(qapp, synthetic, workspace, text, measured):
+    from model.file_query_model import FileQueryModel
+    model = FileQueryModel()
+    model.set_workspace_dir(synthetic[0])
+    measured(lambda cursor: fill_query_model(model, cursor),
+             setup=lambda: (workspace.query_exact_cursor(text, True, True, True),))
+
+@pytest.mark.benchmark(group="query_exact")
+def bench_end_to_end(synthetic, tag_model, text, measured):
+    # What a search in the GUI does, minus the worker thread: TagModel.do_query, then the results model
+    from model.file_query_model import FileQueryModel
+    model = FileQueryModel()
+    model.set_workspace_dir(synthetic[0])
+    measured(lambda: fill_query_model(model, tag_model.do_query(True, text)))
+
+@pytest.mark.benchmark(group="query_fuzzy")
+def bench_fuzzy_rust_query(workspace, measured):
+    measured(workspace.query_fuzzy_cursor, "ag1", True, True, True)
+
+@pytest.mark.benchmark(group="query_fuzzy")
+def bench_fuzzy_format_strings(workspace, measured):
+    measured(lambda cursor: cursor.fetch_strings(len(cursor)),
+             setup=lambda: (workspace.query_fuzzy_cursor("ag1", True, True, True),))
+
+@pytest.mark.benchmark(group="facets")
+def bench_facets(workspace, text, measured):
+    # What the facet panel shows after a search
+    measured(lambda cursor: cursor.facets(),
+             setup=lambda: (workspace.query_exact_cursor(text, True, True, True),))
+
+@pytest.mark.benchmark(group="facets")
+def bench_narrow(workspace, text, measured):
+    # Drilling down from the results of a search into those that also carry a second tag
+    measured(lambda cursor: cursor.narrow(Shape.word(1)),
+             setup=lambda: (workspace.query_exact_cursor(text, True, True, True),))
@@ -0,0 +1,73 @@
+import os
+import sys
+
+# Qt models run without a display. Must be set before PySide6 is imported
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+# The GUI's packages (model, controller...) are imported the way main.py imports them
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+from harness import Shape, generate_workspace, measure_allocations
+
+SHAPES = {
+    "small": Shape(),
+    "large": Shape(depth=3, fan_out=10, vocabulary=10000),
+}
+
+# (group, stage, peak bytes, retained bytes) of every stage measured, reported at the end of the session
+_allocations: list[tuple[str, str, int, int]] = []
+
+@pytest.fixture(scope="session")
+def qapp():
+    from PySide6.QtWidgets import QApplication
+    return QApplication.instance() or QApplication([])
+
+@pytest.fixture(scope="session", params=list(SHAPES))
+def synthetic(request, tmp_path_factory):
+    """(root, shape, directories) of a generated workspace, once per shape for the whole session"""
+    shape = SHAPES[request.param]
+    root = str(tmp_path_factory.mktemp(f"workspace_{request.param}"))
+    return root, shape, generate_workspace(root, shape)
+
+@pytest.fixture
+def workspace(synthetic):
+    import rs_tags
+    root, _, _ = synthetic
+    ws = rs_tags.TagWorkspace.open_workspace(root, "bench")
+    ws.scan_for_tagfiles()
+    return ws
+
+@pytest.fixture
+def tag_model(qapp, synthetic):
+    """The GUI's TagModel with the generated workspace open, as after File > Open"""
+    from model.tag_model import TagModel
+    root, _, _ = synthetic
+    model = TagModel(root)
+    model.open_and_set_workspace(root, "bench")
+    yield model
+    model.shutdown()
+
+@pytest.fixture
+def measured(benchmark, request):
+    """measured(fn, *args, setup=None) benchmarks fn(*args), then records the Python allocations of one more run for the summary.
+    setup, if given, returns fresh arguments for each round, for arguments that are used up (such as a cursor, which is read once)."""
+    def run(fn, *args, setup=None):
+        if setup is None:
+            benchmark(fn, *args)
+            peak, retained = measure_allocations(fn, *args)
+        else:
+            benchmark.pedantic(fn, setup=lambda: (setup(), {}), rounds=20)
+            peak, retained = measure_allocations(fn, *setup())
+        benchmark.extra_info["alloc_peak_bytes"] = peak
+        benchmark.extra_info["alloc_retained_bytes"] = retained
+        _allocations.append((benchmark.group or "", request.node.name, peak, retained))
+    return run
+
+def pytest_terminal_summary(terminalreporter):
+    if not _allocations:
+        return
+    terminalreporter.section("Python heap allocations per stage (one run)")
+    terminalreporter.write_line(f"{'group':<24} {'stage':<48} {'peak KiB':>10} {'retained KiB':>13}")
+    for group, name, peak, retained in _allocations:
+        terminalreporter.write_line(f"{group:<24} {name:<48} {peak / 1024:>10.1f} {retained / 1024:>13.1f}")
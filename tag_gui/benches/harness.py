@@ -0,0 +1,92 @@
+"""Synthetic workspaces and allocation measurement for the benchmarks. Workspaces are shaped like tagcore's benches/common Synthetic: nested directories and Zipf-distributed tags."""
+import bisect
+import itertools
+import os
+import random
+import tracemalloc
+
+from dataclasses import dataclass
+from typing import Callable
+
+WORKSPACE_NAME = "bench"
+
+@dataclass(frozen=True)
+class Shape:
+    """A directory tree `depth` levels deep below the root, each directory having `fan_out` subdirectories and `files_per_dir` files.
+    Each file gets `tags_per_file` distinct tags from `vocabulary` words, the word of rank k picked with a probability proportional to 1/k^zipf_exponent.
+    `kv_ratio` of the tags are Key-Value tags."""
+    depth: int = 2
+    fan_out: int = 8
+    files_per_dir: int = 50
+    tags_per_file: int = 3
+    vocabulary: int = 1000
+    zipf_exponent: float = 1.0
+    kv_ratio: float = 0.3
+    seed: int = 1
+
+    def num_dirs(self) -> int:
+        return sum(self.fan_out ** level for level in range(self.depth + 1))
+
+    def num_files(self) -> int:
+        return self.num_dirs() * self.files_per_dir
+
+    @staticmethod
+    def word(rank: int) -> str:
+        return f"Tag{rank}"
+
+def generate_workspace(root: str, shape: Shape) -> list[str]:
+    """Writes a workspace of the given shape under root: empty files, so that Qt models can list them, and one TOML tag file per directory.
+    Returns the directories, root first. The same shape always gives the same workspace."""
+    import rs_tags
+    rs_tags.TagWorkspace.create_workspace(root, WORKSPACE_NAME)
+    rng = random.Random(shape.seed)
+    cumulative = list(itertools.accumulate(1.0 / (rank ** shape.zipf_exponent) for rank in range(1, shape.vocabulary + 1)))
+
+    def zipf() -> int:
+        return min(bisect.bisect_right(cumulative, rng.random() * cumulative[-1]), shape.vocabulary - 1)
+
+    directories = []
+    pending = [(root, 0)]
+    while pending:
+        directory, level = pending.pop()
+        directories.append(directory)
+        lines = ["[mapping]"]
+        for file_index in range(shape.files_per_dir):
+            file_name = f"file{file_index}.txt"
+            open(os.path.join(directory, file_name), "w").close()
+            words: list[int] = []
+            tags: list[str] = []
+            # Give up on distinct words after a few tries, for tiny vocabularies
+            for _ in range(shape.tags_per_file * 4):
+                if len(tags) == shape.tags_per_file:
+                    break
+                word = zipf()
+                if word in words:
+                    continue
+                words.append(word)
+                if rng.random() < shape.kv_ratio:
+                    tags.append(f'["{Shape.word(word)}", "{Shape.word(zipf())}"]')
+                else:
+                    tags.append(f'"{Shape.word(word)}"')
+            lines.append(f'"{file_name}" = [{", ".join(tags)}]')
+        with open(os.path.join(directory, f".tag_{WORKSPACE_NAME}"), "w") as tagfile:
+            tagfile.write("\n".join(lines) + "\n")
+
+        if level < shape.depth:
+            for child in range(shape.fan_out):
+                child_dir = os.path.join(directory, f"d{child}")
+                os.mkdir(child_dir)
+                pending.append((child_dir, level + 1))
+    return directories
+
+def measure_allocations(fn: Callable, *args) -> tuple[int, int]:
+    """Runs fn(*args) once and returns (peak, retained) bytes allocated on the Python heap meanwhile.
+    Memory allocated by Rust is not seen here, only the Python objects it returns: see tagcore's memory bench for that side."""
+    tracemalloc.start()
+    try:
+        result = fn(*args)
+        retained, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    del result
+    return peak, retained
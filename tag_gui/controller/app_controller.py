@@ -6,6 +6,7 @@ from view.main_window import MainWindow, FileInfoWidget, FilesTab, QueryTab
 from PySide6.QtWidgets import QApplication
 
 from configparser import ConfigParser
+import os
 
 class AppController():
     def __init__(self, script_dir, app: QApplication, fs_model: FileExplorerModel, tag_model: TagModel, file_query_model: FileQueryModel, view: MainWindow):
@@ -19,6 +20,10 @@ class AppController():
         self.query_file_info_widget = view.query_tab.right_file_info_widget
         self.files_tab = view.files_tab
         self.query_tab = view.query_tab
+        # Results of the last query, and the narrower results shown after drilling down through the facet panel by _facet_filters
+        self._query_cursor = None
+        self._facet_cursor = None
+        self._facet_filters: list[str] = []
 
         self.main_window = view
 
@@ -31,6 +36,11 @@ class AppController():
         self.fs_model.set_directory(self.fs_model.current_directory, self.tag_model.get_tag_mapping_in_dir_as_strings(self.fs_model.current_directory))
         
         self.tag_model.sg_error_encountered.connect(self._on_tagmodel_error_encounter)
+        self.tag_model.sg_query_finished.connect(self._on_query_finished)
+        self.tag_model.sg_tags_changed.connect(self._on_tags_changed)
+        self.tag_model.sg_directory_tags_loaded.connect(self.fs_model.set_directory_tags)
+        self.tag_model.sg_file_tags_loaded.connect(self._on_file_tags_loaded)
+        app.aboutToQuit.connect(self.tag_model.shutdown)
 
         view.sg_quit_app_request.connect(lambda: app.quit())
         view.sg_create_workspace_request.connect(self._on_mainwindow_create_workspace_request)
@@ -54,12 +64,16 @@ class AppController():
         self.files_tab.sg_selected_file_change.connect(self._on_exploreview_selected_file_change)
 
         self.explore_file_info_widget.sg_remove_tab_button_clicked.connect(self._on_tag_btn_delete_click)
-        self.explore_file_info_widget.sg_add_simple_button_clicked.connect(self._on_tag_simple_btn_add_click)
-        self.explore_file_info_widget.sg_add_kv_button_clicked.connect(self._on_tag_kv_btn_add_click)
+        self.explore_file_info_widget.sg_add_simple_button_clicked.connect(lambda file_name, tag_t1: self._on_explore_tag_btn_add_click(file_name, tag_t1, None))
+        self.explore_file_info_widget.sg_add_kv_button_clicked.connect(self._on_explore_tag_btn_add_click)
 
         # ** Query Tab ** #
         self.query_tab.middle_root.setModel(self.file_query_model)
         self.query_tab.left_root.sg_search_query_entered.connect(self._on_query_entered)
+        self.query_tab.left_root.sg_expression_query_entered.connect(self._on_expression_query_entered)
+        self.query_tab.left_root.sg_completion_requested.connect(self._on_completion_requested)
+        self.query_tab.facet_panel.sg_facet_activated.connect(self._on_facet_activated)
+        self.query_tab.facet_panel.sg_clear_requested.connect(self._on_facet_clear_requested)
         self.query_tab.sg_file_folder_double_click.connect(self._on_queryview_doubleclick)
 
         self.query_tab.middle_root.selectionModel().selectionChanged.connect(self.query_tab.on_file_folder_selection_changed)
@@ -69,58 +83,94 @@ class AppController():
         self.query_file_info_widget.sg_add_simple_button_clicked.connect(self._on_tag_simple_btn_add_click)
         self.query_file_info_widget.sg_add_kv_button_clicked.connect(self._on_tag_kv_btn_add_click)
 
+    # Views are updated from the changes the workspace reports (see _on_tags_changed), not rebuilt
     def _on_tag_btn_delete_click(self, file_name, tag_t1, tag_t2):
-        rv = self.tag_model.remove_tag_from_file(file_name, tag_t1, tag_t2)
-        if rv: # If removing the tag was successful, we need to re-fresh the views manually. Signals would have helped...
-            # Refresh the file explorer model, by resetting its root dir and setting it back again
-            self.fs_model.set_directory(self.fs_model.current_directory, self.tag_model.get_tag_mapping_in_dir_as_strings(self.fs_model.current_directory))
-            root_path = self.fs_model.rootPath()
-            self.fs_model.setRootPath("")
-            self.fs_model.setRootPath(root_path)
-
-            # Refresh the file info widget(s)
-            self.refresh_info_widgets_after_add_or_del()
+        self.tag_model.remove_tag_from_file(file_name, tag_t1, tag_t2)
+        return
     
     def _on_tag_simple_btn_add_click(self, file_name, tag_t1):
-        rv = self.tag_model.add_tag_to_file(file_name, tag_t1, None)
-        if rv:
-            self.fs_model.set_directory(self.fs_model.current_directory, self.tag_model.get_tag_mapping_in_dir_as_strings(self.fs_model.current_directory))
-            root_path = self.fs_model.rootPath()
-            self.fs_model.setRootPath("")
-            self.fs_model.setRootPath(root_path)
-
-            # Refresh the file info widget(s)
-            self.refresh_info_widgets_after_add_or_del()
+        self.tag_model.add_tag_to_file(file_name, tag_t1, None)
         return
     
     def _on_tag_kv_btn_add_click(self, file_name, tag_t1, tag_t2):
-        rv = self.tag_model.add_tag_to_file(file_name, tag_t1, tag_t2)
-        if rv:
-            self.fs_model.set_directory(self.fs_model.current_directory, self.tag_model.get_tag_mapping_in_dir_as_strings(self.fs_model.current_directory))
-            root_path = self.fs_model.rootPath()
-            self.fs_model.setRootPath("")
-            self.fs_model.setRootPath(root_path)
+        self.tag_model.add_tag_to_file(file_name, tag_t1, tag_t2)
+        return
 
-            # Refresh the file info widget(s)
-            self.refresh_info_widgets_after_add_or_del()
+    def _on_explore_tag_btn_add_click(self, file_name, tag_t1, tag_t2):
+        # Adds to every file selected in the explorer, writing each tag file once
+        paths = [self.fs_model.filePath(index) for index in self.files_tab.selected_indexes() if not self.fs_model.isDir(index)]
+        if len(paths) > 1:
+            self.tag_model.add_tag_to_files(paths, tag_t1, tag_t2)
+        else:
+            self.tag_model.add_tag_to_file(file_name, tag_t1, tag_t2)
         return
 
-    def refresh_info_widgets_after_add_or_del(self):
-            self.explore_file_info_widget.tags = self.tag_model.get_tags_for_filename_as_list(self.explore_file_info_widget.current_file_path)
-            self.explore_file_info_widget.rebuild_tag_list()
-            self.explore_file_info_widget.update()
+    def _on_tags_changed(self, changes: list):
+        for change in changes:
+            self.fs_model.update_file_tags(change.directory, change.file_name, change.tag_string)
+            self.file_query_model.update_file_tags(change.path, change.tag_string)
+
+            changed_path = os.path.join(change.directory, change.file_name)
+            for widget in (self.explore_file_info_widget, self.query_file_info_widget):
+                if widget.current_file_path != "" and os.path.realpath(widget.current_file_path) == changed_path:
+                    widget.tags = TagModel.tags_as_list(change.tags)
+                    widget.rebuild_tag_list()
+                    widget.update()
+        return
 
-            if self.query_file_info_widget.current_file_path != "":
-                self.query_file_info_widget.tags = self.tag_model.get_tags_for_filename_as_list(self.query_file_info_widget.current_file_path)
-                self.file_query_model.mapping = self.tag_model.do_query(self.file_query_model.last_query_params[0], self.file_query_model.last_query_params[1], self.file_query_model.last_query_params[2], self.file_query_model.last_query_params[3], self.file_query_model.last_query_params[4])
-                self.query_file_info_widget.rebuild_tag_list()
-                self.query_file_info_widget.update()
-                self.file_query_model.rebuild_from_mapping()
+    def _on_file_tags_loaded(self, path: str, tags: list):
+        # Tags of a selected file, read once the worker was free
+        for widget in (self.explore_file_info_widget, self.query_file_info_widget):
+            if widget.current_file_path == path:
+                widget.tags = tags
+                widget.rebuild_tag_list()
+                widget.update()
+        return
 
     def _on_query_entered(self, exact: bool, text: str, simple: bool, key: bool, value: bool):
-        self.file_query_model.mapping = self.tag_model.do_query(exact, text, simple, key, value)
+        # Runs off the Qt thread: the first query of a workspace loads every tag file
         self.file_query_model.set_last_query_params(exact, text, simple, key, value)
-        self.file_query_model.rebuild_from_mapping()
+        self.tag_model.do_query_async(exact, text, simple, key, value)
+        return
+
+    def _on_expression_query_entered(self, expr: str):
+        self.file_query_model.set_last_expression(expr)
+        self.tag_model.do_expression_query_async(expr)
+        return
+
+    def _on_completion_requested(self, prefix: str):
+        # Answered from the tag counts kept in memory, on the Qt thread
+        self.query_tab.left_root.set_completions(self.tag_model.suggest_tags(prefix))
+        return
+
+    def _on_query_finished(self, cursor):
+        self._query_cursor = cursor
+        self._show_query_results(cursor, [])
+        return
+
+    def _on_facet_activated(self, term: str):
+        # Narrows the results already in memory: no new query runs
+        if self._facet_cursor is None or term in self._facet_filters:
+            return
+        try:
+            cursor = self._facet_cursor.narrow(term)
+        except Exception as e:
+            self.main_window.show_error_dialogue("Cannot refine search", str(e))
+            return
+        self._show_query_results(cursor, self._facet_filters + [term])
+        return
+
+    def _on_facet_clear_requested(self):
+        if self._query_cursor is not None:
+            self._query_cursor.rewind()
+        self._show_query_results(self._query_cursor, [])
+        return
+
+    def _show_query_results(self, cursor, filters: list[str]):
+        self._facet_cursor = cursor
+        self._facet_filters = filters
+        self.file_query_model.set_cursor(cursor)
+        self.query_tab.facet_panel.set_facets(cursor.facets() if cursor is not None else None, filters)
         return
     
     def _on_explorerview_doubleclick(self, index):
@@ -188,7 +238,8 @@ class AppController():
         self.fs_model.set_directory(self.fs_model.current_directory, mapping)
         self.files_tab.left_file_hierarchy.setRootIndex(self.fs_model.index(self.fs_model.current_directory))
 
-        self.file_query_model.clear()
+        self._query_cursor = None
+        self._show_query_results(None, [])
         self.file_query_model.set_workspace_dir(self.tag_model.cwd)
         self.save_workspace_name_to_config(self.tag_model.get_workspace_name())
         return
@@ -205,7 +256,8 @@ class AppController():
         self.fs_model.set_directory(self.fs_model.current_directory, mapping)
         self.files_tab.left_file_hierarchy.setRootIndex(self.fs_model.index(self.fs_model.current_directory))
 
-        self.file_query_model.clear()
+        self._query_cursor = None
+        self._show_query_results(None, [])
         self.file_query_model.set_workspace_dir(self.tag_model.cwd)
         self.save_workspace_name_to_config(self.tag_model.get_workspace_name())
         return
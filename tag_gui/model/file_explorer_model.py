@@ -10,6 +10,8 @@ class FileExplorerModel(QFileSystemModel):
         super().__init__()
         self.current_directory = starting_dir
         self.current_dir_tags: dict = {}
+        # current_directory with symlinks resolved, as in the directories of workspace changes
+        self._current_directory_real = os.path.realpath(starting_dir)
         self.setRootPath(starting_dir)
 
     def columnCount(self, parent: QModelIndex | QPersistentModelIndex = QModelIndex()):
@@ -42,10 +44,33 @@ class FileExplorerModel(QFileSystemModel):
     def set_directory(self, new_directory_path, mapping: dict):
         # print(f"CHANIGN PATHS (mapping IS {mapping})")
         self.current_directory = new_directory_path
+        self._current_directory_real = os.path.realpath(new_directory_path)
         self.current_dir_tags = mapping
         self.setRootPath(new_directory_path)
         self.setIconProvider(QFileIconProvider())
     
+    def set_directory_tags(self, directory: str, mapping: dict):
+        """Replaces the tags shown for every file, once they were read after set_directory. Ignored unless directory is still the current one."""
+        if directory != self.current_directory:
+            return
+        self.current_dir_tags = mapping
+        root = self.index(self.current_directory)
+        rows = self.rowCount(root)
+        if rows > 0:
+            self.dataChanged.emit(self.index(0, 1, root), self.index(rows - 1, 1, root), [Qt.ItemDataRole.DisplayRole])
+
+    def update_file_tags(self, directory: str, file_name: str, tag_string: str):
+        """Updates the tags shown for one file, repainting only its row. Ignored unless the file is in the current directory."""
+        if directory != self._current_directory_real:
+            return
+        if tag_string:
+            self.current_dir_tags[file_name] = tag_string
+        else:
+            self.current_dir_tags.pop(file_name, None)
+        index = self.index(os.path.join(self.current_directory, file_name), 1)
+        if index.isValid():
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DisplayRole])
+
     # Returns (FALSE, directory_path) if DIRECTORY, TRUE,"" if FILE
     def open_file_info_from_index(self, index) -> tuple[bool, str]:
         name = index.siblingAtColumn(0)
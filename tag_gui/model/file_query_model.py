@@ -1,27 +1,69 @@
-from PySide6.QtCore import Qt, QFileInfo, QDateTime
-from PySide6.QtGui import QStandardItemModel, QStandardItem, QIcon
+from PySide6.QtCore import Qt, QFileInfo, QDateTime, QModelIndex, QAbstractTableModel
+from PySide6.QtGui import QIcon
 from PySide6.QtWidgets import QFileIconProvider
 
+from rs_tags import TagQueryCursor
+
 import os
 import sys, subprocess
 
-class FileQueryModel(QStandardItemModel):
+# Results added to the model each time the view asks for more
+FETCH_BATCH = 256
+
+class FileQueryModel(QAbstractTableModel):
+    """Query results, one row per file. Rows only hold the file's path and tag string: names, icons and absolute paths are made when the view asks for them, which it only does for visible rows."""
+
     def __init__(self):
         super().__init__()
-        self.mapping = dict()
+        # Results not shown yet are pulled from the cursor as the view scrolls (canFetchMore / fetchMore)
+        self._cursor: TagQueryCursor | None = None
+        # Fetched results as columns: row i is the file _paths[i] (relative to workspace_dir), tagged _tags[i]
+        self._paths: list[str] = []
+        self._tags: list[str] = []
+        # Row of each fetched path
+        self._rows: dict[str, int] = dict()
+        # Tags changed since the query ran, for results not fetched yet (the cursor returns them as they were)
+        self._changed_tags: dict[str, str] = dict()
         self.workspace_dir = ""
         self._icon_provider = QFileIconProvider()
-        self.setHeaderData(0, Qt.Orientation.Horizontal, "Name")
-        self.setHeaderData(0, Qt.Orientation.Horizontal, "Tags")
+        # Icons by lowercased file suffix. Finding a file's icon is slow, and files of a type share one
+        self._icon_cache: dict[str, QIcon] = dict()
         
         self.last_query_params = [True, "", False, False, False]
+        # Set instead of last_query_params when the last query was an expression
+        self.last_expression: str | None = None
 
     def set_last_query_params(self, exact, text, simple, key, value):
         self.last_query_params = [exact, text, simple, key, value]
+        self.last_expression = None
+
+    def set_last_expression(self, expr: str):
+        self.last_expression = expr
 
     def set_workspace_dir(self, new_dir):
         self.workspace_dir = new_dir
 
+    def rowCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else len(self._paths)
+
+    def columnCount(self, parent: QModelIndex = QModelIndex()) -> int:
+        return 0 if parent.isValid() else 2
+
+    def data(self, index: QModelIndex, /, role: int = Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        match (index.column(), role):
+            case (0, Qt.ItemDataRole.DisplayRole):
+                return os.path.basename(self._paths[row])
+            case (0, Qt.ItemDataRole.DecorationRole):
+                return self._get_icon_for_suffix(self._paths[row])
+            case (0, Qt.ItemDataRole.UserRole):
+                return self._get_absolute_path(row)
+            case (1, Qt.ItemDataRole.DisplayRole):
+                return self._tags[row]
+        return None
+
     def headerData(self, section: int, orientation: Qt.Orientation, /, role: int = Qt.ItemDataRole.DisplayRole):
         if role == Qt.ItemDataRole.DisplayRole and orientation == Qt.Orientation.Horizontal:
             match section:
@@ -30,33 +72,51 @@ class FileQueryModel(QStandardItemModel):
                 case 1:
                     return "Tags"
         return super().headerData(section, orientation, role)
-    
-    def rebuild_from_mapping(self):
-        self.clear()
+
+    def set_cursor(self, cursor: TagQueryCursor | None):
+        """Replaces the results with those of a query. Only the first batch is added now, the rest as the view scrolls to them."""
         self.beginResetModel()
-        # print(f"  Tags list is {self.mapping}")
-        for path, tags in self.mapping.items():
-            # Paths are relative to the workspace's CWD, so need to join
-            path_c = os.path.join(self.workspace_dir, path)
-            info = QFileInfo(path_c)
-
-            name = QStandardItem(info.fileName())
-            name.setEditable(False)
-            name.setIcon(self._icon_provider.icon(info))
-            name.setData(info.absoluteFilePath(), Qt.ItemDataRole.UserRole)
-
-            # tags_list = []
-            # for tag in tags:
-            #     if isinstance(tag, list) and len(tag) >= 2:
-            #         tags_list.append(f"{tag[0]}: {tag[1]}")
-            #     else:
-            #         tags_list.append(tag)
-            # tags_txt = ",".join(tags_list) if len(tags_list) > 0 else "None"
-            # tags_item = QStandardItem(tags_txt)
-            tags_item = QStandardItem(tags)
-            tags_item.setEditable(False)
-            self.appendRow([name, tags_item])
+        self._paths = []
+        self._tags = []
+        self._rows = dict()
+        self._changed_tags = dict()
+        self._cursor = cursor
         self.endResetModel()
+        if self.canFetchMore():
+            self.fetchMore()
+
+    def clear(self):
+        self.set_cursor(None)
+
+    def canFetchMore(self, parent: QModelIndex = QModelIndex()) -> bool:
+        if parent.isValid() or self._cursor is None:
+            return False
+        return self._cursor.remaining > 0
+
+    def fetchMore(self, parent: QModelIndex = QModelIndex()):
+        if not self.canFetchMore(parent):
+            return
+        batch = self._cursor.fetch_strings(FETCH_BATCH)
+        if not batch:
+            return
+        first = len(self._paths)
+        self.beginInsertRows(QModelIndex(), first, first + len(batch) - 1)
+        for path, tags in batch:
+            self._rows[path] = len(self._paths)
+            self._paths.append(path)
+            self._tags.append(self._changed_tags.pop(path, tags))
+        self.endInsertRows()
+
+    def update_file_tags(self, path: str, tag_string: str):
+        """Updates the tags shown for a result, given its path relative to the workspace, repainting only its row. Files that are not results are ignored."""
+        row = self._rows.get(path)
+        if row is None:
+            if self.canFetchMore():
+                self._changed_tags[path] = tag_string
+            return
+        self._tags[row] = tag_string
+        index = self.index(row, 1)
+        self.dataChanged.emit(index, index, [Qt.ItemDataRole.DisplayRole])
 
     def get_file_info_from_index(self, index):
         index = index.siblingAtColumn(0)
@@ -79,4 +139,16 @@ class FileQueryModel(QStandardItemModel):
             elif sys.platform.startswith("darwin"): # MAC
                 subprocess.run(["open", file_path])
             else: # ASSUME LINUX
-                subprocess.run(["xdg-open", file_path])
\ No newline at end of file
+                subprocess.run(["xdg-open", file_path])
+
+    def _get_absolute_path(self, row: int) -> str:
+        # Paths are relative to the workspace's CWD, so need to join
+        return os.path.abspath(os.path.join(self.workspace_dir, self._paths[row]))
+
+    def _get_icon_for_suffix(self, path: str) -> QIcon:
+        suffix = os.path.splitext(path)[1].lower()
+        icon = self._icon_cache.get(suffix)
+        if icon is None:
+            icon = self._icon_provider.icon(QFileInfo(os.path.join(self.workspace_dir, path)))
+            self._icon_cache[suffix] = icon
+        return icon
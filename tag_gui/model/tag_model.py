@@ -1,79 +1,126 @@
 import rs_tags as tags
-import os
+import threading
 
-from typing import Dict
+from typing import Callable, Dict
 
-from PySide6.QtCore import Signal, QObject
+from PySide6.QtCore import Signal, QObject, QRunnable, QThreadPool, QTimer
+
+# Threads used to scan a workspace for tag files. 0 = one per core
+SCAN_THREADS = 0
+# Most tag files kept in memory while browsing. Tag files are loaded per directory until the first query loads them all
+LAZY_TAGFILES = 256
+# Tag files changed by other programs are reloaded once their changes have been quiet this long
+WATCH_DEBOUNCE_MS = 500
+# How often the workspace is asked for tag files changed by other programs
+WATCH_POLL_MS = 1000
+# Most tags offered by the search box's completer
+SUGGESTION_LIMIT = 20
+
+class WorkspaceTaskSignals(QObject):
+    # Each signal carries the task, so that one slot can serve every task
+    sg_finished = Signal(object, object)
+    sg_failed = Signal(object, str)
+    sg_cancelled = Signal(object)
+
+class WorkspaceTask(QRunnable):
+    """Runs fn(*args) on a QThreadPool thread. Cancelling a task that already started only drops its result, since workspace operations cannot be interrupted.
+    A task made with cancellable=False (such as a tag edit) ignores cancel."""
+
+    def __init__(self, fn: Callable, *args, on_finished: Callable | None = None, on_cancelled: Callable | None = None, cancellable: bool = True):
+        super().__init__()
+        self.signals = WorkspaceTaskSignals()
+        self.on_finished = on_finished
+        self.on_cancelled = on_cancelled
+        self.cancellable = cancellable
+        self._fn = fn
+        self._args = args
+        self._cancelled = threading.Event()
+
+    def cancel(self):
+        if self.cancellable:
+            self._cancelled.set()
+
+    def is_cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    def run(self):
+        if self.is_cancelled():
+            self.signals.sg_cancelled.emit(self)
+            return
+        try:
+            result = self._fn(*self._args)
+        except Exception as e:
+            self.signals.sg_failed.emit(self, str(e))
+            return
+        if self.is_cancelled():
+            self.signals.sg_cancelled.emit(self)
+        else:
+            self.signals.sg_finished.emit(self, result)
 
 class TagModel(QObject):
     # sg_tag_info_changed = Signal()
     sg_workspace_name_change = Signal(str)
     sg_error_encountered = Signal(str)
+    sg_query_finished = Signal(object)
+    sg_query_cancelled = Signal()
+    # Files whose tags changed, as a list of rs_tags.TagChange. Emitted once per workspace call that changed tags
+    sg_tags_changed = Signal(list)
+    # (directory, tags by file name) and (path to file, tags), read on the worker after the workspace was busy when they were asked for
+    sg_directory_tags_loaded = Signal(str, dict)
+    sg_file_tags_loaded = Signal(str, list)
 
     def __init__(self, cwd):
         super().__init__()
         self.cwd = cwd
         self.current_workspace: tags.TagWorkspace | None = None
+        # rs_tags releases the GIL during workspace operations, but a workspace runs one at a time: every access holds this lock
+        self._workspace_lock = threading.RLock()
+        # A single worker keeps background operations in the order they were started
+        self._pool = QThreadPool(self)
+        self._pool.setMaxThreadCount(1)
+        self._tasks: set[WorkspaceTask] = set()
+        self._pending_query: WorkspaceTask | None = None
+        self._pending_poll: WorkspaceTask | None = None
+        self._pending_suggestions: WorkspaceTask | None = None
+        # Whether the workspace's tag counts are loaded, after which suggest_tags answers without reading the disk
+        self._suggestions_ready = False
+        self._watch_timer = QTimer(self)
+        self._watch_timer.setInterval(WATCH_POLL_MS)
+        self._watch_timer.timeout.connect(self._poll_workspace_changes)
+        self._watch_timer.start()
 
         if self.current_workspace:
             self.current_workspace.scan_for_tagfiles()
 
     def get_tag_mapping_in_dir_as_strings(self, path_to_directory: str) -> Dict[str, str]:
+        """Returns the tags of every file in a directory, formatted for display, in one call. Never waits for the worker: while it holds the workspace
+        (during a search, say), returns nothing and reads them once the worker is free, emitting sg_directory_tags_loaded."""
         if self.current_workspace == None:
             return {}
-        return_val = {}
-        for entry in os.listdir(path_to_directory):
-            full_path = os.path.join(path_to_directory, entry)
-            list_tag = self.current_workspace.get_tags_for_file_name(full_path)
-            if len(list_tag) <= 0:
-                continue
-            tags_as_list = []
-            for tag in list_tag:
-                if tag.is_simple():
-                    tags_as_list.append(tag.simple_value)
-                else:
-                    tags_as_list.append(f"{tag.kv_key}: {tag.kv_value}")
-            return_val[entry] = " ".join(f"[{t}]" for t in tags_as_list)
-        return return_val
-    
+        mapping = self._read_or_defer(TagModel._read_directory_tags, path_to_directory,
+                                      on_deferred=lambda result: self.sg_directory_tags_loaded.emit(*result))
+        return mapping[1] if mapping else {}
+
     def get_tags_for_filename_as_list(self, path_to_file_name: str) -> list:
-        # print(f"START get_tags_for_filename_as_list_of_str: {path_to_file_name}")
-        if self.current_workspace:
-            list_tag = self.current_workspace.get_tags_for_file_name(path_to_file_name)
-            if len(list_tag) <= 0:
-                return []
-            return_list = []
-            for tag in list_tag:
-                if tag.is_simple():
-                    return_list.append(tag.simple_value)
-                else:
-                    return_list.append([tag.kv_key, tag.kv_value])
-            # print(f"DONE get_tags_for_filename_as_list_of_str: {path_to_file_name}")
-            return return_list
-        else:
+        """Returns a file's tags as TagModel.tags_as_list does. Never waits, like get_tag_mapping_in_dir_as_strings, emitting sg_file_tags_loaded instead."""
+        if self.current_workspace == None:
             return []
-    
+        file_tags = self._read_or_defer(TagModel._read_file_tags, path_to_file_name,
+                                        on_deferred=lambda result: self.sg_file_tags_loaded.emit(*result))
+        return file_tags[1] if file_tags else []
+
+    # Tag edits write to disk, so they run on the worker, after any search already running. They reach the views through sg_tags_changed,
+    # and failures are reported through sg_error_encountered. Returns whether the edit was started.
     def add_tag_to_file(self, path_to_file_name: str, tag1_to_add: str, tag2_to_add: str | None):
-        if self.current_workspace == None:
-            self.sg_error_encountered.emit("No workspace is open!")
-            return False
-        try:
-            self.current_workspace.add_tag_to_file(path_to_file_name, tag1_to_add, tag2_to_add)
-        except Exception as e:
-            self.sg_error_encountered.emit(str(e))
-            return False
-        return True
+        return self._edit_async(tags.TagWorkspace.add_tag_to_file, path_to_file_name, tag1_to_add, tag2_to_add)
+
+    def add_tag_to_files(self, paths_to_files: list[str], tag1_to_add: str, tag2_to_add: str | None):
+        """Adds one tag to many files at once: each tag file changed is written once, and the views are notified once"""
+        tag = tags.Tag.simple(tag1_to_add) if tag2_to_add is None else tags.Tag.kv(tag1_to_add, tag2_to_add)
+        return self._edit_async(tags.TagWorkspace.add_tags_bulk, [(path, [tag]) for path in paths_to_files])
 
     def remove_tag_from_file(self, path_to_file_name: str, tag1_to_remove: str, tag2_to_remove: str | None):
-        if self.current_workspace == None:
-            self.sg_error_encountered.emit("No workspace is open!")
-            return False
-        try:
-            self.current_workspace.remove_tag_from_file(path_to_file_name, tag1_to_remove, tag2_to_remove)
-        except Exception as e:
-            self.sg_error_encountered.emit(str(e))
-            return False
-        return True
+        return self._edit_async(tags.TagWorkspace.remove_tag_from_file, path_to_file_name, tag1_to_remove, tag2_to_remove)
         
     def get_workspace_name(self) -> str:
         if self.current_workspace == None:
@@ -83,9 +130,15 @@ class TagModel(QObject):
     def open_and_set_workspace(self, new_cwd, workspace_name) -> bool:
         wksp = tags.TagWorkspace.open_workspace(new_cwd, workspace_name)
         if wksp != None:
-            self.current_workspace = wksp
-            self.cwd = new_cwd
-            self.current_workspace.scan_for_tagfiles()
+            self.cancel_pending()
+            with self._workspace_lock:
+                self.current_workspace = wksp
+                self.cwd = new_cwd
+                self.current_workspace.set_scan_threads(SCAN_THREADS)
+                self.current_workspace.enable_lazy_loading(LAZY_TAGFILES)
+                self.current_workspace.set_change_callback(self._on_workspace_changes)
+                self._suggestions_ready = False
+            self._watch_current_workspace()
             self.sg_workspace_name_change.emit(workspace_name)
             return True
         return False
@@ -94,25 +147,186 @@ class TagModel(QObject):
     def create_and_set_workspace(self, new_cwd, workspace_name) -> bool:
         wksp = tags.TagWorkspace.create_workspace(new_cwd, workspace_name)
         if wksp != None:
-            self.current_workspace = wksp
-            self.cwd = new_cwd
-            self.current_workspace.scan_for_tagfiles()
+            self.cancel_pending()
+            with self._workspace_lock:
+                self.current_workspace = wksp
+                self.cwd = new_cwd
+                self.current_workspace.set_scan_threads(SCAN_THREADS)
+                self.current_workspace.enable_lazy_loading(LAZY_TAGFILES)
+                self.current_workspace.set_change_callback(self._on_workspace_changes)
+                self._suggestions_ready = False
+            self._watch_current_workspace()
             self.sg_workspace_name_change.emit(workspace_name)
             return True
         return False
     
-    def do_query(self, exact: bool, text: str, simple=True, key=True, value=True) -> dict:
+    def do_query(self, exact: bool, text: str, simple=True, key=True, value=True) -> tags.TagQueryCursor | None:
+        """Returns a cursor over the matching files, sorted by path. Tags are only formatted as results are fetched from it."""
+        if self.current_workspace == None:
+            return None
+        with self._workspace_lock:
+            if exact:
+                return self.current_workspace.query_exact_cursor(text, simple, key, value)
+            return self.current_workspace.query_fuzzy_cursor(text, simple, key, value)
+
+    def do_expression_query(self, expr: str) -> tags.TagQueryCursor | None:
+        """Runs a compound query such as "Texture:Verso AND NOT Due:Today OR Personal". Raises if the query cannot be parsed."""
+        if self.current_workspace == None:
+            return None
+        with self._workspace_lock:
+            return self.current_workspace.query_cursor(expr)
+
+    def do_query_async(self, exact: bool, text: str, simple=True, key=True, value=True):
+        """Same as do_query, on the worker thread. Emits sg_query_finished with the cursor, or sg_query_cancelled if a newer query replaced it first."""
+        if self._pending_query:
+            self._pending_query.cancel()
+        self._pending_query = self.run_async(self.do_query, exact, text, simple, key, value,
+                                             on_finished=self.sg_query_finished.emit, on_cancelled=self.sg_query_cancelled.emit)
+
+    def do_expression_query_async(self, expr: str):
+        """Same as do_expression_query, on the worker thread. Reports like do_query_async; a query that cannot be parsed is reported through sg_error_encountered."""
+        if self._pending_query:
+            self._pending_query.cancel()
+        self._pending_query = self.run_async(self.do_expression_query, expr,
+                                             on_finished=self.sg_query_finished.emit, on_cancelled=self.sg_query_cancelled.emit)
+
+    def suggest_tags(self, prefix: str) -> list[str]:
+        """Returns the tags starting with prefix, most used first, for completion. Never waits: returns nothing while the worker holds the workspace,
+        or while the tag counts are first loaded (on the worker, since it loads every tag file)."""
+        if self.current_workspace == None or not prefix:
+            return []
+        if not self._suggestions_ready:
+            if self._pending_suggestions == None:
+                self._pending_suggestions = self.run_async(self._load_suggestions, on_finished=self._on_suggestions_loaded)
+            return []
+        if not self._workspace_lock.acquire(blocking=False):
+            return []
+        try:
+            return [text for text, _count in self.current_workspace.suggest(prefix, SUGGESTION_LIMIT)]
+        finally:
+            self._workspace_lock.release()
+
+    def run_async(self, fn: Callable, *args, on_finished: Callable | None = None, on_cancelled: Callable | None = None, cancellable: bool = True) -> WorkspaceTask:
+        """Runs fn(*args) on the worker thread. on_finished (with the result) and on_cancelled are called on the Qt thread; failures are reported through sg_error_encountered."""
+        task = WorkspaceTask(fn, *args, on_finished=on_finished, on_cancelled=on_cancelled, cancellable=cancellable)
+        task.signals.sg_finished.connect(self._on_task_finished)
+        task.signals.sg_failed.connect(self._on_task_failed)
+        task.signals.sg_cancelled.connect(self._on_task_cancelled)
+        self._tasks.add(task) # Keeps the task and its signals alive until it reports back
+        self._pool.start(task)
+        return task
+
+    def cancel_pending(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def shutdown(self):
+        """Cancels queued work and waits for the running operation, so that the workspace is not dropped mid-write"""
+        self._watch_timer.stop()
+        self.cancel_pending()
+        self._pool.waitForDone()
+
+    @staticmethod
+    def tags_as_list(list_tag: list) -> list:
+        """Converts rs_tags Tags to the form used by the views: a string for a simple tag, [key, value] for a key-value tag"""
+        return_list = []
+        for tag in list_tag:
+            if tag.is_simple():
+                return_list.append(tag.simple_value)
+            else:
+                return_list.append([tag.kv_key, tag.kv_value])
+        return return_list
+
+    def _read_or_defer(self, read: Callable, *args, on_deferred: Callable):
+        """Returns read(workspace, *args) if the workspace is free. Otherwise returns None, and runs it on the worker, passing its result to on_deferred."""
+        workspace = self.current_workspace
+        if self._workspace_lock.acquire(blocking=False):
+            try:
+                return read(workspace, *args)
+            finally:
+                self._workspace_lock.release()
+        self.run_async(self._locked, read, workspace, *args, on_finished=on_deferred)
+        return None
+
+    def _edit_async(self, edit: Callable, *args) -> bool:
+        # The workspace is taken now: an edit is never cancelled, and applies to the workspace it was made in even if another is opened meanwhile
         if self.current_workspace == None:
-            return dict()
-        rv = dict()
-        qv = self.current_workspace.query_exact(text, simple, key, value) if exact else self.current_workspace.query_fuzzy(text, simple, key, value)
-
-        for key, value in qv.items():
-            tag_strs = []
-            for tag in value:
-                if tag.is_simple():
-                    tag_strs.append(tag.simple_value)
-                else:
-                    tag_strs.append(f"{tag.kv_key}: {tag.kv_value}")
-            rv[key] = " ".join(f"[{t}]" for t in tag_strs)
-        return rv
\ No newline at end of file
+            self.sg_error_encountered.emit("No workspace is open!")
+            return False
+        self.run_async(self._locked, edit, self.current_workspace, *args, cancellable=False)
+        return True
+
+    def _locked(self, fn: Callable, workspace: tags.TagWorkspace, *args):
+        with self._workspace_lock:
+            return fn(workspace, *args)
+
+    @staticmethod
+    def _read_directory_tags(workspace: tags.TagWorkspace, path_to_directory: str) -> tuple[str, Dict[str, str]]:
+        return path_to_directory, workspace.get_tag_strings_for_directory(path_to_directory)
+
+    @staticmethod
+    def _read_file_tags(workspace: tags.TagWorkspace, path_to_file_name: str) -> tuple[str, list]:
+        return path_to_file_name, TagModel.tags_as_list(workspace.get_tags_for_file_name(path_to_file_name))
+
+    def _watch_current_workspace(self):
+        # Without a watch, tag files changed by other programs (such as tag-cli) are only seen after reopening the workspace
+        try:
+            with self._workspace_lock:
+                self.current_workspace.watch(WATCH_DEBOUNCE_MS)
+        except Exception as e:
+            self.sg_error_encountered.emit(f"Changes made by other programs will not be shown: {e}")
+
+    def _poll_workspace_changes(self):
+        # Reloading tag files reads the disk, so it runs on the worker; changes reach the views through sg_tags_changed
+        if self.current_workspace == None or self._pending_poll:
+            return
+        self._pending_poll = self.run_async(self._poll_changes_now)
+
+    def _poll_changes_now(self):
+        with self._workspace_lock:
+            if self.current_workspace:
+                self.current_workspace.poll_changes()
+
+    def _load_suggestions(self):
+        with self._workspace_lock:
+            if self.current_workspace:
+                self.current_workspace.suggest("", 0) # Builds the tag counts
+
+    def _on_suggestions_loaded(self, _result):
+        self._suggestions_ready = True
+
+    def _on_workspace_changes(self, changes: list):
+        # Called by rs_tags on the thread that made the change: the signal queues it to slots on the Qt thread
+        self.sg_tags_changed.emit(changes)
+
+    def _on_task_finished(self, task: WorkspaceTask, result):
+        self._tasks.discard(task)
+        if task is self._pending_query:
+            self._pending_query = None
+        if task is self._pending_poll:
+            self._pending_poll = None
+        if task is self._pending_suggestions:
+            self._pending_suggestions = None
+        if task.on_finished:
+            task.on_finished(result)
+
+    def _on_task_failed(self, task: WorkspaceTask, error_msg: str):
+        self._tasks.discard(task)
+        if task is self._pending_query:
+            self._pending_query = None
+        if task is self._pending_poll:
+            self._pending_poll = None
+        if task is self._pending_suggestions:
+            self._pending_suggestions = None
+        self.sg_error_encountered.emit(error_msg)
+
+    def _on_task_cancelled(self, task: WorkspaceTask):
+        self._tasks.discard(task)
+        if task is self._pending_query:
+            self._pending_query = None
+        if task is self._pending_poll:
+            self._pending_poll = None
+        if task is self._pending_suggestions:
+            self._pending_suggestions = None
+        if task.on_cancelled:
+            task.on_cancelled()
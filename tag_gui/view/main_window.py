@@ -1,9 +1,15 @@
-from PySide6.QtCore import Qt, QDir, QModelIndex, Signal
+from PySide6.QtCore import Qt, QDir, QModelIndex, QStringListModel, Signal
 from PySide6.QtGui import QIcon, QAction
 from PySide6.QtWidgets import (
-    QWidget, QTabWidget, QVBoxLayout, QHBoxLayout, QLabel, QSplitter, QFileSystemModel, QTreeView, QMenuBar, QHeaderView, QPushButton, QStackedWidget, QLineEdit, QScrollArea, QSizePolicy, QCheckBox, QRadioButton, QGroupBox, QDialog
+    QWidget, QTabWidget, QVBoxLayout, QHBoxLayout, QLabel, QSplitter, QFileSystemModel, QTreeView, QMenuBar, QHeaderView, QPushButton, QStackedWidget, QLineEdit, QScrollArea, QSizePolicy, QCheckBox, QRadioButton, QGroupBox, QDialog, QCompleter, QTreeWidget, QTreeWidgetItem, QAbstractItemView
 )
 
+def query_word(text: str) -> str:
+    """Writes text as one side of a term of a compound query, quoting it if it has spaces, parentheses, colons or quotes, or is spelled like an operator"""
+    if text in ("AND", "OR", "NOT", "*") or any(c.isspace() or c in '():"\\' for c in text):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+    return text
+
 class MainWindow(QWidget):
     sg_quit_app_request = Signal()
     sg_create_workspace_request = Signal(str)
@@ -163,6 +169,7 @@ class FilesTab(QWidget):
         header.setSectionResizeMode(1,QHeaderView.ResizeMode.ResizeToContents)
         header.setMinimumSectionSize(50)
         self.left_file_hierarchy.setColumnWidth(0, 250)
+        self.left_file_hierarchy.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection) # Tags added apply to every selected file
         # self.left_file_hierarchy.doubleClicked.connect(self._on_file_folder_double_click)
         self.left_file_hierarchy.activated.connect(self._on_file_folder_double_click) #works w/ double click, enter key
 
@@ -188,15 +195,21 @@ class FilesTab(QWidget):
     def set_info_to_placeholder(self):
         self.right_stack.setCurrentIndex(0)
 
-    def on_file_folder_selection_changed(self, selected, _deselected):
-        indexes = selected.indexes()
-        if not indexes or not indexes[0].isValid():
+    def on_file_folder_selection_changed(self, _selected, _deselected):
+        rows = self.selected_indexes()
+        if not rows:
             self.right_stack.setCurrentIndex(0)
         else:
             self.right_stack.setCurrentIndex(1)
-            self.sg_selected_file_change.emit(indexes[0].siblingAtColumn(0))
+            self.right_file_info_widget.set_selection_count(len(rows))
+            current = self.left_file_hierarchy.selectionModel().currentIndex().siblingAtColumn(0)
+            self.sg_selected_file_change.emit(current if current in rows else rows[0])
         return
 
+    def selected_indexes(self) -> list[QModelIndex]:
+        """The selected rows, as indexes of their first column"""
+        return [index for index in self.left_file_hierarchy.selectionModel().selectedRows(0) if index.isValid()]
+
     def _on_file_folder_double_click(self, index: QModelIndex):
         self.sg_file_folder_doubleclick.emit(index)
         return 
@@ -263,6 +276,13 @@ class FileInfoWidget(QWidget):
         self.setLayout(layout)
         return
     
+    def set_selection_count(self, count: int):
+        """Shows on the add buttons how many files a tag will be added to"""
+        suffix = f" to {count} Files" if count > 1 else ""
+        self.add_simple_tag_button.setText(f"Add Simple Tag{suffix}")
+        self.add_kv_tag_button.setText(f"Add Key-Value Tag{suffix}")
+        return
+
     def set_selected(self, index: QModelIndex, icon: QIcon, fname: str, path: str, size: int, last_modified: str):
         if not index.isValid():
             self.hide()
@@ -315,8 +335,12 @@ class QueryTab(QWidget):
         super().__init__()
         layout = QVBoxLayout(self)
 
-        # ** LEFT - SEARCH BOX ** #
+        # ** LEFT - SEARCH BOX, FACETS BELOW ** #
         self.left_root = QuerySearchArea()        
+        self.facet_panel = FacetPanel()
+        left_splitter = QSplitter(Qt.Orientation.Vertical)
+        left_splitter.addWidget(self.left_root)
+        left_splitter.addWidget(self.facet_panel)
         # ** MIDDLE - FILES ** #
         self.middle_root = QTreeView()
         self.middle_root.setItemsExpandable(False)
@@ -345,7 +369,7 @@ class QueryTab(QWidget):
 
         # ** SPLITTER ROOT ** #
         splitter_root = QSplitter(Qt.Orientation.Horizontal)
-        splitter_root.addWidget(self.left_root)
+        splitter_root.addWidget(left_splitter)
         splitter_root.addWidget(self.middle_root)
         splitter_root.addWidget(self.right_root_stack)
         layout.addWidget(splitter_root)
@@ -370,6 +394,9 @@ class QueryTab(QWidget):
 
 class QuerySearchArea(QWidget):
     sg_search_query_entered = Signal(bool, str, bool, bool, bool)
+    sg_expression_query_entered = Signal(str)
+    # The tag being typed in the search box, for which completions are wanted (see set_completions)
+    sg_completion_requested = Signal(str)
 
     def __init__(self):
         super().__init__()
@@ -382,14 +409,25 @@ class QuerySearchArea(QWidget):
         self.tag_name_search = QLineEdit()
         self.tag_name_search.setPlaceholderText("Search by Tags...")
         left_root_layout.addWidget(self.tag_name_search)
+        # Completes the tag under the cursor rather than the whole text, so the completer is not set on the line edit itself.
+        # Completions come already filtered and ranked (most used first) from set_completions.
+        self.completion_model = QStringListModel(self)
+        self.completer = QCompleter(self.completion_model, self)
+        self.completer.setWidget(self.tag_name_search)
+        self.completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
+        self.completer.activated.connect(self._insert_completion)
         
         exact_fuzzy_group = QGroupBox()
         exact_fuzzy_group_layout = QHBoxLayout()
         self.exact_radio_btn = QRadioButton("Exact")
         self.fuzzy_radio_btn = QRadioButton("Fuzzy")
         self.fuzzy_radio_btn.setChecked(True)
+        # Compound queries such as "Texture:Verso AND NOT Due:Today OR Personal"
+        self.expression_radio_btn = QRadioButton("Expression")
+        self.expression_radio_btn.setToolTip("Combine tags with AND, OR, NOT and parentheses.\nTerms: Simple, Key:Value, Key:*, *:Value. Quote text with spaces.")
         exact_fuzzy_group_layout.addWidget(self.exact_radio_btn)
         exact_fuzzy_group_layout.addWidget(self.fuzzy_radio_btn)
+        exact_fuzzy_group_layout.addWidget(self.expression_radio_btn)
         exact_fuzzy_group.setLayout(exact_fuzzy_group_layout)
         left_root_layout.addWidget(exact_fuzzy_group)
 
@@ -415,12 +453,113 @@ class QuerySearchArea(QWidget):
         left_root_layout.addWidget(flags_group)
 
         self.tag_name_search.editingFinished.connect(self._emit_search_query_entered)
+        self.tag_name_search.textEdited.connect(self._emit_completion_requested)
+        # The include flags do not apply to expressions, where each term says what it matches
+        self.expression_radio_btn.toggled.connect(lambda checked: flags_group.setEnabled(not checked))
     
+    def set_completions(self, completions: list):
+        self.completion_model.setStringList(completions)
+        if completions and self.tag_name_search.hasFocus():
+            self.completer.complete()
+        else:
+            self.completer.popup().hide()
+
+    def _current_term_span(self) -> tuple[int, int]:
+        # Expressions complete the term before the cursor; other searches are a single tag
+        end = self.tag_name_search.cursorPosition()
+        if not self.expression_radio_btn.isChecked():
+            return 0, end
+        text = self.tag_name_search.text()
+        start = end
+        while start > 0 and not text[start - 1].isspace() and text[start - 1] not in '()"':
+            start -= 1
+        return start, end
+
+    def _emit_completion_requested(self, _text: str):
+        start, end = self._current_term_span()
+        self.sg_completion_requested.emit(self.tag_name_search.text()[start:end])
+
+    def _insert_completion(self, completion: str):
+        start, end = self._current_term_span()
+        if self.expression_radio_btn.isChecked():
+            # Each side of a term is quoted if the query syntax needs it
+            completion = ":".join(query_word(part) for part in completion.split(":", 1))
+        text = self.tag_name_search.text()
+        self.tag_name_search.setText(text[:start] + completion + text[end:])
+        self.tag_name_search.setCursorPosition(start + len(completion))
+
     def _emit_search_query_entered(self):
+        if self.expression_radio_btn.isChecked():
+            self.sg_expression_query_entered.emit(self.tag_name_search.text())
+            return
         exact = self.exact_radio_btn.isChecked()
         text = self.tag_name_search.text()
         simple = self.checkbox_simple.isChecked()
         key = self.checkbox_key.isChecked()
         value = self.checkbox_value.isChecked()
         self.sg_search_query_entered.emit(exact, text, simple, key, value)
-        return
\ No newline at end of file
+        return
+
+class FacetPanel(QWidget):
+    """How many results carry each tag, key and value. Activating one narrows the results to the files carrying it."""
+    # A term of a compound query, such as Personal, Texture:* or Texture:Verso
+    sg_facet_activated = Signal(str)
+    sg_clear_requested = Signal()
+
+    def __init__(self):
+        super().__init__()
+        layout = QVBoxLayout(self)
+
+        title_bar = QHBoxLayout()
+        title = QLabel("Refine")
+        title.setAlignment(Qt.AlignmentFlag.AlignHCenter)
+        self.clear_btn = QPushButton("Clear")
+        self.clear_btn.setEnabled(False)
+        self.clear_btn.clicked.connect(lambda: self.sg_clear_requested.emit())
+        title_bar.addWidget(title)
+        title_bar.addStretch()
+        title_bar.addWidget(self.clear_btn)
+        layout.addLayout(title_bar)
+        self.filters_label = QLabel()
+        self.filters_label.setWordWrap(True)
+        self.filters_label.hide()
+        layout.addWidget(self.filters_label)
+
+        self.tree = QTreeWidget()
+        self.tree.setColumnCount(2)
+        self.tree.setHeaderLabels(["Tag", "Files"])
+        self.tree.header().setSectionResizeMode(0, QHeaderView.ResizeMode.Stretch)
+        self.tree.header().setSectionResizeMode(1, QHeaderView.ResizeMode.ResizeToContents)
+        self.tree.header().setStretchLastSection(False)
+        self.tree.itemActivated.connect(self._on_item_activated)
+        layout.addWidget(self.tree)
+
+    def set_facets(self, facets: dict | None, filters: list[str]):
+        """Shows the facets of the current results (see TagQueryCursor.facets), and the terms they were narrowed by"""
+        self.tree.clear()
+        self.clear_btn.setEnabled(bool(filters))
+        self.filters_label.setText("Within: " + " AND ".join(filters))
+        self.filters_label.setVisible(bool(filters))
+        if not facets:
+            return
+        if facets["simple"]:
+            simple_root = QTreeWidgetItem(self.tree, ["Tags"])
+            for tag, count in facets["simple"]:
+                self._add_item(simple_root, tag, count, query_word(tag))
+            simple_root.setExpanded(True)
+        for key, count, values in facets["keys"]:
+            key_item = self._add_item(self.tree, key, count, f"{query_word(key)}:*")
+            for value, value_count in values:
+                self._add_item(key_item, value, value_count, f"{query_word(key)}:{query_word(value)}")
+
+    @staticmethod
+    def _add_item(parent, text: str, count: int, term: str) -> QTreeWidgetItem:
+        item = QTreeWidgetItem(parent, [text, str(count)])
+        item.setData(0, Qt.ItemDataRole.UserRole, term)
+        item.setTextAlignment(1, Qt.AlignmentFlag.AlignRight)
+        return item
+
+    def _on_item_activated(self, item: QTreeWidgetItem, _column: int):
+        term = item.data(0, Qt.ItemDataRole.UserRole)
+        if term:
+            self.sg_facet_activated.emit(term)
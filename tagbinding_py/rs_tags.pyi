@@ -1,4 +1,4 @@
-from typing import List, Dict, Optional
+from typing import Any, Callable, List, Dict, Literal, Optional
 
 class Tag:
     @staticmethod
@@ -18,16 +18,89 @@ class Tag:
     @property
     def kv_value(self) -> Optional[str]: ...
 
+class TagBatch:
+    def __enter__(self) -> TagWorkspace: ...
+    def __exit__(self, exc_type: object, exc_value: object, traceback: object) -> bool: ...
+
+class TagQueryCursor:
+    def fetch(self, n: int) -> list[tuple[str, list[Tag]]]: ...
+    def fetch_strings(self, n: int) -> list[tuple[str, str]]: ...
+    @property
+    def remaining(self) -> int: ...
+    def rewind(self) -> None: ...
+    def facets(self) -> Dict[str, list[Any]]: ...
+    def narrow(self, expr: str) -> TagQueryCursor: ...
+    def __len__(self) -> int: ...
+    def __iter__(self) -> TagQueryCursor: ...
+    def __next__(self) -> tuple[str, list[Tag]]: ...
+
+class TagChange:
+    @property
+    def directory(self) -> str: ...
+    @property
+    def file_name(self) -> str: ...
+    @property
+    def path(self) -> str: ...
+    @property
+    def tags(self) -> list[Tag]: ...
+    @property
+    def tag_string(self) -> str: ...
+    def __repr__(self) -> str: ...
+
 class TagWorkspace:
     @staticmethod
     def open_workspace(directory: str, name: str) -> TagWorkspace: ...
     @staticmethod
     def create_workspace(directory: str, name: str) -> TagWorkspace: ...
     def scan_for_tagfiles(self) -> None: ...
+    def scan_for_tagfiles_cached(self) -> None: ...
+    def set_scan_threads(self, threads: int) -> None: ...
+    def set_durability(self, durability: Literal["none", "file", "file-and-dir"]) -> None: ...
+    def set_tagfile_format(self, format: Literal["toml", "binary"]) -> None: ...
+    def migrate_tagfiles(self, format: Literal["toml", "binary"]) -> int: ...
+    def enable_lazy_loading(self, max_tagfiles: int) -> None: ...
+    def begin_batch(self) -> None: ...
+    def commit_batch(self) -> None: ...
+    def flush(self) -> None: ...
+    def batch(self) -> TagBatch: ...
     def add_tag_to_file(self, path_to_file: str, tag_1: str, tag_2: str | None) -> None: ...
     def remove_tag_from_file(self, path_to_file: str, tag_1: str, tag_2: str | None) -> None: ...
+    def add_tags_bulk(self, files_and_tags: list[tuple[str, list[Tag]]]) -> int: ...
+    def add_tags_glob(self, base_dir: str, pattern: str, tags: list[Tag]) -> int: ...
+    def find_files(self, base_dir: str, pattern: str) -> list[str]: ...
+    def move_file(self, from_path: str, to_path: str) -> None: ...
+    def rename_file(self, path_to_file: str, new_name: str) -> None: ...
+    def reconcile(self) -> list[tuple[str, str]]: ...
+    def rename_tag(self, from_tag: Tag, to_tag: Tag) -> tuple[int, int]: ...
+    def merge_tags(self, from_tags: list[Tag], into: Tag) -> tuple[int, int]: ...
+    def delete_tag(self, tag: Tag) -> tuple[int, int]: ...
+    def rename_key(self, from_key: str, to_key: str) -> tuple[int, int]: ...
+    def delete_key(self, key: str) -> tuple[int, int]: ...
+    def watch(self, debounce_ms: int = 500) -> None: ...
+    def unwatch(self) -> None: ...
+    def poll_changes(self) -> list[str]: ...
+    def set_change_callback(self, callback: Callable[[list[TagChange]], object] | None = None) -> None: ...
     def get_tags_for_file_name(self, path_to_file: str) -> list[Tag]: ...
+    def get_tags_for_directory(self, path_to_directory: str) -> Dict[str, list[Tag]]: ...
+    def get_tags_for_directories(self, paths_to_directories: list[str]) -> Dict[str, Dict[str, list[Tag]]]: ...
+    def get_tag_strings_for_directory(self, path_to_directory: str) -> Dict[str, str]: ...
     def get_name(self) -> str: ...
     def get_path_to_workspace_file(self) -> str: ...
+    def query(self, expr: str) -> Dict[str, list[Tag]]: ...
     def query_exact(self, text: str, simple: bool, key: bool, value: bool) -> Dict[str, list[Tag]]: ...
-    def query_fuzzy(self, text: str, simple: bool, key: bool, value: bool) -> Dict[str, list[Tag]]: ...
\ No newline at end of file
+    def query_fuzzy(self, text: str, simple: bool, key: bool, value: bool) -> Dict[str, list[Tag]]: ...
+    @staticmethod
+    def enable_profiling(trace: bool = False) -> None: ...
+    @staticmethod
+    def disable_profiling() -> None: ...
+    @staticmethod
+    def reset_stats() -> None: ...
+    @staticmethod
+    def stats() -> Dict[str, Dict[str, Any]]: ...
+    @staticmethod
+    def write_trace(path: str) -> None: ...
+    def query_cursor(self, expr: str) -> TagQueryCursor: ...
+    def query_exact_cursor(self, text: str, simple: bool, key: bool, value: bool) -> TagQueryCursor: ...
+    def query_fuzzy_cursor(self, text: str, simple: bool, key: bool, value: bool) -> TagQueryCursor: ...
+    def suggest(self, prefix: str, limit: int = 10) -> list[tuple[str, int]]: ...
+    def tag_counts(self) -> list[tuple[Tag, int]]: ...
\ No newline at end of file
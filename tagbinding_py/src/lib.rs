@@ -1,7 +1,7 @@
 #[pyo3::pymodule]
 mod rs_tags {
     use tagcore;
-    use pyo3::{Bound, PyResult, create_exception, prelude::*, pyclass, types::PyType};
+    use pyo3::{Bound, PyResult, create_exception, prelude::*, pyclass, types::{PyDict, PyType}};
 
     create_exception!(rs_tags, PyTagError, pyo3::exceptions::PyException);
 
@@ -71,52 +71,397 @@ mod rs_tags {
         }
     }
 
+    /// Context manager returned by TagWorkspace.batch(). Begins a batch on enter and commits it on exit, even if the block raised.
+    #[pyclass]
+    struct TagBatch {
+        workspace: Py<TagWorkspace>,
+    }
+
+    #[pymethods]
+    impl TagBatch {
+        pub fn __enter__(&self, py: Python<'_>) -> Py<TagWorkspace> {
+            self.workspace.borrow_mut(py).inner.begin_batch();
+            self.workspace.clone_ref(py)
+        }
+
+        #[pyo3(signature = (_exc_type=None, _exc_value=None, _traceback=None))]
+        pub fn __exit__(&self, py: Python<'_>, _exc_type: Option<Bound<'_, PyAny>>, _exc_value: Option<Bound<'_, PyAny>>, _traceback: Option<Bound<'_, PyAny>>) -> PyResult<bool> {
+            let mut workspace = self.workspace.borrow_mut(py);
+            let inner = &mut workspace.inner;
+            py.detach(|| inner.commit_batch()).map_err(|e| PyTagError::new_err(e.to_string()))?;
+            Ok(false)
+        }
+    }
+
+    /// Results of a query in a stable order (by directory, then file name), returned a batch at a time.
+    /// Holds its own copy of the results, so the workspace can be used (and changed) while it is read.
+    #[pyclass]
+    struct TagQueryCursor {
+        inner: tagcore::QueryCursor,
+    }
+
+    #[pymethods]
+    impl TagQueryCursor {
+        /// Returns the next (at most) n results as (relative file path, tags) pairs. Returns an empty list once every result was fetched.
+        pub fn fetch(&mut self, py: Python<'_>, n: usize) -> Vec<(String, Vec<Tag>)> {
+            let batch = py.detach(|| self.inner.fetch(n));
+            let _span = tagcore::Profiler::span(tagcore::Phase::Convert);
+            batch.into_iter()
+                .map(|(file_name, tags)| (file_name, tags.into_iter().map(Tag::from).collect()))
+                .collect()
+        }
+
+        /// Same as fetch, with the tags of each file formatted like get_tag_strings_for_directory
+        pub fn fetch_strings(&mut self, py: Python<'_>, n: usize) -> Vec<(String, String)> {
+            py.detach(|| {
+                let _span = tagcore::Profiler::span(tagcore::Phase::Convert);
+                self.inner.fetch(n).into_iter()
+                    .map(|(file_name, tags)| (file_name, TagWorkspace::display_string(&tags)))
+                    .collect()
+            })
+        }
+
+        #[getter]
+        pub fn remaining(&self) -> usize {
+            self.inner.remaining()
+        }
+
+        pub fn rewind(&mut self) {
+            self.inner.rewind();
+        }
+
+        /// Counts the tags of every result, fetched or not: {"simple": [(tag, count)], "keys": [(key, count, [(value, count)])]}, most common first
+        pub fn facets<'py>(&self, py: Python<'py>) -> PyResult<Bound<'py, PyDict>> {
+            let facets = py.detach(|| self.inner.facets());
+            let _span = tagcore::Profiler::span(tagcore::Phase::Convert);
+            let keys: Vec<(String, usize, Vec<(String, usize)>)> = facets.keys.into_iter()
+                .map(|facet| (facet.key, facet.count, facet.values))
+                .collect();
+            let rv = PyDict::new(py);
+            rv.set_item("simple", facets.simple)?;
+            rv.set_item("keys", keys)?;
+            Ok(rv)
+        }
+
+        /// Returns a new cursor over the results that also match a compound query such as "Texture:Verso AND NOT Personal", without querying the workspace again.
+        /// Raises PyTagError if the query cannot be parsed.
+        pub fn narrow(&self, py: Python<'_>, expr: &str) -> PyResult<TagQueryCursor> {
+            let cursor = py.detach(|| self.inner.narrow(expr)).map_err(|e| PyTagError::new_err(e.to_string()))?;
+            Ok(TagQueryCursor { inner: cursor })
+        }
+
+        fn __len__(&self) -> usize {
+            self.inner.len()
+        }
+
+        fn __iter__(slf: PyRef<'_, Self>) -> PyRef<'_, Self> {
+            slf
+        }
+
+        fn __next__(&mut self) -> Option<(String, Vec<Tag>)> {
+            let (file_name, tags) = self.inner.next()?;
+            Some((file_name, tags.into_iter().map(Tag::from).collect()))
+        }
+    }
+
+    /// A file whose tags were changed, with the tags it has now. Passed to the callback set by TagWorkspace.set_change_callback.
+    #[pyclass]
+    struct TagChange {
+        inner: tagcore::TagChange,
+    }
+
+    #[pymethods]
+    impl TagChange {
+        #[getter]
+        pub fn directory(&self) -> String {
+            self.inner.directory.to_string_lossy().into_owned()
+        }
+
+        #[getter]
+        pub fn file_name(&self) -> &str {
+            &self.inner.file_name
+        }
+
+        /// Path of the file relative to the workspace root, as in query results
+        #[getter]
+        pub fn path(&self) -> &str {
+            &self.inner.path
+        }
+
+        #[getter]
+        pub fn tags(&self) -> Vec<Tag> {
+            self.inner.tags.iter().cloned().map(Tag::from).collect()
+        }
+
+        /// The tags formatted like get_tag_strings_for_directory
+        #[getter]
+        pub fn tag_string(&self) -> String {
+            TagWorkspace::display_string(&self.inner.tags)
+        }
+
+        fn __repr__(&self) -> String {
+            format!("TagChange({}, {})", self.inner.path, self.tag_string())
+        }
+    }
+
     impl From<tagcore::Tag> for Tag {
         fn from(tag: tagcore::Tag) -> Self {
             Tag { inner: tag }
         }
     }
 
+    /// Methods that read or write TagFiles release the GIL while they run, so other Python threads (such as a GUI's) keep running.
+    /// A workspace still runs one method at a time: calling it from another thread meanwhile raises RuntimeError (already borrowed).
     #[pyclass]
     struct TagWorkspace {
         inner: tagcore::Workspace,
+        /// Called with a list of TagChange after each method that changed tags, see set_change_callback
+        on_change: Option<Py<PyAny>>,
     }
 
     #[pymethods]
     impl TagWorkspace {
         #[classmethod]
-        pub fn open_workspace(_class: Bound<PyType>, directory: std::path::PathBuf, name: String) -> PyResult<Self> {
-            match tagcore::Workspace::open_workspace(directory, &name) {
-                Ok(x) => Ok(TagWorkspace {inner: x}),
+        pub fn open_workspace(_class: Bound<PyType>, py: Python<'_>, directory: std::path::PathBuf, name: String) -> PyResult<Self> {
+            match py.detach(|| tagcore::Workspace::open_workspace(directory, &name)) {
+                Ok(x) => Ok(TagWorkspace { inner: x, on_change: None }),
                 Err(err) => Err(PyTagError::new_err(err.to_string())),
             }
         }
 
         #[classmethod]
-        pub fn create_workspace(_class: Bound<PyType>, directory: std::path::PathBuf, name: String) -> PyResult<Self> {
-            match tagcore::Workspace::create_workspace(directory, &name) {
-                Ok(x) => Ok(TagWorkspace { inner: x }),
+        pub fn create_workspace(_class: Bound<PyType>, py: Python<'_>, directory: std::path::PathBuf, name: String) -> PyResult<Self> {
+            match py.detach(|| tagcore::Workspace::create_workspace(directory, &name)) {
+                Ok(x) => Ok(TagWorkspace { inner: x, on_change: None }),
                 Err(err) => Err(PyTagError::new_err(err.to_string())),
             }
         }
 
-        pub fn scan_for_tagfiles(&mut self) {
-            self.inner.scan_for_tagfiles();
+        pub fn scan_for_tagfiles(&mut self, py: Python<'_>) {
+            py.detach(|| self.inner.scan_for_tagfiles());
+        }
+
+        pub fn scan_for_tagfiles_cached(&mut self, py: Python<'_>) {
+            py.detach(|| self.inner.scan_for_tagfiles_cached());
+        }
+
+        pub fn set_scan_threads(&mut self, threads: usize) {
+            self.inner.set_scan_threads(threads);
+        }
+
+        /// Takes "none", "file" or "file-and-dir"
+        pub fn set_durability(&mut self, durability: &str) -> PyResult<()> {
+            let durability = durability.parse::<tagcore::Durability>().map_err(PyTagError::new_err)?;
+            self.inner.set_durability(durability);
+            Ok(())
+        }
+
+        /// Takes "toml" or "binary"
+        pub fn set_tagfile_format(&mut self, format: &str) -> PyResult<()> {
+            let format = format.parse::<tagcore::TagFileFormat>().map_err(PyTagError::new_err)?;
+            self.inner.set_tagfile_format(format);
+            Ok(())
+        }
+
+        /// Takes "toml" or "binary". Returns how many TagFiles were rewritten.
+        pub fn migrate_tagfiles(&mut self, py: Python<'_>, format: &str) -> PyResult<usize> {
+            let format = format.parse::<tagcore::TagFileFormat>().map_err(PyTagError::new_err)?;
+            py.detach(|| self.inner.migrate_tagfiles(format)).map_err(|e| PyTagError::new_err(e.to_string()))
+        }
+
+        pub fn enable_lazy_loading(&mut self, py: Python<'_>, max_tagfiles: usize) -> PyResult<()> {
+            py.detach(|| self.inner.enable_lazy_loading(max_tagfiles)).map_err(|e| PyTagError::new_err(e.to_string()))
+        }
+
+        pub fn begin_batch(&mut self) {
+            self.inner.begin_batch();
+        }
+
+        pub fn commit_batch(&mut self, py: Python<'_>) -> PyResult<()> {
+            py.detach(|| self.inner.commit_batch()).map_err(|e| PyTagError::new_err(e.to_string()))
+        }
+
+        pub fn flush(&mut self, py: Python<'_>) -> PyResult<()> {
+            py.detach(|| self.inner.flush()).map_err(|e| PyTagError::new_err(e.to_string()))
+        }
+
+        /// Returns a context manager that runs its block as one batch: `with workspace.batch(): ...`
+        pub fn batch(slf: Bound<'_, Self>) -> TagBatch {
+            TagBatch { workspace: slf.unbind() }
+        }
+
+        pub fn add_tag_to_file(slf: &Bound<'_, Self>, path_to_file: std::path::PathBuf, tag_1: String, tag_2: Option<String>) -> PyResult<()> {
+            {
+                let mut workspace = slf.borrow_mut();
+                let inner = &mut workspace.inner;
+                slf.py().detach(|| inner.add_tag_to_file(path_to_file, tag_1, tag_2)).map_err(|e| PyTagError::new_err(e.to_string()))?;
+            }
+            TagWorkspace::notify_changes(slf)
+        }
+
+        pub fn remove_tag_from_file(slf: &Bound<'_, Self>, path_to_file: std::path::PathBuf, tag_1: String, tag_2: Option<String>) -> PyResult<()> {
+            {
+                let mut workspace = slf.borrow_mut();
+                let inner = &mut workspace.inner;
+                slf.py().detach(|| inner.remove_tag_from_file(path_to_file, tag_1, tag_2)).map_err(|e| PyTagError::new_err(e.to_string()))?;
+            }
+            TagWorkspace::notify_changes(slf)
+        }
+
+        /// Adds tags to many files, given as (path, [Tag]) pairs, writing each TagFile changed once. Returns the number of files whose tags changed.
+        /// Raises PyTagError, changing nothing, if any path or tag is invalid.
+        pub fn add_tags_bulk(slf: &Bound<'_, Self>, files_and_tags: Vec<(std::path::PathBuf, Vec<PyRef<'_, Tag>>)>) -> PyResult<usize> {
+            let files_and_tags: Vec<(std::path::PathBuf, Vec<tagcore::Tag>)> = files_and_tags.into_iter()
+                .map(|(path, tags)| (path, tags.iter().map(|tag| tag.inner.clone()).collect()))
+                .collect();
+            let changed = {
+                let mut workspace = slf.borrow_mut();
+                let inner = &mut workspace.inner;
+                slf.py().detach(|| inner.apply_bulk(files_and_tags))
+            };
+            TagWorkspace::notify_changes(slf)?;
+            changed.map_err(|e| PyTagError::new_err(e.to_string()))
         }
 
-        pub fn add_tag_to_file(&mut self, path_to_file: std::path::PathBuf, tag_1: String, tag_2: Option<String>) -> PyResult<()> {
-            self.inner.add_tag_to_file(path_to_file, tag_1, tag_2).map_err(|e| PyTagError::new_err(e.to_string()))
+        /// Same as add_tags_bulk, for every file below base_dir whose relative path matches a glob pattern such as "assets/**/*.png"
+        pub fn add_tags_glob(slf: &Bound<'_, Self>, base_dir: std::path::PathBuf, pattern: &str, tags: Vec<PyRef<'_, Tag>>) -> PyResult<usize> {
+            let tags: Vec<tagcore::Tag> = tags.iter().map(|tag| tag.inner.clone()).collect();
+            let changed = {
+                let mut workspace = slf.borrow_mut();
+                let inner = &mut workspace.inner;
+                slf.py().detach(|| {
+                    let files = inner.find_files(&base_dir, pattern)?;
+                    inner.apply_bulk(files.into_iter().map(|path| (path, tags.clone())).collect())
+                })
+            };
+            TagWorkspace::notify_changes(slf)?;
+            changed.map_err(|e| PyTagError::new_err(e.to_string()))
         }
 
-        pub fn remove_tag_from_file(&mut self, path_to_file: std::path::PathBuf, tag_1: String, tag_2: Option<String>) -> PyResult<()> {
-            self.inner.remove_tag_from_file(path_to_file, tag_1, tag_2).map_err(|e| PyTagError::new_err(e.to_string()))
+        /// Returns the files below base_dir whose relative path matches a glob pattern such as "assets/**/*.png", sorted
+        pub fn find_files(&self, py: Python<'_>, base_dir: std::path::PathBuf, pattern: &str) -> PyResult<Vec<String>> {
+            let files = py.detach(|| self.inner.find_files(&base_dir, pattern)).map_err(|e| PyTagError::new_err(e.to_string()))?;
+            Ok(files.into_iter().map(|path| path.to_string_lossy().into_owned()).collect())
+        }
+
+        /// Moves (or renames) a file on disk, along with its tags. Both TagFiles involved are written once.
+        pub fn move_file(slf: &Bound<'_, Self>, from_path: std::path::PathBuf, to_path: std::path::PathBuf) -> PyResult<()> {
+            {
+                let mut workspace = slf.borrow_mut();
+                let inner = &mut workspace.inner;
+                slf.py().detach(|| inner.move_file(from_path, to_path)).map_err(|e| PyTagError::new_err(e.to_string()))?;
+            }
+            TagWorkspace::notify_changes(slf)
+        }
+
+        pub fn rename_file(slf: &Bound<'_, Self>, path_to_file: std::path::PathBuf, new_name: String) -> PyResult<()> {
+            {
+                let mut workspace = slf.borrow_mut();
+                let inner = &mut workspace.inner;
+                slf.py().detach(|| inner.rename_file(path_to_file, &new_name)).map_err(|e| PyTagError::new_err(e.to_string()))?;
+            }
+            TagWorkspace::notify_changes(slf)
         }
 
-        pub fn get_tags_for_file_name(&self, full_path_to_file: std::path::PathBuf) -> PyResult<Vec<Tag>> {
-            let rval = self.inner.get_tags_for_file_name(full_path_to_file).map_err(|e| PyTagError::new_err(e.to_string()))?;
+        /// Moves the tags of files moved or renamed by other programs to their new path, found by the fingerprint recorded when they were tagged.
+        /// Returns every (old path, new path) re-linked.
+        pub fn reconcile(slf: &Bound<'_, Self>) -> PyResult<Vec<(String, String)>> {
+            let relinked = {
+                let mut workspace = slf.borrow_mut();
+                let inner = &mut workspace.inner;
+                slf.py().detach(|| inner.reconcile()).map_err(|e| PyTagError::new_err(e.to_string()))?
+            };
+            TagWorkspace::notify_changes(slf)?;
+            Ok(relinked.into_iter()
+                .map(|(from, to)| (from.to_string_lossy().into_owned(), to.to_string_lossy().into_owned()))
+                .collect())
+        }
+
+        /// Replaces a tag by another on every file carrying it. Returns how many (files, tag files) changed; only the tag files that change are rewritten, once each.
+        pub fn rename_tag(slf: &Bound<'_, Self>, from_tag: PyRef<'_, Tag>, to_tag: PyRef<'_, Tag>) -> PyResult<(usize, usize)> {
+            TagWorkspace::retag(slf, vec![tagcore::Retag::Rename(from_tag.inner.clone(), to_tag.inner.clone())])
+        }
+
+        /// Replaces several tags by one on every file carrying any of them. Returns how many (files, tag files) changed.
+        pub fn merge_tags(slf: &Bound<'_, Self>, from_tags: Vec<PyRef<'_, Tag>>, into: PyRef<'_, Tag>) -> PyResult<(usize, usize)> {
+            TagWorkspace::retag(slf, from_tags.iter().map(|tag| tagcore::Retag::Rename(tag.inner.clone(), into.inner.clone())).collect())
+        }
+
+        /// Removes a tag from every file carrying it. Returns how many (files, tag files) changed.
+        pub fn delete_tag(slf: &Bound<'_, Self>, tag: PyRef<'_, Tag>) -> PyResult<(usize, usize)> {
+            TagWorkspace::retag(slf, vec![tagcore::Retag::Delete(tag.inner.clone())])
+        }
+
+        /// Renames a key on every file, keeping the values: Due:Today becomes Deadline:Today. Returns how many (files, tag files) changed.
+        pub fn rename_key(slf: &Bound<'_, Self>, from_key: String, to_key: String) -> PyResult<(usize, usize)> {
+            TagWorkspace::retag(slf, vec![tagcore::Retag::RenameKey(from_key, to_key)])
+        }
+
+        /// Removes every key-value tag using a key. Returns how many (files, tag files) changed.
+        pub fn delete_key(slf: &Bound<'_, Self>, key: String) -> PyResult<(usize, usize)> {
+            TagWorkspace::retag(slf, vec![tagcore::Retag::DeleteKey(key)])
+        }
+
+        /// Starts watching the workspace's directories for TagFiles changed by other processes, such as tag-cli. See poll_changes.
+        #[pyo3(signature = (debounce_ms=500))]
+        pub fn watch(&mut self, debounce_ms: u64) -> PyResult<()> {
+            self.inner.watch(std::time::Duration::from_millis(debounce_ms)).map_err(|e| PyTagError::new_err(e.to_string()))
+        }
+
+        pub fn unwatch(&mut self) {
+            self.inner.unwatch();
+        }
+
+        /// Reloads the TagFiles changed on disk once their changes have been quiet for the debounce delay, and returns their paths.
+        /// The files whose tags changed are passed to the change callback, as for changes made through this workspace.
+        pub fn poll_changes(slf: &Bound<'_, Self>) -> PyResult<Vec<String>> {
+            let reloaded = {
+                let mut workspace = slf.borrow_mut();
+                let inner = &mut workspace.inner;
+                slf.py().detach(|| inner.poll_changes()).map_err(|e| PyTagError::new_err(e.to_string()))?
+            };
+            TagWorkspace::notify_changes(slf)?;
+            Ok(reloaded.into_iter().map(|path| path.to_string_lossy().into_owned()).collect())
+        }
+
+        /// Calls callback(changes), with a list of TagChange, after each call that changed the tags of files. None stops the calls.
+        /// The callback runs on the thread that made the change, once the workspace is free again, so it may use the workspace.
+        #[pyo3(signature = (callback=None))]
+        pub fn set_change_callback(&mut self, callback: Option<Py<PyAny>>) {
+            self.inner.track_changes(callback.is_some());
+            self.on_change = callback;
+        }
+
+        pub fn get_tags_for_file_name(&mut self, py: Python<'_>, full_path_to_file: std::path::PathBuf) -> PyResult<Vec<Tag>> {
+            let rval = py.detach(|| self.inner.get_tags_for_file_name(full_path_to_file)).map_err(|e| PyTagError::new_err(e.to_string()))?;
             Ok(rval.into_iter().map(Tag::from).collect())
         }
 
+        /// Returns the tags of every tagged file in a directory, by file name, in one call
+        pub fn get_tags_for_directory(&mut self, py: Python<'_>, path_to_directory: std::path::PathBuf) -> PyResult<std::collections::HashMap<String, Vec<Tag>>> {
+            let mapping = py.detach(|| self.inner.get_tags_for_directory(path_to_directory)).map_err(|e| PyTagError::new_err(e.to_string()))?;
+            Ok(TagWorkspace::wrap_mapping(mapping))
+        }
+
+        /// Same as get_tags_for_directory for several directories, keyed by the paths as given
+        pub fn get_tags_for_directories(&mut self, py: Python<'_>, paths_to_directories: Vec<String>) -> PyResult<std::collections::HashMap<String, std::collections::HashMap<String, Vec<Tag>>>> {
+            let paths = paths_to_directories.into_iter().map(std::path::PathBuf::from).collect();
+            let result = py.detach(|| self.inner.get_tags_for_directories(paths)).map_err(|e| PyTagError::new_err(e.to_string()))?;
+            Ok(result.into_iter()
+                .map(|(path, mapping)| (path.to_string_lossy().into_owned(), TagWorkspace::wrap_mapping(mapping)))
+                .collect())
+        }
+
+        /// Same as get_tags_for_directory, with each file's tags already formatted for display: "[simple] [key: value]"
+        pub fn get_tag_strings_for_directory(&mut self, py: Python<'_>, path_to_directory: std::path::PathBuf) -> PyResult<std::collections::HashMap<String, String>> {
+            py.detach(|| {
+                let mapping = self.inner.get_tags_for_directory(path_to_directory)?;
+                Ok(mapping.into_iter()
+                    .map(|(file_name, tags)| (file_name, TagWorkspace::display_string(&tags)))
+                    .collect())
+            }).map_err(|e: tagcore::WorkspaceError| PyTagError::new_err(e.to_string()))
+        }
+
         pub fn get_name(&self) -> &str {
             self.inner.get_name()
         }
@@ -128,8 +473,15 @@ mod rs_tags {
             }
         }
 
-        pub fn query_exact(&self, text: &str, simple: bool, key: bool, value: bool) -> std::collections::HashMap<String, Vec<Tag>> {
-            let result = self.inner.query_exact(text, simple, key, value);
+        /// Searches with a compound query such as "Texture:Verso AND NOT Due:Today OR Personal". Raises PyTagError if the query cannot be parsed.
+        pub fn query(&mut self, py: Python<'_>, expr: &str) -> PyResult<std::collections::HashMap<String, Vec<Tag>>> {
+            let result = py.detach(|| self.inner.query(expr)).map_err(|e| PyTagError::new_err(e.to_string()))?;
+            Ok(TagWorkspace::wrap_mapping(result))
+        }
+
+        pub fn query_exact(&mut self, py: Python<'_>, text: &str, simple: bool, key: bool, value: bool) -> std::collections::HashMap<String, Vec<Tag>> {
+            let result = py.detach(|| self.inner.query_exact(text, simple, key, value));
+            let _span = tagcore::Profiler::span(tagcore::Phase::Convert);
             let mut rv: std::collections::HashMap<String, Vec<Tag>> = std::collections::HashMap::new();
             for (fname, vector) in result {
                 let v = vector.into_iter().map(|item| {
@@ -141,8 +493,9 @@ mod rs_tags {
             rv
         }
 
-        pub fn query_fuzzy(&self, text: &str, simple: bool, key: bool, value: bool) -> std::collections::HashMap<String, Vec<Tag>> {
-            let result = self.inner.query_fuzzy(text, simple, key, value);
+        pub fn query_fuzzy(&mut self, py: Python<'_>, text: &str, simple: bool, key: bool, value: bool) -> std::collections::HashMap<String, Vec<Tag>> {
+            let result = py.detach(|| self.inner.query_fuzzy(text, simple, key, value));
+            let _span = tagcore::Profiler::span(tagcore::Phase::Convert);
             let mut rv: std::collections::HashMap<String, Vec<Tag>> = std::collections::HashMap::new();
             for (fname, vector) in result {
                 let v = vector.into_iter().map(|item| {
@@ -153,6 +506,131 @@ mod rs_tags {
             };
             rv
         }
+
+        /// Starts timing the phases of every workspace operation (scan, parse, index, query, save, canonicalize, convert), for stats.
+        /// With trace, every span is also recorded for write_trace. Measurements are shared by every workspace in the process.
+        #[classmethod]
+        #[pyo3(signature = (trace=false))]
+        pub fn enable_profiling(_class: Bound<PyType>, trace: bool) {
+            tagcore::Profiler::enable(trace);
+        }
+
+        #[classmethod]
+        pub fn disable_profiling(_class: Bound<PyType>) {
+            tagcore::Profiler::disable();
+        }
+
+        #[classmethod]
+        pub fn reset_stats(_class: Bound<PyType>) {
+            tagcore::Profiler::reset();
+        }
+
+        /// What was measured since profiling was enabled: {"phases": {phase: {"count", "total_ms", "max_ms"}}, "counters": {counter: value}}.
+        /// The convert phase is the time spent building Python values from workspace results.
+        #[classmethod]
+        pub fn stats<'py>(_class: Bound<'py, PyType>, py: Python<'py>) -> PyResult<Bound<'py, PyDict>> {
+            let stats = tagcore::Profiler::stats();
+            let phases = PyDict::new(py);
+            for (phase, phase_stats) in stats.phases {
+                let entry = PyDict::new(py);
+                entry.set_item("count", phase_stats.count)?;
+                entry.set_item("total_ms", phase_stats.total.as_secs_f64() * 1e3)?;
+                entry.set_item("max_ms", phase_stats.max.as_secs_f64() * 1e3)?;
+                phases.set_item(phase.to_string(), entry)?;
+            }
+            let counters = PyDict::new(py);
+            for (counter, value) in stats.counters {
+                counters.set_item(counter.to_string(), value)?;
+            }
+            let rv = PyDict::new(py);
+            rv.set_item("phases", phases)?;
+            rv.set_item("counters", counters)?;
+            Ok(rv)
+        }
+
+        /// Writes the spans recorded since profiling was enabled with trace, as a Chrome trace (chrome://tracing or ui.perfetto.dev)
+        #[classmethod]
+        pub fn write_trace(_class: Bound<PyType>, path: std::path::PathBuf) -> PyResult<()> {
+            tagcore::Profiler::write_chrome_trace(&path).map_err(|e| PyTagError::new_err(e.to_string()))
+        }
+
+        /// Same as query, but returns a TagQueryCursor instead of building every result at once
+        pub fn query_cursor(&mut self, py: Python<'_>, expr: &str) -> PyResult<TagQueryCursor> {
+            let cursor = py.detach(|| self.inner.query_cursor(expr)).map_err(|e| PyTagError::new_err(e.to_string()))?;
+            Ok(TagQueryCursor { inner: cursor })
+        }
+
+        /// Same as query_exact, but returns a TagQueryCursor instead of building every result at once
+        pub fn query_exact_cursor(&mut self, py: Python<'_>, text: &str, simple: bool, key: bool, value: bool) -> TagQueryCursor {
+            TagQueryCursor { inner: py.detach(|| self.inner.query_exact_cursor(text, simple, key, value)) }
+        }
+
+        /// Same as query_fuzzy, but returns a TagQueryCursor instead of building every result at once
+        pub fn query_fuzzy_cursor(&mut self, py: Python<'_>, text: &str, simple: bool, key: bool, value: bool) -> TagQueryCursor {
+            TagQueryCursor { inner: py.detach(|| self.inner.query_fuzzy_cursor(text, simple, key, value)) }
+        }
+
+        /// Returns at most limit (text, count) pairs for the tags starting with prefix (ignoring case), most used first: for autocompletion.
+        /// "Key:prefix" completes the values used with Key, as "Key:Value". The first call loads every tag file; later ones only visit the matching tags.
+        #[pyo3(signature = (prefix, limit=10))]
+        pub fn suggest(&mut self, py: Python<'_>, prefix: &str, limit: usize) -> Vec<(String, usize)> {
+            py.detach(|| self.inner.suggest(prefix, limit))
+        }
+
+        /// Returns every tag of the workspace with the number of files carrying it, sorted by text
+        pub fn tag_counts(&mut self, py: Python<'_>) -> Vec<(Tag, usize)> {
+            let result = py.detach(|| self.inner.tag_counts());
+            let _span = tagcore::Profiler::span(tagcore::Phase::Convert);
+            result.into_iter().map(|(tag, count)| (Tag { inner: tag }, count)).collect()
+        }
+    }
+
+    // Private / Helper Functions
+    impl TagWorkspace {
+        /// Passes the changes made since the last call to the change callback, if one is set. The workspace is not borrowed during the callback.
+        fn notify_changes(slf: &Bound<'_, Self>) -> PyResult<()> {
+            let (callback, changes) = {
+                let mut workspace = slf.borrow_mut();
+                let Some(callback) = workspace.on_change.as_ref().map(|c| c.clone_ref(slf.py())) else {
+                    return Ok(());
+                };
+                let changes: Vec<TagChange> = workspace.inner.take_changes().into_iter().map(|inner| TagChange { inner }).collect();
+                (callback, changes)
+            };
+            if !changes.is_empty() {
+                callback.call1(slf.py(), (changes,))?;
+            }
+            Ok(())
+        }
+
+        /// Applies retag rules to the whole workspace, without holding the GIL, then notifies the changes
+        fn retag(slf: &Bound<'_, Self>, rules: Vec<tagcore::Retag>) -> PyResult<(usize, usize)> {
+            let report = {
+                let mut workspace = slf.borrow_mut();
+                let inner = &mut workspace.inner;
+                slf.py().detach(|| inner.retag(&rules)).map_err(|e| PyTagError::new_err(e.to_string()))?
+            };
+            TagWorkspace::notify_changes(slf)?;
+            Ok((report.files, report.tagfiles))
+        }
+
+        fn wrap_mapping(mapping: std::collections::HashMap<String, Vec<tagcore::Tag>>) -> std::collections::HashMap<String, Vec<Tag>> {
+            let _span = tagcore::Profiler::span(tagcore::Phase::Convert);
+            mapping.into_iter()
+                .map(|(file_name, tags)| (file_name, tags.into_iter().map(Tag::from).collect()))
+                .collect()
+        }
+
+        /// Formats tags the way the GUI shows them: "[simple] [key: value]"
+        fn display_string(tags: &[tagcore::Tag]) -> String {
+            tags.iter()
+                .map(|tag| match tag {
+                    tagcore::Tag::Simple(s) => format!("[{}]", s),
+                    tagcore::Tag::KV(k, v) => format!("[{}: {}]", k, v),
+                })
+                .collect::<Vec<String>>()
+                .join(" ")
+        }
     }
 }
 
@@ -0,0 +1,237 @@
+// Helpers shared by the benchmarks: builds throwaway workspaces with many tagged files, either uniform (Fixture) or shaped like a real tree (Synthetic).
+#![allow(dead_code)]
+
+use std::{fmt::Write, fs::File, path::{Path, PathBuf}, time::{Duration, SystemTime}};
+
+use tagcore::Workspace;
+use tempdir::TempDir;
+
+pub const WORKSPACE_NAME: &str = "bench";
+pub const FILES_PER_DIR: usize = 100;
+
+/// A workspace on disk with `num_files` tagged files, spread over directories of FILES_PER_DIR files.
+/// Every file gets a common simple tag, a KV tag from a small vocabulary and one tag that is unique to it.
+pub struct Fixture {
+    pub dir: TempDir,
+    pub num_files: usize,
+}
+
+impl Fixture {
+    pub fn new(num_files: usize) -> Fixture {
+        Fixture::with_files_per_dir(num_files, FILES_PER_DIR)
+    }
+
+    /// Like new, with files_per_dir files (so as many entries per TagFile) in each directory
+    pub fn with_files_per_dir(num_files: usize, files_per_dir: usize) -> Fixture {
+        let dir = TempDir::new("tagcore_bench").unwrap();
+        Workspace::create_workspace(dir.path().to_path_buf(), &WORKSPACE_NAME.to_string()).unwrap();
+
+        let num_dirs = num_files.div_ceil(files_per_dir);
+        for dir_index in 0..num_dirs {
+            let sub_dir: PathBuf = dir.path().join(format!("dir{}", dir_index));
+            std::fs::create_dir_all(&sub_dir).unwrap();
+
+            let mut contents = String::from("[mapping]\n");
+            let first = dir_index * files_per_dir;
+            for file_index in first..num_files.min(first + files_per_dir) {
+                writeln!(contents, "\"file{}.txt\" = [\"Common\", [\"Due\", \"Day{}\"], \"Unique{}\"]", file_index, file_index % 7, file_index).unwrap();
+            }
+            let tagfile = sub_dir.join(format!(".tag_{}", WORKSPACE_NAME));
+            std::fs::write(&tagfile, contents).unwrap();
+            backdate(&tagfile);
+            backdate(&sub_dir);
+        }
+        backdate(dir.path());
+
+        Fixture { dir, num_files }
+    }
+
+    /// Opens the fixture's workspace and loads every TagFile
+    pub fn open(&self) -> Workspace {
+        let mut workspace = Workspace::open_workspace(self.dir.path().to_path_buf(), &WORKSPACE_NAME.to_string()).unwrap();
+        workspace.scan_for_tagfiles();
+        workspace
+    }
+
+    /// Opens the fixture's workspace and loads every TagFile through the workspace snapshot
+    pub fn open_cached(&self) -> Workspace {
+        let mut workspace = Workspace::open_workspace(self.dir.path().to_path_buf(), &WORKSPACE_NAME.to_string()).unwrap();
+        workspace.scan_for_tagfiles_cached();
+        workspace
+    }
+
+    pub fn snapshot_path(&self) -> PathBuf {
+        self.dir.path().join(format!(".tagsnap_{}", WORKSPACE_NAME))
+    }
+}
+
+/// Moves a file's modification time an hour into the past, like a tree that was not just written
+fn backdate(path: &Path) {
+    let an_hour_ago = SystemTime::now() - Duration::from_secs(3600);
+    File::open(path).unwrap().set_modified(an_hour_ago).unwrap();
+}
+
+/// The shape of a Synthetic workspace: a directory tree `depth` levels deep below the root, each directory having `fan_out` subdirectories
+/// and `files_per_dir` tagged files. Each file gets `tags_per_file` distinct tags drawn from `vocabulary` words, the word of rank k being
+/// picked with a probability proportional to 1/k^zipf_exponent, like real tags where a few are on most files. `kv_ratio` of the tags are
+/// Key-Value tags, whose value is drawn the same way.
+#[derive(Clone, Debug)]
+pub struct Shape {
+    pub depth: usize,
+    pub fan_out: usize,
+    pub files_per_dir: usize,
+    pub tags_per_file: usize,
+    pub vocabulary: usize,
+    pub zipf_exponent: f64,
+    pub kv_ratio: f64,
+    pub seed: u64,
+}
+
+impl Default for Shape {
+    fn default() -> Self {
+        Shape { depth: 2, fan_out: 8, files_per_dir: 50, tags_per_file: 3, vocabulary: 1_000, zipf_exponent: 1.0, kv_ratio: 0.3, seed: 1 }
+    }
+}
+
+impl Shape {
+    pub fn num_dirs(&self) -> usize {
+        (0..=self.depth).map(|level| self.fan_out.pow(level as u32)).sum()
+    }
+
+    pub fn num_files(&self) -> usize {
+        self.num_dirs() * self.files_per_dir
+    }
+
+    /// The word of a vocabulary rank (0 is the most popular)
+    pub fn word(rank: usize) -> String {
+        format!("Tag{}", rank)
+    }
+}
+
+/// A workspace on disk generated from a Shape. Only the TagFiles are written, the tagged files themselves do not exist.
+/// The same Shape (and seed) always gives the same workspace.
+pub struct Synthetic {
+    pub dir: TempDir,
+    pub shape: Shape,
+    /// Every tagged file, in generation order
+    pub files: Vec<PathBuf>,
+}
+
+impl Synthetic {
+    pub fn new(shape: Shape) -> Synthetic {
+        let dir = TempDir::new("tagcore_bench").unwrap();
+        Workspace::create_workspace(dir.path().to_path_buf(), &WORKSPACE_NAME.to_string()).unwrap();
+        let zipf = Zipf::new(shape.vocabulary, shape.zipf_exponent);
+        let mut rng = Rng::new(shape.seed);
+        let mut files = Vec::with_capacity(shape.num_files());
+
+        let mut dirs: Vec<(PathBuf, usize)> = vec![(dir.path().to_path_buf(), 0)];
+        while let Some((sub_dir, level)) = dirs.pop() {
+            let mut contents = String::from("[mapping]\n");
+            for file_index in 0..shape.files_per_dir {
+                let file_name = format!("file{}.txt", file_index);
+                let mut words: Vec<usize> = Vec::with_capacity(shape.tags_per_file);
+                let mut tags: Vec<String> = Vec::with_capacity(shape.tags_per_file);
+                // Give up on distinct words after a few tries, for tiny vocabularies
+                for _ in 0..shape.tags_per_file * 4 {
+                    if tags.len() == shape.tags_per_file {
+                        break;
+                    }
+                    let word = zipf.sample(&mut rng);
+                    if words.contains(&word) {
+                        continue;
+                    }
+                    words.push(word);
+                    if rng.next_f64() < shape.kv_ratio {
+                        tags.push(format!("[\"{}\", \"{}\"]", Shape::word(word), Shape::word(zipf.sample(&mut rng))));
+                    } else {
+                        tags.push(format!("\"{}\"", Shape::word(word)));
+                    }
+                }
+                writeln!(contents, "\"{}\" = [{}]", file_name, tags.join(", ")).unwrap();
+                files.push(sub_dir.join(file_name));
+            }
+            let tagfile = sub_dir.join(format!(".tag_{}", WORKSPACE_NAME));
+            std::fs::write(&tagfile, contents).unwrap();
+            backdate(&tagfile);
+
+            if level < shape.depth {
+                for child in 0..shape.fan_out {
+                    let child_dir = sub_dir.join(format!("d{}", child));
+                    std::fs::create_dir(&child_dir).unwrap();
+                    dirs.push((child_dir, level + 1));
+                }
+            }
+        }
+        // Backdated last, since creating entries updates a directory's modification time
+        for path in walkdir::WalkDir::new(dir.path()).into_iter().filter_map(|e| e.ok()).filter(|e| e.file_type().is_dir()) {
+            backdate(path.path());
+        }
+
+        Synthetic { dir, shape, files }
+    }
+
+    /// Opens the workspace and loads every TagFile
+    pub fn open(&self) -> Workspace {
+        let mut workspace = Workspace::open_workspace(self.dir.path().to_path_buf(), &WORKSPACE_NAME.to_string()).unwrap();
+        workspace.scan_for_tagfiles();
+        workspace
+    }
+
+    /// n files picked at random (with repeats), the same ones on every call
+    pub fn sample_files(&self, n: usize) -> Vec<PathBuf> {
+        let mut rng = Rng::new(self.shape.seed ^ 0x5eed);
+        (0..n).map(|_| self.files[rng.below(self.files.len())].clone()).collect()
+    }
+}
+
+/// Draws ranks in 0..n with probability proportional to 1/(rank + 1)^exponent
+pub struct Zipf {
+    /// Sum of the weights of every rank up to and including the index
+    cumulative: Vec<f64>,
+}
+
+impl Zipf {
+    pub fn new(n: usize, exponent: f64) -> Zipf {
+        let mut total = 0.0;
+        let cumulative = (1..=n.max(1))
+            .map(|rank| {
+                total += 1.0 / (rank as f64).powf(exponent);
+                total
+            })
+            .collect();
+        Zipf { cumulative }
+    }
+
+    pub fn sample(&self, rng: &mut Rng) -> usize {
+        let x = rng.next_f64() * self.cumulative[self.cumulative.len() - 1];
+        self.cumulative.partition_point(|&c| c <= x).min(self.cumulative.len() - 1)
+    }
+}
+
+/// A small deterministic generator (SplitMix64), so that generated workspaces do not depend on a random crate or differ between runs
+pub struct Rng(u64);
+
+impl Rng {
+    pub fn new(seed: u64) -> Rng {
+        Rng(seed)
+    }
+
+    pub fn next_u64(&mut self) -> u64 {
+        self.0 = self.0.wrapping_add(0x9e3779b97f4a7c15);
+        let mut z = self.0;
+        z = (z ^ (z >> 30)).wrapping_mul(0xbf58476d1ce4e5b9);
+        z = (z ^ (z >> 27)).wrapping_mul(0x94d049bb133111eb);
+        z ^ (z >> 31)
+    }
+
+    /// Uniform in [0, 1)
+    pub fn next_f64(&mut self) -> f64 {
+        (self.next_u64() >> 11) as f64 / (1u64 << 53) as f64
+    }
+
+    /// Uniform in 0..n
+    pub fn below(&mut self, n: usize) -> usize {
+        (self.next_u64() % n as u64) as usize
+    }
+}
@@ -0,0 +1,59 @@
+use criterion::{criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+use tagcore::TagFileFormat;
+
+mod common;
+
+const NUM_FILES: usize = 20_000;
+const FILES_PER_DIR: usize = 1_000;
+
+/// One fixture per format, with the same tags
+fn fixtures() -> Vec<(TagFileFormat, common::Fixture)> {
+    [TagFileFormat::Toml, TagFileFormat::Binary].into_iter()
+        .map(|format| {
+            let fixture = common::Fixture::with_files_per_dir(NUM_FILES, FILES_PER_DIR);
+            fixture.open().migrate_tagfiles(format).unwrap();
+            (format, fixture)
+        })
+        .collect()
+}
+
+/// Reads every TagFile of the workspace
+fn parse_tagfiles(c: &mut Criterion) {
+    let mut group = c.benchmark_group("parse_tagfiles");
+    group.sample_size(10);
+    group.throughput(Throughput::Elements(NUM_FILES as u64));
+    for (format, fixture) in fixtures() {
+        group.bench_with_input(BenchmarkId::new(format.to_string(), NUM_FILES), &fixture, |b, fixture| {
+            b.iter(|| fixture.open())
+        });
+    }
+    group.finish();
+}
+
+/// Changes every TagFile of the workspace, then writes them all
+fn serialize_tagfiles(c: &mut Criterion) {
+    let mut group = c.benchmark_group("serialize_tagfiles");
+    group.sample_size(10);
+    group.throughput(Throughput::Elements(NUM_FILES as u64));
+    for (format, fixture) in fixtures() {
+        let paths: Vec<_> = (0..NUM_FILES / FILES_PER_DIR)
+            .map(|d| fixture.dir.path().join(format!("dir{}", d)).join(format!("file{}.txt", d * FILES_PER_DIR)))
+            .collect();
+        group.bench_with_input(BenchmarkId::new(format.to_string(), NUM_FILES), &paths, |b, paths| {
+            let mut workspace = fixture.open();
+            let mut round = 0;
+            b.iter(|| {
+                round += 1;
+                workspace.begin_batch();
+                for path in paths {
+                    workspace.add_tag_to_file(path.clone(), format!("Round{}", round), None).unwrap();
+                }
+                workspace.commit_batch().unwrap();
+            })
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, parse_tagfiles, serialize_tagfiles);
+criterion_main!(benches);
@@ -0,0 +1,78 @@
+// Measures the heap memory held by an open workspace, per million tag assignments (a tag on a file), using a counting allocator.
+// Not a timing benchmark: run with `cargo bench --bench memory` and read the printed report.
+use std::{
+    alloc::{GlobalAlloc, Layout, System}, sync::atomic::{AtomicUsize, Ordering}
+};
+
+mod common;
+
+/// Every fixture file carries three tags
+const TAGS_PER_FILE: usize = 3;
+const ASSIGNMENTS: usize = 1_000_000;
+
+/// Forwards to the system allocator, keeping count of the bytes currently allocated
+struct CountingAllocator;
+
+static ALLOCATED: AtomicUsize = AtomicUsize::new(0);
+
+unsafe impl GlobalAlloc for CountingAllocator {
+    unsafe fn alloc(&self, layout: Layout) -> *mut u8 {
+        let ptr = unsafe { System.alloc(layout) };
+        if !ptr.is_null() {
+            ALLOCATED.fetch_add(layout.size(), Ordering::Relaxed);
+        }
+        ptr
+    }
+
+    unsafe fn alloc_zeroed(&self, layout: Layout) -> *mut u8 {
+        let ptr = unsafe { System.alloc_zeroed(layout) };
+        if !ptr.is_null() {
+            ALLOCATED.fetch_add(layout.size(), Ordering::Relaxed);
+        }
+        ptr
+    }
+
+    unsafe fn dealloc(&self, ptr: *mut u8, layout: Layout) {
+        unsafe { System.dealloc(ptr, layout) };
+        ALLOCATED.fetch_sub(layout.size(), Ordering::Relaxed);
+    }
+
+    unsafe fn realloc(&self, ptr: *mut u8, layout: Layout, new_size: usize) -> *mut u8 {
+        let new_ptr = unsafe { System.realloc(ptr, layout, new_size) };
+        if !new_ptr.is_null() {
+            ALLOCATED.fetch_add(new_size, Ordering::Relaxed);
+            ALLOCATED.fetch_sub(layout.size(), Ordering::Relaxed);
+        }
+        new_ptr
+    }
+}
+
+#[global_allocator]
+static GLOBAL: CountingAllocator = CountingAllocator;
+
+fn allocated() -> usize {
+    ALLOCATED.load(Ordering::Relaxed)
+}
+
+fn report(label: &str, bytes: usize, assignments: usize) {
+    let per_million = bytes as f64 * 1_000_000.0 / assignments as f64;
+    println!("{:<40} {:>10.1} MiB per million tag assignments", label, per_million / (1024.0 * 1024.0));
+}
+
+fn main() {
+    let num_files = ASSIGNMENTS / TAGS_PER_FILE;
+    let assignments = num_files * TAGS_PER_FILE;
+    let fixture = common::Fixture::new(num_files);
+
+    let before = allocated();
+    let mut workspace = fixture.open();
+    let loaded = allocated() - before;
+    report("memory/loaded_tagfiles", loaded, assignments);
+
+    // The first query builds the index; its result is dropped before measuring
+    let found = workspace.query_exact("Common", true, true, true).len();
+    assert_eq!(found, num_files);
+    report("memory/loaded_tagfiles_and_index", allocated() - before, assignments);
+
+    drop(workspace);
+}
@@ -0,0 +1,71 @@
+use criterion::{criterion_group, criterion_main, BenchmarkId, Criterion};
+use tagcore::Workspace;
+
+mod common;
+
+/// Compares opening a workspace with a full scan (cold) against opening it from an up-to-date snapshot (warm),
+/// and against a snapshot where one TagFile in a hundred changed since it was saved
+fn open_workspace(c: &mut Criterion) {
+    let mut group = c.benchmark_group("open_workspace");
+    group.sample_size(10);
+    for num_files in [10_000, 100_000] {
+        let fixture = common::Fixture::new(num_files);
+
+        group.bench_with_input(BenchmarkId::new("full_scan", num_files), &fixture, |b, fixture| {
+            b.iter(|| fixture.open())
+        });
+        group.bench_with_input(BenchmarkId::new("no_snapshot", num_files), &fixture, |b, fixture| {
+            b.iter(|| {
+                let _ = std::fs::remove_file(fixture.snapshot_path());
+                fixture.open_cached()
+            })
+        });
+
+        fixture.open_cached();
+        group.bench_with_input(BenchmarkId::new("snapshot", num_files), &fixture, |b, fixture| {
+            b.iter(|| fixture.open_cached())
+        });
+
+        let mut workspace = fixture.open_cached();
+        let num_dirs = num_files.div_ceil(common::FILES_PER_DIR);
+        for dir_index in (0..num_dirs).step_by(100) {
+            let path = fixture.dir.path().join(format!("dir{}", dir_index)).join(format!("file{}.txt", dir_index * common::FILES_PER_DIR));
+            workspace.add_tag_to_file(path, "Changed".to_string(), None).unwrap();
+        }
+        group.bench_with_input(BenchmarkId::new("snapshot_1pct_changed", num_files), &fixture, |b, fixture| {
+            // The first open re-reads the changed TagFiles and re-saves the snapshot, so restore the stale snapshot each time
+            let stale = std::fs::read(fixture.snapshot_path()).unwrap();
+            b.iter(|| {
+                std::fs::write(fixture.snapshot_path(), &stale).unwrap();
+                fixture.open_cached()
+            })
+        });
+    }
+    group.finish();
+}
+
+/// Time to read one file's tags from a freshly opened workspace, like `tag-cli show`: lazily loading one TagFile against loading them all from a snapshot
+fn open_and_show_one_file(c: &mut Criterion) {
+    let mut group = c.benchmark_group("open_and_show_one_file");
+    group.sample_size(10);
+    for num_files in [10_000, 100_000] {
+        let fixture = common::Fixture::new(num_files);
+        fixture.open_cached();
+        let path = fixture.dir.path().join("dir0").join("file0.txt");
+
+        group.bench_with_input(BenchmarkId::new("snapshot", num_files), &path, |b, path| {
+            b.iter(|| fixture.open_cached().get_tags_for_file_name(path.clone()).unwrap())
+        });
+        group.bench_with_input(BenchmarkId::new("lazy", num_files), &path, |b, path| {
+            b.iter(|| {
+                let mut workspace = Workspace::open_workspace(fixture.dir.path().to_path_buf(), &common::WORKSPACE_NAME.to_string()).unwrap();
+                workspace.enable_lazy_loading(64).unwrap();
+                workspace.get_tags_for_file_name(path.clone()).unwrap()
+            })
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, open_workspace, open_and_show_one_file);
+criterion_main!(benches);
@@ -0,0 +1,91 @@
+use std::hint::black_box;
+
+use criterion::{criterion_group, criterion_main, BenchmarkId, Criterion};
+
+mod common;
+
+/// Compares the indexed query_exact against a scan over every TagFile, for a query with a single hit
+fn query_exact_single_hit(c: &mut Criterion) {
+    let mut group = c.benchmark_group("query_exact_single_hit");
+    for num_files in [1_000, 10_000, 100_000] {
+        let fixture = common::Fixture::new(num_files);
+        let mut workspace = fixture.open();
+        let text = format!("Unique{}", num_files / 2);
+
+        group.bench_with_input(BenchmarkId::new("indexed", num_files), &text, |b, text| {
+            b.iter(|| workspace.query_exact(black_box(text), true, true, true))
+        });
+        group.bench_with_input(BenchmarkId::new("scan", num_files), &text, |b, text| {
+            b.iter(|| workspace.query_exact_unindexed(black_box(text), true, true, true))
+        });
+    }
+    group.finish();
+}
+
+/// Same comparison for a value carried by a seventh of all files
+fn query_exact_many_hits(c: &mut Criterion) {
+    let mut group = c.benchmark_group("query_exact_many_hits");
+    group.sample_size(20);
+    for num_files in [1_000, 10_000, 100_000] {
+        let fixture = common::Fixture::new(num_files);
+        let mut workspace = fixture.open();
+
+        group.bench_with_input(BenchmarkId::new("indexed", num_files), &"Day3", |b, text| {
+            b.iter(|| workspace.query_exact(black_box(text), false, false, true))
+        });
+        group.bench_with_input(BenchmarkId::new("scan", num_files), &"Day3", |b, text| {
+            b.iter(|| workspace.query_exact_unindexed(black_box(text), false, false, true))
+        });
+    }
+    group.finish();
+}
+
+/// Compares the trigram-indexed query_fuzzy against a scan that lowercases every tag, for a long and a short (< 3 chars) text
+fn query_fuzzy(c: &mut Criterion) {
+    let mut group = c.benchmark_group("query_fuzzy");
+    group.sample_size(20);
+    for num_files in [1_000, 10_000, 100_000] {
+        let fixture = common::Fixture::new(num_files);
+        let mut workspace = fixture.open();
+        let text = format!("unique{}", num_files / 2);
+
+        for (label, text) in [("trigram", text.as_str()), ("short", "y3")] {
+            group.bench_with_input(BenchmarkId::new(format!("indexed_{}", label), num_files), text, |b, text| {
+                b.iter(|| workspace.query_fuzzy(black_box(text), true, true, true))
+            });
+            group.bench_with_input(BenchmarkId::new(format!("scan_{}", label), num_files), text, |b, text| {
+                b.iter(|| workspace.query_fuzzy_unindexed(black_box(text), true, true, true))
+            });
+        }
+    }
+    group.finish();
+}
+
+/// A compound query narrowing a common tag down to one file, against intersecting the results of one query_exact per term
+fn query_compound(c: &mut Criterion) {
+    let mut group = c.benchmark_group("query_compound");
+    group.sample_size(20);
+    for num_files in [1_000, 10_000, 100_000] {
+        let fixture = common::Fixture::new(num_files);
+        let mut workspace = fixture.open();
+        let unique = format!("Unique{}", num_files / 2);
+        let expr = format!("Common AND {} AND NOT Due:Day6", unique);
+
+        group.bench_with_input(BenchmarkId::new("expr", num_files), &expr, |b, expr| {
+            b.iter(|| workspace.query(black_box(expr)).unwrap())
+        });
+        group.bench_with_input(BenchmarkId::new("per_term", num_files), &unique, |b, unique| {
+            b.iter(|| {
+                let mut result = workspace.query_exact(black_box("Common"), true, false, false);
+                let unique = workspace.query_exact(black_box(unique), true, false, false);
+                let day6 = workspace.query_exact(black_box("Day6"), false, false, true);
+                result.retain(|path, _| unique.contains_key(path) && !day6.contains_key(path));
+                result
+            })
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, query_exact_single_hit, query_exact_many_hits, query_fuzzy, query_compound);
+criterion_main!(benches);
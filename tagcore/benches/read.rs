@@ -0,0 +1,33 @@
+use std::hint::black_box;
+
+use criterion::{criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+
+mod common;
+
+/// Reads the tags of every file in one directory: once per file, as a directory listing used to, and with a single get_tags_for_directory
+fn directory_listing(c: &mut Criterion) {
+    let mut group = c.benchmark_group("directory_listing");
+    group.sample_size(20);
+    for num_files in [1_000, 10_000] {
+        let fixture = common::Fixture::with_files_per_dir(num_files, num_files);
+        let mut workspace = fixture.open();
+        let dir = fixture.dir.path().join("dir0");
+        let paths: Vec<_> = (0..num_files).map(|i| dir.join(format!("file{}.txt", i))).collect();
+        group.throughput(Throughput::Elements(num_files as u64));
+
+        group.bench_with_input(BenchmarkId::new("per_file", num_files), &paths, |b, paths| {
+            b.iter(|| {
+                for path in paths {
+                    black_box(workspace.get_tags_for_file_name(path.clone()).unwrap());
+                }
+            })
+        });
+        group.bench_with_input(BenchmarkId::new("directory", num_files), &dir, |b, dir| {
+            b.iter(|| black_box(workspace.get_tags_for_directory(dir.clone()).unwrap()))
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, directory_listing);
+criterion_main!(benches);
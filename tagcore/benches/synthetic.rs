@@ -0,0 +1,116 @@
+// The main operations of a workspace on generated trees shaped like real ones: nested directories and Zipf-distributed tags.
+// Change the shapes below (or the Shape defaults) to explore other trees; the same Shape always generates the same workspace.
+use std::hint::black_box;
+
+use criterion::{criterion_group, criterion_main, BenchmarkId, Criterion, Throughput};
+use tagcore::Durability;
+
+mod common;
+
+use common::{Shape, Synthetic};
+
+/// A small tree (73 directories, 3 650 files) and a large one (1 111 directories, 55 550 files)
+fn shapes() -> Vec<(&'static str, Shape)> {
+    vec![
+        ("small", Shape::default()),
+        ("large", Shape { depth: 3, fan_out: 10, vocabulary: 10_000, ..Shape::default() }),
+    ]
+}
+
+fn scan_for_tagfiles(c: &mut Criterion) {
+    let mut group = c.benchmark_group("synthetic_scan_for_tagfiles");
+    group.sample_size(10);
+    for (label, shape) in shapes() {
+        let synthetic = Synthetic::new(shape);
+        group.throughput(Throughput::Elements(synthetic.shape.num_dirs() as u64));
+        group.bench_with_input(BenchmarkId::from_parameter(label), &synthetic, |b, synthetic| {
+            b.iter(|| synthetic.open())
+        });
+    }
+    group.finish();
+}
+
+/// The most popular tag (on a large share of the files), a middling one and the rarest one, as simple tags and as KV values
+fn query_exact(c: &mut Criterion) {
+    let mut group = c.benchmark_group("synthetic_query_exact");
+    for (label, shape) in shapes() {
+        let synthetic = Synthetic::new(shape);
+        let mut workspace = synthetic.open();
+        let vocabulary = synthetic.shape.vocabulary;
+        for (rank_label, rank) in [("popular", 0), ("middle", vocabulary / 10), ("rare", vocabulary - 1)] {
+            let text = Shape::word(rank);
+            group.bench_with_input(BenchmarkId::new(format!("{}_simple", label), rank_label), &text, |b, text| {
+                b.iter(|| workspace.query_exact(black_box(text), true, false, false))
+            });
+            group.bench_with_input(BenchmarkId::new(format!("{}_value", label), rank_label), &text, |b, text| {
+                b.iter(|| workspace.query_exact(black_box(text), false, false, true))
+            });
+        }
+    }
+    group.finish();
+}
+
+/// Fragments of a popular and a rare tag: "ag1" is in every tag of rank 1, 1x, 1xx..., the rare fragment in a single word
+fn query_fuzzy(c: &mut Criterion) {
+    let mut group = c.benchmark_group("synthetic_query_fuzzy");
+    group.sample_size(20);
+    for (label, shape) in shapes() {
+        let synthetic = Synthetic::new(shape);
+        let mut workspace = synthetic.open();
+        let rare = Shape::word(synthetic.shape.vocabulary - 1).to_lowercase();
+        for (text_label, text) in [("popular", "ag1".to_string()), ("rare", rare)] {
+            group.bench_with_input(BenchmarkId::new(label, text_label), &text, |b, text| {
+                b.iter(|| workspace.query_fuzzy(black_box(text), true, true, true))
+            });
+        }
+    }
+    group.finish();
+}
+
+/// Adds a tag to 100 files spread over the tree, then removes it, each change written immediately (without fsync, to measure the workspace itself)
+fn add_and_remove_tag(c: &mut Criterion) {
+    let mut group = c.benchmark_group("synthetic_add_and_remove_tag");
+    group.sample_size(10);
+    let num_files = 100;
+    for (label, shape) in shapes() {
+        let synthetic = Synthetic::new(shape);
+        let mut workspace = synthetic.open();
+        workspace.set_durability(Durability::None);
+        let paths: Vec<_> = synthetic.files.iter().step_by(synthetic.files.len() / num_files).take(num_files).cloned().collect();
+        group.throughput(Throughput::Elements(2 * num_files as u64));
+        group.bench_with_input(BenchmarkId::from_parameter(label), &paths, |b, paths| {
+            b.iter(|| {
+                for path in paths {
+                    workspace.add_tag_to_file(path.clone(), "Bench".to_string(), Some("Tag".to_string())).unwrap();
+                }
+                for path in paths {
+                    workspace.remove_tag_from_file(path.clone(), "Bench".to_string(), Some("Tag".to_string())).unwrap();
+                }
+            })
+        });
+    }
+    group.finish();
+}
+
+/// Reads the tags of 1 000 files picked at random
+fn get_tags_for_file_name(c: &mut Criterion) {
+    let mut group = c.benchmark_group("synthetic_get_tags_for_file_name");
+    let num_files = 1_000;
+    for (label, shape) in shapes() {
+        let synthetic = Synthetic::new(shape);
+        let mut workspace = synthetic.open();
+        let paths = synthetic.sample_files(num_files);
+        group.throughput(Throughput::Elements(num_files as u64));
+        group.bench_with_input(BenchmarkId::from_parameter(label), &paths, |b, paths| {
+            b.iter(|| {
+                for path in paths {
+                    black_box(workspace.get_tags_for_file_name(path.clone()).unwrap());
+                }
+            })
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, scan_for_tagfiles, query_exact, query_fuzzy, add_and_remove_tag, get_tags_for_file_name);
+criterion_main!(benches);
@@ -0,0 +1,85 @@
+use criterion::{criterion_group, criterion_main, BenchmarkId, Criterion};
+use tagcore::{Durability, Retag};
+
+mod common;
+
+/// Adds num_tags tags, spread over the files of the first ten directories, writing each change immediately or in one batch
+fn add_tags(c: &mut Criterion) {
+    let mut group = c.benchmark_group("add_tags");
+    group.sample_size(10);
+    let fixture = common::Fixture::new(10 * common::FILES_PER_DIR);
+    for num_tags in [100, 1_000] {
+        let paths: Vec<_> = (0..num_tags)
+            .map(|n| fixture.dir.path().join(format!("dir{}", n % 10)).join(format!("file{}.txt", (n % 10) * common::FILES_PER_DIR + n % common::FILES_PER_DIR)))
+            .collect();
+
+        for batched in [false, true] {
+            let label = if batched { "batched" } else { "unbatched" };
+            group.bench_with_input(BenchmarkId::new(label, num_tags), &paths, |b, paths| {
+                let mut workspace = fixture.open();
+                let mut round = 0;
+                b.iter(|| {
+                    round += 1;
+                    if batched {
+                        workspace.begin_batch();
+                    }
+                    for path in paths {
+                        workspace.add_tag_to_file(path.clone(), format!("Round{}", round), None).unwrap();
+                    }
+                    if batched {
+                        workspace.commit_batch().unwrap();
+                    }
+                })
+            });
+        }
+    }
+    group.finish();
+}
+
+/// Adds thousands of tags one after the other, each written immediately, under every durability policy
+fn add_tags_durability(c: &mut Criterion) {
+    let mut group = c.benchmark_group("add_tags_durability");
+    group.sample_size(10);
+    let fixture = common::Fixture::new(10 * common::FILES_PER_DIR);
+    let num_tags = 2_000;
+    let paths: Vec<_> = (0..num_tags)
+        .map(|n| fixture.dir.path().join(format!("dir{}", n % 10)).join(format!("file{}.txt", (n % 10) * common::FILES_PER_DIR + n % common::FILES_PER_DIR)))
+        .collect();
+
+    for durability in [Durability::None, Durability::FsyncFile, Durability::FsyncFileAndDir] {
+        group.bench_with_input(BenchmarkId::new(durability.to_string(), num_tags), &paths, |b, paths| {
+            let mut workspace = fixture.open();
+            workspace.set_durability(durability);
+            let mut round = 0;
+            b.iter(|| {
+                round += 1;
+                for path in paths {
+                    workspace.add_tag_to_file(path.clone(), format!("Round{}", round), None).unwrap();
+                }
+            })
+        });
+    }
+    group.finish();
+}
+
+/// Renames a key used by every file of the workspace, back and forth, rewriting every TagFile on one thread or one per core
+fn rename_key(c: &mut Criterion) {
+    let mut group = c.benchmark_group("rename_key");
+    group.sample_size(10);
+    let fixture = common::Fixture::new(10_000);
+    for threads in [1, 0] {
+        group.bench_with_input(BenchmarkId::new("threads", threads), &threads, |b, threads| {
+            let mut workspace = fixture.open();
+            workspace.set_scan_threads(*threads);
+            let mut keys = ("Due".to_string(), "Deadline".to_string());
+            b.iter(|| {
+                workspace.retag(&[Retag::RenameKey(keys.0.clone(), keys.1.clone())]).unwrap();
+                keys = (keys.1.clone(), keys.0.clone());
+            })
+        });
+    }
+    group.finish();
+}
+
+criterion_group!(benches, add_tags, add_tags_durability, rename_key);
+criterion_main!(benches);
@@ -0,0 +1,15 @@
+use std::path::PathBuf;
+
+use crate::tag::Tag;
+
+/// A file whose tags were changed through a Workspace, with the tags it has now. Returned by Workspace::take_changes.
+#[derive(Debug, Clone, PartialEq)]
+pub struct TagChange {
+    /// Cannonical path of the directory holding the file
+    pub directory: PathBuf,
+    pub file_name: String,
+    /// Path of the file relative to the workspace root, as in query results
+    pub path: String,
+    /// ALL tags of the file after the change. Empty if its last tag was removed.
+    pub tags: Vec<Tag>,
+}
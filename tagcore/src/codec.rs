@@ -0,0 +1,157 @@
+use crate::errors::TagFileError;
+
+/// Appends primitive values to a byte buffer, for the binary files written by the library.
+/// Integers are little-endian; lengths and counts are LEB128 varints.
+#[derive(Debug, Default)]
+pub struct ByteWriter {
+    buf: Vec<u8>,
+}
+
+impl ByteWriter {
+    pub fn new() -> ByteWriter {
+        ByteWriter::default()
+    }
+
+    pub fn write_bytes(&mut self, bytes: &[u8]) {
+        self.buf.extend_from_slice(bytes);
+    }
+
+    pub fn write_u8(&mut self, value: u8) {
+        self.buf.push(value);
+    }
+
+    pub fn write_u32(&mut self, value: u32) {
+        self.buf.extend_from_slice(&value.to_le_bytes());
+    }
+
+    pub fn write_u64(&mut self, value: u64) {
+        self.buf.extend_from_slice(&value.to_le_bytes());
+    }
+
+    pub fn write_varint(&mut self, mut value: u64) {
+        while value >= 0x80 {
+            self.buf.push((value as u8 & 0x7f) | 0x80);
+            value >>= 7;
+        }
+        self.buf.push(value as u8);
+    }
+
+    /// Writes a length-prefixed UTF-8 string
+    pub fn write_str(&mut self, value: &str) {
+        self.write_varint(value.len() as u64);
+        self.buf.extend_from_slice(value.as_bytes());
+    }
+
+    pub fn into_bytes(self) -> Vec<u8> {
+        self.buf
+    }
+}
+
+/// Reads values written by a ByteWriter. Every read fails with TagFileError::Serialize on truncated or malformed input.
+#[derive(Debug)]
+pub struct ByteReader<'a> {
+    buf: &'a [u8],
+    pos: usize,
+}
+
+impl<'a> ByteReader<'a> {
+    pub fn new(buf: &'a [u8]) -> ByteReader<'a> {
+        ByteReader { buf, pos: 0 }
+    }
+
+    pub fn is_at_end(&self) -> bool {
+        self.pos >= self.buf.len()
+    }
+
+    pub fn read_bytes(&mut self, len: usize) -> Result<&'a [u8], TagFileError> {
+        if self.buf.len() - self.pos < len {
+            return Err(TagFileError::Serialize("Unexpected end of data".to_string()));
+        }
+        let bytes = &self.buf[self.pos..self.pos + len];
+        self.pos += len;
+        Ok(bytes)
+    }
+
+    pub fn read_u8(&mut self) -> Result<u8, TagFileError> {
+        Ok(self.read_bytes(1)?[0])
+    }
+
+    pub fn read_u32(&mut self) -> Result<u32, TagFileError> {
+        Ok(u32::from_le_bytes(self.read_bytes(4)?.try_into().unwrap()))
+    }
+
+    pub fn read_u64(&mut self) -> Result<u64, TagFileError> {
+        Ok(u64::from_le_bytes(self.read_bytes(8)?.try_into().unwrap()))
+    }
+
+    pub fn read_varint(&mut self) -> Result<u64, TagFileError> {
+        let mut value: u64 = 0;
+        for shift in (0..64).step_by(7) {
+            let byte = self.read_u8()?;
+            value |= ((byte & 0x7f) as u64) << shift;
+            if byte & 0x80 == 0 {
+                return Ok(value);
+            }
+        }
+        Err(TagFileError::Serialize("Malformed varint".to_string()))
+    }
+
+    /// Reads a count or length, rejecting values that could not possibly fit in the remaining data
+    pub fn read_len(&mut self) -> Result<usize, TagFileError> {
+        let len = self.read_varint()?;
+        if len > (self.buf.len() - self.pos) as u64 {
+            return Err(TagFileError::Serialize("Length exceeds data".to_string()));
+        }
+        Ok(len as usize)
+    }
+
+    pub fn read_str(&mut self) -> Result<&'a str, TagFileError> {
+        let len = self.read_len()?;
+        let bytes = self.read_bytes(len)?;
+        std::str::from_utf8(bytes).map_err(|_| TagFileError::Serialize("Invalid UTF-8 string".to_string()))
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn codec_round_trip() {
+        let mut writer = ByteWriter::new();
+        writer.write_bytes(b"MAGIC");
+        writer.write_u8(7);
+        writer.write_u32(0xdeadbeef);
+        writer.write_u64(u64::MAX);
+        for value in [0, 1, 127, 128, 300, u32::MAX as u64, u64::MAX] {
+            writer.write_varint(value);
+        }
+        writer.write_str("héllo");
+        writer.write_str("");
+        let bytes = writer.into_bytes();
+
+        let mut reader = ByteReader::new(&bytes);
+        assert_eq!(reader.read_bytes(5).unwrap(), b"MAGIC");
+        assert_eq!(reader.read_u8().unwrap(), 7);
+        assert_eq!(reader.read_u32().unwrap(), 0xdeadbeef);
+        assert_eq!(reader.read_u64().unwrap(), u64::MAX);
+        for value in [0, 1, 127, 128, 300, u32::MAX as u64, u64::MAX] {
+            assert_eq!(reader.read_varint().unwrap(), value);
+        }
+        assert_eq!(reader.read_str().unwrap(), "héllo");
+        assert_eq!(reader.read_str().unwrap(), "");
+        assert!(reader.is_at_end());
+        assert!(reader.read_u8().is_err());
+    }
+
+    #[test]
+    fn codec_rejects_bad_lengths() {
+        let mut writer = ByteWriter::new();
+        writer.write_varint(1000);
+        writer.write_bytes(b"short");
+        let bytes = writer.into_bytes();
+        assert!(ByteReader::new(&bytes).read_str().is_err());
+        assert!(ByteReader::new(&[0xff; 11]).read_varint().is_err());
+        assert!(ByteReader::new(&[0x02, 0xff, 0xfe]).read_str().is_err());
+    }
+}
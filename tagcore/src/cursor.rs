@@ -0,0 +1,145 @@
+use std::{
+    path::{Path, PathBuf}, sync::Arc
+};
+
+use crate::{
+    errors::QueryError, facet::Facets, query::Query, symbol::{Symbol, SymbolTable, SymbolTag}, tag::Tag
+};
+
+/// The results of a query, sorted by directory then file name, turned into strings a batch at a time by fetch.
+/// Holds its own copy of the matching tags, so it stays valid (and unchanged) while the workspace is edited.
+#[derive(Debug)]
+pub struct QueryCursor {
+    symbols: Arc<SymbolTable>,
+    /// Directories holding results, relative to the workspace root and prefixed with "."
+    dirs: Vec<PathBuf>,
+    /// Every result, as (index into dirs, file name, ALL tags of the file), in order
+    hits: Vec<(usize, Symbol, Vec<SymbolTag>)>,
+    /// Index of the next result returned by fetch
+    position: usize,
+}
+
+impl QueryCursor {
+    /// Sorts the results of a query. Each hit is (index into dirs, file name, ALL tags of the file).
+    pub(crate) fn new(symbols: Arc<SymbolTable>, dirs: Vec<PathBuf>, mut hits: Vec<(usize, Symbol, Vec<SymbolTag>)>) -> QueryCursor {
+        {
+            let strings = symbols.read();
+            hits.sort_unstable_by(|(dir_a, name_a, _), (dir_b, name_b, _)| {
+                dirs[*dir_a].cmp(&dirs[*dir_b]).then_with(|| strings.resolve(*name_a).cmp(strings.resolve(*name_b)))
+            });
+        }
+        QueryCursor { symbols, dirs, hits, position: 0 }
+    }
+
+    /// Total number of results, fetched or not
+    pub fn len(&self) -> usize {
+        self.hits.len()
+    }
+
+    pub fn is_empty(&self) -> bool {
+        self.hits.is_empty()
+    }
+
+    /// Number of results not fetched yet
+    pub fn remaining(&self) -> usize {
+        self.hits.len() - self.position
+    }
+
+    /// Returns the next (at most) n results, as relative file paths and ALL their tags. Returns nothing once every result was fetched.
+    pub fn fetch(&mut self, n: usize) -> Vec<(String, Vec<Tag>)> {
+        let end = self.hits.len().min(self.position.saturating_add(n));
+        let symbols = self.symbols.read();
+        let batch = self.hits[self.position..end].iter()
+            .map(|(dir, file_name, tags)| {
+                let used_file_path = self.dirs[*dir].join(Path::new(symbols.resolve(*file_name))).to_string_lossy().into_owned();
+                (used_file_path, tags.iter().map(|tag| tag.resolve(&symbols)).collect())
+            })
+            .collect();
+        self.position = end;
+        batch
+    }
+
+    /// Goes back to the first result
+    pub fn rewind(&mut self) {
+        self.position = 0;
+    }
+
+    /// Counts the tags of every result, fetched or not, in a single pass over the tags the cursor already holds
+    pub fn facets(&self) -> Facets {
+        Facets::count(self.hits.iter().map(|(_, _, tags)| tags.as_slice()), &self.symbols.read())
+    }
+
+    /// Returns a new cursor over the results that also match a compound query (see Query for the syntax), for drilling down.
+    /// Each result is checked against the tags the cursor holds, so the workspace is not queried again.
+    pub fn narrow(&self, expr: &str) -> Result<QueryCursor, QueryError> {
+        let filter = Query::parse(expr)?.filter(&self.symbols.read());
+        let hits = self.hits.iter()
+            .filter(|(_, _, tags)| filter.matches(tags))
+            .cloned()
+            .collect();
+        // Results stay in order
+        Ok(QueryCursor { symbols: self.symbols.clone(), dirs: self.dirs.clone(), hits, position: 0 })
+    }
+}
+
+impl Iterator for QueryCursor {
+    type Item = (String, Vec<Tag>);
+
+    fn next(&mut self) -> Option<Self::Item> {
+        self.fetch(1).pop()
+    }
+
+    fn size_hint(&self) -> (usize, Option<usize>) {
+        (self.remaining(), Some(self.remaining()))
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn cursor_fetch_in_order() {
+        let symbols = SymbolTable::new();
+        let (b, a, c) = (symbols.intern("b.txt"), symbols.intern("a.txt"), symbols.intern("c.txt"));
+        let tag = SymbolTag::Simple(symbols.intern("Tag"));
+        let dirs = vec![PathBuf::from("./sub"), PathBuf::from(".")];
+        let hits = vec![(0, a, vec![tag]), (1, b, vec![tag]), (1, c, Vec::new()), (1, a, vec![tag])];
+        let mut cursor = QueryCursor::new(symbols, dirs, hits);
+        assert_eq!(cursor.len(), 4);
+
+        let first = cursor.fetch(2);
+        assert_eq!(first, vec![("./a.txt".to_string(), vec![Tag::Simple("Tag".to_string())]), ("./b.txt".to_string(), vec![Tag::Simple("Tag".to_string())])]);
+        assert_eq!(cursor.remaining(), 2);
+
+        let rest: Vec<String> = cursor.by_ref().map(|(path, _)| path).collect();
+        assert_eq!(rest, vec!["./c.txt", "./sub/a.txt"]);
+        assert!(cursor.fetch(10).is_empty());
+
+        cursor.rewind();
+        assert_eq!(cursor.fetch(usize::MAX).len(), 4);
+    }
+
+    #[test]
+    fn cursor_facets_and_narrow() {
+        let symbols = SymbolTable::new();
+        let (a, b, c) = (symbols.intern("a.txt"), symbols.intern("b.txt"), symbols.intern("c.txt"));
+        let verso = SymbolTag::KV(symbols.intern("Texture"), symbols.intern("Verso"));
+        let recto = SymbolTag::KV(symbols.intern("Texture"), symbols.intern("Recto"));
+        let personal = SymbolTag::Simple(symbols.intern("Personal"));
+        let hits = vec![(0, a, vec![verso, personal]), (0, b, vec![recto]), (0, c, vec![verso])];
+        let cursor = QueryCursor::new(symbols, vec![PathBuf::from(".")], hits);
+
+        let facets = cursor.facets();
+        assert_eq!(facets.simple, vec![("Personal".to_string(), 1)]);
+        assert_eq!((facets.keys[0].key.as_str(), facets.keys[0].count), ("Texture", 3));
+        assert_eq!(facets.keys[0].values, vec![("Verso".to_string(), 2), ("Recto".to_string(), 1)]);
+
+        let mut narrowed = cursor.narrow("Texture:Verso AND NOT Personal").unwrap();
+        assert_eq!(narrowed.fetch(10), vec![("./c.txt".to_string(), vec![Tag::KV("Texture".to_string(), "Verso".to_string())])]);
+        assert_eq!(narrowed.facets().keys[0].values, vec![("Verso".to_string(), 1)]);
+        assert!(cursor.narrow("Unknown").unwrap().is_empty());
+        assert!(cursor.narrow("(").is_err());
+        assert_eq!(cursor.len(), 3);
+    }
+}
@@ -3,7 +3,8 @@ use std::fmt;
 #[derive(Debug)]
 pub enum WorkspaceError {
     InvalidName(String),
-    FileUnavailable(String)
+    FileUnavailable(String),
+    Watch(String)
 }
 
 impl fmt::Display for WorkspaceError {
@@ -11,6 +12,7 @@ impl fmt::Display for WorkspaceError {
         match self {
             WorkspaceError::InvalidName(name) => write!(f, "Workspace name is invalid: {}", name),
             WorkspaceError::FileUnavailable(name) => write!(f, "Cannot open/create workspace file: {}", name),
+            WorkspaceError::Watch(value) => write!(f, "Cannot watch workspace: {}", value),
         }
     }
 }
@@ -32,4 +34,25 @@ impl fmt::Display for TagFileError {
             TagFileError::Io(value) => write!(f, "Encountered IO error: {}", value),
         }
     }
-}
\ No newline at end of file
+}
+
+#[derive(Debug, PartialEq)]
+pub enum QueryError {
+    Empty,
+    UnexpectedEnd,
+    UnexpectedToken(String),
+    UnclosedQuote,
+    InvalidTerm(String)
+}
+
+impl fmt::Display for QueryError {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        match self {
+            QueryError::Empty => write!(f, "Query is empty"),
+            QueryError::UnexpectedEnd => write!(f, "Query ended unexpectedly"),
+            QueryError::UnexpectedToken(value) => write!(f, "Unexpected '{}' in query", value),
+            QueryError::UnclosedQuote => write!(f, "Query has an unclosed quote"),
+            QueryError::InvalidTerm(value) => write!(f, "Invalid query term '{}'", value),
+        }
+    }
+}
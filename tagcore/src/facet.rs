@@ -0,0 +1,105 @@
+use std::{
+    cmp::Reverse, collections::HashMap, hash::Hash
+};
+
+use crate::symbol::{Symbol, SymbolTag, Symbols};
+
+/// How many files of a result set use a key, and carry each of its values
+#[derive(Debug, Clone, PartialEq)]
+pub struct KeyFacet {
+    pub key: String,
+    /// Files with at least one tag using the key
+    pub count: usize,
+    /// Files carrying each value of the key, most common first
+    pub values: Vec<(String, usize)>,
+}
+
+/// How many files of a result set carry each tag, for drilling down into the results of a query. Each file counts once per tag, key and value.
+#[derive(Debug, Clone, Default, PartialEq)]
+pub struct Facets {
+    /// Files carrying each simple tag, most common first
+    pub simple: Vec<(String, usize)>,
+    /// Keys used by the files, most common first
+    pub keys: Vec<KeyFacet>,
+}
+
+impl Facets {
+    /// Counts the tags of every file of a result set, given as the tags of each file, in a single pass
+    pub(crate) fn count<'a>(files: impl Iterator<Item = &'a [SymbolTag]>, symbols: &Symbols) -> Facets {
+        // Each count remembers the last file it was incremented for, so that a file counts once per term
+        let mut simple: HashMap<Symbol, (usize, usize)> = HashMap::new();
+        let mut keys: HashMap<Symbol, (usize, usize)> = HashMap::new();
+        let mut pairs: HashMap<(Symbol, Symbol), (usize, usize)> = HashMap::new();
+        for (file, tags) in files.enumerate() {
+            for tag in tags {
+                match tag {
+                    SymbolTag::Simple(s) => Facets::increment(&mut simple, *s, file),
+                    SymbolTag::KV(k, v) => {
+                        Facets::increment(&mut keys, *k, file);
+                        Facets::increment(&mut pairs, (*k, *v), file);
+                    },
+                }
+            }
+        }
+
+        let mut values: HashMap<Symbol, Vec<(String, usize)>> = HashMap::new();
+        for ((key, value), (count, _)) in pairs {
+            values.entry(key).or_default().push((symbols.resolve(value).to_string(), count));
+        }
+        let mut keys: Vec<KeyFacet> = keys.into_iter()
+            .map(|(key, (count, _))| {
+                let mut values = values.remove(&key).unwrap_or_default();
+                Facets::sort_by_count(&mut values, |(value, count)| (*count, value.as_str()));
+                KeyFacet { key: symbols.resolve(key).to_string(), count, values }
+            })
+            .collect();
+        Facets::sort_by_count(&mut keys, |facet| (facet.count, facet.key.as_str()));
+        let mut simple: Vec<(String, usize)> = simple.into_iter().map(|(s, (count, _))| (symbols.resolve(s).to_string(), count)).collect();
+        Facets::sort_by_count(&mut simple, |(s, count)| (*count, s.as_str()));
+        Facets { simple, keys }
+    }
+}
+
+// Private / Helper Functions
+impl Facets {
+    fn increment<T: Hash + Eq>(counts: &mut HashMap<T, (usize, usize)>, term: T, file: usize) {
+        let (count, last_file) = counts.entry(term).or_insert((0, usize::MAX));
+        if *last_file != file {
+            *count += 1;
+            *last_file = file;
+        }
+    }
+
+    /// Sorts most common first, ties broken by text
+    fn sort_by_count<T>(items: &mut [T], count_and_text: impl Fn(&T) -> (usize, &str)) {
+        items.sort_unstable_by(|a, b| {
+            let (count_a, text_a) = count_and_text(a);
+            let (count_b, text_b) = count_and_text(b);
+            Reverse(count_a).cmp(&Reverse(count_b)).then_with(|| text_a.cmp(text_b))
+        });
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn facets_count() {
+        let mut symbols = Symbols::default();
+        let [texture, verso, recto, personal, due] = ["Texture", "Verso", "Recto", "Personal", "Due"].map(|s| symbols.intern(s));
+        let files = [
+            vec![SymbolTag::KV(texture, verso), SymbolTag::KV(texture, recto), SymbolTag::Simple(personal)],
+            vec![SymbolTag::KV(texture, verso), SymbolTag::Simple(due)],
+            vec![SymbolTag::Simple(personal)],
+        ];
+        let facets = Facets::count(files.iter().map(Vec::as_slice), &symbols);
+        assert_eq!(facets.simple, vec![("Personal".to_string(), 2), ("Due".to_string(), 1)]);
+        assert_eq!(facets.keys, vec![KeyFacet {
+            key: "Texture".to_string(),
+            count: 2,
+            values: vec![("Verso".to_string(), 2), ("Recto".to_string(), 1)],
+        }]);
+        assert_eq!(Facets::count(std::iter::empty(), &symbols), Facets::default());
+    }
+}
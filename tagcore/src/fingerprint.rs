@@ -0,0 +1,27 @@
+use std::{fs, path::Path};
+
+/// Identifies a file independently of its name: its inode number and size. Recorded when a file is tagged, so that
+/// its tags can be found again after another program renamed or moved it (see Workspace::reconcile).
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Hash)]
+pub struct Fingerprint {
+    pub inode: u64,
+    pub size: u64,
+}
+
+impl Fingerprint {
+    /// Stats a file, following symbolic links. Returns None if it cannot be stat'ed, or on platforms without inode numbers.
+    pub fn of(path: &Path) -> Option<Fingerprint> {
+        Fingerprint::from_metadata(&fs::metadata(path).ok()?)
+    }
+
+    #[cfg(unix)]
+    pub fn from_metadata(metadata: &fs::Metadata) -> Option<Fingerprint> {
+        use std::os::unix::fs::MetadataExt;
+        Some(Fingerprint { inode: metadata.ino(), size: metadata.len() })
+    }
+
+    #[cfg(not(unix))]
+    pub fn from_metadata(_metadata: &fs::Metadata) -> Option<Fingerprint> {
+        None
+    }
+}
@@ -0,0 +1,316 @@
+use std::{
+    collections::{HashMap, HashSet}, hash::Hash, path::{Path, PathBuf}
+};
+
+use crate::{stats::TagStats, symbol::{Symbol, SymbolTag, Symbols}, tagfile::TagFile, trigram::TrigramIndex};
+
+/// Compact identifier for a TagFile known to the index
+pub type DirId = u32;
+
+/// Files carrying a tag (by the Symbol of their name), grouped by the TagFile they live in
+pub type Postings = HashMap<DirId, HashSet<Symbol>>;
+
+/// A term that has its own postings in the index
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub enum IndexTerm {
+    Simple(Symbol),
+    Key(Symbol),
+    Value(Symbol),
+    /// A whole key-value tag
+    Pair(Symbol, Symbol),
+}
+
+/// Inverted index from tag text to the files carrying it. Kept by the Workspace so that queries do not need to visit every TagFile.
+/// Terms and file names are the Symbols of the workspace's SymbolTable.
+#[derive(Debug, Default)]
+pub struct TagIndex {
+    /// Paths to TagFiles (the keys of Workspace::all_tagfiles), by DirId
+    dirs: Vec<PathBuf>,
+    /// Directory of each TagFile relative to root_folder and prefixed with ".", by DirId. None if outside root_folder.
+    prefixes: Vec<Option<PathBuf>>,
+    /// Cannonical root of the workspace, which prefixes are relative to
+    root_folder: PathBuf,
+    dir_ids: HashMap<PathBuf, DirId>,
+    simple: HashMap<Symbol, Postings>,
+    keys: HashMap<Symbol, Postings>,
+    values: HashMap<Symbol, Postings>,
+    pairs: HashMap<(Symbol, Symbol), Postings>,
+    /// Every distinct simple value, key and value, for substring search
+    vocabulary: TrigramIndex,
+    /// Number of files carrying each term, and the sorted vocabulary used for autocompletion
+    stats: TagStats,
+}
+
+impl TagIndex {
+    /// Creates an empty index for a workspace, given its (cannonical) root folder, which dir_prefix is relative to
+    pub fn new(root_folder: PathBuf) -> TagIndex {
+        TagIndex { root_folder, ..TagIndex::default() }
+    }
+
+    /// Indexes every file mapped by a TagFile. The TagFile must not have been indexed already.
+    pub fn add_tagfile(&mut self, path_to_tagfile: &Path, tf: &TagFile, symbols: &Symbols) {
+        let dir_id = self.get_or_insert_dir(path_to_tagfile);
+        for (file_name, tags) in tf.get_mapping_ref() {
+            self.update_file_in_dir(dir_id, *file_name, &[], tags, symbols);
+        }
+    }
+
+    /// Updates the postings of one file, given the tags it had before and the tags it has now
+    pub fn update_file(&mut self, path_to_tagfile: &Path, file_name: Symbol, old_tags: &[SymbolTag], new_tags: &[SymbolTag], symbols: &Symbols) {
+        let dir_id = self.get_or_insert_dir(path_to_tagfile);
+        self.update_file_in_dir(dir_id, file_name, old_tags, new_tags, symbols);
+    }
+
+    /// Returns all files having a tag whose text is the given term, in the enabled tag positions. Files are grouped by TagFile.
+    pub fn lookup_exact(&self, term: Symbol, simple: bool, key: bool, value: bool) -> HashMap<DirId, HashSet<Symbol>> {
+        let mut rv: HashMap<DirId, HashSet<Symbol>> = HashMap::new();
+        let enabled = [(simple, &self.simple), (key, &self.keys), (value, &self.values)];
+        for (_, postings) in enabled.iter().filter(|(on, _)| *on) {
+            let Some(postings) = postings.get(&term) else {
+                continue;
+            };
+            for (dir_id, file_names) in postings {
+                rv.entry(*dir_id).or_default().extend(file_names.iter().copied());
+            }
+        }
+        rv
+    }
+
+    /// Returns all files having a tag whose lowercased text contains the given (already lowercased) text, in the enabled tag positions.
+    /// Files are grouped by TagFile.
+    pub fn lookup_fuzzy(&self, lower_text: &str, simple: bool, key: bool, value: bool) -> HashMap<DirId, HashSet<Symbol>> {
+        let mut rv: HashMap<DirId, HashSet<Symbol>> = HashMap::new();
+        let enabled = [(simple, &self.simple), (key, &self.keys), (value, &self.values)];
+        for term in self.vocabulary.find_containing(lower_text) {
+            for (_, postings) in enabled.iter().filter(|(on, _)| *on) {
+                let Some(postings) = postings.get(&term) else {
+                    continue;
+                };
+                for (dir_id, file_names) in postings {
+                    rv.entry(*dir_id).or_default().extend(file_names.iter().copied());
+                }
+            }
+        }
+        rv
+    }
+
+    /// Returns the files carrying a term, if any
+    pub fn postings(&self, term: IndexTerm) -> Option<&Postings> {
+        match term {
+            IndexTerm::Simple(s) => self.simple.get(&s),
+            IndexTerm::Key(k) => self.keys.get(&k),
+            IndexTerm::Value(v) => self.values.get(&v),
+            IndexTerm::Pair(k, v) => self.pairs.get(&(k, v)),
+        }
+    }
+
+    /// Returns every file with at least one tag. Every tag is either simple or has a key, so these are the files in the simple and key postings.
+    pub fn all_files(&self) -> Postings {
+        let mut rv = Postings::new();
+        for postings in self.simple.values().chain(self.keys.values()) {
+            for (dir_id, file_names) in postings {
+                rv.entry(*dir_id).or_default().extend(file_names.iter().copied());
+            }
+        }
+        rv
+    }
+
+    /// Returns the tag counts and sorted vocabulary of the indexed files
+    pub fn stats(&self) -> &TagStats {
+        &self.stats
+    }
+
+    /// Returns the path to the TagFile a DirId refers to
+    pub fn dir_path(&self, dir_id: DirId) -> &Path {
+        &self.dirs[dir_id as usize]
+    }
+
+    /// Returns the directory of the TagFile a DirId refers to, relative to the root folder and prefixed with "." (such as "./sub"),
+    /// or None if it is not within the root folder. Computed once per TagFile.
+    pub fn dir_prefix(&self, dir_id: DirId) -> Option<&Path> {
+        self.prefixes[dir_id as usize].as_deref()
+    }
+}
+
+// Private / Helper Functions
+impl TagIndex {
+    fn get_or_insert_dir(&mut self, path_to_tagfile: &Path) -> DirId {
+        if let Some(id) = self.dir_ids.get(path_to_tagfile) {
+            return *id;
+        }
+        let id = self.dirs.len() as DirId;
+        let prefix = path_to_tagfile.parent()
+            .and_then(|dir| dir.strip_prefix(&self.root_folder).ok())
+            .map(|relative_dir| Path::new(".").join(relative_dir));
+        self.prefixes.push(prefix);
+        self.dirs.push(path_to_tagfile.to_path_buf());
+        self.dir_ids.insert(path_to_tagfile.to_path_buf(), id);
+        id
+    }
+
+    fn update_file_in_dir(&mut self, dir_id: DirId, file_name: Symbol, old_tags: &[SymbolTag], new_tags: &[SymbolTag], symbols: &Symbols) {
+        let (old_simple, old_keys, old_values, old_pairs) = TagIndex::terms_of(old_tags);
+        let (new_simple, new_keys, new_values, new_pairs) = TagIndex::terms_of(new_tags);
+
+        TagIndex::update_postings(&mut self.simple, dir_id, file_name, &old_simple, &new_simple);
+        TagIndex::update_postings(&mut self.keys, dir_id, file_name, &old_keys, &new_keys);
+        TagIndex::update_postings(&mut self.values, dir_id, file_name, &old_values, &new_values);
+        TagIndex::update_postings(&mut self.pairs, dir_id, file_name, &old_pairs, &new_pairs);
+        self.stats.update(&old_simple, &new_simple, &old_keys, &new_keys, &old_pairs, &new_pairs, symbols);
+
+        let changed_terms = [(&old_simple, &new_simple), (&old_keys, &new_keys), (&old_values, &new_values)];
+        for (old, new) in changed_terms {
+            for term in old.symmetric_difference(new) {
+                self.sync_vocabulary(*term, symbols);
+            }
+        }
+    }
+
+    /// Adds or removes a term from the vocabulary, depending on whether any file still carries it
+    fn sync_vocabulary(&mut self, term: Symbol, symbols: &Symbols) {
+        let in_use = self.simple.contains_key(&term) || self.keys.contains_key(&term) || self.values.contains_key(&term);
+        if in_use {
+            self.vocabulary.insert(term, symbols.resolve(term));
+        } else {
+            self.vocabulary.remove(term);
+        }
+    }
+
+    /// Splits a list of tags into its distinct simple values, keys, values and key-value pairs
+    fn terms_of(tags: &[SymbolTag]) -> (HashSet<Symbol>, HashSet<Symbol>, HashSet<Symbol>, HashSet<(Symbol, Symbol)>) {
+        let mut simple = HashSet::new();
+        let mut keys = HashSet::new();
+        let mut values = HashSet::new();
+        let mut pairs = HashSet::new();
+        for tag in tags {
+            match tag {
+                SymbolTag::Simple(s) => { simple.insert(*s); },
+                SymbolTag::KV(k, v) => {
+                    keys.insert(*k);
+                    values.insert(*v);
+                    pairs.insert((*k, *v));
+                }
+            }
+        }
+        (simple, keys, values, pairs)
+    }
+
+    fn update_postings<T: Hash + Eq + Copy>(postings: &mut HashMap<T, Postings>, dir_id: DirId, file_name: Symbol, old: &HashSet<T>, new: &HashSet<T>) {
+        for term in old.difference(new) {
+            let Some(term_postings) = postings.get_mut(term) else {
+                continue;
+            };
+            if let Some(file_names) = term_postings.get_mut(&dir_id) {
+                file_names.remove(&file_name);
+                if file_names.is_empty() {
+                    term_postings.remove(&dir_id);
+                }
+            }
+            if term_postings.is_empty() {
+                postings.remove(term);
+            }
+        }
+        for term in new.difference(old) {
+            postings.entry(*term).or_default()
+                .entry(dir_id).or_default()
+                .insert(file_name);
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::{symbol::SymbolTable, tag::Tag};
+
+    /// Updates one file of the index, interning its name and tags
+    fn update(index: &mut TagIndex, symbols: &SymbolTable, path: &Path, file_name: &str, old_tags: &[Tag], new_tags: &[Tag]) {
+        let mut table = symbols.write();
+        let file_name = table.intern(file_name);
+        let old_tags: Vec<SymbolTag> = old_tags.iter().map(|tag| SymbolTag::intern(tag, &mut table)).collect();
+        let new_tags: Vec<SymbolTag> = new_tags.iter().map(|tag| SymbolTag::intern(tag, &mut table)).collect();
+        index.update_file(path, file_name, &old_tags, &new_tags, &table);
+    }
+
+    fn lookup_exact(index: &TagIndex, symbols: &SymbolTable, text: &str, simple: bool, key: bool, value: bool) -> HashMap<DirId, HashSet<Symbol>> {
+        index.lookup_exact(symbols.intern(text), simple, key, value)
+    }
+
+    /// Returns the names of the files found in a TagFile
+    fn names(symbols: &SymbolTable, files: &HashSet<Symbol>) -> HashSet<String> {
+        files.iter().map(|s| symbols.read().resolve(*s).to_string()).collect()
+    }
+
+    #[test]
+    fn index_update_file() {
+        let symbols = SymbolTable::new();
+        let mut index = TagIndex::new(PathBuf::new());
+        let path = PathBuf::from("/root/.tag_test");
+        let tags = vec![Tag::Simple("TODO".to_string()), Tag::KV("Due".to_string(), "Today".to_string()), Tag::KV("Due".to_string(), "Later".to_string())];
+        update(&mut index, &symbols, &path, "file1", &[], &tags);
+
+        assert_eq!(lookup_exact(&index, &symbols, "TODO", true, false, false).len(), 1);
+        assert_eq!(lookup_exact(&index, &symbols, "TODO", false, true, true).len(), 0);
+        assert_eq!(lookup_exact(&index, &symbols, "Due", false, true, false).len(), 1);
+        assert_eq!(lookup_exact(&index, &symbols, "Due", true, false, true).len(), 0);
+        assert_eq!(lookup_exact(&index, &symbols, "Today", false, false, true).len(), 1);
+        let (due, today) = (symbols.intern("Due"), symbols.intern("Today"));
+        assert_eq!(index.postings(IndexTerm::Pair(due, today)).unwrap()[&0], HashSet::from([symbols.intern("file1")]));
+        assert!(index.postings(IndexTerm::Pair(today, due)).is_none());
+
+        // Removing one of two tags sharing a key keeps the key posting
+        let new_tags = vec![Tag::Simple("TODO".to_string()), Tag::KV("Due".to_string(), "Later".to_string())];
+        update(&mut index, &symbols, &path, "file1", &tags, &new_tags);
+        assert_eq!(lookup_exact(&index, &symbols, "Due", false, true, false).len(), 1);
+        assert_eq!(lookup_exact(&index, &symbols, "Today", false, false, true).len(), 0);
+        assert!(!index.values.contains_key(&symbols.intern("Today")));
+        assert!(index.postings(IndexTerm::Pair(due, today)).is_none());
+
+        update(&mut index, &symbols, &path, "file1", &new_tags, &[]);
+        assert!(index.simple.is_empty());
+        assert!(index.keys.is_empty());
+        assert!(index.values.is_empty());
+        assert!(index.pairs.is_empty());
+        assert!(index.vocabulary.find_containing("").is_empty());
+    }
+
+    #[test]
+    fn index_lookup_fuzzy() {
+        let symbols = SymbolTable::new();
+        let mut index = TagIndex::new(PathBuf::new());
+        let path = PathBuf::from("/root/.tag_test");
+        update(&mut index, &symbols, &path, "file1", &[], &[Tag::Simple("Today".to_string())]);
+        update(&mut index, &symbols, &path, "file2", &[], &[Tag::KV("Due".to_string(), "TODAY".to_string())]);
+        update(&mut index, &symbols, &path, "file3", &[], &[Tag::KV("Today".to_string(), "x".to_string())]);
+
+        assert_eq!(index.lookup_fuzzy("oda", true, true, true)[&0].len(), 3);
+        assert_eq!(names(&symbols, &index.lookup_fuzzy("oda", false, false, true)[&0]), HashSet::from(["file2".to_string()]));
+        assert_eq!(names(&symbols, &index.lookup_fuzzy("oda", true, false, false)[&0]), HashSet::from(["file1".to_string()]));
+        assert!(index.lookup_fuzzy("due", true, false, true).is_empty());
+
+        // "Today" is still used as a key after it is removed as a simple tag
+        let today = symbols.intern("Today");
+        update(&mut index, &symbols, &path, "file1", &[Tag::Simple("Today".to_string())], &[]);
+        assert!(index.vocabulary.contains(today));
+        assert_eq!(names(&symbols, &index.lookup_fuzzy("today", true, true, true)[&0]), HashSet::from(["file2".to_string(), "file3".to_string()]));
+        update(&mut index, &symbols, &path, "file3", &[Tag::KV("Today".to_string(), "x".to_string())], &[]);
+        assert!(!index.vocabulary.contains(today));
+    }
+
+    #[test]
+    fn index_lookup_exact_multiple_dirs() {
+        let symbols = SymbolTable::new();
+        let mut index = TagIndex::new(PathBuf::new());
+        let path_1 = PathBuf::from("/root/.tag_test");
+        let path_2 = PathBuf::from("/root/sub/.tag_test");
+        update(&mut index, &symbols, &path_1, "file1", &[], &[Tag::Simple("A".to_string())]);
+        update(&mut index, &symbols, &path_2, "file1", &[], &[Tag::KV("A".to_string(), "B".to_string())]);
+
+        let result = lookup_exact(&index, &symbols, "A", true, true, true);
+        assert_eq!(result.len(), 2);
+        assert!(result.values().all(|files| names(&symbols, files) == HashSet::from(["file1".to_string()])));
+        let dirs: HashSet<&Path> = result.keys().map(|id| index.dir_path(*id)).collect();
+        assert!(dirs.contains(path_1.as_path()));
+        assert!(dirs.contains(path_2.as_path()));
+    }
+}
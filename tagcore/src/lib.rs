@@ -3,11 +3,36 @@ mod workspace;
 mod tagfile;
 mod errors;
 mod tag;
+mod index;
+mod trigram;
+mod scan;
+mod codec;
+mod snapshot;
+mod lru;
+mod persist;
+mod symbol;
+mod query;
+mod cursor;
+mod change;
+mod fingerprint;
+mod profile;
+mod facet;
+mod stats;
+mod retag;
+#[cfg(feature = "watch")]
+mod watch;
 
 extern crate tempdir; //For unit tests in files
 
 // Public interface for library
 pub use workspace::Workspace;
 pub use tag::Tag;
-pub use errors::WorkspaceError;
+pub use persist::Durability;
+pub use tagfile::TagFileFormat;
+pub use cursor::QueryCursor;
+pub use facet::{Facets, KeyFacet};
+pub use change::TagChange;
+pub use retag::{Retag, RetagReport};
+pub use errors::{QueryError, WorkspaceError};
+pub use profile::{Counter, Phase, PhaseStats, ProfileStats, Profiler, Span};
 
@@ -0,0 +1,102 @@
+use std::{
+    borrow::Borrow, collections::{BTreeMap, HashMap}, hash::Hash
+};
+
+/// Map holding at most `capacity` entries. Inserting into a full cache evicts the least recently used entries.
+#[derive(Debug)]
+pub struct LruCache<K, V> {
+    capacity: usize,
+    /// Values with the tick of their last use
+    entries: HashMap<K, (V, u64)>,
+    /// Keys by the tick of their last use, oldest first
+    order: BTreeMap<u64, K>,
+    tick: u64,
+}
+
+impl<K: Clone + Eq + Hash, V> LruCache<K, V> {
+    /// Creates an empty cache. A capacity of 0 is treated as 1.
+    pub fn new(capacity: usize) -> LruCache<K, V> {
+        LruCache {
+            capacity: capacity.max(1),
+            entries: HashMap::new(),
+            order: BTreeMap::new(),
+            tick: 0,
+        }
+    }
+
+    /// Returns an entry without marking it as used
+    pub fn peek<Q>(&self, key: &Q) -> Option<&V> where K: Borrow<Q>, Q: Hash + Eq + ?Sized {
+        self.entries.get(key).map(|(value, _)| value)
+    }
+
+    /// Returns an entry and marks it as the most recently used
+    pub fn get_mut<Q>(&mut self, key: &Q) -> Option<&mut V> where K: Borrow<Q>, Q: Hash + Eq + ?Sized {
+        self.tick += 1;
+        let (value, last_used) = self.entries.get_mut(key)?;
+        let key = self.order.remove(last_used).unwrap();
+        *last_used = self.tick;
+        self.order.insert(self.tick, key);
+        Some(value)
+    }
+
+    /// Inserts (or replaces) an entry as the most recently used. Returns the entries evicted to make room for it.
+    pub fn insert(&mut self, key: K, value: V) -> Vec<(K, V)> {
+        self.remove(&key);
+        let mut evicted = Vec::new();
+        while self.entries.len() >= self.capacity {
+            let Some((_, oldest)) = self.order.pop_first() else {
+                break;
+            };
+            let (value, _) = self.entries.remove(&oldest).unwrap();
+            evicted.push((oldest, value));
+        }
+        self.tick += 1;
+        self.order.insert(self.tick, key.clone());
+        self.entries.insert(key, (value, self.tick));
+        evicted
+    }
+
+    pub fn remove<Q>(&mut self, key: &Q) -> Option<V> where K: Borrow<Q>, Q: Hash + Eq + ?Sized {
+        let (value, last_used) = self.entries.remove(key)?;
+        self.order.remove(&last_used);
+        Some(value)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn lru_evicts_least_recently_used() {
+        let mut cache: LruCache<String, u32> = LruCache::new(2);
+        assert!(cache.insert("a".to_string(), 1).is_empty());
+        assert!(cache.insert("b".to_string(), 2).is_empty());
+
+        // Using "a" makes "b" the oldest entry
+        *cache.get_mut("a").unwrap() += 10;
+        assert_eq!(cache.insert("c".to_string(), 3), vec![("b".to_string(), 2)]);
+        assert_eq!(cache.peek("a"), Some(&11));
+        assert_eq!(cache.peek("b"), None);
+        assert_eq!(cache.entries.len(), 2);
+
+        // Peeking does not count as a use
+        cache.peek("a");
+        assert_eq!(cache.insert("d".to_string(), 4), vec![("a".to_string(), 11)]);
+
+        // Replacing an entry does not evict
+        assert!(cache.insert("d".to_string(), 5).is_empty());
+        assert_eq!(cache.peek("d"), Some(&5));
+        assert_eq!(cache.remove("c"), Some(3));
+        assert_eq!(cache.entries.len(), 1);
+        assert!(cache.get_mut("c").is_none());
+    }
+
+    #[test]
+    fn lru_zero_capacity() {
+        let mut cache: LruCache<u32, u32> = LruCache::new(0);
+        assert_eq!(cache.capacity, 1);
+        cache.insert(1, 1);
+        assert_eq!(cache.insert(2, 2), vec![(1, 1)]);
+    }
+}
@@ -0,0 +1,132 @@
+use std::{
+    fmt, fs::{self, File, OpenOptions}, io::{self, Write}, path::Path, process, str::FromStr, sync::atomic::{AtomicU64, Ordering}
+};
+
+/// How hard a write tries to survive a crash. Every policy writes to a temporary file and renames it over the target,
+/// so readers and other processes never see a half-written file, and a crashed process leaves the old file intact.
+/// The fsync policies additionally make sure the new contents survive a power loss or OS crash, at the cost of throughput.
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Default)]
+pub enum Durability {
+    /// Rename only. After a power loss the file may hold its old contents (but never a mix of old and new).
+    #[default]
+    None,
+    /// Flush the file's contents to the storage device before renaming it
+    FsyncFile,
+    /// Also flush the directory after renaming, so that the rename itself is on the storage device once the write returns
+    FsyncFileAndDir,
+}
+
+impl FromStr for Durability {
+    type Err = String;
+
+    fn from_str(value: &str) -> Result<Self, Self::Err> {
+        match value {
+            "none" => Ok(Durability::None),
+            "file" => Ok(Durability::FsyncFile),
+            "file-and-dir" => Ok(Durability::FsyncFileAndDir),
+            _ => Err(format!("Unknown durability '{}', expected none, file or file-and-dir", value)),
+        }
+    }
+}
+
+impl fmt::Display for Durability {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        match self {
+            Durability::None => write!(f, "none"),
+            Durability::FsyncFile => write!(f, "file"),
+            Durability::FsyncFileAndDir => write!(f, "file-and-dir"),
+        }
+    }
+}
+
+/// Distinguishes the temporary files of concurrent writes from the same process
+static TEMP_COUNTER: AtomicU64 = AtomicU64::new(0);
+
+/// Replaces the file at path with contents, atomically. The new file keeps the permissions of the file it replaces.
+pub fn write_atomic(path: &Path, contents: &[u8], durability: Durability) -> io::Result<()> {
+    let Some(file_name) = path.file_name() else {
+        return Err(io::Error::new(io::ErrorKind::InvalidInput, "Path has no file name"));
+    };
+    // Unique per process and write, so that concurrent writers never share a temporary file
+    let mut temp_name = file_name.to_os_string();
+    temp_name.push(format!(".tmp.{}.{}", process::id(), TEMP_COUNTER.fetch_add(1, Ordering::Relaxed)));
+    let temp_path = path.with_file_name(temp_name);
+
+    let result = write_and_rename(path, &temp_path, contents, durability);
+    if result.is_err() {
+        let _ = fs::remove_file(&temp_path);
+    }
+    result
+}
+
+fn write_and_rename(path: &Path, temp_path: &Path, contents: &[u8], durability: Durability) -> io::Result<()> {
+    let mut file = OpenOptions::new().write(true).create_new(true).open(temp_path)?;
+    file.write_all(contents)?;
+    if let Ok(metadata) = fs::metadata(path) {
+        file.set_permissions(metadata.permissions())?;
+    }
+    if durability != Durability::None {
+        file.sync_all()?;
+    }
+    drop(file);
+
+    fs::rename(temp_path, path)?;
+    if durability == Durability::FsyncFileAndDir {
+        sync_parent_dir(path)?;
+    }
+    Ok(())
+}
+
+#[cfg(unix)]
+fn sync_parent_dir(path: &Path) -> io::Result<()> {
+    let parent = match path.parent() {
+        Some(parent) if !parent.as_os_str().is_empty() => parent,
+        _ => Path::new("."),
+    };
+    File::open(parent)?.sync_all()
+}
+
+/// Directories cannot be opened for syncing on other platforms, where the rename is durable once the file is
+#[cfg(not(unix))]
+fn sync_parent_dir(_path: &Path) -> io::Result<()> {
+    Ok(())
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn write_atomic_replaces_file() {
+        use tempdir::TempDir;
+        let root_dir = TempDir::new("test").unwrap();
+        let path = root_dir.path().join(".tag_test");
+
+        for (durability, contents) in [(Durability::None, "one"), (Durability::FsyncFile, "two"), (Durability::FsyncFileAndDir, "three")] {
+            write_atomic(&path, contents.as_bytes(), durability).unwrap();
+            assert_eq!(fs::read_to_string(&path).unwrap(), contents);
+        }
+        // No temporary files are left behind
+        assert_eq!(fs::read_dir(root_dir.path()).unwrap().count(), 1);
+
+        #[cfg(unix)]
+        {
+            use std::os::unix::fs::PermissionsExt;
+            fs::set_permissions(&path, fs::Permissions::from_mode(0o600)).unwrap();
+            write_atomic(&path, b"four", Durability::None).unwrap();
+            assert_eq!(fs::metadata(&path).unwrap().permissions().mode() & 0o777, 0o600);
+        }
+
+        // A failed write does not leave anything behind
+        assert!(write_atomic(&root_dir.path().join("missing_dir/.tag_test"), b"five", Durability::None).is_err());
+        assert_eq!(fs::read_dir(root_dir.path()).unwrap().count(), 1);
+    }
+
+    #[test]
+    fn durability_from_str() {
+        for durability in [Durability::None, Durability::FsyncFile, Durability::FsyncFileAndDir] {
+            assert_eq!(durability.to_string().parse::<Durability>().unwrap(), durability);
+        }
+        assert!("fsync".parse::<Durability>().is_err());
+    }
+}
@@ -0,0 +1,320 @@
+use std::{
+    fmt, fs, io, path::{Path, PathBuf}, sync::{atomic::{AtomicBool, AtomicU64, Ordering}, Mutex, OnceLock}, time::{Duration, Instant}
+};
+
+/// Most trace events kept; later spans are still counted, but left out of the trace
+const MAX_TRACE_EVENTS: usize = 1_000_000;
+
+/// What a span of time was spent on. Phases nest: a scan includes the parsing of the TagFiles it finds.
+#[derive(Clone, Copy, Debug, PartialEq, Eq, Hash)]
+pub enum Phase {
+    /// Walking the workspace tree for TagFiles, or loading them from a snapshot
+    Scan,
+    /// Decoding a TagFile or snapshot read from disk
+    Parse,
+    /// Building the tag index, on the first query after TagFiles were loaded
+    Index,
+    /// Looking up and collecting the results of a query
+    Query,
+    /// Encoding and writing a TagFile or snapshot
+    Save,
+    /// Resolving a path to its canonical form
+    Canonicalize,
+    /// Converting results for a caller, such as the Python binding
+    Convert,
+}
+
+impl Phase {
+    pub const ALL: [Phase; 7] = [Phase::Scan, Phase::Parse, Phase::Index, Phase::Query, Phase::Save, Phase::Canonicalize, Phase::Convert];
+}
+
+impl fmt::Display for Phase {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        match self {
+            Phase::Scan => write!(f, "scan"),
+            Phase::Parse => write!(f, "parse"),
+            Phase::Index => write!(f, "index"),
+            Phase::Query => write!(f, "query"),
+            Phase::Save => write!(f, "save"),
+            Phase::Canonicalize => write!(f, "canonicalize"),
+            Phase::Convert => write!(f, "convert"),
+        }
+    }
+}
+
+/// Events counted while profiling, besides the spans of each phase
+#[derive(Clone, Copy, Debug, PartialEq, Eq, Hash)]
+pub enum Counter {
+    DirsListed,
+    TagFilesParsed,
+    BytesParsed,
+    TagFilesSaved,
+    BytesSaved,
+    QueryHits,
+    /// Caller-supplied directories resolved from the workspace's path cache, without a canonicalize
+    PathCacheHits,
+}
+
+impl Counter {
+    pub const ALL: [Counter; 7] = [Counter::DirsListed, Counter::TagFilesParsed, Counter::BytesParsed, Counter::TagFilesSaved, Counter::BytesSaved, Counter::QueryHits, Counter::PathCacheHits];
+}
+
+impl fmt::Display for Counter {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        match self {
+            Counter::DirsListed => write!(f, "dirs_listed"),
+            Counter::TagFilesParsed => write!(f, "tagfiles_parsed"),
+            Counter::BytesParsed => write!(f, "bytes_parsed"),
+            Counter::TagFilesSaved => write!(f, "tagfiles_saved"),
+            Counter::BytesSaved => write!(f, "bytes_saved"),
+            Counter::QueryHits => write!(f, "query_hits"),
+            Counter::PathCacheHits => write!(f, "path_cache_hits"),
+        }
+    }
+}
+
+/// Time spent in one phase since profiling was enabled (or reset)
+#[derive(Clone, Copy, Debug, Default, PartialEq)]
+pub struct PhaseStats {
+    pub count: u64,
+    pub total: Duration,
+    pub max: Duration,
+}
+
+/// Everything measured since profiling was enabled (or reset), in the order of Phase::ALL and Counter::ALL
+#[derive(Clone, Debug, Default)]
+pub struct ProfileStats {
+    pub phases: Vec<(Phase, PhaseStats)>,
+    pub counters: Vec<(Counter, u64)>,
+}
+
+impl fmt::Display for ProfileStats {
+    /// A table of the phases, then the counters, for people to read
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        writeln!(f, "{:<16} {:>8} {:>12} {:>12}", "phase", "calls", "total ms", "max ms")?;
+        for (phase, stats) in &self.phases {
+            if stats.count == 0 {
+                continue;
+            }
+            writeln!(f, "{:<16} {:>8} {:>12.3} {:>12.3}", phase.to_string(), stats.count, stats.total.as_secs_f64() * 1e3, stats.max.as_secs_f64() * 1e3)?;
+        }
+        for (counter, value) in &self.counters {
+            if *value > 0 {
+                writeln!(f, "{:<16} {:>8}", counter.to_string(), value)?;
+            }
+        }
+        Ok(())
+    }
+}
+
+/// Span-based instrumentation of tagcore: time spent per Phase, a few Counters, and optionally every span for a Chrome trace.
+/// Disabled by default, in which case a span costs a single atomic load. Measurements are shared by the whole process (every workspace and thread).
+pub struct Profiler;
+
+impl Profiler {
+    /// Starts measuring. With trace, every span is also recorded for write_chrome_trace.
+    pub fn enable(trace: bool) {
+        origin();
+        TRACING.store(trace, Ordering::Relaxed);
+        ENABLED.store(true, Ordering::Relaxed);
+    }
+
+    /// Stops measuring, keeping what was measured
+    pub fn disable() {
+        ENABLED.store(false, Ordering::Relaxed);
+        TRACING.store(false, Ordering::Relaxed);
+    }
+
+    pub fn is_enabled() -> bool {
+        ENABLED.load(Ordering::Relaxed)
+    }
+
+    /// Forgets everything measured so far
+    pub fn reset() {
+        for phase in &PHASES {
+            phase.reset();
+        }
+        for counter in &COUNTERS {
+            counter.store(0, Ordering::Relaxed);
+        }
+        trace_events().clear();
+    }
+
+    /// Times the rest of the scope, until the returned Span is dropped
+    pub fn span(phase: Phase) -> Span {
+        span(phase)
+    }
+
+    pub fn count(counter: Counter, n: u64) {
+        count(counter, n);
+    }
+
+    pub fn stats() -> ProfileStats {
+        ProfileStats {
+            phases: Phase::ALL.iter().map(|phase| (*phase, PHASES[*phase as usize].stats())).collect(),
+            counters: Counter::ALL.iter().map(|counter| (*counter, COUNTERS[*counter as usize].load(Ordering::Relaxed))).collect(),
+        }
+    }
+
+    /// Writes the spans recorded while tracing in the Chrome trace event format, for chrome://tracing or ui.perfetto.dev
+    pub fn write_chrome_trace(path: &Path) -> io::Result<()> {
+        let events = trace_events();
+        let mut json = String::from("{\"traceEvents\":[\n");
+        for (i, event) in events.iter().enumerate() {
+            if i > 0 {
+                json.push_str(",\n");
+            }
+            json.push_str(&format!(
+                "{{\"name\":\"{}\",\"cat\":\"tagcore\",\"ph\":\"X\",\"ts\":{:.3},\"dur\":{:.3},\"pid\":1,\"tid\":{}}}",
+                event.phase, event.start.as_secs_f64() * 1e6, event.duration.as_secs_f64() * 1e6, event.thread
+            ));
+        }
+        json.push_str("\n],\"displayTimeUnit\":\"ms\"}\n");
+        fs::write(path, json)
+    }
+}
+
+/// Times a phase until dropped. Does nothing if profiling was disabled when it was made.
+#[must_use = "a span measures the scope it is kept in"]
+pub struct Span {
+    phase: Phase,
+    start: Option<Instant>,
+}
+
+impl Drop for Span {
+    fn drop(&mut self) {
+        let Some(start) = self.start else {
+            return;
+        };
+        let duration = start.elapsed();
+        PHASES[self.phase as usize].record(duration);
+        if TRACING.load(Ordering::Relaxed) {
+            let mut events = trace_events();
+            if events.len() < MAX_TRACE_EVENTS {
+                events.push(TraceEvent { phase: self.phase, start: start.duration_since(origin()), duration, thread: thread_id() });
+            }
+        }
+    }
+}
+
+/// Times the rest of the scope in a phase, if profiling is enabled
+pub(crate) fn span(phase: Phase) -> Span {
+    let start = if ENABLED.load(Ordering::Relaxed) { Some(Instant::now()) } else { None };
+    Span { phase, start }
+}
+
+/// Adds n to a counter, if profiling is enabled
+pub(crate) fn count(counter: Counter, n: u64) {
+    if ENABLED.load(Ordering::Relaxed) {
+        COUNTERS[counter as usize].fetch_add(n, Ordering::Relaxed);
+    }
+}
+
+/// Path::canonicalize, timed as Phase::Canonicalize
+pub(crate) fn canonicalize(path: &Path) -> io::Result<PathBuf> {
+    let _span = span(Phase::Canonicalize);
+    path.canonicalize()
+}
+
+// Private / Helper Functions
+
+static ENABLED: AtomicBool = AtomicBool::new(false);
+static TRACING: AtomicBool = AtomicBool::new(false);
+static PHASES: [PhaseCounters; Phase::ALL.len()] = [const { PhaseCounters::new() }; Phase::ALL.len()];
+static COUNTERS: [AtomicU64; Counter::ALL.len()] = [const { AtomicU64::new(0) }; Counter::ALL.len()];
+static TRACE_EVENTS: Mutex<Vec<TraceEvent>> = Mutex::new(Vec::new());
+static ORIGIN: OnceLock<Instant> = OnceLock::new();
+static NEXT_THREAD_ID: AtomicU64 = AtomicU64::new(1);
+
+thread_local! {
+    static THREAD_ID: u64 = NEXT_THREAD_ID.fetch_add(1, Ordering::Relaxed);
+}
+
+struct PhaseCounters {
+    count: AtomicU64,
+    total_nanos: AtomicU64,
+    max_nanos: AtomicU64,
+}
+
+impl PhaseCounters {
+    const fn new() -> PhaseCounters {
+        PhaseCounters { count: AtomicU64::new(0), total_nanos: AtomicU64::new(0), max_nanos: AtomicU64::new(0) }
+    }
+
+    fn record(&self, duration: Duration) {
+        let nanos = u64::try_from(duration.as_nanos()).unwrap_or(u64::MAX);
+        self.count.fetch_add(1, Ordering::Relaxed);
+        self.total_nanos.fetch_add(nanos, Ordering::Relaxed);
+        self.max_nanos.fetch_max(nanos, Ordering::Relaxed);
+    }
+
+    fn reset(&self) {
+        self.count.store(0, Ordering::Relaxed);
+        self.total_nanos.store(0, Ordering::Relaxed);
+        self.max_nanos.store(0, Ordering::Relaxed);
+    }
+
+    fn stats(&self) -> PhaseStats {
+        PhaseStats {
+            count: self.count.load(Ordering::Relaxed),
+            total: Duration::from_nanos(self.total_nanos.load(Ordering::Relaxed)),
+            max: Duration::from_nanos(self.max_nanos.load(Ordering::Relaxed)),
+        }
+    }
+}
+
+struct TraceEvent {
+    phase: Phase,
+    /// Since the profiler was first enabled
+    start: Duration,
+    duration: Duration,
+    thread: u64,
+}
+
+fn origin() -> Instant {
+    *ORIGIN.get_or_init(Instant::now)
+}
+
+fn thread_id() -> u64 {
+    THREAD_ID.with(|id| *id)
+}
+
+/// The recorded trace events. A panic while recording cannot leave them inconsistent, so a poisoned lock is ignored.
+fn trace_events() -> std::sync::MutexGuard<'static, Vec<TraceEvent>> {
+    TRACE_EVENTS.lock().unwrap_or_else(|poisoned| poisoned.into_inner())
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    // The profiler is shared by the whole process, and tests run in parallel: this is its only test, and it only checks lower bounds
+    #[test]
+    fn profiler_spans_counters_and_trace() {
+        use tempdir::TempDir;
+
+        {
+            let _span = span(Phase::Convert); // Disabled: not counted
+        }
+        Profiler::enable(true);
+        {
+            let _outer = span(Phase::Convert);
+            let _inner = span(Phase::Convert);
+            count(Counter::QueryHits, 3);
+        }
+        let stats = Profiler::stats();
+        let convert = stats.phases.iter().find(|(phase, _)| *phase == Phase::Convert).unwrap().1;
+        assert_eq!(convert.count, 2);
+        assert!(convert.max <= convert.total);
+        assert!(stats.counters.contains(&(Counter::QueryHits, 3)));
+        assert!(stats.to_string().contains("convert"));
+
+        let dir = TempDir::new("test").unwrap();
+        let path_to_trace = dir.path().join("trace.json");
+        Profiler::write_chrome_trace(&path_to_trace).unwrap();
+        let trace = fs::read_to_string(&path_to_trace).unwrap();
+        assert!(trace.starts_with("{\"traceEvents\":["));
+        assert_eq!(trace.matches("\"name\":\"convert\"").count(), 2);
+        Profiler::disable();
+    }
+}
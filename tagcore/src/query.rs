@@ -0,0 +1,469 @@
+use std::{
+    cmp::Reverse, collections::HashSet, fmt, iter::Peekable, str::Chars, vec
+};
+
+use crate::{
+    errors::QueryError, index::{DirId, IndexTerm, Postings, TagIndex}, symbol::{Symbol, SymbolTag, Symbols}
+};
+
+/// A file known to the index: the TagFile it lives in, and the Symbol of its name
+type FileRef = (DirId, Symbol);
+
+/// A compound query over exact tag text, such as `Texture:Verso AND NOT Due:Today OR Personal`.
+/// Terms are combined with NOT, AND and OR, from tightest to loosest binding, and grouped with parentheses. Adjacent terms are ANDed.
+/// A term is a simple tag (`Personal`), a key-value tag (`Due:Today`), any tag with a key (`Due:*`) or any tag with a value (`*:Today`).
+/// Text with spaces, parentheses or colons, or spelled like an operator, is quoted: `"Due Date":"Next week"`.
+#[derive(Debug, Clone, PartialEq)]
+pub enum Query {
+    Simple(String),
+    KV(String, String),
+    Key(String),
+    Value(String),
+    And(Vec<Query>),
+    Or(Vec<Query>),
+    Not(Box<Query>),
+}
+
+#[derive(Debug, PartialEq)]
+enum Token {
+    LParen,
+    RParen,
+    And,
+    Or,
+    Not,
+    Term(Query),
+}
+
+/// One side of a term, as written
+struct Word {
+    text: String,
+    quoted: bool,
+}
+
+/// A Query with its terms looked up in the index, ready to evaluate
+enum Plan<'a> {
+    /// The files carrying a term, or None if no file does
+    Term(Option<&'a Postings>),
+    And(Vec<Plan<'a>>),
+    Or(Vec<Plan<'a>>),
+    Not(Box<Plan<'a>>),
+}
+
+/// A Query with its terms looked up in a SymbolTable, to check files one at a time against their own tags, without the index
+pub enum Filter {
+    /// A term, or None if it was never interned (so no file carries it)
+    Term(Option<IndexTerm>),
+    And(Vec<Filter>),
+    Or(Vec<Filter>),
+    Not(Box<Filter>),
+}
+
+impl Query {
+    pub fn parse(text: &str) -> Result<Query, QueryError> {
+        let tokens = Query::tokenize(text)?;
+        if tokens.is_empty() {
+            return Err(QueryError::Empty);
+        }
+        let mut tokens = tokens.into_iter().peekable();
+        let query = Query::parse_or(&mut tokens)?;
+        match tokens.next() {
+            None => Ok(query),
+            Some(token) => Err(QueryError::UnexpectedToken(token.to_string())),
+        }
+    }
+
+    /// Returns the files matching the query, grouped by TagFile like the results of TagIndex::lookup_exact.
+    /// Intersections start from the term with the fewest files and stop as soon as nothing is left.
+    pub fn evaluate(&self, index: &TagIndex, symbols: &Symbols) -> Postings {
+        let files = Plan::new(self, index, symbols).evaluate(index);
+        let mut rv = Postings::new();
+        for (dir_id, file_name) in files {
+            rv.entry(dir_id).or_default().insert(file_name);
+        }
+        rv
+    }
+
+    /// Looks up the terms of the query, to check files against it one at a time (see Filter::matches)
+    pub fn filter(&self, symbols: &Symbols) -> Filter {
+        match self {
+            Query::Simple(s) => Filter::Term(symbols.get(s).map(IndexTerm::Simple)),
+            Query::KV(k, v) => Filter::Term(symbols.get(k).zip(symbols.get(v)).map(|(k, v)| IndexTerm::Pair(k, v))),
+            Query::Key(k) => Filter::Term(symbols.get(k).map(IndexTerm::Key)),
+            Query::Value(v) => Filter::Term(symbols.get(v).map(IndexTerm::Value)),
+            Query::And(queries) => Filter::And(queries.iter().map(|q| q.filter(symbols)).collect()),
+            Query::Or(queries) => Filter::Or(queries.iter().map(|q| q.filter(symbols)).collect()),
+            Query::Not(query) => Filter::Not(Box::new(query.filter(symbols))),
+        }
+    }
+}
+
+impl Filter {
+    /// Whether a file carrying the given tags matches the query. Agrees with Query::evaluate for every file with at least one tag.
+    pub fn matches(&self, tags: &[SymbolTag]) -> bool {
+        match self {
+            Filter::Term(None) => false,
+            Filter::Term(Some(term)) => tags.iter().any(|tag| match (term, tag) {
+                (IndexTerm::Simple(s), SymbolTag::Simple(t)) => s == t,
+                (IndexTerm::Key(k), SymbolTag::KV(t, _)) => k == t,
+                (IndexTerm::Value(v), SymbolTag::KV(_, t)) => v == t,
+                (IndexTerm::Pair(k, v), SymbolTag::KV(tk, tv)) => k == tk && v == tv,
+                _ => false,
+            }),
+            Filter::And(filters) => filters.iter().all(|filter| filter.matches(tags)),
+            Filter::Or(filters) => filters.iter().any(|filter| filter.matches(tags)),
+            Filter::Not(filter) => !filter.matches(tags),
+        }
+    }
+}
+
+// Private / Helper Functions
+impl Query {
+    fn tokenize(text: &str) -> Result<Vec<Token>, QueryError> {
+        let mut tokens = Vec::new();
+        let mut chars = text.chars().peekable();
+        while let Some(&c) = chars.peek() {
+            match c {
+                c if c.is_whitespace() => { chars.next(); },
+                '(' => {
+                    chars.next();
+                    tokens.push(Token::LParen);
+                },
+                ')' => {
+                    chars.next();
+                    tokens.push(Token::RParen);
+                },
+                _ => tokens.push(Query::read_term(&mut chars)?),
+            }
+        }
+        Ok(tokens)
+    }
+
+    /// Reads a term, or an operator (which are only recognized unquoted and without a colon)
+    fn read_term(chars: &mut Peekable<Chars>) -> Result<Token, QueryError> {
+        let first = Query::read_word(chars)?;
+        if chars.peek() != Some(&':') {
+            if !first.quoted {
+                match first.text.as_str() {
+                    "AND" => return Ok(Token::And),
+                    "OR" => return Ok(Token::Or),
+                    "NOT" => return Ok(Token::Not),
+                    _ => {},
+                }
+            }
+            if first.is_wildcard() {
+                return Err(QueryError::InvalidTerm(first.text));
+            }
+            return Ok(Token::Term(Query::Simple(first.text)));
+        }
+        chars.next();
+
+        let second = Query::read_word(chars)?;
+        let term = match (first.is_wildcard(), second.is_wildcard()) {
+            (false, false) => Query::KV(first.text, second.text),
+            (false, true) => Query::Key(first.text),
+            (true, false) => Query::Value(second.text),
+            (true, true) => return Err(QueryError::InvalidTerm("*:*".to_string())),
+        };
+        Ok(Token::Term(term))
+    }
+
+    /// Reads a quoted or bare word. Tags are stored trimmed, so quoted text is trimmed too.
+    fn read_word(chars: &mut Peekable<Chars>) -> Result<Word, QueryError> {
+        if chars.peek() == Some(&'"') {
+            chars.next();
+            let mut text = String::new();
+            loop {
+                match chars.next() {
+                    None => return Err(QueryError::UnclosedQuote),
+                    Some('"') => break,
+                    Some('\\') => text.push(chars.next().ok_or(QueryError::UnclosedQuote)?),
+                    Some(c) => text.push(c),
+                }
+            }
+            if text.trim().is_empty() {
+                return Err(QueryError::InvalidTerm(format!("\"{}\"", text)));
+            }
+            return Ok(Word { text: text.trim().to_string(), quoted: true });
+        }
+
+        let mut text = String::new();
+        while let Some(&c) = chars.peek() {
+            if c.is_whitespace() || "():\"".contains(c) {
+                break;
+            }
+            text.push(c);
+            chars.next();
+        }
+        if text.is_empty() {
+            // Such as the missing value in "Due:" or "Due: Today"
+            return Err(match chars.peek() {
+                None => QueryError::UnexpectedEnd,
+                Some(c) => QueryError::UnexpectedToken(c.to_string()),
+            });
+        }
+        Ok(Word { text, quoted: false })
+    }
+
+    fn parse_or(tokens: &mut Peekable<vec::IntoIter<Token>>) -> Result<Query, QueryError> {
+        let mut queries = vec![Query::parse_and(tokens)?];
+        while tokens.peek() == Some(&Token::Or) {
+            tokens.next();
+            queries.push(Query::parse_and(tokens)?);
+        }
+        Ok(Query::combine(queries, false))
+    }
+
+    fn parse_and(tokens: &mut Peekable<vec::IntoIter<Token>>) -> Result<Query, QueryError> {
+        let mut queries = vec![Query::parse_unary(tokens)?];
+        loop {
+            match tokens.peek() {
+                Some(Token::And) => {
+                    tokens.next();
+                },
+                Some(Token::Not | Token::LParen | Token::Term(_)) => {}, // Adjacent terms are ANDed
+                _ => break,
+            }
+            queries.push(Query::parse_unary(tokens)?);
+        }
+        Ok(Query::combine(queries, true))
+    }
+
+    fn parse_unary(tokens: &mut Peekable<vec::IntoIter<Token>>) -> Result<Query, QueryError> {
+        match tokens.next() {
+            Some(Token::Not) => Ok(Query::Not(Box::new(Query::parse_unary(tokens)?))),
+            Some(Token::LParen) => {
+                let query = Query::parse_or(tokens)?;
+                match tokens.next() {
+                    Some(Token::RParen) => Ok(query),
+                    Some(token) => Err(QueryError::UnexpectedToken(token.to_string())),
+                    None => Err(QueryError::UnexpectedEnd),
+                }
+            },
+            Some(Token::Term(query)) => Ok(query),
+            Some(token) => Err(QueryError::UnexpectedToken(token.to_string())),
+            None => Err(QueryError::UnexpectedEnd),
+        }
+    }
+
+    /// Joins queries with one operator, merging nested uses of the same operator so that all their terms are ordered together
+    fn combine(queries: Vec<Query>, and: bool) -> Query {
+        if queries.len() == 1 {
+            return queries.into_iter().next().unwrap();
+        }
+        let mut flat = Vec::with_capacity(queries.len());
+        for query in queries {
+            match query {
+                Query::And(inner) if and => flat.extend(inner),
+                Query::Or(inner) if !and => flat.extend(inner),
+                query => flat.push(query),
+            }
+        }
+        if and { Query::And(flat) } else { Query::Or(flat) }
+    }
+}
+
+impl fmt::Display for Token {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        match self {
+            Token::LParen => write!(f, "("),
+            Token::RParen => write!(f, ")"),
+            Token::And => write!(f, "AND"),
+            Token::Or => write!(f, "OR"),
+            Token::Not => write!(f, "NOT"),
+            Token::Term(query) => write!(f, "{:?}", query),
+        }
+    }
+}
+
+impl Word {
+    fn is_wildcard(&self) -> bool {
+        !self.quoted && self.text == "*"
+    }
+}
+
+impl<'a> Plan<'a> {
+    /// Looks up every term. Text that was never interned is not carried by any file.
+    fn new(query: &Query, index: &'a TagIndex, symbols: &Symbols) -> Plan<'a> {
+        let term = |term: Option<IndexTerm>| Plan::Term(term.and_then(|term| index.postings(term)));
+        match query {
+            Query::Simple(s) => term(symbols.get(s).map(IndexTerm::Simple)),
+            Query::KV(k, v) => term(symbols.get(k).zip(symbols.get(v)).map(|(k, v)| IndexTerm::Pair(k, v))),
+            Query::Key(k) => term(symbols.get(k).map(IndexTerm::Key)),
+            Query::Value(v) => term(symbols.get(v).map(IndexTerm::Value)),
+            Query::And(queries) => Plan::And(queries.iter().map(|q| Plan::new(q, index, symbols)).collect()),
+            Query::Or(queries) => Plan::Or(queries.iter().map(|q| Plan::new(q, index, symbols)).collect()),
+            Query::Not(query) => Plan::Not(Box::new(Plan::new(query, index, symbols))),
+        }
+    }
+
+    /// Upper bound on the number of matching files, used to order intersections. Negations are not bounded.
+    fn estimate(&self) -> usize {
+        match self {
+            Plan::Term(postings) => postings.map_or(0, |postings| postings.values().map(HashSet::len).sum()),
+            Plan::And(plans) => plans.iter().map(Plan::estimate).min().unwrap_or(usize::MAX),
+            Plan::Or(plans) => plans.iter().map(Plan::estimate).fold(0, usize::saturating_add),
+            Plan::Not(_) => usize::MAX,
+        }
+    }
+
+    fn evaluate(&self, index: &TagIndex) -> HashSet<FileRef> {
+        match self {
+            Plan::Term(None) => HashSet::new(),
+            Plan::Term(Some(postings)) => postings.iter()
+                .flat_map(|(dir_id, file_names)| file_names.iter().map(|file_name| (*dir_id, *file_name)))
+                .collect(),
+            Plan::Or(plans) => {
+                // Add the smaller results into the largest
+                let mut results: Vec<HashSet<FileRef>> = plans.iter().map(|plan| plan.evaluate(index)).collect();
+                results.sort_by_key(|files| Reverse(files.len()));
+                let mut results = results.into_iter();
+                let mut rv = results.next().unwrap_or_default();
+                results.for_each(|files| rv.extend(files));
+                rv
+            },
+            Plan::And(plans) => {
+                let (negated, mut required): (Vec<&Plan>, Vec<&Plan>) = plans.iter().partition(|plan| matches!(plan, Plan::Not(_)));
+                required.sort_by_cached_key(|plan| plan.estimate());
+                let mut rv = match required.first() {
+                    Some(plan) => plan.evaluate(index),
+                    None => Plan::all_files(index),
+                };
+                for plan in required.iter().skip(1) {
+                    if rv.is_empty() {
+                        break;
+                    }
+                    plan.retain_matching(&mut rv, index, true);
+                }
+                for plan in negated {
+                    if let Plan::Not(plan) = plan {
+                        plan.retain_matching(&mut rv, index, false);
+                    }
+                }
+                rv
+            },
+            Plan::Not(plan) => {
+                let mut rv = Plan::all_files(index);
+                plan.retain_matching(&mut rv, index, false);
+                rv
+            },
+        }
+    }
+
+    /// Keeps the files that match the plan (or, if keep is false, the files that do not). Terms are checked against their postings directly.
+    fn retain_matching(&self, files: &mut HashSet<FileRef>, index: &TagIndex, keep: bool) {
+        match self {
+            Plan::Term(None) => if keep {
+                files.clear();
+            },
+            Plan::Term(Some(postings)) => {
+                files.retain(|(dir_id, file_name)| postings.get(dir_id).is_some_and(|file_names| file_names.contains(file_name)) == keep);
+            },
+            _ => {
+                let matching = self.evaluate(index);
+                files.retain(|file| matching.contains(file) == keep);
+            },
+        }
+    }
+
+    fn all_files(index: &TagIndex) -> HashSet<FileRef> {
+        index.all_files().into_iter()
+            .flat_map(|(dir_id, file_names)| file_names.into_iter().map(move |file_name| (dir_id, file_name)))
+            .collect()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::{collections::HashMap, path::PathBuf};
+    use crate::{symbol::{SymbolTable, SymbolTag}, tag::Tag};
+
+    fn simple(s: &str) -> Query {
+        Query::Simple(s.to_string())
+    }
+
+    fn kv(k: &str, v: &str) -> Query {
+        Query::KV(k.to_string(), v.to_string())
+    }
+
+    #[test]
+    fn query_parse_precedence() {
+        assert_eq!(Query::parse("Texture:Verso AND NOT Due:Today OR Personal").unwrap(),
+            Query::Or(vec![
+                Query::And(vec![kv("Texture", "Verso"), Query::Not(Box::new(kv("Due", "Today")))]),
+                simple("Personal"),
+            ]));
+        assert_eq!(Query::parse("A (B OR C)").unwrap(), Query::And(vec![simple("A"), Query::Or(vec![simple("B"), simple("C")])]));
+        assert_eq!(Query::parse("A AND (B AND C)").unwrap(), Query::And(vec![simple("A"), simple("B"), simple("C")]));
+        assert_eq!(Query::parse("NOT NOT A").unwrap(), Query::Not(Box::new(Query::Not(Box::new(simple("A"))))));
+    }
+
+    #[test]
+    fn query_parse_terms() {
+        assert_eq!(Query::parse("Due:*").unwrap(), Query::Key("Due".to_string()));
+        assert_eq!(Query::parse("*:Today").unwrap(), Query::Value("Today".to_string()));
+        assert_eq!(Query::parse("\"Due Date\":\" Next (week) \"").unwrap(), kv("Due Date", "Next (week)"));
+        assert_eq!(Query::parse("\"AND\" \"*\":\"a\\\"b\"").unwrap(), Query::And(vec![simple("AND"), kv("*", "a\"b")]));
+        assert_eq!(Query::parse("and or").unwrap(), Query::And(vec![simple("and"), simple("or")]));
+    }
+
+    #[test]
+    fn query_parse_errors() {
+        assert_eq!(Query::parse("  "), Err(QueryError::Empty));
+        assert_eq!(Query::parse("A AND"), Err(QueryError::UnexpectedEnd));
+        assert_eq!(Query::parse("(A OR B"), Err(QueryError::UnexpectedEnd));
+        assert_eq!(Query::parse("A OR B)"), Err(QueryError::UnexpectedToken(")".to_string())));
+        assert_eq!(Query::parse("OR A"), Err(QueryError::UnexpectedToken("OR".to_string())));
+        assert_eq!(Query::parse("Due: Today"), Err(QueryError::UnexpectedToken(" ".to_string())));
+        assert_eq!(Query::parse("\"Due"), Err(QueryError::UnclosedQuote));
+        assert_eq!(Query::parse("*"), Err(QueryError::InvalidTerm("*".to_string())));
+        assert_eq!(Query::parse("*:*"), Err(QueryError::InvalidTerm("*:*".to_string())));
+        assert_eq!(Query::parse("\" \""), Err(QueryError::InvalidTerm("\" \"".to_string())));
+    }
+
+    #[test]
+    fn query_evaluate() {
+        let symbols = SymbolTable::new();
+        let mut index = TagIndex::new(PathBuf::new());
+        let files: [(&str, Vec<Tag>); 4] = [
+            ("a", vec![Tag::KV("Texture".to_string(), "Verso".to_string()), Tag::KV("Due".to_string(), "Today".to_string())]),
+            ("b", vec![Tag::KV("Texture".to_string(), "Verso".to_string())]),
+            ("c", vec![Tag::Simple("Personal".to_string()), Tag::KV("Due".to_string(), "Later".to_string())]),
+            ("d", vec![Tag::KV("Texture".to_string(), "Recto".to_string())]),
+        ];
+        for (file_name, tags) in &files {
+            let mut table = symbols.write();
+            let file_name = table.intern(file_name);
+            let tags: Vec<SymbolTag> = tags.iter().map(|tag| SymbolTag::intern(tag, &mut table)).collect();
+            index.update_file(&PathBuf::from("/root/.tag_test"), file_name, &[], &tags, &table);
+        }
+        let find = |text: &str| -> Vec<String> {
+            let result: HashMap<DirId, HashSet<Symbol>> = Query::parse(text).unwrap().evaluate(&index, &symbols.read());
+            let mut names: Vec<String> = result.values().flatten().map(|s| symbols.read().resolve(*s).to_string()).collect();
+            names.sort();
+            names
+        };
+
+        assert_eq!(find("Texture:Verso AND NOT Due:Today OR Personal"), vec!["b", "c"]);
+        assert_eq!(find("Texture:Verso Due:*"), vec!["a"]);
+        assert_eq!(find("*:Verso OR *:Later"), vec!["a", "b", "c"]);
+        assert_eq!(find("NOT Texture:*"), vec!["c"]);
+        assert_eq!(find("NOT Personal NOT Due:*"), vec!["b", "d"]);
+        assert_eq!(find("Texture:Verso AND Unknown"), Vec::<String>::new());
+        assert_eq!(find("Texture:Verso AND NOT Unknown"), vec!["a", "b"]);
+        assert_eq!(find("Verso"), Vec::<String>::new()); // A simple term does not match a value
+        assert_eq!(find("Due:Today OR (Texture:Recto AND NOT (Personal OR Due:Later))"), vec!["a", "d"]);
+
+        // Checking each file against its own tags agrees with the index
+        for text in ["Texture:Verso AND NOT Due:Today OR Personal", "*:Verso OR *:Later", "NOT Personal NOT Due:*", "Texture:Verso AND Unknown"] {
+            let filter = Query::parse(text).unwrap().filter(&symbols.read());
+            let mut table = symbols.write();
+            let matching: Vec<String> = files.iter()
+                .filter(|(_, tags)| filter.matches(&tags.iter().map(|tag| SymbolTag::intern(tag, &mut table)).collect::<Vec<SymbolTag>>()))
+                .map(|(file_name, _)| file_name.to_string())
+                .collect();
+            drop(table);
+            assert_eq!(matching, find(text));
+        }
+    }
+}
@@ -0,0 +1,134 @@
+use crate::{errors::TagFileError, index::IndexTerm, symbol::{Symbol, SymbolTag, Symbols}, tag::Tag};
+
+/// A change to the tags of every file of a workspace, for Workspace::retag
+#[derive(Debug, Clone, PartialEq)]
+pub enum Retag {
+    /// Replaces a tag by another. Files already carrying the new tag just lose the old one, so renaming a tag to an existing one merges them.
+    Rename(Tag, Tag),
+    /// Renames a key, keeping the values: Due:Today becomes Deadline:Today
+    RenameKey(String, String),
+    /// Removes a tag from every file
+    Delete(Tag),
+    /// Removes every key-value tag using a key
+    DeleteKey(String),
+}
+
+/// What Workspace::retag changed
+#[derive(Debug, Clone, Copy, Default, PartialEq, Eq)]
+pub struct RetagReport {
+    /// Files whose tags changed
+    pub files: usize,
+    /// TagFiles rewritten, once each
+    pub tagfiles: usize,
+}
+
+/// A Retag with its strings interned, applied to one tag at a time
+#[derive(Debug, Clone, Copy, PartialEq)]
+pub(crate) enum SymbolRetag {
+    Rename(SymbolTag, SymbolTag),
+    RenameKey(Symbol, Symbol),
+    Delete(SymbolTag),
+    DeleteKey(Symbol),
+}
+
+impl Retag {
+    /// Checks the tag (or key) it creates, the same way adding a tag to a file does
+    pub(crate) fn validate(&self) -> Result<(), TagFileError> {
+        let texts: Vec<&String> = match self {
+            Retag::Rename(_, Tag::Simple(s)) => vec![s],
+            Retag::Rename(_, Tag::KV(k, v)) => vec![k, v],
+            Retag::RenameKey(_, k) => vec![k],
+            Retag::Delete(_) | Retag::DeleteKey(_) => Vec::new(),
+        };
+        match texts.into_iter().find(|text| text.trim().is_empty()) {
+            Some(text) => Err(TagFileError::BadString(text.clone())),
+            None => Ok(()),
+        }
+    }
+
+    /// Interns the tag (or key) it creates, trimmed like an added tag. Returns None if what it changes was never interned, as no file can carry it.
+    pub(crate) fn intern(&self, symbols: &mut Symbols) -> Option<SymbolRetag> {
+        match self {
+            Retag::Rename(from, to) => {
+                let from = SymbolTag::get(from, symbols)?;
+                let to = match to {
+                    Tag::Simple(s) => Tag::Simple(s.trim().to_string()),
+                    Tag::KV(k, v) => Tag::KV(k.trim().to_string(), v.trim().to_string()),
+                };
+                Some(SymbolRetag::Rename(from, SymbolTag::intern(&to, symbols)))
+            },
+            Retag::RenameKey(from, to) => Some(SymbolRetag::RenameKey(symbols.get(from)?, symbols.intern(to.trim()))),
+            Retag::Delete(tag) => Some(SymbolRetag::Delete(SymbolTag::get(tag, symbols)?)),
+            Retag::DeleteKey(key) => Some(SymbolRetag::DeleteKey(symbols.get(key)?)),
+        }
+    }
+}
+
+impl SymbolRetag {
+    /// The index term of the files it may change
+    pub(crate) fn term(&self) -> IndexTerm {
+        match self {
+            SymbolRetag::Rename(tag, _) | SymbolRetag::Delete(tag) => match tag {
+                SymbolTag::Simple(s) => IndexTerm::Simple(*s),
+                SymbolTag::KV(k, v) => IndexTerm::Pair(*k, *v),
+            },
+            SymbolRetag::RenameKey(key, _) | SymbolRetag::DeleteKey(key) => IndexTerm::Key(*key),
+        }
+    }
+
+    /// Applies every rule in order to a file's tags, each to the tags left by the previous ones. Tags made equal by a rename are kept once, in their first place.
+    pub(crate) fn apply_all(rules: &[SymbolRetag], tags: &[SymbolTag]) -> Vec<SymbolTag> {
+        let mut rv: Vec<SymbolTag> = Vec::with_capacity(tags.len());
+        for tag in tags {
+            let Some(tag) = rules.iter().try_fold(*tag, |tag, rule| rule.apply(tag)) else {
+                continue;
+            };
+            if !rv.contains(&tag) {
+                rv.push(tag);
+            }
+        }
+        rv
+    }
+}
+
+// Private / Helper Functions
+impl SymbolRetag {
+    /// Returns the tag changed by the rule, or None if the rule deletes it
+    fn apply(&self, tag: SymbolTag) -> Option<SymbolTag> {
+        match (self, tag) {
+            (SymbolRetag::Rename(from, to), tag) if tag == *from => Some(*to),
+            (SymbolRetag::RenameKey(from, to), SymbolTag::KV(k, v)) if k == *from => Some(SymbolTag::KV(*to, v)),
+            (SymbolRetag::Delete(deleted), tag) if tag == *deleted => None,
+            (SymbolRetag::DeleteKey(key), SymbolTag::KV(k, _)) if k == *key => None,
+            (_, tag) => Some(tag),
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn retag_apply_all() {
+        let mut symbols = Symbols::default();
+        let [due, deadline, today, draft, wip, done] = ["Due", "Deadline", "Today", "Draft", "WIP", "Done"].map(|s| symbols.intern(s));
+        let tags = [SymbolTag::KV(due, today), SymbolTag::Simple(draft), SymbolTag::Simple(wip), SymbolTag::Simple(done)];
+
+        let rules = [SymbolRetag::RenameKey(due, deadline), SymbolRetag::Rename(SymbolTag::Simple(draft), SymbolTag::Simple(wip))];
+        assert_eq!(SymbolRetag::apply_all(&rules, &tags), vec![SymbolTag::KV(deadline, today), SymbolTag::Simple(wip), SymbolTag::Simple(done)]);
+        let rules = [SymbolRetag::DeleteKey(due), SymbolRetag::Delete(SymbolTag::Simple(done))];
+        assert_eq!(SymbolRetag::apply_all(&rules, &tags), vec![SymbolTag::Simple(draft), SymbolTag::Simple(wip)]);
+        // Rules apply in order, to the result of the previous ones
+        let rules = [SymbolRetag::Rename(SymbolTag::Simple(draft), SymbolTag::Simple(wip)), SymbolRetag::Delete(SymbolTag::Simple(wip))];
+        assert_eq!(SymbolRetag::apply_all(&rules, &tags), vec![SymbolTag::KV(due, today), SymbolTag::Simple(done)]);
+        assert_eq!(SymbolRetag::apply_all(&[], &tags), tags.to_vec());
+
+        assert!(Retag::Rename(Tag::Simple("Draft".to_string()), Tag::KV("Status".to_string(), " ".to_string())).validate().is_err());
+        assert!(Retag::RenameKey("Due".to_string(), "".to_string()).validate().is_err());
+        assert!(Retag::Delete(Tag::Simple("".to_string())).validate().is_ok());
+        // Strings never interned match nothing
+        assert_eq!(Retag::Delete(Tag::Simple("Unknown".to_string())).intern(&mut symbols), None);
+        assert_eq!(Retag::RenameKey("Due".to_string(), " Deadline ".to_string()).intern(&mut symbols), Some(SymbolRetag::RenameKey(due, deadline)));
+    }
+}
@@ -0,0 +1,306 @@
+use std::{
+    collections::{HashMap, HashSet}, fs, path::{Path, PathBuf}, sync::{Arc, Condvar, Mutex}, thread
+};
+
+use crate::{fingerprint::Fingerprint, profile::{self, Counter}, snapshot::FileStamp, symbol::SymbolTable, tagfile::TagFile};
+
+/// A TagFile loaded by a walk
+pub struct FoundTagFile {
+    /// Cannonical path to the TagFile
+    pub path: PathBuf,
+    pub tagfile: TagFile,
+    /// Stamp of the TagFile taken before reading it, if stamps were recorded
+    pub stamp: Option<FileStamp>,
+}
+
+#[derive(Default)]
+pub struct WalkResult {
+    pub tagfiles: Vec<FoundTagFile>,
+    /// Every directory walked, with its stamp taken before listing it. Empty unless stamps were recorded.
+    pub dirs: Vec<(PathBuf, FileStamp)>,
+}
+
+/// Walks the directory tree below (and including) root_folder and loads every TagFile named tagfile_name.
+/// Returns each TagFile with its cannonical path, with its strings interned in symbols. TagFiles that cannot be loaded are skipped.
+/// With more than one thread, directories are listed and TagFiles parsed on a pool of worker threads. Results are the same either way, only their order differs.
+pub fn find_tagfiles(root_folder: &Path, tagfile_name: &str, threads: usize, symbols: &Arc<SymbolTable>) -> Vec<(PathBuf, TagFile)> {
+    walk(root_folder, tagfile_name, threads, false, symbols).tagfiles.into_iter()
+        .map(|found| (found.path, found.tagfile))
+        .collect()
+}
+
+/// Same as find_tagfiles, but can also record stamps of every directory and TagFile, so that later changes can be detected (see the snapshot module)
+pub fn walk(root_folder: &Path, tagfile_name: &str, threads: usize, record_stamps: bool, symbols: &Arc<SymbolTable>) -> WalkResult {
+    if threads <= 1 {
+        walk_serial(root_folder, tagfile_name, record_stamps, symbols)
+    } else {
+        walk_parallel(root_folder, tagfile_name, threads, record_stamps, symbols)
+    }
+}
+
+/// Resolves a thread count setting, where 0 means one thread per available core
+pub fn resolve_thread_count(threads: usize) -> usize {
+    if threads == 0 {
+        thread::available_parallelism().map(|n| n.get()).unwrap_or(1)
+    } else {
+        threads
+    }
+}
+
+fn walk_serial(root_folder: &Path, tagfile_name: &str, record_stamps: bool, symbols: &Arc<SymbolTable>) -> WalkResult {
+    use walkdir::WalkDir;
+    let mut rv = WalkResult::default();
+    for entry in WalkDir::new(root_folder).into_iter().filter_map(|e| e.ok()) { //Ignores un-owned files
+        // Only directories (or links to them) can hold a TagFile
+        if entry.file_type().is_file() {
+            continue;
+        }
+        profile::count(Counter::DirsListed, 1);
+        if record_stamps && entry.file_type().is_dir() {
+            // Directory entries are yielded before their contents are read
+            if let Some(stamp) = FileStamp::of(entry.path()) {
+                rv.dirs.push((entry.path().to_path_buf(), stamp));
+            }
+        }
+        let full_path = entry.path().join(tagfile_name);
+        if full_path.exists() {
+            if let Some(found) = load_tagfile(full_path, record_stamps, symbols) {
+                rv.tagfiles.push(found);
+            }
+        }
+    }
+    rv
+}
+
+/// Directories still to be listed, plus how many are being listed right now. The walk is done when both are empty.
+struct WorkQueue {
+    state: Mutex<(Vec<PathBuf>, usize)>,
+    changed: Condvar,
+}
+
+impl WorkQueue {
+    /// Blocks until a directory is available, or returns None once every directory has been listed
+    fn pop(&self) -> Option<PathBuf> {
+        let mut state = self.state.lock().unwrap();
+        loop {
+            if let Some(dir) = state.0.pop() {
+                state.1 += 1;
+                return Some(dir);
+            }
+            if state.1 == 0 {
+                return None;
+            }
+            state = self.changed.wait(state).unwrap();
+        }
+    }
+
+    /// Queues the subdirectories found while listing a directory, and marks that directory as done
+    fn finish(&self, sub_dirs: Vec<PathBuf>) {
+        let mut state = self.state.lock().unwrap();
+        state.0.extend(sub_dirs);
+        state.1 -= 1;
+        self.changed.notify_all();
+    }
+}
+
+fn walk_parallel(root_folder: &Path, tagfile_name: &str, threads: usize, record_stamps: bool, symbols: &Arc<SymbolTable>) -> WalkResult {
+    let queue = WorkQueue {
+        state: Mutex::new((vec![root_folder.to_path_buf()], 0)),
+        changed: Condvar::new(),
+    };
+    let results: Mutex<WalkResult> = Mutex::new(WalkResult::default());
+
+    thread::scope(|scope| {
+        for _ in 0..threads {
+            scope.spawn(|| {
+                let mut found = WalkResult::default();
+                while let Some(dir) = queue.pop() {
+                    if record_stamps {
+                        if let Some(stamp) = FileStamp::of(&dir) {
+                            found.dirs.push((dir.clone(), stamp));
+                        }
+                    }
+                    let (sub_dirs, tagfiles) = list_directory(&dir, tagfile_name);
+                    queue.finish(sub_dirs);
+                    found.tagfiles.extend(tagfiles.into_iter().filter_map(|path| load_tagfile(path, record_stamps, symbols)));
+                }
+                let mut results = results.lock().unwrap();
+                results.tagfiles.append(&mut found.tagfiles);
+                results.dirs.append(&mut found.dirs);
+            });
+        }
+    });
+
+    results.into_inner().unwrap()
+}
+
+/// Lists one directory, returning the subdirectories to descend into and the paths of TagFiles to load.
+/// Follows the same rules as the serial walk: symbolic links are probed for a TagFile but not descended into.
+pub fn list_directory(dir: &Path, tagfile_name: &str) -> (Vec<PathBuf>, Vec<PathBuf>) {
+    let mut sub_dirs = Vec::new();
+    let mut tagfiles = Vec::new();
+    profile::count(Counter::DirsListed, 1);
+
+    let Ok(entries) = fs::read_dir(dir) else {
+        // Cannot list the directory (such as without read permission), but it may still hold a TagFile
+        let full_path = dir.join(tagfile_name);
+        if full_path.exists() {
+            tagfiles.push(full_path);
+        }
+        return (sub_dirs, tagfiles);
+    };
+
+    for entry in entries.filter_map(|e| e.ok()) {
+        let Ok(file_type) = entry.file_type() else {
+            continue;
+        };
+        if file_type.is_dir() {
+            sub_dirs.push(entry.path());
+        } else if file_type.is_symlink() {
+            let full_path = entry.path().join(tagfile_name);
+            if full_path.exists() {
+                tagfiles.push(full_path);
+            }
+        }
+        if entry.file_name() == tagfile_name {
+            tagfiles.push(entry.path());
+        }
+    }
+    (sub_dirs, tagfiles)
+}
+
+/// Walks the tree below root_folder and returns the regular files matching any of the wanted fingerprints, on the given number of threads.
+/// Directory listings already give each entry's inode, so only the files with a wanted inode are stat'ed. Symbolic links are not followed.
+pub fn find_fingerprints(root_folder: &Path, wanted: &HashSet<Fingerprint>, threads: usize) -> HashMap<Fingerprint, Vec<PathBuf>> {
+    let wanted_inodes: HashSet<u64> = wanted.iter().map(|fingerprint| fingerprint.inode).collect();
+    let queue = WorkQueue {
+        state: Mutex::new((vec![root_folder.to_path_buf()], 0)),
+        changed: Condvar::new(),
+    };
+    let results: Mutex<HashMap<Fingerprint, Vec<PathBuf>>> = Mutex::new(HashMap::new());
+
+    thread::scope(|scope| {
+        for _ in 0..threads.max(1) {
+            scope.spawn(|| {
+                let mut found: Vec<(Fingerprint, PathBuf)> = Vec::new();
+                while let Some(dir) = queue.pop() {
+                    let mut sub_dirs = Vec::new();
+                    for entry in fs::read_dir(&dir).into_iter().flatten().filter_map(|e| e.ok()) {
+                        let Ok(file_type) = entry.file_type() else {
+                            continue;
+                        };
+                        if file_type.is_dir() {
+                            sub_dirs.push(entry.path());
+                        } else if file_type.is_file() && entry_inode(&entry).is_none_or(|inode| wanted_inodes.contains(&inode)) {
+                            let Some(fingerprint) = entry.metadata().ok().and_then(|metadata| Fingerprint::from_metadata(&metadata)) else {
+                                continue;
+                            };
+                            if wanted.contains(&fingerprint) {
+                                found.push((fingerprint, entry.path()));
+                            }
+                        }
+                    }
+                    queue.finish(sub_dirs);
+                }
+                let mut results = results.lock().unwrap();
+                for (fingerprint, path) in found {
+                    results.entry(fingerprint).or_default().push(path);
+                }
+            });
+        }
+    });
+
+    results.into_inner().unwrap()
+}
+
+/// Returns the regular files below base_dir whose path relative to it matches a glob pattern, such as `assets/**/*.png`, sorted.
+/// `*` and `?` stay within a path component, `**` spans any number of them. Only the directories below the pattern's literal leading components are walked.
+/// Files named in excluded (such as TagFiles) are never returned.
+pub fn find_matching_files(base_dir: &Path, pattern: &str, excluded: &[String]) -> Result<Vec<PathBuf>, globset::Error> {
+    use walkdir::WalkDir;
+    let matcher = globset::GlobBuilder::new(pattern).literal_separator(true).build()?.compile_matcher();
+    let literal_prefix: PathBuf = Path::new(pattern).components()
+        .take_while(|component| !component.as_os_str().to_string_lossy().contains(['*', '?', '[', '{', '\\']))
+        .collect();
+    let start = base_dir.join(literal_prefix);
+
+    let mut rv: Vec<PathBuf> = Vec::new();
+    for entry in WalkDir::new(&start).into_iter().filter_map(|e| e.ok()) {
+        if !entry.file_type().is_file() || excluded.iter().any(|name| entry.file_name() == name.as_str()) {
+            continue;
+        }
+        let Ok(relative_path) = entry.path().strip_prefix(base_dir) else {
+            continue;
+        };
+        if matcher.is_match(relative_path) {
+            rv.push(entry.into_path());
+        }
+    }
+    rv.sort();
+    Ok(rv)
+}
+
+/// Returns the inode of a directory entry without a stat, where the platform provides it
+#[cfg(unix)]
+fn entry_inode(entry: &fs::DirEntry) -> Option<u64> {
+    use std::os::unix::fs::DirEntryExt;
+    Some(entry.ino())
+}
+
+#[cfg(not(unix))]
+fn entry_inode(_entry: &fs::DirEntry) -> Option<u64> {
+    None
+}
+
+/// Loads a TagFile, keyed by its cannonical path, interning its strings in symbols
+pub fn load_tagfile(full_path: PathBuf, record_stamp: bool, symbols: &Arc<SymbolTable>) -> Option<FoundTagFile> {
+    let stamp = if record_stamp { Some(FileStamp::of(&full_path)?) } else { None };
+    //REVIEW - If tag path is IN all_tagfiles hashmap, remove from hasmap and re-serialize it?
+    let tagfile: TagFile = TagFile::from_file_in_dir(full_path.as_path(), symbols).ok()?; //Cannot create TagFile = Skip
+    Some(FoundTagFile { path: profile::canonicalize(&full_path).unwrap_or(full_path), tagfile, stamp })
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::collections::HashMap;
+
+    #[test]
+    fn find_tagfiles_parallel_matches_serial() {
+        use tempdir::TempDir;
+        let root_dir = TempDir::new("test").unwrap();
+        let root = root_dir.path().canonicalize().unwrap();
+
+        std::fs::write(root.join(".tag_test"), "[mapping]\nfile1 = [\"TODO\"]\n").unwrap();
+        std::fs::write(root.join("file1"), "").unwrap();
+        for dir in ["a", "a/b", "a/b/c", "d", "e"] {
+            std::fs::create_dir(root.join(dir)).unwrap();
+            std::fs::write(root.join(dir).join("some_file"), "").unwrap();
+        }
+        std::fs::write(root.join("a/b/.tag_test"), "[mapping]\nx = [[\"Due\", \"Today\"]]\n").unwrap();
+        std::fs::write(root.join("a/b/c/.tag_test"), "[mapping]\ny = [\"A\", \"B\"]\n").unwrap();
+        std::fs::write(root.join("d/.tag_test"), "not valid toml [[").unwrap();
+        std::fs::write(root.join("e/.tag_other"), "[mapping]\nz = [\"C\"]\n").unwrap();
+        #[cfg(unix)]
+        std::os::unix::fs::symlink(root.join("a/b"), root.join("link_to_b")).unwrap();
+
+        let to_map = |found: Vec<(PathBuf, TagFile)>| -> HashMap<PathBuf, HashMap<String, Vec<crate::tag::Tag>>> {
+            found.into_iter().map(|(path, tf)| (path, tf.get_mapping())).collect()
+        };
+        let symbols = SymbolTable::new();
+        let serial = to_map(find_tagfiles(&root, ".tag_test", 1, &symbols));
+        assert_eq!(serial.len(), 3);
+        assert!(serial.contains_key(&root.join("a/b/c/.tag_test")));
+        for threads in [2, 4, 16] {
+            assert_eq!(to_map(find_tagfiles(&root, ".tag_test", threads, &symbols)), serial);
+        }
+
+        for threads in [1, 4] {
+            let result = walk(&root, ".tag_test", threads, true, &symbols);
+            let mut dirs: Vec<PathBuf> = result.dirs.into_iter().map(|(dir, _)| dir).collect();
+            dirs.sort();
+            assert_eq!(dirs, ["", "a", "a/b", "a/b/c", "d", "e"].map(|dir| root.join(dir)).to_vec());
+            assert!(result.tagfiles.iter().all(|found| found.stamp.is_some()));
+        }
+    }
+}
@@ -0,0 +1,426 @@
+use std::{
+    collections::HashMap, fs, path::{Path, PathBuf}, sync::Arc, thread, time::{Duration, SystemTime, UNIX_EPOCH}
+};
+
+use crate::{
+    codec::{ByteReader, ByteWriter}, errors::TagFileError, fingerprint::Fingerprint, persist::{self, Durability}, profile::{self, Counter, Phase}, scan::{self, WalkResult}, symbol::{SymbolTable, SymbolTag}, tagfile::{TagFile, TagFileFormat}
+};
+
+const MAGIC: &[u8; 8] = b"TAGSNAP\0";
+const VERSION: u32 = 3;
+
+/// Files modified this close to (or after) the time a snapshot was taken may have changed again without their stamp changing,
+/// on file systems with coarse timestamps. They are always checked again.
+const RACY_WINDOW: Duration = Duration::from_secs(2);
+
+/// Modification time and size of a file or directory, used to tell whether it changed since it was last read
+#[derive(Debug, Clone, Copy, PartialEq, Eq)]
+pub struct FileStamp {
+    mtime: Duration,
+    size: u64,
+}
+
+impl FileStamp {
+    /// Stats a path, following symbolic links. Returns None if the path cannot be stat'ed.
+    pub fn of(path: &Path) -> Option<FileStamp> {
+        let metadata = fs::metadata(path).ok()?;
+        let mtime = metadata.modified().ok()?.duration_since(UNIX_EPOCH).unwrap_or_default();
+        Some(FileStamp { mtime, size: metadata.len() })
+    }
+}
+
+/// Every TagFile of a workspace as of a given time, with the stamps needed to bring it up to date later.
+/// Saved next to the workspace file so that opening a workspace only re-reads the TagFiles (and re-lists the directories) that changed.
+#[derive(Debug)]
+pub struct Snapshot {
+    pub root_folder: PathBuf,
+    /// When the walk that produced this snapshot started
+    taken_at: Duration,
+    /// Every directory walked, with its stamp
+    dirs: HashMap<PathBuf, FileStamp>,
+    /// Every TagFile loaded, keyed by its cannonical path
+    tagfiles: HashMap<PathBuf, (FileStamp, TagFile)>,
+    /// Holds the strings of the TagFiles
+    symbols: Arc<SymbolTable>,
+}
+
+impl Snapshot {
+    /// Walks the whole tree below root_folder, like a full scan, recording stamps along the way. Strings are interned in symbols.
+    pub fn take(root_folder: &Path, tagfile_name: &str, threads: usize, symbols: &Arc<SymbolTable>) -> Snapshot {
+        let mut snapshot = Snapshot {
+            root_folder: root_folder.to_path_buf(),
+            taken_at: Snapshot::now(),
+            dirs: HashMap::new(),
+            tagfiles: HashMap::new(),
+            symbols: symbols.clone(),
+        };
+        snapshot.merge_walk(scan::walk(root_folder, tagfile_name, threads, true, symbols));
+        snapshot
+    }
+
+    /// Brings the snapshot up to date with the file system. TagFiles are re-read if their stamp changed, and directories are re-listed
+    /// if their stamp changed, which finds TagFiles and subdirectories created since. Returns whether the snapshot should be saved again.
+    pub fn refresh(&mut self, tagfile_name: &str, threads: usize) -> bool {
+        let previous_taken_at = self.taken_at;
+        self.taken_at = Snapshot::now();
+        let mut changed = false;
+
+        // TagFiles
+        let tagfile_paths: Vec<PathBuf> = self.tagfiles.keys().cloned().collect();
+        for (path, stamp) in Snapshot::stat_all(tagfile_paths, threads) {
+            let Some(stamp) = stamp else {
+                self.tagfiles.remove(&path);
+                changed = true;
+                continue;
+            };
+            let old_stamp = self.tagfiles[&path].0;
+            if stamp == old_stamp && !Snapshot::is_racy(stamp, previous_taken_at) {
+                continue;
+            }
+            changed = true;
+            match scan::load_tagfile(path.clone(), true, &self.symbols) {
+                Some(found) => { self.tagfiles.insert(path, (found.stamp.unwrap(), found.tagfile)); },
+                None => { self.tagfiles.remove(&path); },
+            }
+        }
+
+        // Directories
+        let dir_paths: Vec<PathBuf> = self.dirs.keys().cloned().collect();
+        let mut new_dirs: Vec<PathBuf> = Vec::new();
+        for (dir, stamp) in Snapshot::stat_all(dir_paths, threads) {
+            let Some(stamp) = stamp else {
+                self.dirs.remove(&dir);
+                changed = true;
+                continue;
+            };
+            if stamp == self.dirs[&dir] && !Snapshot::is_racy(stamp, previous_taken_at) {
+                continue;
+            }
+            // The new stamp alone does not make the snapshot worth saving: saving it changes the stamp of the root folder, which would then be re-saved on every open
+            self.dirs.insert(dir.clone(), stamp);
+
+            let (sub_dirs, tagfile_paths) = scan::list_directory(&dir, tagfile_name);
+            for path in tagfile_paths {
+                if self.tagfiles.contains_key(&profile::canonicalize(&path).unwrap_or(path.clone())) {
+                    continue;
+                }
+                if let Some(found) = scan::load_tagfile(path, true, &self.symbols) {
+                    self.tagfiles.insert(found.path, (found.stamp.unwrap(), found.tagfile));
+                    changed = true;
+                }
+            }
+            let sub_dirs_before = new_dirs.len();
+            new_dirs.extend(sub_dirs.into_iter().filter(|sub_dir| !self.dirs.contains_key(sub_dir)));
+            changed |= new_dirs.len() > sub_dirs_before;
+        }
+
+        // Subdirectories that did not exist before are walked in full
+        for dir in new_dirs {
+            let walked = scan::walk(&dir, tagfile_name, threads, true, &self.symbols);
+            self.merge_walk(walked);
+        }
+        changed
+    }
+
+    /// Moves the TagFiles out of the snapshot, keyed by their cannonical path
+    pub fn into_tagfiles(self) -> impl Iterator<Item = (PathBuf, TagFile)> {
+        self.tagfiles.into_iter().map(|(path, (_stamp, tf))| (path, tf))
+    }
+
+    /// Reads a snapshot from disk, interning its strings in symbols. Fails with TagFileError::Serialize if the file is corrupt or was written by another version.
+    pub fn load(path_to_snapshot: &Path, symbols: &Arc<SymbolTable>) -> Result<Snapshot, TagFileError> {
+        let bytes = fs::read(path_to_snapshot).map_err(TagFileError::Io)?;
+        let _span = profile::span(Phase::Parse);
+        profile::count(Counter::BytesParsed, bytes.len() as u64);
+        Snapshot::decode(&bytes, symbols)
+    }
+
+    /// Writes the snapshot to disk. The file is replaced atomically, so a crash never leaves a half-written snapshot behind.
+    pub fn save(&self, path_to_snapshot: &Path) -> Result<(), TagFileError> {
+        let _span = profile::span(Phase::Save);
+        let bytes = self.encode()?;
+        profile::count(Counter::BytesSaved, bytes.len() as u64);
+        persist::write_atomic(path_to_snapshot, &bytes, Durability::None).map_err(TagFileError::Io)
+    }
+}
+
+// Private / Helper Functions
+impl Snapshot {
+    fn now() -> Duration {
+        SystemTime::now().duration_since(UNIX_EPOCH).unwrap_or_default()
+    }
+
+    fn is_racy(stamp: FileStamp, taken_at: Duration) -> bool {
+        stamp.mtime + RACY_WINDOW >= taken_at
+    }
+
+    fn merge_walk(&mut self, walked: WalkResult) {
+        self.dirs.extend(walked.dirs);
+        for found in walked.tagfiles {
+            self.tagfiles.entry(found.path).or_insert((found.stamp.unwrap(), found.tagfile));
+        }
+    }
+
+    /// Stats every path, spreading the work over the given number of threads
+    fn stat_all(paths: Vec<PathBuf>, threads: usize) -> Vec<(PathBuf, Option<FileStamp>)> {
+        let stat_chunk = |chunk: &[PathBuf]| -> Vec<(PathBuf, Option<FileStamp>)> {
+            chunk.iter().map(|path| (path.clone(), FileStamp::of(path))).collect()
+        };
+        if threads <= 1 || paths.len() < 2 * threads {
+            return stat_chunk(&paths);
+        }
+        let chunk_size = paths.len().div_ceil(threads);
+        thread::scope(|scope| {
+            let handles: Vec<_> = paths.chunks(chunk_size).map(|chunk| scope.spawn(move || stat_chunk(chunk))).collect();
+            handles.into_iter().flat_map(|handle| handle.join().unwrap()).collect()
+        })
+    }
+
+    fn encode(&self) -> Result<Vec<u8>, TagFileError> {
+        let mut writer = ByteWriter::new();
+        writer.write_bytes(MAGIC);
+        writer.write_u32(VERSION);
+        writer.write_str(Snapshot::path_str(&self.root_folder)?);
+        Snapshot::write_duration(&mut writer, self.taken_at);
+
+        writer.write_varint(self.dirs.len() as u64);
+        for (dir, stamp) in &self.dirs {
+            writer.write_str(Snapshot::path_str(dir)?);
+            Snapshot::write_stamp(&mut writer, *stamp);
+        }
+
+        let symbols = self.symbols.read();
+        writer.write_varint(self.tagfiles.len() as u64);
+        for (path, (stamp, tf)) in &self.tagfiles {
+            writer.write_str(Snapshot::path_str(path)?);
+            Snapshot::write_stamp(&mut writer, *stamp);
+            writer.write_u8(match tf.format {
+                TagFileFormat::Toml => 0,
+                TagFileFormat::Binary => 1,
+            });
+            writer.write_varint(tf.mapping.len() as u64);
+            for (file_name, tags) in &tf.mapping {
+                writer.write_str(symbols.resolve(*file_name));
+                writer.write_varint(tags.len() as u64);
+                for tag in tags {
+                    match tag {
+                        SymbolTag::Simple(s) => {
+                            writer.write_u8(0);
+                            writer.write_str(symbols.resolve(*s));
+                        },
+                        SymbolTag::KV(k, v) => {
+                            writer.write_u8(1);
+                            writer.write_str(symbols.resolve(*k));
+                            writer.write_str(symbols.resolve(*v));
+                        }
+                    }
+                }
+                match tf.fingerprints.get(file_name) {
+                    Some(fingerprint) => {
+                        writer.write_u8(1);
+                        writer.write_u64(fingerprint.inode);
+                        writer.write_u64(fingerprint.size);
+                    },
+                    None => writer.write_u8(0),
+                }
+            }
+        }
+        Ok(writer.into_bytes())
+    }
+
+    fn decode(bytes: &[u8], symbols: &Arc<SymbolTable>) -> Result<Snapshot, TagFileError> {
+        let mut reader = ByteReader::new(bytes);
+        if reader.read_bytes(MAGIC.len())? != MAGIC {
+            return Err(TagFileError::Serialize("Not a workspace snapshot".to_string()));
+        }
+        if reader.read_u32()? != VERSION {
+            return Err(TagFileError::Serialize("Unsupported snapshot version".to_string()));
+        }
+        let root_folder = PathBuf::from(reader.read_str()?);
+        let taken_at = Snapshot::read_duration(&mut reader)?;
+
+        let num_dirs = reader.read_len()?;
+        let mut dirs = HashMap::with_capacity(num_dirs);
+        for _ in 0..num_dirs {
+            let dir = PathBuf::from(reader.read_str()?);
+            dirs.insert(dir, Snapshot::read_stamp(&mut reader)?);
+        }
+
+        let mut table = symbols.write();
+        let num_tagfiles = reader.read_len()?;
+        let mut tagfiles = HashMap::with_capacity(num_tagfiles);
+        for _ in 0..num_tagfiles {
+            let path = PathBuf::from(reader.read_str()?);
+            let stamp = Snapshot::read_stamp(&mut reader)?;
+            let format = match reader.read_u8()? {
+                0 => TagFileFormat::Toml,
+                1 => TagFileFormat::Binary,
+                _ => return Err(TagFileError::Serialize("Unknown TagFile format".to_string())),
+            };
+            let num_files = reader.read_len()?;
+            let mut mapping = HashMap::with_capacity(num_files);
+            let mut fingerprints = HashMap::new();
+            for _ in 0..num_files {
+                let file_name = table.intern(reader.read_str()?);
+                let num_tags = reader.read_len()?;
+                let mut tags = Vec::with_capacity(num_tags);
+                for _ in 0..num_tags {
+                    let tag = match reader.read_u8()? {
+                        0 => SymbolTag::Simple(table.intern(reader.read_str()?)),
+                        1 => SymbolTag::KV(table.intern(reader.read_str()?), table.intern(reader.read_str()?)),
+                        _ => return Err(TagFileError::Serialize("Unknown tag kind".to_string())),
+                    };
+                    tags.push(tag);
+                }
+                mapping.insert(file_name, tags);
+                match reader.read_u8()? {
+                    0 => (),
+                    1 => {
+                        fingerprints.insert(file_name, Fingerprint { inode: reader.read_u64()?, size: reader.read_u64()? });
+                    },
+                    _ => return Err(TagFileError::Serialize("Unknown fingerprint kind".to_string())),
+                }
+            }
+            let mut tf = TagFile::from_interned(path.clone(), format, mapping, symbols);
+            tf.fingerprints = fingerprints;
+            tagfiles.insert(path, (stamp, tf));
+        }
+
+        if !reader.is_at_end() {
+            return Err(TagFileError::Serialize("Trailing data in snapshot".to_string()));
+        }
+        drop(table);
+        Ok(Snapshot { root_folder, taken_at, dirs, tagfiles, symbols: symbols.clone() })
+    }
+
+    fn path_str(path: &Path) -> Result<&str, TagFileError> {
+        path.to_str().ok_or(TagFileError::BadPath(format!("Path is not valid UTF-8: {}", path.to_string_lossy())))
+    }
+
+    fn write_duration(writer: &mut ByteWriter, duration: Duration) {
+        writer.write_u64(duration.as_secs());
+        writer.write_u32(duration.subsec_nanos());
+    }
+
+    fn read_duration(reader: &mut ByteReader) -> Result<Duration, TagFileError> {
+        let secs = reader.read_u64()?;
+        let nanos = reader.read_u32()?;
+        if nanos >= 1_000_000_000 {
+            return Err(TagFileError::Serialize("Invalid timestamp".to_string()));
+        }
+        Ok(Duration::new(secs, nanos))
+    }
+
+    fn write_stamp(writer: &mut ByteWriter, stamp: FileStamp) {
+        Snapshot::write_duration(writer, stamp.mtime);
+        writer.write_u64(stamp.size);
+    }
+
+    fn read_stamp(reader: &mut ByteReader) -> Result<FileStamp, TagFileError> {
+        let mtime = Snapshot::read_duration(reader)?;
+        Ok(FileStamp { mtime, size: reader.read_u64()? })
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use std::fs::File;
+    use tempdir::TempDir;
+    use crate::tag::Tag;
+
+    /// Moves a file's modification time into the past, so that it is not re-checked as racy
+    fn backdate(path: &Path) {
+        let an_hour_ago = SystemTime::now() - Duration::from_secs(3600);
+        File::open(path).unwrap().set_modified(an_hour_ago).unwrap();
+    }
+
+    fn mappings(snapshot: &Snapshot) -> HashMap<PathBuf, HashMap<String, Vec<Tag>>> {
+        snapshot.tagfiles.iter().map(|(path, (_, tf))| (path.clone(), tf.get_mapping())).collect()
+    }
+
+    fn make_tree() -> (TempDir, PathBuf) {
+        let root_dir = TempDir::new("test").unwrap();
+        let root = root_dir.path().canonicalize().unwrap();
+        std::fs::create_dir_all(root.join("a/b")).unwrap();
+        std::fs::create_dir(root.join("c")).unwrap();
+        std::fs::write(root.join(".tag_test"), "[mapping]\nfile1 = [\"TODO\"]\n").unwrap();
+        std::fs::write(root.join("a/b/.tag_test"), "[mapping]\nx = [[\"Due\", \"Today\"], \"A\"]\n").unwrap();
+        for path in [".tag_test", "a/b/.tag_test", "a/b", "a", "c", ""] {
+            backdate(&root.join(path));
+        }
+        (root_dir, root)
+    }
+
+    #[test]
+    fn snapshot_encode_decode() {
+        let (_root_dir, root) = make_tree();
+        let mut snapshot = Snapshot::take(&root, ".tag_test", 1, &SymbolTable::new());
+        assert_eq!(snapshot.tagfiles.len(), 2);
+        assert_eq!(snapshot.dirs.len(), 4);
+        snapshot.tagfiles.get_mut(&root.join(".tag_test")).unwrap().1.format = TagFileFormat::Binary;
+
+        let path = root.join(".tagsnap_test");
+        snapshot.save(&path).unwrap();
+        let loaded = Snapshot::load(&path, &SymbolTable::new()).unwrap();
+        assert_eq!(loaded.root_folder, root);
+        assert_eq!(loaded.taken_at, snapshot.taken_at);
+        assert_eq!(loaded.dirs, snapshot.dirs);
+        assert_eq!(mappings(&loaded), mappings(&snapshot));
+        assert!(loaded.tagfiles.iter().all(|(path, (stamp, tf))| *stamp == snapshot.tagfiles[path].0 && tf.full_path_to_tagfile == *path));
+        assert!(loaded.tagfiles.iter().all(|(path, (_, tf))| tf.format == snapshot.tagfiles[path].1.format));
+
+        // Corrupt, truncated or foreign data is rejected
+        let bytes = std::fs::read(&path).unwrap();
+        assert!(Snapshot::decode(&bytes[..bytes.len() - 1], &SymbolTable::new()).is_err());
+        assert!(Snapshot::decode(b"[mapping]\n", &SymbolTable::new()).is_err());
+        let mut wrong_version = bytes.clone();
+        wrong_version[MAGIC.len()] += 1;
+        assert!(Snapshot::decode(&wrong_version, &SymbolTable::new()).is_err());
+        assert!(Snapshot::load(&root.join("does_not_exist"), &SymbolTable::new()).is_err());
+    }
+
+    #[test]
+    fn snapshot_refresh_unchanged() {
+        let (_root_dir, root) = make_tree();
+        let mut snapshot = Snapshot::take(&root, ".tag_test", 1, &SymbolTable::new());
+        let before = mappings(&snapshot);
+        assert!(!snapshot.refresh(".tag_test", 1));
+        assert_eq!(mappings(&snapshot), before);
+
+        // Saving the snapshot in the root folder changes its stamp, which alone must not ask for another save
+        let path = root.join(".tagsnap_test");
+        snapshot.save(&path).unwrap();
+        for _ in 0..2 {
+            let mut loaded = Snapshot::load(&path, &SymbolTable::new()).unwrap();
+            assert!(!loaded.refresh(".tag_test", 1));
+            assert_eq!(mappings(&loaded), before);
+        }
+    }
+
+    #[test]
+    fn snapshot_refresh_detects_changes() {
+        let (_root_dir, root) = make_tree();
+        let mut snapshot = Snapshot::take(&root, ".tag_test", 1, &SymbolTable::new());
+
+        // Modified, deleted and new TagFiles, plus a TagFile in a new subdirectory
+        std::fs::write(root.join("a/b/.tag_test"), "[mapping]\nx = [\"B\"]\n").unwrap();
+        std::fs::remove_file(root.join(".tag_test")).unwrap();
+        std::fs::write(root.join("c/.tag_test"), "[mapping]\ny = [\"C\"]\n").unwrap();
+        std::fs::create_dir_all(root.join("a/new/deeper")).unwrap();
+        std::fs::write(root.join("a/new/deeper/.tag_test"), "[mapping]\nz = [\"D\"]\n").unwrap();
+
+        for threads in [1, 4] {
+            let mut refreshed = Snapshot::decode(&snapshot.encode().unwrap(), &SymbolTable::new()).unwrap();
+            assert!(refreshed.refresh(".tag_test", threads));
+            assert_eq!(mappings(&refreshed), mappings(&Snapshot::take(&root, ".tag_test", 1, &SymbolTable::new())));
+            assert_eq!(refreshed.dirs.len(), 6);
+        }
+
+        assert!(snapshot.refresh(".tag_test", 1));
+        std::fs::remove_dir_all(root.join("a")).unwrap();
+        assert!(snapshot.refresh(".tag_test", 1));
+        assert_eq!(mappings(&snapshot), mappings(&Snapshot::take(&root, ".tag_test", 1, &SymbolTable::new())));
+        assert_eq!(snapshot.dirs.len(), 2);
+    }
+}
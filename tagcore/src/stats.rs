@@ -0,0 +1,194 @@
+use std::{
+    cmp::Reverse, collections::{BTreeSet, HashMap, HashSet}, hash::Hash
+};
+
+use crate::{symbol::{Symbol, SymbolTag, Symbols}, tag::Tag};
+
+/// Number of files carrying each tag of a workspace, kept up to date by the TagIndex, with a sorted vocabulary for prefix search (autocompletion).
+/// Each file counts once per term, however many of its tags use it.
+#[derive(Debug, Default)]
+pub struct TagStats {
+    simple: HashMap<Symbol, usize>,
+    keys: HashMap<Symbol, usize>,
+    pairs: HashMap<(Symbol, Symbol), usize>,
+    /// Every simple tag and key, as (lowercased text, Symbol), in order
+    names: BTreeSet<(String, Symbol)>,
+    /// The values used with each key, as (lowercased text, Symbol), in order
+    values: HashMap<Symbol, BTreeSet<(String, Symbol)>>,
+}
+
+impl TagStats {
+    /// Updates the counts after a file's terms changed, given its distinct simple tags, keys and key-value pairs before and after
+    pub fn update(&mut self, old_simple: &HashSet<Symbol>, new_simple: &HashSet<Symbol>, old_keys: &HashSet<Symbol>, new_keys: &HashSet<Symbol>,
+                  old_pairs: &HashSet<(Symbol, Symbol)>, new_pairs: &HashSet<(Symbol, Symbol)>, symbols: &Symbols) {
+        let mut changed_names: HashSet<Symbol> = HashSet::new();
+        changed_names.extend(TagStats::update_counts(&mut self.simple, old_simple, new_simple));
+        changed_names.extend(TagStats::update_counts(&mut self.keys, old_keys, new_keys));
+        for name in changed_names {
+            let entry = (symbols.resolve(name).to_lowercase(), name);
+            if self.simple.contains_key(&name) || self.keys.contains_key(&name) {
+                self.names.insert(entry);
+            } else {
+                self.names.remove(&entry);
+            }
+        }
+
+        for (key, value) in TagStats::update_counts(&mut self.pairs, old_pairs, new_pairs) {
+            let entry = (symbols.resolve(value).to_lowercase(), value);
+            if self.pairs.contains_key(&(key, value)) {
+                self.values.entry(key).or_default().insert(entry);
+            } else if let Some(values) = self.values.get_mut(&key) {
+                values.remove(&entry);
+                if values.is_empty() {
+                    self.values.remove(&key);
+                }
+            }
+        }
+    }
+
+    /// Number of files carrying a simple tag
+    pub fn simple_count(&self, simple: Symbol) -> usize {
+        self.simple.get(&simple).copied().unwrap_or(0)
+    }
+
+    /// Number of files with a key-value tag using a key
+    pub fn key_count(&self, key: Symbol) -> usize {
+        self.keys.get(&key).copied().unwrap_or(0)
+    }
+
+    /// Number of files carrying a key-value tag
+    pub fn pair_count(&self, key: Symbol, value: Symbol) -> usize {
+        self.pairs.get(&(key, value)).copied().unwrap_or(0)
+    }
+
+    /// Returns at most limit tag texts starting with a prefix (ignoring case), most used first, with the number of files using them.
+    /// A prefix without ':' completes simple tags and keys (a text used as both counts both). `Key:prefix` completes the values of Key, as `Key:Value`.
+    /// Only the terms matching the prefix are visited, and only the returned ones are turned into strings.
+    pub fn suggest(&self, prefix: &str, limit: usize, symbols: &Symbols) -> Vec<(String, usize)> {
+        if limit == 0 {
+            return Vec::new();
+        }
+        let lower = prefix.trim_start().to_lowercase();
+        match lower.split_once(':') {
+            None => {
+                let candidates = TagStats::starting_with(&self.names, &lower)
+                    .map(|(text, name)| (self.simple_count(name) + self.key_count(name), text, name))
+                    .collect();
+                TagStats::most_used(candidates, limit).into_iter()
+                    .map(|(count, _, name)| (symbols.resolve(name).to_string(), count))
+                    .collect()
+            },
+            Some((key_text, value_prefix)) => {
+                let key_text = key_text.trim_end();
+                let value_prefix = value_prefix.trim_start();
+                let mut candidates = Vec::new();
+                // Keys are matched ignoring case too, so several keys may differ only by case
+                for (_, key) in TagStats::starting_with(&self.names, key_text).take_while(|(text, _)| *text == key_text) {
+                    let Some(values) = self.values.get(&key) else {
+                        continue;
+                    };
+                    candidates.extend(TagStats::starting_with(values, value_prefix).map(|(text, value)| (self.pair_count(key, value), text, (key, value))));
+                }
+                TagStats::most_used(candidates, limit).into_iter()
+                    .map(|(count, _, (key, value))| (format!("{}:{}", symbols.resolve(key), symbols.resolve(value)), count))
+                    .collect()
+            },
+        }
+    }
+
+    /// Returns every simple and key-value tag with the number of files carrying it, sorted by text
+    pub fn tag_counts(&self, symbols: &Symbols) -> Vec<(Tag, usize)> {
+        let mut rv: Vec<(Tag, usize)> = self.simple.iter().map(|(s, count)| (SymbolTag::Simple(*s).resolve(symbols), *count))
+            .chain(self.pairs.iter().map(|((k, v), count)| (SymbolTag::KV(*k, *v).resolve(symbols), *count)))
+            .collect();
+        rv.sort_unstable_by(|(a, _), (b, _)| TagStats::sort_key(a).cmp(&TagStats::sort_key(b)));
+        rv
+    }
+}
+
+// Private / Helper Functions
+impl TagStats {
+    /// Adds 1 to the count of the terms only in new, and takes 1 from the terms only in old (forgetting them at 0). Returns the changed terms.
+    fn update_counts<T: Hash + Eq + Copy>(counts: &mut HashMap<T, usize>, old: &HashSet<T>, new: &HashSet<T>) -> Vec<T> {
+        let mut changed = Vec::new();
+        for term in old.difference(new) {
+            let Some(count) = counts.get_mut(term) else {
+                continue;
+            };
+            *count -= 1;
+            if *count == 0 {
+                counts.remove(term);
+            }
+            changed.push(*term);
+        }
+        for term in new.difference(old) {
+            *counts.entry(*term).or_default() += 1;
+            changed.push(*term);
+        }
+        changed
+    }
+
+    /// The entries of a sorted vocabulary whose text starts with a (lowercased) prefix
+    fn starting_with<'a>(vocabulary: &'a BTreeSet<(String, Symbol)>, prefix: &'a str) -> impl Iterator<Item = (&'a str, Symbol)> + 'a {
+        vocabulary.range((prefix.to_string(), 0)..)
+            .take_while(move |(text, _)| text.starts_with(prefix))
+            .map(|(text, symbol)| (text.as_str(), *symbol))
+    }
+
+    /// Keeps the limit candidates with the highest counts, ties broken by text, in that order
+    fn most_used<T>(mut candidates: Vec<(usize, &str, T)>, limit: usize) -> Vec<(usize, &str, T)> {
+        let order = |a: &(usize, &str, T), b: &(usize, &str, T)| Reverse(a.0).cmp(&Reverse(b.0)).then_with(|| a.1.cmp(b.1));
+        if candidates.len() > limit {
+            candidates.select_nth_unstable_by(limit - 1, order);
+            candidates.truncate(limit);
+        }
+        candidates.sort_unstable_by(order);
+        candidates
+    }
+
+    fn sort_key(tag: &Tag) -> (&str, &str) {
+        match tag {
+            Tag::Simple(s) => (s.as_str(), ""),
+            Tag::KV(k, v) => (k.as_str(), v.as_str()),
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn stats_counts_and_suggest() {
+        let mut symbols = Symbols::default();
+        let [due, today, tomorrow, dune, hello] = ["Due", "Today", "Tomorrow", "dune", "Hello"].map(|s| symbols.intern(s));
+        let set = |symbols: &[Symbol]| symbols.iter().copied().collect::<HashSet<Symbol>>();
+        let pairs = |pairs: &[(Symbol, Symbol)]| pairs.iter().copied().collect::<HashSet<(Symbol, Symbol)>>();
+        let none: HashSet<Symbol> = HashSet::new();
+        let no_pairs: HashSet<(Symbol, Symbol)> = HashSet::new();
+
+        let mut stats = TagStats::default();
+        // file1: Due:Today, dune. file2: Due:Today, Due:Tomorrow. file3: Hello, Due
+        stats.update(&none, &set(&[dune]), &none, &set(&[due]), &no_pairs, &pairs(&[(due, today)]), &symbols);
+        stats.update(&none, &none, &none, &set(&[due]), &no_pairs, &pairs(&[(due, today), (due, tomorrow)]), &symbols);
+        stats.update(&none, &set(&[hello, due]), &none, &none, &no_pairs, &no_pairs, &symbols);
+        assert_eq!((stats.simple_count(due), stats.key_count(due), stats.pair_count(due, today)), (1, 2, 2));
+
+        assert_eq!(stats.suggest("DU", 10, &symbols), vec![("Due".to_string(), 3), ("dune".to_string(), 1)]);
+        assert_eq!(stats.suggest("du", 1, &symbols), vec![("Due".to_string(), 3)]);
+        assert_eq!(stats.suggest("due:t", 10, &symbols), vec![("Due:Today".to_string(), 2), ("Due:Tomorrow".to_string(), 1)]);
+        assert_eq!(stats.suggest("Due:To", 0, &symbols), vec![]);
+        assert_eq!(stats.suggest("x", 10, &symbols), vec![]);
+
+        // Removals are counted down, and unused terms leave the vocabulary
+        stats.update(&none, &none, &set(&[due]), &none, &pairs(&[(due, today), (due, tomorrow)]), &no_pairs, &symbols);
+        stats.update(&set(&[dune]), &none, &set(&[due]), &set(&[due]), &pairs(&[(due, today)]), &pairs(&[(due, today)]), &symbols);
+        assert_eq!(stats.suggest("due:", 10, &symbols), vec![("Due:Today".to_string(), 1)]);
+        assert_eq!(stats.suggest("d", 10, &symbols), vec![("Due".to_string(), 2)]);
+
+        let expected = vec![
+            (Tag::Simple("Due".to_string()), 1), (Tag::KV("Due".to_string(), "Today".to_string()), 1), (Tag::Simple("Hello".to_string()), 1)
+        ];
+        assert_eq!(stats.tag_counts(&symbols), expected);
+    }
+}
@@ -0,0 +1,126 @@
+use std::{
+    collections::HashMap, sync::{Arc, PoisonError, RwLock, RwLockReadGuard, RwLockWriteGuard}
+};
+
+use crate::tag::Tag;
+
+/// Compact identifier for an interned string
+pub type Symbol = u32;
+
+/// Every distinct string used by a workspace (tag text and file names), each stored once. Shared by the Workspace,
+/// its TagFiles and the threads loading them. Strings are never removed, so a Symbol stays valid for the life of the table.
+#[derive(Debug, Default)]
+pub struct SymbolTable {
+    symbols: RwLock<Symbols>,
+}
+
+/// The contents of a SymbolTable. Locking it once for a whole operation is cheaper than going through the table for every string.
+#[derive(Debug, Default)]
+pub struct Symbols {
+    ids: HashMap<Arc<str>, Symbol>,
+    strings: Vec<Arc<str>>,
+}
+
+/// A Tag whose strings are interned in a SymbolTable
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Hash)]
+pub enum SymbolTag {
+    Simple(Symbol),
+    KV(Symbol, Symbol),
+}
+
+impl SymbolTable {
+    pub fn new() -> Arc<SymbolTable> {
+        Arc::new(SymbolTable::default())
+    }
+
+    pub fn read(&self) -> RwLockReadGuard<'_, Symbols> {
+        self.symbols.read().unwrap_or_else(PoisonError::into_inner)
+    }
+
+    pub fn write(&self) -> RwLockWriteGuard<'_, Symbols> {
+        self.symbols.write().unwrap_or_else(PoisonError::into_inner)
+    }
+
+    /// Returns the Symbol of a string, adding it if needed. Only takes the write lock for new strings.
+    pub fn intern(&self, s: &str) -> Symbol {
+        if let Some(symbol) = self.read().get(s) {
+            return symbol;
+        }
+        self.write().intern(s)
+    }
+
+    /// Returns the Symbol of a string, if it was ever interned
+    pub fn get(&self, s: &str) -> Option<Symbol> {
+        self.read().get(s)
+    }
+}
+
+impl Symbols {
+    pub fn intern(&mut self, s: &str) -> Symbol {
+        if let Some(symbol) = self.ids.get(s) {
+            return *symbol;
+        }
+        let symbol = self.strings.len() as Symbol;
+        let s: Arc<str> = Arc::from(s);
+        self.strings.push(s.clone());
+        self.ids.insert(s, symbol);
+        symbol
+    }
+
+    pub fn get(&self, s: &str) -> Option<Symbol> {
+        self.ids.get(s).copied()
+    }
+
+    /// Returns the string of a Symbol. Panics if the Symbol is not from this table.
+    pub fn resolve(&self, symbol: Symbol) -> &str {
+        &self.strings[symbol as usize]
+    }
+}
+
+impl SymbolTag {
+    pub fn intern(tag: &Tag, symbols: &mut Symbols) -> SymbolTag {
+        match tag {
+            Tag::Simple(s) => SymbolTag::Simple(symbols.intern(s)),
+            Tag::KV(k, v) => SymbolTag::KV(symbols.intern(k), symbols.intern(v)),
+        }
+    }
+
+    /// Returns the interned form of a Tag, or None if one of its strings was never interned (so no TagFile holds the Tag)
+    pub fn get(tag: &Tag, symbols: &Symbols) -> Option<SymbolTag> {
+        match tag {
+            Tag::Simple(s) => Some(SymbolTag::Simple(symbols.get(s)?)),
+            Tag::KV(k, v) => Some(SymbolTag::KV(symbols.get(k)?, symbols.get(v)?)),
+        }
+    }
+
+    pub fn resolve(&self, symbols: &Symbols) -> Tag {
+        match self {
+            SymbolTag::Simple(s) => Tag::Simple(symbols.resolve(*s).to_string()),
+            SymbolTag::KV(k, v) => Tag::KV(symbols.resolve(*k).to_string(), symbols.resolve(*v).to_string()),
+        }
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn symbol_table_interns_once() {
+        let table = SymbolTable::new();
+        let due = table.intern("Due");
+        assert_eq!(table.intern("Due"), due);
+        assert_ne!(table.intern("Today"), due);
+        assert_eq!(table.get("Due"), Some(due));
+        assert_eq!(table.get("Later"), None);
+        assert_eq!(table.read().resolve(due), "Due");
+        assert_eq!(table.read().strings.len(), 2);
+
+        let tag = Tag::KV("Due".to_string(), "Today".to_string());
+        let symbol_tag = SymbolTag::intern(&tag, &mut table.write());
+        assert_eq!(symbol_tag.resolve(&table.read()), tag);
+        assert_eq!(SymbolTag::get(&tag, &table.read()), Some(symbol_tag));
+        assert_eq!(SymbolTag::get(&Tag::KV("Due".to_string(), "Later".to_string()), &table.read()), None);
+        assert_eq!(table.read().strings.len(), 2);
+    }
+}
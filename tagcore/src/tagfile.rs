@@ -1,38 +1,111 @@
 use std::{
-    collections::{HashMap, HashSet}, fs::File, io::{Read, Write}, path::{Path, PathBuf}
+    collections::HashMap, fmt, fs, path::{Path, PathBuf}, str::FromStr, sync::Arc
 };
 use serde::{Serialize, Deserialize};
 
-use crate::{errors::TagFileError, tag::Tag};
+use crate::{
+    codec::{ByteReader, ByteWriter}, errors::TagFileError, fingerprint::Fingerprint, persist::{self, Durability}, profile::{self, Counter, Phase}, symbol::{Symbol, SymbolTable, SymbolTag}, tag::Tag
+};
+
+/// Starts every binary TagFile. The leading 0xFF byte never appears in UTF-8, so a binary TagFile is never mistaken for TOML.
+const BINARY_MAGIC: &[u8; 8] = b"\xFFTAGBIN\0";
+/// Version 2 added fingerprints. Version 1 TagFiles are still read.
+const BINARY_VERSION: u32 = 2;
+
+/// How a TagFile is stored on disk. Either format is read transparently.
+#[derive(Debug, Clone, Copy, PartialEq, Eq, Default)]
+pub enum TagFileFormat {
+    /// Human readable and editable
+    #[default]
+    Toml,
+    /// Compact and fast to read and write: every distinct tag string is stored once, and tags refer to it by number
+    Binary,
+}
+
+impl FromStr for TagFileFormat {
+    type Err = String;
 
-#[derive(Debug, Serialize, Deserialize)]
+    fn from_str(value: &str) -> Result<Self, Self::Err> {
+        match value {
+            "toml" => Ok(TagFileFormat::Toml),
+            "binary" => Ok(TagFileFormat::Binary),
+            _ => Err(format!("Unknown tag file format '{}', expected toml or binary", value)),
+        }
+    }
+}
+
+impl fmt::Display for TagFileFormat {
+    fn fmt(&self, f: &mut fmt::Formatter<'_>) -> fmt::Result {
+        match self {
+            TagFileFormat::Toml => write!(f, "toml"),
+            TagFileFormat::Binary => write!(f, "binary"),
+        }
+    }
+}
+
+#[derive(Debug)]
 pub struct TagFile {
-    #[serde(skip)]
     pub full_path_to_tagfile: PathBuf,
 
-    pub mapping: HashMap<String, Vec<Tag>>
+    /// The format the TagFile was read in, and is written in
+    pub format: TagFileFormat,
+
+    /// Tags by file name, interned in symbols
+    pub mapping: HashMap<Symbol, Vec<SymbolTag>>,
+
+    /// Fingerprints of the tagged files, by file name, as of when they were last tagged. Files tagged before fingerprints existed have none.
+    pub fingerprints: HashMap<Symbol, Fingerprint>,
+
+    symbols: Arc<SymbolTable>,
+}
+
+/// A TagFile as stored in TOML
+#[derive(Serialize, Deserialize)]
+struct TomlTagFile {
+    mapping: HashMap<String, Vec<Tag>>,
+    /// [inode, size] by file name. Left out when empty, so TagFiles without fingerprints read the same as before.
+    #[serde(default, skip_serializing_if = "HashMap::is_empty")]
+    fingerprints: HashMap<String, [u64; 2]>
 }
 
 impl TagFile {
-    /// Loads a TagFile from disk and returns it.
-    pub fn from_file_in_dir(path_to_tagfile_file: &Path) -> Result<TagFile, TagFileError> {
-        return TagFile::load_tagfile_from_disk(&path_to_tagfile_file);
+    /// Loads a TagFile from disk and returns it. Its strings are interned in symbols.
+    pub fn from_file_in_dir(path_to_tagfile_file: &Path, symbols: &Arc<SymbolTable>) -> Result<TagFile, TagFileError> {
+        return TagFile::load_tagfile_from_disk(&path_to_tagfile_file, symbols);
     }
 
-    /// Creates an empty TagFile and saves it to disk
-    pub fn empty(path_to_tagfile_file: PathBuf) -> Result<TagFile, TagFileError> {
-        let tf = TagFile {
+    /// Creates an empty TagFile. It is only written to disk by save_tagfile_to_disk.
+    pub fn empty(path_to_tagfile_file: PathBuf, format: TagFileFormat, symbols: &Arc<SymbolTable>) -> TagFile {
+        TagFile {
             full_path_to_tagfile: path_to_tagfile_file,
+            format,
             mapping: HashMap::new(),
-        };
+            fingerprints: HashMap::new(),
+            symbols: symbols.clone(),
+        }
+    }
+
+    /// Creates a TagFile holding the given tags, interning their strings in symbols
+    pub fn from_mapping(path_to_tagfile_file: PathBuf, format: TagFileFormat, mapping: HashMap<String, Vec<Tag>>, symbols: &Arc<SymbolTable>) -> TagFile {
+        let mut interned = HashMap::with_capacity(mapping.len());
+        {
+            let mut symbols = symbols.write();
+            for (file_name, tags) in mapping {
+                let tags = tags.iter().map(|tag| SymbolTag::intern(tag, &mut symbols)).collect();
+                interned.insert(symbols.intern(&file_name), tags);
+            }
+        }
+        TagFile { full_path_to_tagfile: path_to_tagfile_file, format, mapping: interned, fingerprints: HashMap::new(), symbols: symbols.clone() }
+    }
 
-        tf.save_tagfile_to_disk()?;
-        return Ok(tf);
+    /// Creates a TagFile from tags already interned in symbols
+    pub fn from_interned(path_to_tagfile_file: PathBuf, format: TagFileFormat, mapping: HashMap<Symbol, Vec<SymbolTag>>, symbols: &Arc<SymbolTable>) -> TagFile {
+        TagFile { full_path_to_tagfile: path_to_tagfile_file, format, mapping, fingerprints: HashMap::new(), symbols: symbols.clone() }
     }
 
+    /// Adds a tag to a file, in memory only. The Workspace decides when to call save_tagfile_to_disk.
     // TODO - assumes path to file is valid
     pub fn add_tag_to_file_in_self(&mut self, path_to_file: &Path, tag: Tag) -> Result<(), TagFileError> {
-        // Add tag in memory
         let Some(file_name) = path_to_file.file_name().unwrap().to_str() else {
             return Err(TagFileError::BadPath("Invalid File Name".to_string()));
         };
@@ -57,104 +130,126 @@ impl TagFile {
             Tag::Simple(s) => Tag::Simple(s.trim().to_string()),
             Tag::KV(k,v) => Tag::KV(k.trim().to_string(), v.trim().to_string()),
         };
+        let (file_name, tag) = {
+            let mut symbols = self.symbols.write();
+            (symbols.intern(file_name), SymbolTag::intern(&tag, &mut symbols))
+        };
 
         // If file is mapped, only add tag to vec if tag not already in vec. If file unmapped, create a mapping w/ tag
-        if self.mapping.contains_key(file_name) {
-            if !self.mapping[file_name].contains(&tag) {
-                self.mapping.get_mut(file_name).unwrap().push(tag);
+        if self.mapping.contains_key(&file_name) {
+            if !self.mapping[&file_name].contains(&tag) {
+                self.mapping.get_mut(&file_name).unwrap().push(tag);
             }
         } else {
-            self.mapping.insert(file_name.to_string(), vec![tag]);
+            self.mapping.insert(file_name, vec![tag]);
         }
-
-        // Write to disk
-        self.save_tagfile_to_disk()
+        Ok(())
     }
 
+    /// Removes a tag from a file, in memory only
     pub fn remove_tag_from_file_in_self(&mut self, path_to_file: &Path, tag: &Tag) -> Result<(), TagFileError> {
-        // Remove tag in memory
         let Some(file_name) = path_to_file.file_name().unwrap().to_str() else {
             return Err(TagFileError::BadPath("Invalid File Name".to_string()));
         };
+        // A string that was never interned cannot be in any TagFile
+        let (Some(file_name), Some(tag)) = ({
+            let symbols = self.symbols.read();
+            (symbols.get(file_name), SymbolTag::get(tag, &symbols))
+        }) else {
+            return Ok(());
+        };
 
         // IF mapping exists, only remove tag from vec if tag not already in vec. If mapping DNE do nothing?
-        if self.mapping.contains_key(file_name) {
-
-            if self.mapping[file_name].contains(&tag) {
-                // self.mapping.get_mut(file_name).unwrap()
-                //     .retain(|vec_tag| vec_tag != tag);
-                    // .swap_remove(self.mapping[file_name].iter().position(|x| x == tag).unwrap() );
-                
-                if let Some(index) = self.mapping[file_name].iter().position(|val: &Tag | val == tag) {
-                    self.mapping.get_mut(file_name).unwrap().remove(index);
-                }
+        if self.mapping.contains_key(&file_name) {
+
+            if let Some(index) = self.mapping[&file_name].iter().position(|val: &SymbolTag | *val == tag) {
+                self.mapping.get_mut(&file_name).unwrap().remove(index);
             }
 
-            if self.mapping[file_name].len() <= 0 {
-                self.mapping.remove(file_name);
+            if self.mapping[&file_name].len() <= 0 {
+                self.mapping.remove(&file_name);
+                self.fingerprints.remove(&file_name);
             }
         }
-        else {
+        Ok(())
+    }
 
+    /// Records the current fingerprint of a tagged file, so that its tags can be re-linked if it is renamed or moved outside the workspace.
+    /// Does nothing for a file without tags, and forgets the fingerprint if the file cannot be stat'ed.
+    pub fn record_fingerprint(&mut self, path_to_file: &Path) {
+        let Some(file_name) = path_to_file.file_name().and_then(|name| name.to_str()).and_then(|name| self.symbols.get(name)) else {
+            return;
+        };
+        if !self.mapping.contains_key(&file_name) {
+            return;
         }
+        match Fingerprint::of(path_to_file) {
+            Some(fingerprint) => self.fingerprints.insert(file_name, fingerprint),
+            None => self.fingerprints.remove(&file_name),
+        };
+    }
+
+    /// Removes a file's tags and fingerprint, and returns them. Returns None if the file has no tags.
+    pub fn take_entry(&mut self, file_name: Symbol) -> Option<(Vec<SymbolTag>, Option<Fingerprint>)> {
+        let tags = self.mapping.remove(&file_name)?;
+        Some((tags, self.fingerprints.remove(&file_name)))
+    }
 
-        self.save_tagfile_to_disk()
+    /// Sets a file's tags and fingerprint, replacing any it had
+    pub fn insert_entry(&mut self, file_name: Symbol, tags: Vec<SymbolTag>, fingerprint: Option<Fingerprint>) {
+        if tags.is_empty() {
+            self.take_entry(file_name);
+            return;
+        }
+        self.mapping.insert(file_name, tags);
+        match fingerprint {
+            Some(fingerprint) => self.fingerprints.insert(file_name, fingerprint),
+            None => self.fingerprints.remove(&file_name),
+        };
     }
 
     pub fn get_all_tags_for_filename(&self, file_name: &String) -> Vec<Tag> {
-        if let Some(vec_tags) = self.mapping.get(file_name) {
-            // vec_tags.iter().for_each(|tag| {
-            //     match tag {
-            //         Tag::Simple(x) => return_val.insert(x.to_string()),
-            //         Tag::KV(k, v) => {
-            //             return_val.insert(k.to_string());
-            //             return_val.insert(v.to_string())
-            //         }
-            //     };
-            // });
-            vec_tags.clone()
+        let symbols = self.symbols.read();
+        if let Some(vec_tags) = symbols.get(file_name).and_then(|file_name| self.mapping.get(&file_name)) {
+            vec_tags.iter().map(|tag| tag.resolve(&symbols)).collect()
         } else {
             Vec::<Tag>::new()
         }
     }
 
-    pub fn get_all_tags_string(&self) -> HashSet<String> {
-        let mut ret: HashSet<String> = HashSet::<String>::new();
-        self.mapping.values().for_each(|vec | vec.iter().for_each(|tag| {
-            match tag {
-                Tag::Simple(x) => ret.insert(x.to_string()),
-                Tag::KV(k, v) => {
-                    ret.insert(k.to_string());
-                    ret.insert(v.to_string())
-                }
-            };
-        }));
+    /// Returns the interned tags of a file, which are cheap to copy
+    pub fn get_symbol_tags_for_filename(&self, file_name: &str) -> Vec<SymbolTag> {
+        self.symbols.get(file_name)
+            .and_then(|file_name| self.mapping.get(&file_name))
+            .cloned()
+            .unwrap_or_default()
+    }
 
-        ret
+    /// Returns a copy of every file name and its tags, with the strings resolved
+    pub fn get_mapping(&self) -> HashMap<String, Vec<Tag>> {
+        let symbols = self.symbols.read();
+        self.mapping.iter()
+            .map(|(file_name, tags)| (symbols.resolve(*file_name).to_string(), tags.iter().map(|tag| tag.resolve(&symbols)).collect()))
+            .collect()
     }
 
-    pub fn get_mapping_ref(&self) -> &HashMap<String, Vec<Tag>> {
+    pub fn get_mapping_ref(&self) -> &HashMap<Symbol, Vec<SymbolTag>> {
         &self.mapping
     }
-    
-    pub fn get_tagfile_owning_dir(&self) -> Option<&Path> {
-        self.full_path_to_tagfile.parent()
-    }
 }
 
 impl TagFile {
-    fn save_tagfile_to_disk(&self) -> Result<(), TagFileError> {
-        let contents = match toml::to_string(&self) {
-            Ok(contents) => contents,
-            Err(_) => return Err(TagFileError::Serialize("Cannot Serialize TagFile".to_string()))
+    /// Writes the whole TagFile to disk in its format, atomically replacing the file. Durability decides whether the write is also fsynced.
+    pub fn save_tagfile_to_disk(&self, durability: Durability) -> Result<(), TagFileError> {
+        let _span = profile::span(Phase::Save);
+        let contents = match self.format {
+            TagFileFormat::Toml => self.to_toml()?.into_bytes(),
+            TagFileFormat::Binary => self.encode_binary(),
         };
+        profile::count(Counter::TagFilesSaved, 1);
+        profile::count(Counter::BytesSaved, contents.len() as u64);
 
-        let mut file = match File::create(&self.full_path_to_tagfile) {
-            Ok(file) => file,
-            Err(err) => return Err(TagFileError::Io(err))
-        };
-
-        match file.write_all(contents.as_bytes()) {
+        match persist::write_atomic(&self.full_path_to_tagfile, &contents, durability) {
             Ok(_) => (),
             Err(err) => return Err(TagFileError::Io(err)),
         }
@@ -162,24 +257,157 @@ impl TagFile {
         Ok(())
     }
 
-    fn load_tagfile_from_disk(full_path_to_tagfile_file: &Path) -> Result<TagFile, TagFileError> {
-        let mut file: File = match File::open(full_path_to_tagfile_file) {
-            Ok(file) => file,
+    fn load_tagfile_from_disk(full_path_to_tagfile_file: &Path, symbols: &Arc<SymbolTable>) -> Result<TagFile, TagFileError> {
+        let contents = match fs::read(full_path_to_tagfile_file) {
+            Ok(contents) => contents,
             Err(err) => return Err(TagFileError::Io(err))
         };
+        let _span = profile::span(Phase::Parse);
+        profile::count(Counter::TagFilesParsed, 1);
+        profile::count(Counter::BytesParsed, contents.len() as u64);
 
-        let mut contents: String = String::new();
-        match file.read_to_string(&mut contents) {
-            Ok(_) => (),
-            Err(err) => return Err(TagFileError::Io(err)),
+        if contents.starts_with(BINARY_MAGIC) {
+            return TagFile::decode_binary(full_path_to_tagfile_file.to_path_buf(), &contents, symbols);
         }
+        let Ok(contents) = std::str::from_utf8(&contents) else {
+            return Err(TagFileError::Serialize("Cannot Deserailize TagFile".to_string()));
+        };
+        TagFile::from_toml(full_path_to_tagfile_file.to_path_buf(), contents, symbols)
+    }
+}
 
-        let mut tf = match toml::from_str::<TagFile>(contents.as_str()) {
-            Ok(tf) => tf,
-            Err(_) => return Err(TagFileError::Serialize("Cannot Deserailize TagFile".to_string())),
+// Private / Helper Functions
+impl TagFile {
+    fn from_toml(path_to_tagfile_file: PathBuf, contents: &str, symbols: &Arc<SymbolTable>) -> Result<TagFile, TagFileError> {
+        let Ok(raw) = toml::from_str::<TomlTagFile>(contents) else {
+            return Err(TagFileError::Serialize("Cannot Deserailize TagFile".to_string()));
         };
+        let mut tf = TagFile::from_mapping(path_to_tagfile_file, TagFileFormat::Toml, raw.mapping, symbols);
+        let table = symbols.read();
+        for (file_name, [inode, size]) in raw.fingerprints {
+            // Only tagged files have fingerprints, and their names were interned with their tags
+            if let Some(file_name) = table.get(&file_name).filter(|file_name| tf.mapping.contains_key(file_name)) {
+                tf.fingerprints.insert(file_name, Fingerprint { inode, size });
+            }
+        }
+        drop(table);
+        Ok(tf)
+    }
+
+    fn to_toml(&self) -> Result<String, TagFileError> {
+        let symbols = self.symbols.read();
+        let fingerprints = self.fingerprints.iter()
+            .filter(|(_, fingerprint)| fingerprint.inode <= i64::MAX as u64 && fingerprint.size <= i64::MAX as u64) // TOML integers are signed
+            .map(|(file_name, fingerprint)| (symbols.resolve(*file_name).to_string(), [fingerprint.inode, fingerprint.size]))
+            .collect();
+        drop(symbols);
+        match toml::to_string(&TomlTagFile { mapping: self.get_mapping(), fingerprints }) {
+            Ok(contents) => Ok(contents),
+            Err(_) => Err(TagFileError::Serialize("Cannot Serialize TagFile".to_string()))
+        }
+    }
 
-        tf.full_path_to_tagfile = full_path_to_tagfile_file.to_path_buf();
+    /// Binary layout: magic, version, the table of distinct tag strings, every file name with its tags, then every file name with its fingerprint (inode, size).
+    /// A simple tag is stored as (string id << 1), a KV tag as (key id << 1 | 1) followed by the value id.
+    fn encode_binary(&self) -> Vec<u8> {
+        let symbols = self.symbols.read();
+        let mut string_ids: HashMap<Symbol, u64> = HashMap::new();
+        let mut strings: Vec<Symbol> = Vec::new();
+        let mut body = ByteWriter::new();
+        body.write_varint(self.mapping.len() as u64);
+        for (file_name, tags) in &self.mapping {
+            body.write_str(symbols.resolve(*file_name));
+            body.write_varint(tags.len() as u64);
+            for tag in tags {
+                match tag {
+                    SymbolTag::Simple(s) => body.write_varint(TagFile::local_id(*s, &mut string_ids, &mut strings) << 1),
+                    SymbolTag::KV(k, v) => {
+                        body.write_varint(TagFile::local_id(*k, &mut string_ids, &mut strings) << 1 | 1);
+                        body.write_varint(TagFile::local_id(*v, &mut string_ids, &mut strings));
+                    }
+                }
+            }
+        }
+        body.write_varint(self.fingerprints.len() as u64);
+        for (file_name, fingerprint) in &self.fingerprints {
+            body.write_str(symbols.resolve(*file_name));
+            body.write_u64(fingerprint.inode);
+            body.write_u64(fingerprint.size);
+        }
+
+        let mut writer = ByteWriter::new();
+        writer.write_bytes(BINARY_MAGIC);
+        writer.write_u32(BINARY_VERSION);
+        writer.write_varint(strings.len() as u64);
+        for s in strings {
+            writer.write_str(symbols.resolve(s));
+        }
+        writer.write_bytes(&body.into_bytes());
+        writer.into_bytes()
+    }
+
+    /// Returns the id of a string in the binary string table, adding it if needed
+    fn local_id(symbol: Symbol, string_ids: &mut HashMap<Symbol, u64>, strings: &mut Vec<Symbol>) -> u64 {
+        *string_ids.entry(symbol).or_insert_with(|| {
+            strings.push(symbol);
+            strings.len() as u64 - 1
+        })
+    }
+
+    fn decode_binary(path_to_tagfile_file: PathBuf, bytes: &[u8], symbols: &Arc<SymbolTable>) -> Result<TagFile, TagFileError> {
+        let mut reader = ByteReader::new(bytes);
+        if reader.read_bytes(BINARY_MAGIC.len())? != BINARY_MAGIC {
+            return Err(TagFileError::Serialize("Not a binary TagFile".to_string()));
+        }
+        let version = reader.read_u32()?;
+        if !(1..=BINARY_VERSION).contains(&version) {
+            return Err(TagFileError::Serialize("Unsupported TagFile version".to_string()));
+        }
+
+        let mut table = symbols.write();
+        let num_strings = reader.read_len()?;
+        let mut strings = Vec::with_capacity(num_strings);
+        for _ in 0..num_strings {
+            strings.push(table.intern(reader.read_str()?));
+        }
+        let string = |id: u64| match strings.get(id as usize) {
+            Some(symbol) => Ok(*symbol),
+            None => Err(TagFileError::Serialize("Unknown string in TagFile".to_string())),
+        };
+
+        let num_files = reader.read_len()?;
+        let mut mapping = HashMap::with_capacity(num_files);
+        for _ in 0..num_files {
+            let file_name = table.intern(reader.read_str()?);
+            let num_tags = reader.read_len()?;
+            let mut tags = Vec::with_capacity(num_tags);
+            for _ in 0..num_tags {
+                let id = reader.read_varint()?;
+                let tag = if id & 1 == 0 {
+                    SymbolTag::Simple(string(id >> 1)?)
+                } else {
+                    SymbolTag::KV(string(id >> 1)?, string(reader.read_varint()?)?)
+                };
+                tags.push(tag);
+            }
+            mapping.insert(file_name, tags);
+        }
+
+        let mut fingerprints = HashMap::new();
+        if version >= 2 {
+            let num_fingerprints = reader.read_len()?;
+            for _ in 0..num_fingerprints {
+                let file_name = table.intern(reader.read_str()?);
+                fingerprints.insert(file_name, Fingerprint { inode: reader.read_u64()?, size: reader.read_u64()? });
+            }
+        }
+
+        if !reader.is_at_end() {
+            return Err(TagFileError::Serialize("Trailing data in TagFile".to_string()));
+        }
+        drop(table);
+        let mut tf = TagFile::from_interned(path_to_tagfile_file, TagFileFormat::Binary, mapping, symbols);
+        tf.fingerprints = fingerprints;
         Ok(tf)
     }
 }
@@ -196,24 +424,25 @@ file1 = ["TODO"]
 file2 = [["Character", "Jim"], "TODO", "yoohoo", ["Chara","VonVia"], "bello!"]
         "#;
 
-        let tf: TagFile = toml::from_str::<TagFile>(tf_str).unwrap();
+        let tf: TagFile = TagFile::from_toml(PathBuf::from("."), tf_str, &SymbolTable::new()).unwrap();
 
         assert_eq!(tf.mapping.len(), 2);
-        assert!(tf.mapping.contains_key("file1"));
-        assert_eq!(tf.mapping["file1"].len(), 1);
-        assert_eq!(tf.mapping["file1"][0], Tag::Simple("TODO".to_string()));
+        assert!(tf.get_mapping().contains_key("file1"));
+        assert_eq!(tf.get_mapping()["file1"].len(), 1);
+        assert_eq!(tf.get_mapping()["file1"][0], Tag::Simple("TODO".to_string()));
         
-        assert!(tf.mapping.contains_key("file2"));
-        assert_eq!(tf.mapping["file2"].len(), 5);
-        assert_eq!(tf.mapping["file2"][0], Tag::KV("Character".to_string(), "Jim".to_string()));
-        assert_eq!(tf.mapping["file2"][3], Tag::KV("Chara".to_string(), "VonVia".to_string()));
+        assert!(tf.get_mapping().contains_key("file2"));
+        assert_eq!(tf.get_mapping()["file2"].len(), 5);
+        assert_eq!(tf.get_mapping()["file2"][0], Tag::KV("Character".to_string(), "Jim".to_string()));
+        assert_eq!(tf.get_mapping()["file2"][3], Tag::KV("Chara".to_string(), "VonVia".to_string()));
     }
 
     #[test]
     fn serialize_tagfile_to_str() {
-        let tf: TagFile = TagFile {
-            full_path_to_tagfile: PathBuf::from("."),
-            mapping: HashMap::from(
+        let tf: TagFile = TagFile::from_mapping(
+            PathBuf::from("."),
+            TagFileFormat::Toml,
+            HashMap::from(
                 [
                     (
                         "file1".to_string(),
@@ -224,10 +453,11 @@ file2 = [["Character", "Jim"], "TODO", "yoohoo", ["Chara","VonVia"], "bello!"]
                         vec![Tag::KV("Due".to_string(), "Today".to_string()), Tag::Simple("Hi".to_string())]
                     )
                 ]
-            )
-        };
+            ),
+            &SymbolTable::new()
+        );
 
-        let str = toml::to_string(&tf).unwrap();
+        let str = tf.to_toml().unwrap();
         // NOTE - Due to HashMap, order that files are listed is random.
         let possible_string_1 = r#"[mapping]
 file1 = ["TODO"]
@@ -252,17 +482,17 @@ file1 = ["TODO"]
 file2 = [["Due", "Today"], "Hi"]
 "#).unwrap();
 
-        let tf: TagFile = TagFile::from_file_in_dir(&test_dir.path().join(".tag_test")).unwrap();
+        let tf: TagFile = TagFile::from_file_in_dir(&test_dir.path().join(".tag_test"), &SymbolTable::new()).unwrap();
 
         assert_eq!(tf.mapping.len(), 2);
-        assert!(tf.mapping.contains_key("file1"));
-        assert_eq!(tf.mapping["file1"].len(), 1);
-        assert_eq!(tf.mapping["file1"][0], Tag::Simple("TODO".to_string()));
+        assert!(tf.get_mapping().contains_key("file1"));
+        assert_eq!(tf.get_mapping()["file1"].len(), 1);
+        assert_eq!(tf.get_mapping()["file1"][0], Tag::Simple("TODO".to_string()));
         
-        assert!(tf.mapping.contains_key("file2"));
-        assert_eq!(tf.mapping["file2"].len(), 2);
-        assert_eq!(tf.mapping["file2"][0], Tag::KV("Due".to_string(), "Today".to_string()));
-        assert_eq!(tf.mapping["file2"][1], Tag::Simple("Hi".to_string()));
+        assert!(tf.get_mapping().contains_key("file2"));
+        assert_eq!(tf.get_mapping()["file2"].len(), 2);
+        assert_eq!(tf.get_mapping()["file2"][0], Tag::KV("Due".to_string(), "Today".to_string()));
+        assert_eq!(tf.get_mapping()["file2"][1], Tag::Simple("Hi".to_string()));
 
         assert_eq!(tf.full_path_to_tagfile, test_dir.path().join(".tag_test").to_path_buf());
     }
@@ -273,9 +503,10 @@ file2 = [["Due", "Today"], "Hi"]
         let test_dir = TempDir::new("test").unwrap();
         let path_to_tf = test_dir.into_path().join(".tag_test").to_path_buf();
 
-        let tf: TagFile = TagFile {
-            full_path_to_tagfile: path_to_tf.clone(),
-            mapping: HashMap::from(
+        let tf: TagFile = TagFile::from_mapping(
+            path_to_tf.clone(),
+            TagFileFormat::Toml,
+            HashMap::from(
                 [
                     (
                         "file1".to_string(),
@@ -286,10 +517,11 @@ file2 = [["Due", "Today"], "Hi"]
                         vec![Tag::KV("Due".to_string(), "Today".to_string()), Tag::Simple("Hi".to_string())]
                     )
                 ]
-            )
-        };
+            ),
+            &SymbolTable::new()
+        );
 
-        tf.save_tagfile_to_disk().unwrap();
+        tf.save_tagfile_to_disk(Durability::None).unwrap();
         assert!(path_to_tf.exists());
         let msg = std::fs::read_to_string(path_to_tf).unwrap();
 
@@ -316,17 +548,17 @@ file1 = ["TODO"]
 file2 = [["Due", "Today"], "Hi"]
 "#).unwrap();
 
-        let tf: TagFile = TagFile::load_tagfile_from_disk(&test_dir.path().join(".tag_test")).unwrap();
+        let tf: TagFile = TagFile::load_tagfile_from_disk(&test_dir.path().join(".tag_test"), &SymbolTable::new()).unwrap();
 
         assert_eq!(tf.mapping.len(), 2);
-        assert!(tf.mapping.contains_key("file1"));
-        assert_eq!(tf.mapping["file1"].len(), 1);
-        assert_eq!(tf.mapping["file1"][0], Tag::Simple("TODO".to_string()));
+        assert!(tf.get_mapping().contains_key("file1"));
+        assert_eq!(tf.get_mapping()["file1"].len(), 1);
+        assert_eq!(tf.get_mapping()["file1"][0], Tag::Simple("TODO".to_string()));
         
-        assert!(tf.mapping.contains_key("file2"));
-        assert_eq!(tf.mapping["file2"].len(), 2);
-        assert_eq!(tf.mapping["file2"][0], Tag::KV("Due".to_string(), "Today".to_string()));
-        assert_eq!(tf.mapping["file2"][1], Tag::Simple("Hi".to_string()));
+        assert!(tf.get_mapping().contains_key("file2"));
+        assert_eq!(tf.get_mapping()["file2"].len(), 2);
+        assert_eq!(tf.get_mapping()["file2"][0], Tag::KV("Due".to_string(), "Today".to_string()));
+        assert_eq!(tf.get_mapping()["file2"][1], Tag::Simple("Hi".to_string()));
 
         assert_eq!(tf.full_path_to_tagfile, test_dir.path().join(".tag_test").to_path_buf());
     }
@@ -338,11 +570,74 @@ file2 = [["Due", "Today"], "Hi"]
 
         std::fs::write(test_dir.path().join(".tag_test"), "[mapping]\n").unwrap();
 
-        let tf: TagFile = TagFile::load_tagfile_from_disk(&test_dir.path().join(".tag_test")).unwrap();
+        let tf: TagFile = TagFile::load_tagfile_from_disk(&test_dir.path().join(".tag_test"), &SymbolTable::new()).unwrap();
 
         assert_eq!(tf.mapping.len(), 0);
     }
 
+    #[test]
+    fn binary_tagfile_round_trip() {
+        use tempdir::TempDir;
+        let test_dir = TempDir::new("test").unwrap();
+        let path_to_tf = test_dir.path().join(".tag_test");
+
+        std::fs::write(&path_to_tf, "[mapping]\nfile1 = [\"TODO\", [\"Due\", \"TODO\"]]\nfile2 = [[\"Due\", \"Today\"], \"TODO\"]\n").unwrap();
+        let mut tf = TagFile::load_tagfile_from_disk(&path_to_tf, &SymbolTable::new()).unwrap();
+        assert_eq!(tf.format, TagFileFormat::Toml);
+        let toml_size = std::fs::metadata(&path_to_tf).unwrap().len();
+
+        tf.format = TagFileFormat::Binary;
+        tf.save_tagfile_to_disk(Durability::None).unwrap();
+        let bytes = std::fs::read(&path_to_tf).unwrap();
+        assert!(bytes.starts_with(BINARY_MAGIC));
+        assert!((bytes.len() as u64) < toml_size);
+
+        let loaded = TagFile::load_tagfile_from_disk(&path_to_tf, &SymbolTable::new()).unwrap();
+        assert_eq!(loaded.format, TagFileFormat::Binary);
+        assert_eq!(loaded.get_mapping(), tf.get_mapping());
+        assert_eq!(loaded.full_path_to_tagfile, path_to_tf);
+
+        // Truncated files, unknown string ids and trailing data are rejected
+        for bad in [&bytes[..bytes.len() - 1], &[bytes.as_slice(), &[0]].concat()] {
+            std::fs::write(&path_to_tf, bad).unwrap();
+            assert!(matches!(TagFile::load_tagfile_from_disk(&path_to_tf, &SymbolTable::new()), Err(TagFileError::Serialize(_))));
+        }
+        let mut writer = ByteWriter::new();
+        writer.write_bytes(BINARY_MAGIC);
+        writer.write_u32(BINARY_VERSION);
+        writer.write_varint(0); // No strings
+        writer.write_varint(1);
+        writer.write_str("file1");
+        writer.write_varint(1);
+        writer.write_varint(0); // Simple tag with string 0
+        std::fs::write(&path_to_tf, writer.into_bytes()).unwrap();
+        assert!(matches!(TagFile::load_tagfile_from_disk(&path_to_tf, &SymbolTable::new()), Err(TagFileError::Serialize(_))));
+    }
+
+    #[test]
+    fn tagfile_fingerprints_round_trip() {
+        use tempdir::TempDir;
+        let test_dir = TempDir::new("test").unwrap();
+        let path_to_tf = test_dir.path().join(".tag_test");
+        let symbols = SymbolTable::new();
+        let fingerprint = Fingerprint { inode: 42, size: 7 };
+
+        let mut tf = TagFile::empty(path_to_tf.clone(), TagFileFormat::Toml, &symbols);
+        tf.insert_entry(symbols.intern("file1"), vec![SymbolTag::Simple(symbols.intern("TODO"))], Some(fingerprint));
+        tf.insert_entry(symbols.intern("file2"), vec![SymbolTag::Simple(symbols.intern("TODO"))], None);
+        for format in [TagFileFormat::Toml, TagFileFormat::Binary] {
+            tf.format = format;
+            tf.save_tagfile_to_disk(Durability::None).unwrap();
+            let loaded_symbols = SymbolTable::new();
+            let loaded = TagFile::load_tagfile_from_disk(&path_to_tf, &loaded_symbols).unwrap();
+            assert_eq!(loaded.fingerprints, HashMap::from([(loaded_symbols.get("file1").unwrap(), fingerprint)]));
+        }
+
+        // Removing a file's last tag forgets its fingerprint
+        tf.remove_tag_from_file_in_self(&test_dir.path().join("file1"), &Tag::Simple("TODO".to_string())).unwrap();
+        assert!(tf.fingerprints.is_empty());
+    }
+
     #[test]
     fn tagfile_add_tag_to_file_in_self() {
         use tempdir::TempDir;
@@ -352,40 +647,43 @@ file2 = [["Due", "Today"], "Hi"]
         std::fs::write(test_dir.path().join(".tag_test"), "[mapping]\n").unwrap();
 
         let path_to_tagfile = &test_dir.path().join(".tag_test");
-        let mut tf: TagFile = TagFile::load_tagfile_from_disk(&path_to_tagfile).unwrap();
+        let mut tf: TagFile = TagFile::load_tagfile_from_disk(&path_to_tagfile, &SymbolTable::new()).unwrap();
 
         tf.add_tag_to_file_in_self(&path_to_file, Tag::Simple("ADDED TAG".to_string())).unwrap();
 
-        assert!(tf.mapping.contains_key("file1.txt"));
-        assert_eq!(tf.mapping["file1.txt"].len(), 1);
-        assert_eq!(tf.mapping["file1.txt"][0], Tag::Simple("ADDED TAG".to_string()));
+        assert!(tf.get_mapping().contains_key("file1.txt"));
+        assert_eq!(tf.get_mapping()["file1.txt"].len(), 1);
+        assert_eq!(tf.get_mapping()["file1.txt"][0], Tag::Simple("ADDED TAG".to_string()));
 
         tf.add_tag_to_file_in_self(&path_to_file, Tag::Simple("ADDED TAG".to_string())).unwrap();
 
-        assert!(tf.mapping.contains_key("file1.txt"));
-        assert_eq!(tf.mapping["file1.txt"].len(), 1);
-        assert_eq!(tf.mapping["file1.txt"][0], Tag::Simple("ADDED TAG".to_string()));
+        assert!(tf.get_mapping().contains_key("file1.txt"));
+        assert_eq!(tf.get_mapping()["file1.txt"].len(), 1);
+        assert_eq!(tf.get_mapping()["file1.txt"][0], Tag::Simple("ADDED TAG".to_string()));
 
         tf.add_tag_to_file_in_self(&path_to_file, Tag::Simple("SECOND TAG".to_string())).unwrap();
 
-        assert!(tf.mapping.contains_key("file1.txt"));
-        assert_eq!(tf.mapping["file1.txt"].len(), 2);
-        assert_eq!(tf.mapping["file1.txt"][1], Tag::Simple("SECOND TAG".to_string()));
+        assert!(tf.get_mapping().contains_key("file1.txt"));
+        assert_eq!(tf.get_mapping()["file1.txt"].len(), 2);
+        assert_eq!(tf.get_mapping()["file1.txt"][1], Tag::Simple("SECOND TAG".to_string()));
 
         tf.add_tag_to_file_in_self(&path_to_file, Tag::KV("Key".to_string(),"value".to_string())).unwrap();
 
-        assert!(tf.mapping.contains_key("file1.txt"));
-        assert_eq!(tf.mapping["file1.txt"].len(), 3);
-        assert_eq!(tf.mapping["file1.txt"][2], Tag::KV("Key".to_string(),"value".to_string()));
+        assert!(tf.get_mapping().contains_key("file1.txt"));
+        assert_eq!(tf.get_mapping()["file1.txt"].len(), 3);
+        assert_eq!(tf.get_mapping()["file1.txt"][2], Tag::KV("Key".to_string(),"value".to_string()));
 
         let path_to_file: PathBuf = test_dir.path().join("secondfile.c");
         tf.add_tag_to_file_in_self(&path_to_file, Tag::KV("DUE".to_string(),"tomorrow".to_string())).unwrap();
 
-        assert!(tf.mapping.contains_key("file1.txt"));
-        assert!(tf.mapping.contains_key("secondfile.c"));
-        assert_eq!(tf.mapping["secondfile.c"].len(), 1);
-        assert_eq!(tf.mapping["secondfile.c"][0], Tag::KV("DUE".to_string(),"tomorrow".to_string()));
+        assert!(tf.get_mapping().contains_key("file1.txt"));
+        assert!(tf.get_mapping().contains_key("secondfile.c"));
+        assert_eq!(tf.get_mapping()["secondfile.c"].len(), 1);
+        assert_eq!(tf.get_mapping()["secondfile.c"][0], Tag::KV("DUE".to_string(),"tomorrow".to_string()));
 
+        // Changes are only in memory until saved
+        assert_eq!(std::fs::read_to_string(&path_to_tagfile).unwrap(), "[mapping]\n");
+        tf.save_tagfile_to_disk(Durability::None).unwrap();
         let contents = std::fs::read_to_string(&path_to_tagfile).unwrap();
 
         // NOTE - Due to HashMap, order that files are listed is random.
@@ -415,19 +713,19 @@ file2 = [["Due", "Today"], "Hi"]
 
         let path_to_file: PathBuf = test_dir.path().join("three.png");
         tf.add_tag_to_file_in_self(&path_to_file, Tag::Simple(" hello ".to_string())).unwrap();
-        assert!(tf.mapping.contains_key("three.png"));
-        assert_eq!(tf.mapping["three.png"].len(), 1);
-        assert_eq!(tf.mapping["three.png"][0], Tag::Simple("hello".to_string()));
+        assert!(tf.get_mapping().contains_key("three.png"));
+        assert_eq!(tf.get_mapping()["three.png"].len(), 1);
+        assert_eq!(tf.get_mapping()["three.png"][0], Tag::Simple("hello".to_string()));
 
         tf.add_tag_to_file_in_self(&path_to_file, Tag::KV(" hello ".to_string(), "world".to_string())).unwrap();
-        assert!(tf.mapping.contains_key("three.png"));
-        assert_eq!(tf.mapping["three.png"].len(), 2);
-        assert_eq!(tf.mapping["three.png"][1], Tag::KV("hello".to_string(), "world".to_string()));
+        assert!(tf.get_mapping().contains_key("three.png"));
+        assert_eq!(tf.get_mapping()["three.png"].len(), 2);
+        assert_eq!(tf.get_mapping()["three.png"][1], Tag::KV("hello".to_string(), "world".to_string()));
 
         tf.add_tag_to_file_in_self(&path_to_file, Tag::KV("hello_dupe".to_string(), " world ".to_string())).unwrap();
-        assert!(tf.mapping.contains_key("three.png"));
-        assert_eq!(tf.mapping["three.png"].len(), 3);
-        assert_eq!(tf.mapping["three.png"][2], Tag::KV("hello_dupe".to_string(), "world".to_string()));
+        assert!(tf.get_mapping().contains_key("three.png"));
+        assert_eq!(tf.get_mapping()["three.png"].len(), 3);
+        assert_eq!(tf.get_mapping()["three.png"][2], Tag::KV("hello_dupe".to_string(), "world".to_string()));
     }
 
     #[test]
@@ -441,33 +739,34 @@ file2 = [["Due", "Today"], "Hi"]
 "#).unwrap();
 
         let path_to_tagfile = test_dir.path().join(".tag_test");
-        let mut tf: TagFile = TagFile::load_tagfile_from_disk(&path_to_tagfile).unwrap();
+        let mut tf: TagFile = TagFile::load_tagfile_from_disk(&path_to_tagfile, &SymbolTable::new()).unwrap();
 
         let path_to_file1: PathBuf = test_dir.path().join("file1.txt");
         let path_to_file2: PathBuf = test_dir.path().join("file2.c");
         
         tf.remove_tag_from_file_in_self(&path_to_file1, &Tag::Simple("TODO".to_string())).unwrap();
 
-        assert!(tf.mapping.contains_key("file1.txt"));
-        assert_eq!(tf.mapping["file1.txt"].len(), 1);
-        assert_eq!(tf.mapping["file1.txt"][0], Tag::Simple("Blue".to_string()));
-        assert!(tf.mapping.contains_key("file2.c"));
-        assert_eq!(tf.mapping["file2.c"].len(), 3);
+        assert!(tf.get_mapping().contains_key("file1.txt"));
+        assert_eq!(tf.get_mapping()["file1.txt"].len(), 1);
+        assert_eq!(tf.get_mapping()["file1.txt"][0], Tag::Simple("Blue".to_string()));
+        assert!(tf.get_mapping().contains_key("file2.c"));
+        assert_eq!(tf.get_mapping()["file2.c"].len(), 3);
 
         tf.remove_tag_from_file_in_self(&path_to_file2, &Tag::KV("Due".to_string(),"Today".to_string())).unwrap();
 
-        assert!(tf.mapping.contains_key("file1.txt"));
-        assert_eq!(tf.mapping["file1.txt"].len(), 1);
-        assert!(tf.mapping.contains_key("file2.c"));
-        assert_eq!(tf.mapping["file2.c"].len(), 2);
-        assert_eq!(tf.mapping["file2.c"][0], Tag::Simple("Hi".to_string()));
-        assert_eq!(tf.mapping["file2.c"][1], Tag::KV("Color".to_string(),"Red".to_string()));
+        assert!(tf.get_mapping().contains_key("file1.txt"));
+        assert_eq!(tf.get_mapping()["file1.txt"].len(), 1);
+        assert!(tf.get_mapping().contains_key("file2.c"));
+        assert_eq!(tf.get_mapping()["file2.c"].len(), 2);
+        assert_eq!(tf.get_mapping()["file2.c"][0], Tag::Simple("Hi".to_string()));
+        assert_eq!(tf.get_mapping()["file2.c"][1], Tag::KV("Color".to_string(),"Red".to_string()));
 
         tf.remove_tag_from_file_in_self(&path_to_file1, &Tag::Simple("Blue".to_string())).unwrap();
 
-        assert!(!tf.mapping.contains_key("file1.txt"));
-        assert!(tf.mapping.contains_key("file2.c"));
+        assert!(!tf.get_mapping().contains_key("file1.txt"));
+        assert!(tf.get_mapping().contains_key("file2.c"));
 
+        tf.save_tagfile_to_disk(Durability::None).unwrap();
         let contents = std::fs::read_to_string(&path_to_tagfile).unwrap();
         assert_eq!(contents, r#"[mapping]
 "file2.c" = ["Hi", ["Color", "Red"]]
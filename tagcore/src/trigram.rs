@@ -0,0 +1,163 @@
+use std::collections::HashMap;
+
+use crate::symbol::Symbol;
+
+/// Identifier of a term in a TrigramIndex
+type TermId = u32;
+
+/// Substring index over a vocabulary of interned tag strings. Matching is case-insensitive: every term is lowercased once, when it is added.
+#[derive(Debug, Default)]
+pub struct TrigramIndex {
+    ids: HashMap<Symbol, TermId>,
+    /// Every term with its lowercased form, by TermId. Removed terms leave an empty slot, which is reused.
+    terms: Vec<Option<(Symbol, String)>>,
+    free_ids: Vec<TermId>,
+    /// Trigrams of the lowercased terms, mapped to the (sorted) ids of the terms containing them
+    trigrams: HashMap<[char; 3], Vec<TermId>>,
+}
+
+impl TrigramIndex {
+    pub fn contains(&self, term: Symbol) -> bool {
+        self.ids.contains_key(&term)
+    }
+
+    /// Adds a term, given its Symbol and text, to the vocabulary. Does nothing if the term is already known.
+    pub fn insert(&mut self, term: Symbol, text: &str) {
+        if self.contains(term) {
+            return;
+        }
+        let lower = text.to_lowercase();
+        let id = match self.free_ids.pop() {
+            Some(id) => id,
+            None => {
+                self.terms.push(None);
+                (self.terms.len() - 1) as TermId
+            }
+        };
+        for trigram in TrigramIndex::trigrams_of(&lower) {
+            let ids = self.trigrams.entry(trigram).or_default();
+            match ids.last() {
+                Some(last) if *last > id => {
+                    let pos = ids.binary_search(&id).unwrap_err();
+                    ids.insert(pos, id);
+                },
+                _ => ids.push(id),
+            }
+        }
+        self.ids.insert(term, id);
+        self.terms[id as usize] = Some((term, lower));
+    }
+
+    /// Removes a term from the vocabulary
+    pub fn remove(&mut self, term: Symbol) {
+        let Some(id) = self.ids.remove(&term) else {
+            return;
+        };
+        let (_, lower) = self.terms[id as usize].take().unwrap();
+        self.free_ids.push(id);
+        for trigram in TrigramIndex::trigrams_of(&lower) {
+            if let Some(ids) = self.trigrams.get_mut(&trigram) {
+                if let Ok(pos) = ids.binary_search(&id) {
+                    ids.remove(pos);
+                }
+                if ids.is_empty() {
+                    self.trigrams.remove(&trigram);
+                }
+            }
+        }
+    }
+
+    /// Returns every term whose lowercased form contains the given (already lowercased) text.
+    /// Texts shorter than a trigram are matched against the whole lowercased vocabulary.
+    pub fn find_containing(&self, lower_text: &str) -> Vec<Symbol> {
+        let query_trigrams = TrigramIndex::trigrams_of(lower_text);
+        if query_trigrams.is_empty() {
+            return self.terms.iter().flatten()
+                .filter(|(_, lower)| lower.contains(lower_text))
+                .map(|(term, _)| *term)
+                .collect();
+        }
+
+        // Narrow to terms containing every trigram of the text, starting from the rarest trigram
+        let mut posting_sets: Vec<&Vec<TermId>> = Vec::with_capacity(query_trigrams.len());
+        for trigram in &query_trigrams {
+            match self.trigrams.get(trigram) {
+                Some(ids) => posting_sets.push(ids),
+                None => return Vec::new(),
+            }
+        }
+        posting_sets.sort_by_key(|ids| ids.len());
+        let (smallest, rest) = posting_sets.split_first().unwrap();
+
+        smallest.iter()
+            .filter(|id| rest.iter().all(|ids| ids.binary_search(id).is_ok()))
+            .filter_map(|id| self.terms[*id as usize].as_ref())
+            .filter(|(_, lower)| lower.contains(lower_text)) // Trigrams can match out of order, so verify
+            .map(|(term, _)| *term)
+            .collect()
+    }
+}
+
+// Private / Helper Functions
+impl TrigramIndex {
+    /// Returns the distinct trigrams of a text, sorted
+    fn trigrams_of(text: &str) -> Vec<[char; 3]> {
+        let chars: Vec<char> = text.chars().collect();
+        let mut trigrams: Vec<[char; 3]> = chars.windows(3).map(|w| [w[0], w[1], w[2]]).collect();
+        trigrams.sort_unstable();
+        trigrams.dedup();
+        trigrams
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+    use crate::symbol::SymbolTable;
+
+    /// Returns the text of the terms containing lower_text, sorted
+    fn find(index: &TrigramIndex, symbols: &SymbolTable, lower_text: &str) -> Vec<String> {
+        let mut found: Vec<String> = index.find_containing(lower_text).into_iter().map(|s| symbols.read().resolve(s).to_string()).collect();
+        found.sort();
+        found
+    }
+
+    #[test]
+    fn trigram_find_containing() {
+        let symbols = SymbolTable::new();
+        let mut index = TrigramIndex::default();
+        for term in ["Hello", "Yellow", "World", "Other two", "quACk", "lo"] {
+            index.insert(symbols.intern(term), term);
+        }
+
+        assert_eq!(find(&index, &symbols, "ello"), vec!["Hello", "Yellow"]);
+        assert_eq!(find(&index, &symbols, "quack"), vec!["quACk"]);
+        assert_eq!(find(&index, &symbols, "r tw"), vec!["Other two"]);
+        assert!(find(&index, &symbols, "he llo").is_empty());
+        assert!(find(&index, &symbols, "olleh").is_empty());
+
+        // Short texts fall back to a scan of the lowercased vocabulary
+        assert_eq!(find(&index, &symbols, "lo"), vec!["Hello", "Yellow", "lo"]);
+        assert_eq!(find(&index, &symbols, "").len(), 6);
+
+        let yellow = symbols.get("Yellow").unwrap();
+        index.remove(yellow);
+        assert_eq!(find(&index, &symbols, "ello"), vec!["Hello"]);
+        assert!(!index.contains(yellow));
+        assert!(!index.trigrams.contains_key(&['y', 'e', 'l']));
+
+        // The freed slot is reused
+        index.insert(symbols.intern("Mellow"), "Mellow");
+        assert_eq!(index.terms.len(), 6);
+        assert_eq!(find(&index, &symbols, "ello"), vec!["Hello", "Mellow"]);
+    }
+
+    #[test]
+    fn trigram_out_of_order_trigrams() {
+        let symbols = SymbolTable::new();
+        let mut index = TrigramIndex::default();
+        // Contains "abc" and "bcd" trigrams of "abcd", but not "abcd" itself
+        index.insert(symbols.intern("bcd_abc"), "bcd_abc");
+        assert!(index.find_containing("abcd").is_empty());
+    }
+}
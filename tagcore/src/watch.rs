@@ -0,0 +1,55 @@
+use std::{
+    collections::HashSet, path::{Path, PathBuf}, sync::{mpsc::{self, Receiver}, Mutex}, time::{Duration, Instant}
+};
+
+use notify::{RecommendedWatcher, RecursiveMode, Watcher};
+
+/// Watches a directory tree for changes to the TagFiles of one workspace. Events arrive on a background thread and are only
+/// collected there: the TagFiles are reloaded by Workspace::poll_changes, once a burst of events has been quiet for the debounce delay.
+#[derive(Debug)]
+pub struct TagFileWatcher {
+    /// Dropping the watcher stops the events
+    _watcher: RecommendedWatcher,
+    /// In a Mutex only so that the watcher, and so the Workspace, is Sync. take_ready has exclusive access and never locks it.
+    events: Mutex<Receiver<PathBuf>>,
+    /// TagFiles changed since the last reload, and when the latest event about them arrived
+    pending: HashSet<PathBuf>,
+    last_event: Option<Instant>,
+    debounce: Duration,
+}
+
+impl TagFileWatcher {
+    /// Starts watching root_folder and its subdirectories for changes to files named tagfile_name
+    pub fn new(root_folder: &Path, tagfile_name: String, debounce: Duration) -> notify::Result<TagFileWatcher> {
+        let (sender, events) = mpsc::channel();
+        let mut watcher = notify::recommended_watcher(move |event: notify::Result<notify::Event>| {
+            let Ok(event) = event else {
+                return;
+            };
+            for path in event.paths {
+                if path.file_name().is_some_and(|name| name == tagfile_name.as_str()) {
+                    let _ = sender.send(path); // The receiver is only gone while the watcher is being dropped
+                }
+            }
+        })?;
+        watcher.watch(root_folder, RecursiveMode::Recursive)?;
+        Ok(TagFileWatcher { _watcher: watcher, events: Mutex::new(events), pending: HashSet::new(), last_event: None, debounce })
+    }
+
+    /// Returns the TagFiles changed since the last call, once no event about them arrived for the debounce delay. Returns nothing meanwhile.
+    pub fn take_ready(&mut self) -> Vec<PathBuf> {
+        // A panic cannot leave a Receiver inconsistent, so a poisoned lock is ignored
+        let events = self.events.get_mut().unwrap_or_else(|poisoned| poisoned.into_inner());
+        for path in events.try_iter() {
+            self.pending.insert(path);
+            self.last_event = Some(Instant::now());
+        }
+        match self.last_event {
+            Some(last_event) if last_event.elapsed() >= self.debounce => {
+                self.last_event = None;
+                self.pending.drain().collect()
+            },
+            _ => Vec::new(),
+        }
+    }
+}
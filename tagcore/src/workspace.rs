@@ -1,10 +1,17 @@
 use std::{
-    collections::{HashMap, HashSet}, fs::File, path::{Path, PathBuf}
+    collections::{BTreeMap, HashMap, HashSet}, fs::File, path::{Path, PathBuf}, sync::{Arc, OnceLock}
 };
+#[cfg(feature = "watch")]
+use std::time::Duration;
 
 use crate::{
-    errors::{WorkspaceError, TagFileError}, tag::Tag, tagfile::TagFile
+    change::TagChange, cursor::QueryCursor, errors::{QueryError, WorkspaceError, TagFileError}, fingerprint::Fingerprint, index::{DirId, TagIndex}, lru::LruCache, persist::Durability, profile::{self, Counter, Phase}, query::Query, retag::{Retag, RetagReport, SymbolRetag}, scan, snapshot::Snapshot, symbol::{Symbol, SymbolTable, SymbolTag}, tag::Tag, tagfile::{TagFile, TagFileFormat}
 };
+#[cfg(feature = "watch")]
+use crate::watch::TagFileWatcher;
+
+/// Most caller-supplied directories whose cannonical form is remembered
+const PATH_CACHE_SIZE: usize = 1024;
 
 #[derive(Debug)]
 pub struct Workspace {
@@ -13,9 +20,39 @@ pub struct Workspace {
     name: String,
     /// Mapping from directory paths including file names to in-memory TagFiles. Directory paths ARE CANNONICALIZED
     all_tagfiles: HashMap<PathBuf, TagFile>,
-    tags_cache: HashSet<String>
+    /// Every tag string and file name of the workspace's TagFiles, stored once and shared with them
+    symbols: Arc<SymbolTable>,
+    /// Inverted index over all_tagfiles, used by queries. Built by the first query after a scan, so that opening a workspace does not pay for it.
+    index: OnceLock<TagIndex>,
+    /// Number of threads used when scanning for TagFiles. 0 means one per available core.
+    scan_threads: usize,
+    /// Set by enable_lazy_loading: TagFiles loaded on first access, used instead of all_tagfiles until an operation needs every TagFile
+    lazy_tagfiles: Option<LruCache<PathBuf, TagFile>>,
+    /// Number of begin_batch calls not yet committed. While above 0, changes to tags are only made in memory.
+    batch_depth: usize,
+    /// Paths to TagFiles changed in memory but not yet written to disk
+    dirty_tagfiles: HashSet<PathBuf>,
+    /// Whether writing a TagFile waits for it to reach the storage device
+    durability: Durability,
+    /// Format of the TagFiles created by this workspace. Existing TagFiles keep the format they were read in.
+    tagfile_format: TagFileFormat,
+    /// Set by track_changes: files whose tags changed since the last take_changes, as (cannonical TagFile path, file name), oldest first
+    changes: Option<Vec<(PathBuf, String)>>,
+    /// Cannonical form of the (absolute) directories given by callers, so that repeated calls on a directory do not resolve it again.
+    /// Cleared whenever TagFiles are scanned or reloaded, and when files are moved, since directories may have moved too.
+    path_cache: LruCache<PathBuf, PathBuf>,
+    /// Set by watch: reports the TagFiles changed on disk, reloaded by poll_changes
+    #[cfg(feature = "watch")]
+    watcher: Option<TagFileWatcher>
 }
 
+// The Python binding shares a Workspace across threads: the watcher must not make it lose Send or Sync
+#[cfg(feature = "watch")]
+const _: fn() = || {
+    fn assert_send_sync<T: Send + Sync>() {}
+    assert_send_sync::<Workspace>();
+};
+
 // Public functions
 impl Workspace {
     /// Attempts to open a workspace given a directory (a folder) and a workspace name. If no workspace exists in the directory, errors. Validates the workspace name.
@@ -30,15 +67,10 @@ impl Workspace {
         Workspace::open_workspace_file(&workspace_file_name).map_err(|_e| WorkspaceError::FileUnavailable("".to_string()))?;
 
         //Create a workspace instance
-        let Ok(cannon_dir) = directory.canonicalize() else {
+        let Ok(cannon_dir) = profile::canonicalize(&directory) else {
             return Err(WorkspaceError::FileUnavailable("Cannot get parent directory".to_string()))
         };
-        Ok(Workspace { 
-            root_folder: cannon_dir,
-            name: name.clone(),
-            all_tagfiles: HashMap::new(),
-            tags_cache: HashSet::new()
-        })
+        Ok(Workspace::new_in_dir(cannon_dir, name))
     }
 
     /// Attempts to create a workspace given a directory (a folder) and a workspace name. If a same-named workspace exists in the directory, errors. Validates the workspace name
@@ -53,109 +85,467 @@ impl Workspace {
         Workspace::create_workspace_file(&workspace_file_name).map_err(|_e| WorkspaceError::FileUnavailable("".to_string()))?;
 
         //Create a workspace instance
-        let Ok(cannon_dir) = directory.canonicalize() else {
+        let Ok(cannon_dir) = profile::canonicalize(&directory) else {
             return Err(WorkspaceError::FileUnavailable("Cannot get parent directory".to_string()))
         };
-        Ok(Workspace { 
-            root_folder: cannon_dir,
-            name: name.clone(),
-            all_tagfiles: HashMap::new(),
-            tags_cache: HashSet::new()
-        })
+        Ok(Workspace::new_in_dir(cannon_dir, name))
     }
 
     /// Scans for .tag files, starting from the workspace's root directory and recursing into folders.
+    /// Uses the number of threads set by set_scan_threads; the loaded TagFiles are the same for any thread count.
+    /// TagFiles with changes not yet written to disk (see begin_batch) are kept as they are in memory.
     pub fn scan_for_tagfiles(&mut self) {
-        use walkdir::WalkDir;
-        let root_folder: String = self.root_folder.to_str().unwrap().to_string();
-        for entry in WalkDir::new(root_folder).into_iter().filter_map(|e| e.ok()) { //Ignores un-owned files
-            // Check if TagFile exists in directory
-            let full_path = entry.path().join(Workspace::get_tagfile_file_name(&self.name));
-            if full_path.exists() {
-                //REVIEW - If tag path is IN all_tagfiles hashmap, remove from hasmap and re-serialize it?
-                let tf: TagFile = match TagFile::from_file_in_dir(full_path.as_path()) {
-                    Ok(tf) => tf,
-                    Err(_) => continue, //Cannot create TagFile = Skip
+        let _span = profile::span(Phase::Scan);
+        self.clear_path_cache();
+        let dirty = self.take_dirty_tagfiles();
+        let threads = scan::resolve_thread_count(self.scan_threads);
+        let found = scan::find_tagfiles(&self.root_folder, &Workspace::get_tagfile_file_name(&self.name), threads, &self.symbols);
+        for (path_to_tagfile, tf) in found {
+            //add tagfile to workspace's set. This moves the TagFile.
+            self.all_tagfiles.insert(path_to_tagfile, tf);
+        }
+        self.all_tagfiles.extend(dirty);
+
+        self.reset_index();
+    }
+
+    /// Same as scan_for_tagfiles, but starts from the snapshot saved next to the workspace file by the previous call, if there is one.
+    /// Only TagFiles whose modification time or size changed are re-read, and only directories that changed are re-listed.
+    /// Falls back to a full scan if the snapshot is missing, corrupt or belongs to another root folder. The snapshot is saved again if anything changed.
+    pub fn scan_for_tagfiles_cached(&mut self) {
+        let _span = profile::span(Phase::Scan);
+        self.clear_path_cache();
+        let dirty = self.take_dirty_tagfiles();
+        let threads = scan::resolve_thread_count(self.scan_threads);
+        let tagfile_name = Workspace::get_tagfile_file_name(&self.name);
+        let snapshot_path = self.root_folder.join(Workspace::get_snapshot_file_name(&self.name));
+
+        let (snapshot, changed) = match Snapshot::load(&snapshot_path, &self.symbols) {
+            Ok(mut snapshot) if snapshot.root_folder == self.root_folder => {
+                let changed = snapshot.refresh(&tagfile_name, threads);
+                (snapshot, changed)
+            },
+            _ => (Snapshot::take(&self.root_folder, &tagfile_name, threads, &self.symbols), true),
+        };
+        if changed {
+            let _ = snapshot.save(&snapshot_path); // Failing to save only costs a full scan next time
+        }
+
+        for (path_to_tagfile, tf) in snapshot.into_tagfiles() {
+            self.all_tagfiles.insert(path_to_tagfile, tf);
+        }
+        self.all_tagfiles.extend(dirty);
+
+        self.reset_index();
+    }
+
+    /// Switches the workspace to lazy loading: instead of scanning for every TagFile, the TagFile of a directory is loaded the first time a file in it is accessed,
+    /// and at most max_tagfiles TagFiles are kept in memory (the least recently used are dropped). Queries need every TagFile, so the first query loads them all
+    /// (through scan_for_tagfiles_cached) and the workspace stays fully loaded from then on.
+    /// Drops any TagFiles already loaded, after writing any unsaved changes to disk.
+    pub fn enable_lazy_loading(&mut self, max_tagfiles: usize) -> Result<(), TagFileError> {
+        self.flush()?;
+        self.all_tagfiles.clear();
+        self.reset_index();
+        self.lazy_tagfiles = Some(LruCache::new(max_tagfiles));
+        Ok(())
+    }
+
+    /// Re-reads TagFiles from disk, for when they were changed by another process (such as tag-cli or another workspace instance). Returns the paths of the TagFiles that changed.
+    /// New TagFiles are added and deleted ones forgotten; unreadable ones (possibly still being written) are left as they are. TagFiles with unsaved changes (see begin_batch) are kept as they are in memory.
+    /// In lazy mode, TagFiles not loaded yet are skipped, since they are read when first used. The files whose tags changed are reported by take_changes.
+    pub fn reload_tagfiles(&mut self, paths_to_tagfiles: Vec<PathBuf>) -> Result<Vec<PathBuf>, TagFileError> {
+        self.clear_path_cache();
+        let tagfile_name = Workspace::get_tagfile_file_name(&self.name);
+        let mut reloaded: Vec<PathBuf> = Vec::new();
+        for path_to_tagfile in paths_to_tagfiles {
+            if path_to_tagfile.file_name().is_none_or(|name| name != tagfile_name.as_str()) || self.dirty_tagfiles.contains(&path_to_tagfile) {
+                continue;
+            }
+            let old_mapping = self.peek_tagfile(&path_to_tagfile).map(|tf| tf.get_mapping_ref().clone());
+            if old_mapping.is_none() && self.lazy_tagfiles.is_some() {
+                continue;
+            }
+            let new_tagfile = if path_to_tagfile.exists() {
+                let Some(found) = scan::load_tagfile(path_to_tagfile.clone(), false, &self.symbols) else {
+                    continue;
                 };
+                Some(found.tagfile)
+            } else {
+                None
+            };
+            let new_mapping = new_tagfile.as_ref().map(|tf| tf.get_mapping_ref().clone());
+            if old_mapping == new_mapping {
+                continue;
+            }
+
+            match new_tagfile {
+                Some(tf) => {
+                    self.insert_tagfile(path_to_tagfile.clone(), tf)?;
+                },
+                None => {
+                    match self.lazy_tagfiles.as_mut() {
+                        Some(lazy_tagfiles) => lazy_tagfiles.remove(&path_to_tagfile),
+                        None => self.all_tagfiles.remove(&path_to_tagfile),
+                    };
+                },
+            }
+
+            // Update the index and report every file whose tags differ
+            let old_mapping = old_mapping.unwrap_or_default();
+            let new_mapping = new_mapping.unwrap_or_default();
+            let file_names: HashSet<&Symbol> = old_mapping.keys().chain(new_mapping.keys()).collect();
+            for file_name in file_names {
+                let old_tags = old_mapping.get(file_name).map(Vec::as_slice).unwrap_or_default();
+                if new_mapping.get(file_name).map(Vec::as_slice).unwrap_or_default() == old_tags {
+                    continue;
+                }
+                let file_name = self.symbols.read().resolve(*file_name).to_string();
+                self.reindex_file(&path_to_tagfile, &file_name, old_tags);
+                self.record_change(&path_to_tagfile, &file_name, old_tags);
+            }
+            reloaded.push(path_to_tagfile);
+        }
+        Ok(reloaded)
+    }
+
+    /// Starts watching the workspace's directory tree for TagFiles changed, created or deleted by other processes. Bursts of events are collected until
+    /// they have been quiet for the debounce delay; poll_changes then reloads only the TagFiles concerned, so long-running sessions need no periodic rescans.
+    #[cfg(feature = "watch")]
+    pub fn watch(&mut self, debounce: Duration) -> Result<(), WorkspaceError> {
+        let watcher = TagFileWatcher::new(&self.root_folder, Workspace::get_tagfile_file_name(&self.name), debounce).map_err(|e| WorkspaceError::Watch(e.to_string()))?;
+        self.watcher = Some(watcher);
+        Ok(())
+    }
+
+    #[cfg(feature = "watch")]
+    pub fn unwatch(&mut self) {
+        self.watcher = None;
+    }
+
+    /// Reloads the TagFiles changed on disk since the last call (see watch and reload_tagfiles), and returns their paths.
+    /// Does nothing until the changes have been quiet for the debounce delay, or if the workspace is not watched.
+    #[cfg(feature = "watch")]
+    pub fn poll_changes(&mut self) -> Result<Vec<PathBuf>, TagFileError> {
+        let Some(watcher) = self.watcher.as_mut() else {
+            return Ok(Vec::new());
+        };
+        let ready = watcher.take_ready();
+        if ready.is_empty() {
+            return Ok(ready);
+        }
+        self.reload_tagfiles(ready)
+    }
+
+    /// Starts a batch of changes. Until the matching commit_batch, adding and removing tags only changes TagFiles in memory,
+    /// and each changed TagFile is written to disk once when the batch is committed. Batches can be nested: only the outermost commit writes.
+    pub fn begin_batch(&mut self) {
+        self.batch_depth += 1;
+    }
+
+    /// Ends a batch started by begin_batch. Ending the outermost batch writes every changed TagFile to disk.
+    pub fn commit_batch(&mut self) -> Result<(), TagFileError> {
+        self.batch_depth = self.batch_depth.saturating_sub(1);
+        if self.batch_depth > 0 {
+            return Ok(());
+        }
+        self.flush()
+    }
+
+    /// Writes every TagFile changed in memory to disk, without ending the current batch. Also done (ignoring errors) when the workspace is dropped.
+    /// TagFiles are written on the scan threads (see set_scan_threads), each atomically. On error, the TagFiles that could not be written
+    /// stay marked as changed, so the flush can be retried, and the first error is returned.
+    pub fn flush(&mut self) -> Result<(), TagFileError> {
+        let threads = scan::resolve_thread_count(self.scan_threads);
+        let dirty: Vec<PathBuf> = self.dirty_tagfiles.iter().cloned().collect();
+        let results = {
+            // TagFiles no longer open have nothing left to write
+            let tagfiles: Vec<Option<&TagFile>> = dirty.iter().map(|path_to_tagfile| self.peek_tagfile(path_to_tagfile)).collect();
+            Workspace::save_tagfiles(&tagfiles, threads, self.durability)
+        };
+        let mut rv = Ok(());
+        for (path_to_tagfile, result) in dirty.iter().zip(results) {
+            match result {
+                Ok(()) => { self.dirty_tagfiles.remove(path_to_tagfile); },
+                Err(err) if rv.is_ok() => rv = Err(err),
+                Err(_) => (),
+            }
+        }
+        rv
+    }
+
+    /// Sets how many threads scan_for_tagfiles uses to walk directories and parse TagFiles. 1 (the default) scans serially, 0 uses one thread per available core.
+    pub fn set_scan_threads(&mut self, threads: usize) {
+        self.scan_threads = threads;
+    }
+
+    /// Sets whether writing a TagFile also fsyncs it (and its directory). TagFiles are always replaced atomically;
+    /// the default, Durability::None, does not fsync, so the most recent changes may be lost (but never corrupted) by a power loss.
+    pub fn set_durability(&mut self, durability: Durability) {
+        self.durability = durability;
+    }
+
+    /// Sets the format of TagFiles created from now on. TagFiles already on disk are read in either format, and keep theirs.
+    pub fn set_tagfile_format(&mut self, format: TagFileFormat) {
+        self.tagfile_format = format;
+    }
+
+    /// Rewrites every TagFile that is not in the given format, and creates new TagFiles in that format from now on.
+    /// Loads every TagFile first in lazy mode; otherwise only the TagFiles already scanned are converted. Returns how many TagFiles were rewritten.
+    pub fn migrate_tagfiles(&mut self, format: TagFileFormat) -> Result<usize, TagFileError> {
+        self.load_all_if_lazy();
+        self.tagfile_format = format;
+        let mut converted = 0;
+        for (path_to_tagfile, tf) in self.all_tagfiles.iter_mut().filter(|(_, tf)| tf.format != format) {
+            tf.format = format;
+            self.dirty_tagfiles.insert(path_to_tagfile.clone());
+            converted += 1;
+        }
+        if self.batch_depth == 0 {
+            self.flush()?;
+        }
+        Ok(converted)
+    }
 
-                self.tags_cache.extend(tf.get_all_tags_string());
+    /// Starts (or stops) keeping track of the files whose tags are changed through this workspace, for take_changes. Stopping drops the changes not yet taken.
+    pub fn track_changes(&mut self, enabled: bool) {
+        self.changes = if enabled { Some(self.changes.take().unwrap_or_default()) } else { None };
+    }
 
-                //add tagfile to workspace's set. This moves the TagFile.
-                self.all_tagfiles.insert(full_path.to_path_buf().canonicalize().unwrap_or(full_path.to_path_buf()), tf);
+    /// Returns the files whose tags changed since the last call, oldest first, each once and with the tags it has now.
+    /// Returns nothing unless track_changes was enabled.
+    pub fn take_changes(&mut self) -> Vec<TagChange> {
+        let Some(changes) = self.changes.as_mut() else {
+            return Vec::new();
+        };
+        let changes = std::mem::take(changes);
+        let mut seen: HashSet<(&PathBuf, &String)> = HashSet::with_capacity(changes.len());
+        let symbols = self.symbols.read();
+        let mut rv: Vec<TagChange> = Vec::with_capacity(changes.len());
+        for (path_to_tagfile, file_name) in &changes {
+            if !seen.insert((path_to_tagfile, file_name)) {
+                continue;
             }
+            let (Some(directory), Some(relative_dir)) = (path_to_tagfile.parent(), self.get_relative_dir_of_tagfile(path_to_tagfile)) else {
+                continue;
+            };
+            rv.push(TagChange {
+                directory: directory.to_path_buf(),
+                file_name: file_name.clone(),
+                path: relative_dir.join(file_name).to_string_lossy().into_owned(),
+                tags: self.get_tags_in_tagfile(path_to_tagfile, file_name).iter().map(|tag| tag.resolve(&symbols)).collect(),
+            });
         }
+        rv
     }
 
     /// Adds the given string(s) as a tag to a file. THe file must be within the workspace's directory or a subdirectory.
     pub fn add_tag_to_file(&mut self, path_to_file: PathBuf, tag_1: String, tag_2: Option<String>) -> Result<(), TagFileError> {
         let parent_dir: &Path = path_to_file.parent().ok_or(TagFileError::BadPath("Invalid Path, parent dir".to_string()))?;
-        let full_parent_dir = parent_dir.canonicalize().map_err(|_| TagFileError::BadPath("Invalid Path, canonical dir".to_string()))?;
+        let full_parent_dir = self.canonical_dir(parent_dir).map_err(|_| TagFileError::BadPath("Invalid Path, canonical dir".to_string()))?;
 
         if full_parent_dir.strip_prefix(&self.root_folder).is_err() {
             return Err(TagFileError::BadPath("Path not within workspace".to_string()));
         }
 
-        let tag: Tag = if tag_2.is_none() {
-            Tag::Simple(tag_1.clone()) //clone so that tag_cache can update with original strings
-        }
-        else {
-            Tag::KV(tag_1.clone(), tag_2.clone().unwrap())
+        let tag: Tag = match tag_2 {
+            None => Tag::Simple(tag_1),
+            Some(tag_2) => Tag::KV(tag_1, tag_2),
         };
 
-        if let Some(tf) = self.all_tagfiles.get_mut(&full_parent_dir.join(Workspace::get_tagfile_file_name(&self.name))) {
+        let path_to_tagfile = full_parent_dir.join(Workspace::get_tagfile_file_name(&self.name));
+        let file_name = Workspace::file_name_of(&path_to_file)?;
+
+        let old_tags = if let Some(tf) = self.get_tagfile_mut(&path_to_tagfile)? {
+            let old_tags = tf.get_symbol_tags_for_filename(&file_name);
             //takes ownership of the Tag enum. Will return any errors because of '?'
             tf.add_tag_to_file_in_self(&path_to_file, tag)?;
+            tf.record_fingerprint(&path_to_file);
+            old_tags
         }
         else {
-            let mut tf = TagFile::empty(parent_dir.join(Workspace::get_tagfile_file_name(&self.name)))?;
+            let mut tf = TagFile::empty(parent_dir.join(Workspace::get_tagfile_file_name(&self.name)), self.tagfile_format, &self.symbols);
             tf.add_tag_to_file_in_self(&path_to_file, tag)?;
-            self.all_tagfiles.insert(full_parent_dir.join(Workspace::get_tagfile_file_name(&self.name)), tf);
-        }
+            tf.record_fingerprint(&path_to_file);
+            self.insert_tagfile(path_to_tagfile.clone(), tf)?;
+            Vec::new()
+        };
+        self.reindex_file(&path_to_tagfile, &file_name, &old_tags);
+        self.record_change(&path_to_tagfile, &file_name, &old_tags);
+        self.tagfile_changed(&path_to_tagfile)?;
+
+        Ok(())
+    }
 
-        // Check if tag is in memory-cache, if not, add to cache. Since down here, only add to cache if TagFile open/create was successful
-        if !self.tags_cache.contains(&tag_1) {
-            self.tags_cache.insert(tag_1);
+    /// Adds tags to many files at once, given as (path to file, tags to add) pairs. The files must be within the workspace's directory or a subdirectory.
+    /// Every path and tag is checked first, so that an invalid one changes nothing. Files are grouped by directory, so that each directory is resolved once,
+    /// and every TagFile changed is written once at the end (or when the current batch ends, see begin_batch). Returns the number of files whose tags changed.
+    pub fn apply_bulk(&mut self, files_and_tags: Vec<(PathBuf, Vec<Tag>)>) -> Result<usize, TagFileError> {
+        let mut by_dir: BTreeMap<PathBuf, Vec<(PathBuf, Vec<Tag>)>> = BTreeMap::new();
+        for (path_to_file, tags) in files_and_tags {
+            let parent_dir = path_to_file.parent().ok_or(TagFileError::BadPath("Invalid Path, parent dir".to_string()))?;
+            Workspace::file_name_of(&path_to_file)?;
+            for tag in &tags {
+                Workspace::check_tag(tag)?;
+            }
+            by_dir.entry(parent_dir.to_path_buf()).or_default().push((path_to_file, tags));
         }
-        if tag_2.as_ref().is_some_and(|t| self.tags_cache.contains(t)) {
-            self.tags_cache.insert(tag_2.unwrap());
+        let mut by_tagfile: Vec<(PathBuf, Vec<(PathBuf, Vec<Tag>)>)> = Vec::with_capacity(by_dir.len());
+        for (dir, files_and_tags) in by_dir {
+            let full_dir = self.canonical_dir(&dir).map_err(|_| TagFileError::BadPath("Invalid Path, canonical dir".to_string()))?;
+            if full_dir.strip_prefix(&self.root_folder).is_err() {
+                return Err(TagFileError::BadPath("Path not within workspace".to_string()));
+            }
+            by_tagfile.push((full_dir.join(Workspace::get_tagfile_file_name(&self.name)), files_and_tags));
         }
 
-        Ok(())
+        self.begin_batch();
+        let mut applied = Ok(0);
+        for (path_to_tagfile, files_and_tags) in by_tagfile {
+            match self.apply_bulk_in_tagfile(&path_to_tagfile, files_and_tags) {
+                Ok(changed) => applied = applied.map(|total| total + changed),
+                Err(error) => {
+                    applied = Err(error);
+                    break;
+                },
+            }
+        }
+        let committed = self.commit_batch();
+        let changed = applied?;
+        committed?;
+        Ok(changed)
+    }
+
+    /// Returns the files below base_dir whose path relative to it matches a glob pattern, such as `assets/**/*.png`, sorted. The workspace's own files are left out.
+    /// `*` and `?` stay within a directory, `**` matches any number of them. Only the directories the pattern can match are walked.
+    pub fn find_files(&self, base_dir: &Path, pattern: &str) -> Result<Vec<PathBuf>, TagFileError> {
+        let excluded = [
+            Workspace::get_tagfile_file_name(&self.name), Workspace::get_workspace_file_name(&self.name), Workspace::get_snapshot_file_name(&self.name)
+        ];
+        scan::find_matching_files(base_dir, pattern, &excluded).map_err(|e| TagFileError::BadPath(format!("Invalid pattern: {}", e)))
     }
 
     /// Removes the given string(s) as a tag from a file. If the file does not have the tag/any tags, does nothing.
     pub fn remove_tag_from_file(&mut self, path_to_file: PathBuf, tag_1: String, tag_2: Option<String>) -> Result<(), TagFileError> {
         let parent_dir: &Path = path_to_file.parent().ok_or(TagFileError::BadPath("Invalid Path".to_string()))?;
-        let parent_dir_cannonical = parent_dir.canonicalize().map_err(|_| TagFileError::BadPath("Invalid Path, canonical dir".to_string()))?;
+        let parent_dir_cannonical = self.canonical_dir(parent_dir).map_err(|_| TagFileError::BadPath("Invalid Path, canonical dir".to_string()))?;
 
         if parent_dir_cannonical.strip_prefix(&self.root_folder).is_err() {
             return Err(TagFileError::BadPath("Path not within workspace".to_string()));
         }
 
-        let tag: Tag = if tag_2.is_none() {
-            Tag::Simple(tag_1.clone()) //clone so that tag_cache can update with original strings
-        }
-        else {
-            Tag::KV(tag_1.clone(), tag_2.clone().unwrap())
+        let tag: Tag = match tag_2 {
+            None => Tag::Simple(tag_1),
+            Some(tag_2) => Tag::KV(tag_1, tag_2),
         };
 
         // If tagfile exists, attempt to remove tag. If no tagfile, silently do nothing.
-        if let Some(tf) = self.all_tagfiles.get_mut(&parent_dir_cannonical.join(Workspace::get_tagfile_file_name(&self.name))) {
+        let path_to_tagfile = parent_dir_cannonical.join(Workspace::get_tagfile_file_name(&self.name));
+        let file_name = Workspace::file_name_of(&path_to_file)?;
+        if let Some(tf) = self.get_tagfile_mut(&path_to_tagfile)? {
+            let old_tags = tf.get_symbol_tags_for_filename(&file_name);
             tf.remove_tag_from_file_in_self(&path_to_file, &tag)?;
+            self.reindex_file(&path_to_tagfile, &file_name, &old_tags);
+            self.record_change(&path_to_tagfile, &file_name, &old_tags);
+            self.tagfile_changed(&path_to_tagfile)?;
         }
 
         // No need to "rebuild" tag cache as tag may need to be used elsewhere... just return
         Ok(())
     }
 
-    pub fn get_tags_for_file_name(&self, full_path_to_file: PathBuf) -> Result<Vec<Tag>, WorkspaceError> {
+    /// Moves (or renames) a file on disk, and moves its tags along with it. Both paths must be within the workspace, and the destination directory must exist.
+    /// The TagFiles involved are written once each, after both were changed. Tags the destination had, if it existed, are replaced by those of the moved file.
+    pub fn move_file(&mut self, from: PathBuf, to: PathBuf) -> Result<(), TagFileError> {
+        let (from_tagfile, from_name) = self.locate_file(&from)?;
+        let (to_tagfile, to_name) = self.locate_file(&to)?;
+        std::fs::rename(&from, &to).map_err(TagFileError::Io)?;
+        self.clear_path_cache(); // In case a directory was moved
+
+        self.begin_batch();
+        let relinked = self.relink_file(&from_tagfile, &from_name, &to_tagfile, &to_name, &to);
+        let committed = self.commit_batch();
+        relinked?;
+        committed
+    }
+
+    /// Renames a file on disk, keeping its tags. The new name must be a plain file name, in the same directory.
+    pub fn rename_file(&mut self, path_to_file: PathBuf, new_name: &str) -> Result<(), TagFileError> {
+        if new_name.is_empty() || Path::new(new_name).file_name().is_none_or(|name| name != new_name) {
+            return Err(TagFileError::BadPath(format!("Invalid new file name '{}'", new_name)));
+        }
+        let to = path_to_file.with_file_name(new_name);
+        self.move_file(path_to_file, to)
+    }
+
+    /// Re-links the tags of files that were renamed or moved by another program, using the fingerprints recorded when they were tagged. Returns every (old path, new path) re-linked.
+    /// Each TagFile's directory is listed once to find the tagged files that are gone. If there are any, a single sweep of the workspace tree (on the scan threads,
+    /// stat'ing only files whose inode matches) finds where they went. Files without a fingerprint, matching no file or several, or moved onto a tagged file are left as they are.
+    /// Loads every TagFile first in lazy mode. Each changed TagFile is written once.
+    pub fn reconcile(&mut self) -> Result<Vec<(PathBuf, PathBuf)>, TagFileError> {
+        self.load_all_if_lazy();
+        let orphans = self.find_orphans();
+        if orphans.is_empty() {
+            return Ok(Vec::new());
+        }
+        let wanted: HashSet<Fingerprint> = orphans.keys().copied().collect();
+        let found = scan::find_fingerprints(&self.root_folder, &wanted, scan::resolve_thread_count(self.scan_threads));
+
+        self.begin_batch();
+        let relinked = self.relink_orphans(orphans, found);
+        let committed = self.commit_batch();
+        let relinked = relinked?;
+        committed?;
+        Ok(relinked)
+    }
+
+    /// Changes the tags of every file of the workspace, such as renaming, merging or deleting tags or keys. Rules apply in order, each to the tags left by the previous ones.
+    /// The files to change are found through the tag index, and only their TagFiles are rewritten, once each, atomically and on the scan threads (see set_scan_threads).
+    /// Loads every TagFile first in lazy mode. Nothing is changed if a rule would create an invalid tag. Returns how many files and TagFiles changed.
+    pub fn retag(&mut self, rules: &[Retag]) -> Result<RetagReport, TagFileError> {
+        for rule in rules {
+            rule.validate()?;
+        }
+        self.load_all_if_lazy();
+        let rules: Vec<SymbolRetag> = {
+            let mut symbols = self.symbols.write();
+            rules.iter().filter_map(|rule| rule.intern(&mut symbols)).collect()
+        };
+        let affected = self.find_retagged(&rules);
+
+        self.begin_batch();
+        let report = self.retag_files(affected, &rules);
+        let committed = self.commit_batch();
+        let report = report?;
+        committed?;
+        Ok(report)
+    }
+
+    /// Replaces a tag by another on every file carrying it. See retag.
+    pub fn rename_tag(&mut self, from: Tag, to: Tag) -> Result<RetagReport, TagFileError> {
+        self.retag(&[Retag::Rename(from, to)])
+    }
+
+    /// Replaces several tags by a single one on every file carrying any of them, which is kept once per file. See retag.
+    pub fn merge_tags(&mut self, from: Vec<Tag>, into: Tag) -> Result<RetagReport, TagFileError> {
+        let rules: Vec<Retag> = from.into_iter().map(|tag| Retag::Rename(tag, into.clone())).collect();
+        self.retag(&rules)
+    }
+
+    /// Removes a tag from every file carrying it. See retag.
+    pub fn delete_tag(&mut self, tag: Tag) -> Result<RetagReport, TagFileError> {
+        self.retag(&[Retag::Delete(tag)])
+    }
+
+    pub fn get_tags_for_file_name(&mut self, full_path_to_file: PathBuf) -> Result<Vec<Tag>, WorkspaceError> {
         let parent_dir: &Path = &full_path_to_file.parent().ok_or(WorkspaceError::InvalidName("Invalid Path, parent dir".to_string()))?;
-        let full_parent_dir = parent_dir.canonicalize().map_err(|_| WorkspaceError::InvalidName("Invalid Path, canonical dir".to_string()))?;
+        let full_parent_dir = self.canonical_dir(parent_dir).map_err(|_| WorkspaceError::InvalidName("Invalid Path, canonical dir".to_string()))?;
         let file_name = full_path_to_file.file_name().ok_or(WorkspaceError::InvalidName("Invalid File Name".to_string()))?;
         let file_name = file_name.to_str().ok_or(WorkspaceError::InvalidName("Invalid File Name".to_string()))?.to_string();
 
         let path_to_tagfile = &full_parent_dir.join(Workspace::get_tagfile_file_name(&self.name));
-        if let Some(t) = self.all_tagfiles.get(path_to_tagfile) {
+        let tf = self.get_tagfile_mut(path_to_tagfile).map_err(|e| WorkspaceError::FileUnavailable(e.to_string()))?;
+        if let Some(t) = tf {
             Ok(t.get_all_tags_for_filename(&file_name))
         }
         else {
@@ -163,6 +553,25 @@ impl Workspace {
         }
     }
 
+    /// Returns the tags of every tagged file in a directory, by file name. Unlike calling get_tags_for_file_name for each file,
+    /// the directory is canonicalized and its TagFile looked up only once. Files without tags are left out.
+    pub fn get_tags_for_directory(&mut self, path_to_directory: PathBuf) -> Result<HashMap<String, Vec<Tag>>, WorkspaceError> {
+        let full_dir = self.canonical_dir(&path_to_directory).map_err(|_| WorkspaceError::InvalidName("Invalid Path, canonical dir".to_string()))?;
+        let path_to_tagfile = full_dir.join(Workspace::get_tagfile_file_name(&self.name));
+        let tf = self.get_tagfile_mut(&path_to_tagfile).map_err(|e| WorkspaceError::FileUnavailable(e.to_string()))?;
+        Ok(tf.map(|tf| tf.get_mapping()).unwrap_or_default())
+    }
+
+    /// Same as get_tags_for_directory for several directories, keyed by the paths as given. Fails if any directory is invalid.
+    pub fn get_tags_for_directories(&mut self, paths_to_directories: Vec<PathBuf>) -> Result<HashMap<PathBuf, HashMap<String, Vec<Tag>>>, WorkspaceError> {
+        let mut rv = HashMap::with_capacity(paths_to_directories.len());
+        for path_to_directory in paths_to_directories {
+            let mapping = self.get_tags_for_directory(path_to_directory.clone())?;
+            rv.insert(path_to_directory, mapping);
+        }
+        Ok(rv)
+    }
+
     pub fn get_name(&self) -> &str {
         &self.name.as_str()
     }
@@ -172,37 +581,45 @@ impl Workspace {
     }
 
     /// Searches workspace's open TagFiles for tags whose text is composed of the provided value (whitespace-stripped). Returns a map between relative file paths and a vector of ALL their tags.
-    pub fn query_fuzzy(&self, text: &str, simple: bool, key: bool, value: bool) -> HashMap<String, Vec<Tag>> {
+    /// Uses the workspace's tag index, so only tags containing every trigram of the text are compared.
+    pub fn query_fuzzy(&mut self, text: &str, simple: bool, key: bool, value: bool) -> HashMap<String, Vec<Tag>> {
+        self.load_all_if_lazy();
+        let _span = profile::span(Phase::Query);
+        let text: String = text.to_lowercase();
+        let text: &str = text.trim();
+        let hits = self.index().lookup_fuzzy(text, simple, key, value);
+        self.collect_query_results(hits)
+    }
+
+    /// Same as query_fuzzy, but scans every open TagFile instead of using the tag index. Kept as a reference for tests and benchmarks.
+    pub fn query_fuzzy_unindexed(&mut self, text: &str, simple: bool, key: bool, value: bool) -> HashMap<String, Vec<Tag>> {
+        self.load_all_if_lazy();
+        let _span = profile::span(Phase::Query);
         let text: String = text.to_lowercase();
         let text: &str = text.trim();
         let mut rv: HashMap<String, Vec<Tag>> = HashMap::new();
-        for (_path, tf) in &self.all_tagfiles {
-            let Some(parent_dir_name) = tf.get_tagfile_owning_dir() else {
-                continue;
-            };
-            let Ok(parent_dir_name) = parent_dir_name.canonicalize() else {
+        for (path_to_tagfile, tf) in &self.all_tagfiles {
+            // Keys are cannonical already
+            let Some(parent_dir_path) = self.get_relative_dir_of_tagfile(path_to_tagfile) else {
                 continue;
             };
-            let Ok(parent_dir_name) = parent_dir_name.strip_prefix(&self.root_folder) else {
-                continue;
-            };
-            let parent_dir_path = Path::new(".").join(parent_dir_name);
 
+            let symbols = self.symbols.read();
             for (file_name,tags) in tf.get_mapping_ref() {
                 let mut vec: Vec<Tag>= Vec::new();
 
                 let tag_in = tags.iter().any(|tag| {
                     match tag {
-                        Tag::Simple(s) => simple && s.to_lowercase().contains(text),
-                        Tag::KV(k, v) => (key && k.to_lowercase().contains(text)) || (value && v.to_lowercase().contains(text)),
+                        SymbolTag::Simple(s) => simple && symbols.resolve(*s).to_lowercase().contains(text),
+                        SymbolTag::KV(k, v) => (key && symbols.resolve(*k).to_lowercase().contains(text)) || (value && symbols.resolve(*v).to_lowercase().contains(text)),
                     }
                 });
                 if tag_in {
-                    vec = tags.clone();
+                    vec = tags.iter().map(|tag| tag.resolve(&symbols)).collect();
                 }
 
                 if !vec.is_empty() {
-                    let used_file_path = parent_dir_path.join(Path::new(&file_name)).to_string_lossy().into_owned();
+                    let used_file_path = parent_dir_path.join(Path::new(symbols.resolve(*file_name))).to_string_lossy().into_owned();
                     rv.insert(used_file_path, vec);
                 }
             }
@@ -211,35 +628,48 @@ impl Workspace {
     }
 
     /// Searches workspace's open TagFiles for tags whose text matches the provided value. Returns a map between relative file paths and a vector of ALL their tags.
-    pub fn query_exact(&self, text: &str, simple: bool, key: bool, value: bool) -> HashMap<String, Vec<Tag>> {
+    /// Uses the workspace's tag index, so only the matching files are visited.
+    pub fn query_exact(&mut self, text: &str, simple: bool, key: bool, value: bool) -> HashMap<String, Vec<Tag>> {
+        self.load_all_if_lazy();
+        let _span = profile::span(Phase::Query);
+        // A string that was never interned is not the text of any tag
+        let Some(term) = self.symbols.get(text) else {
+            return HashMap::new();
+        };
+        let hits = self.index().lookup_exact(term, simple, key, value);
+        self.collect_query_results(hits)
+    }
+
+    /// Same as query_exact, but scans every open TagFile instead of using the tag index. Kept as a reference for tests and benchmarks.
+    pub fn query_exact_unindexed(&mut self, text: &str, simple: bool, key: bool, value: bool) -> HashMap<String, Vec<Tag>> {
+        self.load_all_if_lazy();
+        let _span = profile::span(Phase::Query);
+        let Some(text) = self.symbols.get(text) else {
+            return HashMap::new();
+        };
         let mut rv: HashMap<String, Vec<Tag>> = HashMap::new();
-        for (_path, tf) in &self.all_tagfiles {
-            let Some(parent_dir_name) = tf.get_tagfile_owning_dir() else {
-                continue;
-            };
-            let Ok(parent_dir_name) = parent_dir_name.canonicalize() else {
-                continue;
-            };
-            let Ok(parent_dir_name) = parent_dir_name.strip_prefix(&self.root_folder) else {
+        for (path_to_tagfile, tf) in &self.all_tagfiles {
+            // Keys are cannonical already
+            let Some(parent_dir_path) = self.get_relative_dir_of_tagfile(path_to_tagfile) else {
                 continue;
             };
-            let parent_dir_path = Path::new(".").join(parent_dir_name);
             
+            let symbols = self.symbols.read();
             for (file_name,tags) in tf.get_mapping_ref() {
                 let mut vec: Vec<Tag>= Vec::new();
 
                 let tag_in = tags.iter().any(|tag| {
                     match tag {
-                        Tag::Simple(s) => simple && s == text,
-                        Tag::KV(k, v) => (key && k == text) || (value && v == text),
+                        SymbolTag::Simple(s) => simple && *s == text,
+                        SymbolTag::KV(k, v) => (key && *k == text) || (value && *v == text),
                     }
                 });
                 if tag_in {
-                    vec = tags.clone();
+                    vec = tags.iter().map(|tag| tag.resolve(&symbols)).collect();
                 }
 
                 if !vec.is_empty() {
-                    let used_file_path = parent_dir_path.join(Path::new(&file_name)).to_string_lossy().into_owned();
+                    let used_file_path = parent_dir_path.join(Path::new(symbols.resolve(*file_name))).to_string_lossy().into_owned();
                     rv.insert(used_file_path, vec);
                 }
             }
@@ -247,6 +677,64 @@ impl Workspace {
         rv
     }
 
+    /// Searches with a compound query over exact tag text, such as `Texture:Verso AND NOT Due:Today OR Personal` (see Query for the syntax),
+    /// in a single pass over the tag index. Returns a map between relative file paths and a vector of ALL their tags, or why the query could not be parsed.
+    pub fn query(&mut self, expr: &str) -> Result<HashMap<String, Vec<Tag>>, QueryError> {
+        let query = Query::parse(expr)?;
+        self.load_all_if_lazy();
+        let _span = profile::span(Phase::Query);
+        let index = self.index();
+        let hits = query.evaluate(index, &self.symbols.read());
+        Ok(self.collect_query_results(hits))
+    }
+
+    /// Same as query_exact, but returns the results as a QueryCursor: sorted by path, and only turned into strings as they are fetched.
+    pub fn query_exact_cursor(&mut self, text: &str, simple: bool, key: bool, value: bool) -> QueryCursor {
+        self.load_all_if_lazy();
+        let _span = profile::span(Phase::Query);
+        let Some(term) = self.symbols.get(text) else {
+            return self.cursor_from_hits(HashMap::new());
+        };
+        let hits = self.index().lookup_exact(term, simple, key, value);
+        self.cursor_from_hits(hits)
+    }
+
+    /// Same as query_fuzzy, but returns the results as a QueryCursor: sorted by path, and only turned into strings as they are fetched.
+    pub fn query_fuzzy_cursor(&mut self, text: &str, simple: bool, key: bool, value: bool) -> QueryCursor {
+        self.load_all_if_lazy();
+        let _span = profile::span(Phase::Query);
+        let text: String = text.to_lowercase();
+        let text: &str = text.trim();
+        let hits = self.index().lookup_fuzzy(text, simple, key, value);
+        self.cursor_from_hits(hits)
+    }
+
+    /// Same as query, but returns the results as a QueryCursor: sorted by path, and only turned into strings as they are fetched.
+    pub fn query_cursor(&mut self, expr: &str) -> Result<QueryCursor, QueryError> {
+        let query = Query::parse(expr)?;
+        self.load_all_if_lazy();
+        let _span = profile::span(Phase::Query);
+        let index = self.index();
+        let hits = query.evaluate(index, &self.symbols.read());
+        Ok(self.cursor_from_hits(hits))
+    }
+
+    /// Returns at most limit tag texts starting with a prefix (ignoring case), most used first, with the number of files using them: for autocompletion.
+    /// A prefix without ':' completes simple tags and keys; `Key:prefix` completes the values used with Key, as `Key:Value`.
+    /// Counts are kept with the tag index, so after the first call (which builds it) only the matching tags are visited.
+    pub fn suggest(&mut self, prefix: &str, limit: usize) -> Vec<(String, usize)> {
+        self.load_all_if_lazy();
+        let _span = profile::span(Phase::Query);
+        self.index().stats().suggest(prefix, limit, &self.symbols.read())
+    }
+
+    /// Returns every simple and key-value tag of the workspace with the number of files carrying it, sorted by text
+    pub fn tag_counts(&mut self) -> Vec<(Tag, usize)> {
+        self.load_all_if_lazy();
+        let _span = profile::span(Phase::Query);
+        self.index().stats().tag_counts(&self.symbols.read())
+    }
+
     /// Attempts to find (and create) a workspace.
     pub fn discover_workspace_above(path: &Path, name: String) -> Option<Workspace> {
         if !Workspace::is_name_valid(&name) {
@@ -280,8 +768,445 @@ impl Workspace {
     }
 }
 
+impl Drop for Workspace {
+    /// Writes any changes not yet written, such as from a batch that was never committed
+    fn drop(&mut self) {
+        let _ = self.flush();
+    }
+}
+
 // Private / Helper Functions
 impl Workspace {
+    fn new_in_dir(cannon_dir: PathBuf, name: &String) -> Workspace {
+        Workspace {
+            root_folder: cannon_dir,
+            name: name.clone(),
+            all_tagfiles: HashMap::new(),
+            symbols: SymbolTable::new(),
+            index: OnceLock::new(),
+            scan_threads: 1,
+            lazy_tagfiles: None,
+            batch_depth: 0,
+            dirty_tagfiles: HashSet::new(),
+            durability: Durability::default(),
+            tagfile_format: TagFileFormat::default(),
+            changes: None,
+            path_cache: LruCache::new(PATH_CACHE_SIZE),
+            #[cfg(feature = "watch")]
+            watcher: None
+        }
+    }
+
+    /// Loads every TagFile if the workspace is in lazy mode, for operations that need all of them
+    fn load_all_if_lazy(&mut self) {
+        if self.lazy_tagfiles.is_some() {
+            self.scan_for_tagfiles_cached();
+        }
+    }
+
+    /// Returns an open TagFile. In lazy mode, loads it from disk if needed (and if it exists).
+    /// Errors only if loading it made room by dropping a TagFile with unsaved changes, which then could not be written.
+    fn get_tagfile_mut(&mut self, path_to_tagfile: &Path) -> Result<Option<&mut TagFile>, TagFileError> {
+        let Some(lazy_tagfiles) = self.lazy_tagfiles.as_mut() else {
+            return Ok(self.all_tagfiles.get_mut(path_to_tagfile));
+        };
+        if lazy_tagfiles.peek(path_to_tagfile).is_none() {
+            let Some(found) = scan::load_tagfile(path_to_tagfile.to_path_buf(), false, &self.symbols) else {
+                return Ok(None);
+            };
+            let evicted = lazy_tagfiles.insert(path_to_tagfile.to_path_buf(), found.tagfile);
+            Workspace::save_evicted(&mut self.dirty_tagfiles, evicted, self.durability)?;
+        }
+        Ok(self.lazy_tagfiles.as_mut().unwrap().get_mut(path_to_tagfile))
+    }
+
+    /// Returns an open TagFile, without loading it
+    fn peek_tagfile(&self, path_to_tagfile: &Path) -> Option<&TagFile> {
+        match self.lazy_tagfiles.as_ref() {
+            Some(lazy_tagfiles) => lazy_tagfiles.peek(path_to_tagfile),
+            None => self.all_tagfiles.get(path_to_tagfile),
+        }
+    }
+
+    /// Adds a newly created TagFile to the open TagFiles
+    fn insert_tagfile(&mut self, path_to_tagfile: PathBuf, tf: TagFile) -> Result<(), TagFileError> {
+        match self.lazy_tagfiles.as_mut() {
+            Some(lazy_tagfiles) => {
+                let evicted = lazy_tagfiles.insert(path_to_tagfile, tf);
+                Workspace::save_evicted(&mut self.dirty_tagfiles, evicted, self.durability)
+            },
+            None => {
+                self.all_tagfiles.insert(path_to_tagfile, tf);
+                Ok(())
+            },
+        }
+    }
+
+    /// Writes the open TagFiles to disk on up to threads threads, each taking an equal share. Returns the result of each write, in order (Ok for None).
+    fn save_tagfiles(tagfiles: &[Option<&TagFile>], threads: usize, durability: Durability) -> Vec<Result<(), TagFileError>> {
+        let save = move |tf: &Option<&TagFile>| tf.map_or(Ok(()), |tf| tf.save_tagfile_to_disk(durability));
+        if threads <= 1 || tagfiles.len() <= 1 {
+            return tagfiles.iter().map(save).collect();
+        }
+        let chunk_size = tagfiles.len().div_ceil(threads);
+        std::thread::scope(|scope| {
+            let handles: Vec<_> = tagfiles.chunks(chunk_size)
+                .map(|chunk| scope.spawn(move || chunk.iter().map(save).collect::<Vec<_>>()))
+                .collect();
+            handles.into_iter().flat_map(|handle| handle.join().unwrap()).collect()
+        })
+    }
+
+    /// Writes the TagFiles dropped from the lazy cache that had unsaved changes
+    fn save_evicted(dirty_tagfiles: &mut HashSet<PathBuf>, evicted: Vec<(PathBuf, TagFile)>, durability: Durability) -> Result<(), TagFileError> {
+        for (path_to_tagfile, tf) in evicted {
+            if dirty_tagfiles.remove(&path_to_tagfile) {
+                tf.save_tagfile_to_disk(durability)?;
+            }
+        }
+        Ok(())
+    }
+
+    /// Records that a TagFile changed in memory, and writes it to disk unless a batch is in progress
+    fn tagfile_changed(&mut self, path_to_tagfile: &Path) -> Result<(), TagFileError> {
+        self.dirty_tagfiles.insert(path_to_tagfile.to_path_buf());
+        if self.batch_depth > 0 {
+            return Ok(());
+        }
+        self.flush()
+    }
+
+    /// Leaves lazy mode, returning the TagFiles with unsaved changes so that a scan does not replace them with their older version on disk
+    fn take_dirty_tagfiles(&mut self) -> Vec<(PathBuf, TagFile)> {
+        let mut lazy_tagfiles = self.lazy_tagfiles.take();
+        self.dirty_tagfiles.iter()
+            .filter_map(|path_to_tagfile| {
+                let tf = match lazy_tagfiles.as_mut() {
+                    Some(lazy_tagfiles) => lazy_tagfiles.remove(path_to_tagfile),
+                    None => self.all_tagfiles.remove(path_to_tagfile),
+                };
+                tf.map(|tf| (path_to_tagfile.clone(), tf))
+            })
+            .collect()
+    }
+
+    /// Returns the tag index, building it from every open TagFile if needed
+    fn index(&self) -> &TagIndex {
+        self.index.get_or_init(|| {
+            let _span = profile::span(Phase::Index);
+            let mut index = TagIndex::new(self.root_folder.clone());
+            let symbols = self.symbols.read();
+            for (path_to_tagfile, tf) in &self.all_tagfiles {
+                index.add_tagfile(path_to_tagfile, tf, &symbols);
+            }
+            index
+        })
+    }
+
+    /// Drops the tag index, so that the next query rebuilds it from every open TagFile
+    fn reset_index(&mut self) {
+        self.index = OnceLock::new();
+    }
+
+    /// Brings the tag index (if built) up to date after a file's tags changed in memory
+    fn reindex_file(&mut self, path_to_tagfile: &Path, file_name: &str, old_tags: &[SymbolTag]) {
+        if self.index.get().is_none() {
+            return;
+        }
+        // A file name that was never interned has no tags, before or after
+        let Some(file_name_symbol) = self.symbols.get(file_name) else {
+            return;
+        };
+        let new_tags = self.get_tags_in_tagfile(path_to_tagfile, file_name);
+        let symbols = self.symbols.read();
+        if let Some(index) = self.index.get_mut() {
+            index.update_file(path_to_tagfile, file_name_symbol, old_tags, &new_tags, &symbols);
+        }
+    }
+
+    /// Remembers that a file's tags were changed, for take_changes, if they differ from old_tags and changes are tracked
+    fn record_change(&mut self, path_to_tagfile: &Path, file_name: &str, old_tags: &[SymbolTag]) {
+        if self.changes.is_none() || self.get_tags_in_tagfile(path_to_tagfile, file_name) == old_tags {
+            return;
+        }
+        if let Some(changes) = self.changes.as_mut() {
+            changes.push((path_to_tagfile.to_path_buf(), file_name.to_string()));
+        }
+    }
+
+    /// Path::canonicalize for a directory given by a caller, through path_cache. Relative paths are not cached, since they depend on the current directory.
+    fn canonical_dir(&mut self, dir: &Path) -> std::io::Result<PathBuf> {
+        if let Some(cannon_dir) = self.path_cache.get_mut(dir) {
+            profile::count(Counter::PathCacheHits, 1);
+            return Ok(cannon_dir.clone());
+        }
+        let cannon_dir = profile::canonicalize(dir)?;
+        if dir.is_absolute() {
+            self.path_cache.insert(dir.to_path_buf(), cannon_dir.clone());
+        }
+        Ok(cannon_dir)
+    }
+
+    fn clear_path_cache(&mut self) {
+        self.path_cache = LruCache::new(PATH_CACHE_SIZE);
+    }
+
+    /// Returns the (cannonical) path of the TagFile holding a file's tags, and the file's name. Errors if the file is not within the workspace.
+    fn locate_file(&mut self, path_to_file: &Path) -> Result<(PathBuf, String), TagFileError> {
+        let parent_dir: &Path = path_to_file.parent().ok_or(TagFileError::BadPath("Invalid Path, parent dir".to_string()))?;
+        let full_parent_dir = self.canonical_dir(parent_dir).map_err(|_| TagFileError::BadPath("Invalid Path, canonical dir".to_string()))?;
+        if full_parent_dir.strip_prefix(&self.root_folder).is_err() {
+            return Err(TagFileError::BadPath("Path not within workspace".to_string()));
+        }
+        Ok((full_parent_dir.join(Workspace::get_tagfile_file_name(&self.name)), Workspace::file_name_of(path_to_file)?))
+    }
+
+    /// Moves the tags and fingerprint of a file to another (existing) file, which is given by path so that its fingerprint can be taken.
+    /// Creates the destination TagFile if needed. Returns false if the source file had no tags.
+    fn relink_file(&mut self, from_tagfile: &Path, from_name: &str, to_tagfile: &Path, to_name: &str, path_to_destination: &Path) -> Result<bool, TagFileError> {
+        let Some(from_symbol) = self.symbols.get(from_name) else {
+            return Ok(false);
+        };
+        let Some((tags, fingerprint)) = self.get_tagfile_mut(from_tagfile)?.and_then(|tf| tf.take_entry(from_symbol)) else {
+            return Ok(false);
+        };
+        self.reindex_file(from_tagfile, from_name, &tags);
+        self.record_change(from_tagfile, from_name, &tags);
+        self.tagfile_changed(from_tagfile)?;
+
+        let to_symbol = self.symbols.intern(to_name);
+        let fingerprint = Fingerprint::of(path_to_destination).or(fingerprint);
+        let old_tags = match self.get_tagfile_mut(to_tagfile)? {
+            Some(tf) => {
+                let old_tags = tf.get_symbol_tags_for_filename(to_name);
+                tf.insert_entry(to_symbol, tags, fingerprint);
+                old_tags
+            },
+            None => {
+                let mut tf = TagFile::empty(to_tagfile.to_path_buf(), self.tagfile_format, &self.symbols);
+                tf.insert_entry(to_symbol, tags, fingerprint);
+                self.insert_tagfile(to_tagfile.to_path_buf(), tf)?;
+                Vec::new()
+            },
+        };
+        self.reindex_file(to_tagfile, to_name, &old_tags);
+        self.record_change(to_tagfile, to_name, &old_tags);
+        self.tagfile_changed(to_tagfile)?;
+        Ok(true)
+    }
+
+    /// Returns the tagged files with a fingerprint that are missing from their directory, as (TagFile path, file name), by fingerprint
+    fn find_orphans(&self) -> HashMap<Fingerprint, Vec<(PathBuf, String)>> {
+        let mut orphans: HashMap<Fingerprint, Vec<(PathBuf, String)>> = HashMap::new();
+        let symbols = self.symbols.read();
+        for (path_to_tagfile, tf) in &self.all_tagfiles {
+            if tf.fingerprints.is_empty() {
+                continue;
+            }
+            let Some(Ok(entries)) = path_to_tagfile.parent().map(std::fs::read_dir) else {
+                continue;
+            };
+            let present: HashSet<std::ffi::OsString> = entries.filter_map(|e| e.ok()).map(|entry| entry.file_name()).collect();
+            for (file_name, fingerprint) in &tf.fingerprints {
+                let file_name = symbols.resolve(*file_name);
+                if !present.contains(std::ffi::OsStr::new(file_name)) {
+                    orphans.entry(*fingerprint).or_default().push((path_to_tagfile.clone(), file_name.to_string()));
+                }
+            }
+        }
+        orphans
+    }
+
+    /// Moves the tags of each orphan to the one file found with its fingerprint, for reconcile
+    fn relink_orphans(&mut self, orphans: HashMap<Fingerprint, Vec<(PathBuf, String)>>, found: HashMap<Fingerprint, Vec<PathBuf>>) -> Result<Vec<(PathBuf, PathBuf)>, TagFileError> {
+        let mut relinked: Vec<(PathBuf, PathBuf)> = Vec::new();
+        for (fingerprint, orphans) in orphans {
+            let ([(from_tagfile, from_name)], Some([to])) = (orphans.as_slice(), found.get(&fingerprint).map(Vec::as_slice)) else {
+                continue; // Not found, or ambiguous
+            };
+            let Ok((to_tagfile, to_name)) = self.locate_file(to) else {
+                continue;
+            };
+            // Never replace the tags of a file that has its own
+            if !self.get_tags_in_tagfile(&to_tagfile, &to_name).is_empty() {
+                continue;
+            }
+            if self.relink_file(from_tagfile, from_name, &to_tagfile, &to_name, to)? {
+                let from_dir = from_tagfile.parent().unwrap_or(&self.root_folder);
+                relinked.push((from_dir.join(from_name), to.clone()));
+            }
+        }
+        Ok(relinked)
+    }
+
+    /// Adds tags to files of a single directory, for apply_bulk, which checked the paths and tags. Returns the number of files whose tags changed.
+    fn apply_bulk_in_tagfile(&mut self, path_to_tagfile: &Path, files_and_tags: Vec<(PathBuf, Vec<Tag>)>) -> Result<usize, TagFileError> {
+        let mut changed = 0;
+        for (path_to_file, tags) in files_and_tags {
+            let file_name = Workspace::file_name_of(&path_to_file)?;
+            let old_tags = match self.get_tagfile_mut(path_to_tagfile)? {
+                Some(tf) => {
+                    let old_tags = tf.get_symbol_tags_for_filename(&file_name);
+                    Workspace::add_tags_in_tagfile(tf, &path_to_file, tags)?;
+                    old_tags
+                },
+                None => {
+                    let mut tf = TagFile::empty(path_to_tagfile.to_path_buf(), self.tagfile_format, &self.symbols);
+                    Workspace::add_tags_in_tagfile(&mut tf, &path_to_file, tags)?;
+                    self.insert_tagfile(path_to_tagfile.to_path_buf(), tf)?;
+                    Vec::new()
+                },
+            };
+            if self.get_tags_in_tagfile(path_to_tagfile, &file_name) != old_tags {
+                changed += 1;
+                self.reindex_file(path_to_tagfile, &file_name, &old_tags);
+                self.record_change(path_to_tagfile, &file_name, &old_tags);
+                self.tagfile_changed(path_to_tagfile)?;
+            }
+        }
+        Ok(changed)
+    }
+
+    /// Checks a tag the way TagFile::add_tag_to_file_in_self does, without changing anything
+    fn check_tag(tag: &Tag) -> Result<(), TagFileError> {
+        let texts = match tag {
+            Tag::Simple(s) => vec![s],
+            Tag::KV(k, v) => vec![k, v],
+        };
+        match texts.into_iter().find(|text| text.trim().is_empty()) {
+            Some(text) => Err(TagFileError::BadString(text.clone())),
+            None => Ok(()),
+        }
+    }
+
+    fn add_tags_in_tagfile(tf: &mut TagFile, path_to_file: &Path, tags: Vec<Tag>) -> Result<(), TagFileError> {
+        for tag in tags {
+            tf.add_tag_to_file_in_self(path_to_file, tag)?;
+        }
+        tf.record_fingerprint(path_to_file);
+        Ok(())
+    }
+
+    /// Returns the files that retag rules may change, as (path to TagFile, file names), from the tag index
+    fn find_retagged(&self, rules: &[SymbolRetag]) -> HashMap<PathBuf, HashSet<Symbol>> {
+        let index = self.index();
+        let mut rv: HashMap<PathBuf, HashSet<Symbol>> = HashMap::new();
+        for rule in rules {
+            let Some(postings) = index.postings(rule.term()) else {
+                continue;
+            };
+            for (dir_id, file_names) in postings {
+                rv.entry(index.dir_path(*dir_id).to_path_buf()).or_default().extend(file_names.iter().copied());
+            }
+        }
+        rv
+    }
+
+    /// Applies retag rules to the given files, in memory, marking their TagFiles as changed. Returns how many files and TagFiles changed.
+    fn retag_files(&mut self, affected: HashMap<PathBuf, HashSet<Symbol>>, rules: &[SymbolRetag]) -> Result<RetagReport, TagFileError> {
+        let mut report = RetagReport::default();
+        for (path_to_tagfile, file_names) in affected {
+            let mut changed = Vec::new();
+            let Some(tf) = self.get_tagfile_mut(&path_to_tagfile)? else {
+                continue;
+            };
+            for file_name in file_names {
+                let Some(old_tags) = tf.mapping.get(&file_name).cloned() else {
+                    continue;
+                };
+                let new_tags = SymbolRetag::apply_all(rules, &old_tags);
+                if new_tags != old_tags {
+                    let fingerprint = tf.fingerprints.get(&file_name).copied();
+                    tf.insert_entry(file_name, new_tags, fingerprint);
+                    changed.push((file_name, old_tags));
+                }
+            }
+            if changed.is_empty() {
+                continue;
+            }
+            report.files += changed.len();
+            report.tagfiles += 1;
+            for (file_name, old_tags) in changed {
+                let file_name = self.symbols.read().resolve(file_name).to_string();
+                self.reindex_file(&path_to_tagfile, &file_name, &old_tags);
+                self.record_change(&path_to_tagfile, &file_name, &old_tags);
+            }
+            self.tagfile_changed(&path_to_tagfile)?;
+        }
+        Ok(report)
+    }
+
+    /// Returns the tags of a file in an open TagFile, or an empty vector if either is unknown
+    fn get_tags_in_tagfile(&self, path_to_tagfile: &Path, file_name: &str) -> Vec<SymbolTag> {
+        match self.peek_tagfile(path_to_tagfile) {
+            Some(tf) => tf.get_symbol_tags_for_filename(file_name),
+            None => Vec::new(),
+        }
+    }
+
+    /// Builds a query result (relative file path to ALL its tags) from index hits
+    fn collect_query_results(&self, hits: HashMap<DirId, HashSet<Symbol>>) -> HashMap<String, Vec<Tag>> {
+        profile::count(Counter::QueryHits, hits.values().map(|file_names| file_names.len() as u64).sum());
+        let mut rv: HashMap<String, Vec<Tag>> = HashMap::new();
+        let index = self.index();
+        let symbols = self.symbols.read();
+        for (dir_id, file_names) in hits {
+            let Some(tf) = self.all_tagfiles.get(index.dir_path(dir_id)) else {
+                continue;
+            };
+            let Some(parent_dir_path) = index.dir_prefix(dir_id) else {
+                continue;
+            };
+
+            for file_name in file_names {
+                let Some(tags) = tf.get_mapping_ref().get(&file_name) else {
+                    continue;
+                };
+                let used_file_path = parent_dir_path.join(Path::new(symbols.resolve(file_name))).to_string_lossy().into_owned();
+                rv.insert(used_file_path, tags.iter().map(|tag| tag.resolve(&symbols)).collect());
+            }
+        }
+        rv
+    }
+
+    /// Builds a QueryCursor from index hits. Tags are copied in their interned form, so no string is built until the results are fetched.
+    fn cursor_from_hits(&self, hits: HashMap<DirId, HashSet<Symbol>>) -> QueryCursor {
+        profile::count(Counter::QueryHits, hits.values().map(|file_names| file_names.len() as u64).sum());
+        let mut dirs: Vec<PathBuf> = Vec::with_capacity(hits.len());
+        let mut cursor_hits: Vec<(usize, Symbol, Vec<SymbolTag>)> = Vec::new();
+        let index = self.index();
+        for (dir_id, file_names) in hits {
+            let Some(tf) = self.all_tagfiles.get(index.dir_path(dir_id)) else {
+                continue;
+            };
+            let Some(parent_dir_path) = index.dir_prefix(dir_id) else {
+                continue;
+            };
+
+            let dir = dirs.len();
+            dirs.push(parent_dir_path.to_path_buf());
+            for file_name in file_names {
+                let Some(tags) = tf.get_mapping_ref().get(&file_name) else {
+                    continue;
+                };
+                cursor_hits.push((dir, file_name, tags.clone()));
+            }
+        }
+        QueryCursor::new(self.symbols.clone(), dirs, cursor_hits)
+    }
+
+    /// Returns the directory owning a (cannonical) TagFile path, relative to the workspace root and prefixed with "."
+    fn get_relative_dir_of_tagfile(&self, path_to_tagfile: &Path) -> Option<PathBuf> {
+        let parent_dir_name = path_to_tagfile.parent()?;
+        let parent_dir_name = parent_dir_name.strip_prefix(&self.root_folder).ok()?;
+        Some(Path::new(".").join(parent_dir_name))
+    }
+
+    fn file_name_of(path_to_file: &Path) -> Result<String, TagFileError> {
+        let file_name = path_to_file.file_name().ok_or(TagFileError::BadPath("Invalid File Name".to_string()))?;
+        Ok(file_name.to_str().ok_or(TagFileError::BadPath("Invalid File Name".to_string()))?.to_string())
+    }
+
     // TODO - fix
     fn is_name_valid(name: &String) -> bool {
         let invalid_workspace_name_chars: &str = "/*<>. ";
@@ -293,6 +1218,11 @@ impl Workspace {
         format!(".tagwksp_{}",name)
     }
 
+    /// Returns the file name of a workspace snapshot, given a workspace name
+    fn get_snapshot_file_name(workspace_name: &String) -> String {
+        format!(".tagsnap_{}", workspace_name)
+    }
+
     /// Returns the file name of a tag file, given a workspace name
     fn get_tagfile_file_name(workspace_name: &String) -> String {
         format!(".tag_{}", workspace_name)
@@ -506,6 +1436,39 @@ mod tests {
         assert_eq!(result[0], Tag::Simple("TODO".to_string()));
     }
 
+    #[test]
+    fn workspace_get_tags_for_directory() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        std::fs::create_dir(root_dir_path.join("subfolder/") ).unwrap();
+        std::fs::create_dir(root_dir_path.join("untagged/") ).unwrap();
+
+        let mut workspace = Workspace::create_workspace(root_dir.path().to_path_buf(), &"testspace".to_string()).unwrap();
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file1.txt"), "Hello".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file1.txt"), "Hello".to_string(), Some("World".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file2.txt"), "EndAll".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("subfolder/nested.txt"), "TODO".to_string(), None);
+
+        // Same tags as get_tags_for_file_name, for every file at once
+        let result = workspace.get_tags_for_directory(root_dir_path.clone()).unwrap();
+        assert_eq!(result.len(), 2);
+        for file_name in ["file1.txt", "file2.txt"] {
+            assert_eq!(result[file_name], workspace.get_tags_for_file_name(root_dir_path.join(file_name)).unwrap());
+        }
+
+        assert!(workspace.get_tags_for_directory(root_dir_path.join("untagged")).unwrap().is_empty());
+        assert!(workspace.get_tags_for_directory(root_dir_path.join("dir_dne")).is_err());
+
+        let dirs = vec![root_dir_path.clone(), root_dir_path.join("subfolder"), root_dir_path.join("untagged")];
+        let result = workspace.get_tags_for_directories(dirs.clone()).unwrap();
+        assert_eq!(result.len(), 3);
+        assert_eq!(result[&dirs[1]]["nested.txt"], vec![Tag::Simple("TODO".to_string())]);
+        assert!(result[&dirs[2]].is_empty());
+        assert!(workspace.get_tags_for_directories(vec![root_dir_path.join("dir_dne")]).is_err());
+    }
+
     #[test]
     fn workspace_open_remove_tags_from_file() {
         use tempdir::TempDir;
@@ -589,6 +1552,104 @@ mod tests {
         assert!(matches!(result.err().unwrap(), TagFileError::BadPath(_)));
     }
 
+    #[test]
+    fn workspace_apply_bulk() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        std::fs::create_dir_all(root_dir_path.join("assets/textures/old")).unwrap();
+        for name in ["assets/a.png", "assets/textures/b.png", "assets/textures/old/c.png", "assets/textures/notes.txt", "d.png"] {
+            File::create(root_dir_path.join(name)).unwrap();
+        }
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        let _ = workspace.add_tag_to_file(root_dir_path.join("assets/a.png"), "Old".to_string(), None);
+        let files = workspace.find_files(&root_dir_path, "assets/**/*.png").unwrap();
+        assert_eq!(files, vec![root_dir_path.join("assets/a.png"), root_dir_path.join("assets/textures/b.png"), root_dir_path.join("assets/textures/old/c.png")]);
+        assert_eq!(workspace.find_files(&root_dir_path, "*.png").unwrap(), vec![root_dir_path.join("d.png")]);
+        assert!(workspace.find_files(&root_dir_path, "assets/**").unwrap().iter().all(|path| !path.ends_with(".tag_testspace")));
+        assert!(workspace.find_files(&root_dir_path, "[").is_err());
+
+        let tags = vec![Tag::KV("Texture".to_string(), "Verso".to_string()), Tag::Simple("Old".to_string())];
+        let changed = workspace.apply_bulk(files.into_iter().map(|path| (path, tags.clone())).collect()).unwrap();
+        assert_eq!(changed, 3);
+        assert_eq!(workspace.query("Texture:Verso AND Old").unwrap().len(), 3);
+        // Adding tags a file already has changes nothing
+        assert_eq!(workspace.apply_bulk(vec![(root_dir_path.join("assets/a.png"), tags.clone())]).unwrap(), 0);
+
+        // Written to disk
+        let mut reopened = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        reopened.scan_for_tagfiles();
+        assert_eq!(reopened.get_tags_for_file_name(root_dir_path.join("assets/textures/old/c.png")).unwrap(), tags);
+        // Also when the TagFiles are loaded lazily, by apply_bulk itself
+        let mut lazy = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        lazy.enable_lazy_loading(2).unwrap();
+        assert_eq!(lazy.apply_bulk(vec![(root_dir_path.join("assets/a.png"), tags.clone()), (root_dir_path.join("assets/textures/b.png"), tags.clone())]).unwrap(), 0);
+
+        // An invalid tag or path anywhere changes nothing
+        let new_tag = vec![Tag::Simple("New".to_string())];
+        let with_bad_tag = vec![(root_dir_path.join("d.png"), new_tag.clone()), (root_dir_path.join("assets/a.png"), vec![Tag::Simple("Ok".to_string()), Tag::Simple(" ".to_string())])];
+        assert!(matches!(workspace.apply_bulk(with_bad_tag), Err(TagFileError::BadString(_))));
+        let with_bad_path = vec![(root_dir_path.join("d.png"), new_tag.clone()), (root_dir_path.join("../outside.png"), new_tag)];
+        assert!(workspace.apply_bulk(with_bad_path).is_err());
+        assert!(workspace.get_tags_for_file_name(root_dir_path.join("d.png")).unwrap().is_empty());
+        assert_eq!(workspace.get_tags_for_file_name(root_dir_path.join("assets/a.png")).unwrap(), vec![Tag::Simple("Old".to_string()), tags[0].clone()]);
+    }
+
+    #[test]
+    fn workspace_retag() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        std::fs::create_dir_all(root_dir_path.join("sub")).unwrap();
+        std::fs::create_dir_all(root_dir_path.join("untouched")).unwrap();
+        for name in ["file1.txt", "file2.txt", "sub/file3.txt", "untouched/file4.txt"] {
+            File::create(root_dir_path.join(name)).unwrap();
+        }
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        workspace.set_scan_threads(2);
+        workspace.track_changes(true);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("file1.txt"), "Due".to_string(), Some("Today".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("file1.txt"), "Draft".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("file2.txt"), "WIP".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("sub/file3.txt"), "Due".to_string(), Some("Tomorrow".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("sub/file3.txt"), "Draft".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("sub/file3.txt"), "WIP".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("untouched/file4.txt"), "Done".to_string(), None);
+        workspace.take_changes();
+        let untouched_tagfile = root_dir_path.join("untouched/.tag_testspace");
+        let untouched_modified = std::fs::metadata(&untouched_tagfile).unwrap().modified().unwrap();
+
+        let report = workspace.retag(&[Retag::RenameKey("Due".to_string(), "Deadline".to_string())]).unwrap();
+        assert_eq!(report, RetagReport { files: 2, tagfiles: 2 });
+        assert_eq!(workspace.query("Deadline:Today OR Deadline:Tomorrow").unwrap().len(), 2);
+        assert!(workspace.query("Due:*").unwrap().is_empty());
+        assert_eq!(workspace.take_changes().len(), 2);
+
+        // Merging keeps each tag once per file
+        let report = workspace.merge_tags(vec![Tag::Simple("Draft".to_string()), Tag::Simple("WIP".to_string())], Tag::Simple("InProgress".to_string())).unwrap();
+        assert_eq!(report, RetagReport { files: 3, tagfiles: 2 });
+        assert_eq!(workspace.get_tags_for_file_name(root_dir_path.join("sub/file3.txt")).unwrap(),
+                   vec![Tag::KV("Deadline".to_string(), "Tomorrow".to_string()), Tag::Simple("InProgress".to_string())]);
+        assert_eq!(workspace.tag_counts().iter().find(|(tag, _)| *tag == Tag::Simple("InProgress".to_string())).map(|(_, count)| *count), Some(3));
+
+        // Files left without tags are dropped
+        assert_eq!(workspace.delete_tag(Tag::Simple("InProgress".to_string())).unwrap(), RetagReport { files: 3, tagfiles: 2 });
+        assert!(workspace.get_tags_for_file_name(root_dir_path.join("file2.txt")).unwrap().is_empty());
+        assert_eq!(workspace.delete_tag(Tag::Simple("Unknown".to_string())).unwrap(), RetagReport::default());
+        assert!(matches!(workspace.rename_tag(Tag::Simple("Done".to_string()), Tag::Simple(" ".to_string())), Err(TagFileError::BadString(_))));
+
+        // Written to disk, without rewriting TagFiles that did not change
+        let mut reopened = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        reopened.scan_for_tagfiles();
+        assert_eq!(reopened.get_tags_for_file_name(root_dir_path.join("file1.txt")).unwrap(), vec![Tag::KV("Deadline".to_string(), "Today".to_string())]);
+        assert_eq!(reopened.get_tags_for_file_name(root_dir_path.join("untouched/file4.txt")).unwrap(), vec![Tag::Simple("Done".to_string())]);
+        assert_eq!(std::fs::metadata(&untouched_tagfile).unwrap().modified().unwrap(), untouched_modified);
+    }
+
     #[test]
     fn workspace_query_exact() {
         use tempdir::TempDir;
@@ -829,4 +1890,590 @@ mod tests {
             assert!(result.keys().any(|k| k == "./file4.txt"));
         }
     }
-}
\ No newline at end of file
+
+    #[test]
+    fn workspace_query_exact_index_matches_scan() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        std::fs::create_dir(root_dir_path.join("subfolder/") ).unwrap();
+
+        let mut workspace = Workspace::create_workspace(root_dir.path().to_path_buf(), &"testspace".to_string()).unwrap();
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file1.txt"), "Hello".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file1.txt"), "Due".to_string(), Some("Today".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file2.txt"), "Due".to_string(), Some("Hello".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file2.txt"), "Due".to_string(), Some("Later".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("subfolder/nested.txt"), "Today".to_string(), None);
+        let _ = workspace.remove_tag_from_file(root_dir_path.join("./file2.txt"), "Due".to_string(), Some("Later".to_string()));
+
+        let check = |workspace: &mut Workspace| {
+            for text in ["Hello", "Due", "Today", "Later", "Missing"] {
+                for flags in [(true, true, true), (true, false, false), (false, true, false), (false, false, true), (false, true, true)] {
+                    assert_eq!(workspace.query_exact(text, flags.0, flags.1, flags.2), workspace.query_exact_unindexed(text, flags.0, flags.1, flags.2));
+                }
+            }
+        };
+        check(&mut workspace);
+        assert_eq!(workspace.query_exact("Due", false, true, false).len(), 2);
+        assert!(workspace.query_exact("Later", true, true, true).is_empty());
+
+        // A re-opened workspace builds the index on its first query, from the TagFiles scanned
+        let mut reopened = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        reopened.scan_for_tagfiles();
+        check(&mut reopened);
+        assert_eq!(reopened.query_exact("Today", true, true, true).len(), 2);
+    }
+
+    #[test]
+    fn workspace_query_fuzzy_index_matches_scan() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        std::fs::create_dir(root_dir_path.join("subfolder/") ).unwrap();
+
+        let mut workspace = Workspace::create_workspace(root_dir.path().to_path_buf(), &"testspace".to_string()).unwrap();
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file1.txt"), "Hello".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file1.txt"), "Due".to_string(), Some("Today".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file2.txt"), "Due".to_string(), Some("Yellow".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file2.txt"), "Straße".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("subfolder/nested.txt"), "ÅNGSTRÖM".to_string(), Some("x".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("subfolder/nested.txt"), "Other two".to_string(), None);
+        let _ = workspace.remove_tag_from_file(root_dir_path.join("./file1.txt"), "Hello".to_string(), None);
+
+        for text in ["", "e", "LL", "ello", " hello ", "due", "oda", "aß", "ångs", "ström", "r tw", "He llo", "missing"] {
+            for flags in [(true, true, true), (true, false, false), (false, true, false), (false, false, true), (false, true, true)] {
+                assert_eq!(workspace.query_fuzzy(text, flags.0, flags.1, flags.2), workspace.query_fuzzy_unindexed(text, flags.0, flags.1, flags.2), "text {:?}, flags {:?}", text, flags);
+            }
+        }
+        assert_eq!(workspace.query_fuzzy("ello", true, true, true).len(), 1);
+    }
+
+    #[test]
+    fn workspace_query() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        std::fs::create_dir(root_dir_path.join("subfolder/") ).unwrap();
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file1.txt"), "Texture".to_string(), Some("Verso".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file1.txt"), "Due".to_string(), Some("Today".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file2.txt"), "Texture".to_string(), Some("Verso".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("subfolder/nested.txt"), "Personal".to_string(), None);
+
+        let result = workspace.query("Texture:Verso AND NOT Due:Today OR Personal").unwrap();
+        let mut paths: Vec<&String> = result.keys().collect();
+        paths.sort();
+        assert_eq!(paths, vec!["./file2.txt", "./subfolder/nested.txt"]);
+        assert_eq!(result["./file2.txt"], vec![Tag::KV("Texture".to_string(), "Verso".to_string())]);
+
+        // A single term gives the same files as query_exact
+        assert_eq!(workspace.query("Personal").unwrap(), workspace.query_exact("Personal", true, false, false));
+        assert!(workspace.query("Unknown OR Due:Later").unwrap().is_empty());
+        assert_eq!(workspace.query("Texture:Verso AND"), Err(QueryError::UnexpectedEnd));
+
+        // The index follows changes
+        let _ = workspace.remove_tag_from_file(root_dir_path.join("./file1.txt"), "Due".to_string(), Some("Today".to_string()));
+        assert_eq!(workspace.query("Texture:Verso NOT Due:*").unwrap().len(), 2);
+    }
+
+    #[test]
+    fn workspace_query_cursor() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        std::fs::create_dir(root_dir_path.join("subfolder/") ).unwrap();
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        for name in ["c.txt", "a.txt", "subfolder/b.txt", "b.txt"] {
+            let _ = workspace.add_tag_to_file(root_dir_path.join(name), "Hello".to_string(), None);
+        }
+        let _ = workspace.add_tag_to_file(root_dir_path.join("a.txt"), "Due".to_string(), Some("Today".to_string()));
+
+        // Same results as query_fuzzy, in a stable order
+        let mut cursor = workspace.query_fuzzy_cursor("ell", true, true, true);
+        assert_eq!(cursor.len(), 4);
+        let first = cursor.fetch(3);
+        let paths: Vec<&str> = first.iter().map(|(path, _)| path.as_str()).collect();
+        assert_eq!(paths, vec!["./a.txt", "./b.txt", "./c.txt"]);
+        assert_eq!(first[0].1, workspace.query_fuzzy("ell", true, true, true)["./a.txt"]);
+
+        // The cursor keeps its results while the workspace changes
+        let _ = workspace.remove_tag_from_file(root_dir_path.join("subfolder/b.txt"), "Hello".to_string(), None);
+        assert_eq!(cursor.fetch(3), vec![("./subfolder/b.txt".to_string(), vec![Tag::Simple("Hello".to_string())])]);
+        assert!(cursor.fetch(3).is_empty());
+
+        assert_eq!(workspace.query_exact_cursor("Today", false, false, true).collect::<HashMap<String, Vec<Tag>>>(), workspace.query_exact("Today", false, false, true));
+        assert!(workspace.query_exact_cursor("Unknown", true, true, true).is_empty());
+        assert_eq!(workspace.query_cursor("Hello AND NOT Due:*").unwrap().len(), 2);
+        assert!(workspace.query_cursor("(Hello").is_err());
+    }
+
+    #[test]
+    fn workspace_suggest() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        std::fs::create_dir(root_dir_path.join("subfolder/") ).unwrap();
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        for name in ["a.txt", "b.txt", "subfolder/c.txt"] {
+            let _ = workspace.add_tag_to_file(root_dir_path.join(name), "Due".to_string(), Some("Today".to_string()));
+        }
+        let _ = workspace.add_tag_to_file(root_dir_path.join("a.txt"), "Dune".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("b.txt"), "Due".to_string(), Some("Tomorrow".to_string()));
+        assert_eq!(workspace.suggest("du", 10), vec![("Due".to_string(), 3), ("Dune".to_string(), 1)]);
+        assert_eq!(workspace.suggest("due:", 10), vec![("Due:Today".to_string(), 3), ("Due:Tomorrow".to_string(), 1)]);
+
+        // Counts follow changes made after the index was built
+        let _ = workspace.remove_tag_from_file(root_dir_path.join("subfolder/c.txt"), "Due".to_string(), Some("Today".to_string()));
+        let _ = workspace.remove_tag_from_file(root_dir_path.join("a.txt"), "Dune".to_string(), None);
+        assert_eq!(workspace.suggest("du", 10), vec![("Due".to_string(), 2)]);
+        assert_eq!(workspace.suggest("Due:To", 1), vec![("Due:Today".to_string(), 2)]);
+
+        // And match a workspace scanned from disk
+        let mut reopened = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        reopened.scan_for_tagfiles();
+        assert_eq!(reopened.tag_counts(), workspace.tag_counts());
+        assert_eq!(reopened.tag_counts(), vec![
+            (Tag::KV("Due".to_string(), "Today".to_string()), 2), (Tag::KV("Due".to_string(), "Tomorrow".to_string()), 1)
+        ]);
+    }
+
+    #[test]
+    fn workspace_take_changes() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        std::fs::create_dir(root_dir_path.join("subfolder/") ).unwrap();
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        let _ = workspace.add_tag_to_file(root_dir_path.join("file1.txt"), "Untracked".to_string(), None);
+        assert!(workspace.take_changes().is_empty());
+
+        workspace.track_changes(true);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("subfolder/nested.txt"), "Due".to_string(), Some("Today".to_string()));
+        let _ = workspace.add_tag_to_file(root_dir_path.join("file1.txt"), "Hello".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("subfolder/nested.txt"), "Hello".to_string(), None);
+        // Removing a tag the file does not have changes nothing
+        let _ = workspace.remove_tag_from_file(root_dir_path.join("file1.txt"), "Absent".to_string(), None);
+
+        let changes = workspace.take_changes();
+        assert_eq!(changes.len(), 2);
+        assert_eq!(changes[0].directory, root_dir_path.join("subfolder").canonicalize().unwrap());
+        assert_eq!(changes[0].file_name, "nested.txt");
+        assert_eq!(changes[0].path, "./subfolder/nested.txt");
+        assert_eq!(changes[0].tags, vec![Tag::KV("Due".to_string(), "Today".to_string()), Tag::Simple("Hello".to_string())]);
+        assert_eq!(changes[1].path, "./file1.txt");
+        assert!(workspace.take_changes().is_empty());
+
+        let _ = workspace.remove_tag_from_file(root_dir_path.join("file1.txt"), "Hello".to_string(), None);
+        let _ = workspace.remove_tag_from_file(root_dir_path.join("file1.txt"), "Untracked".to_string(), None);
+        assert_eq!(workspace.take_changes()[0].tags, Vec::<Tag>::new());
+
+        workspace.track_changes(false);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("file1.txt"), "Hello".to_string(), None);
+        assert!(workspace.take_changes().is_empty());
+    }
+
+    #[test]
+    fn workspace_reload_tagfiles() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().canonicalize().unwrap();
+        std::fs::create_dir(root_dir_path.join("subfolder/") ).unwrap();
+        let root_tagfile = root_dir_path.join(".tag_testspace");
+        let nested_tagfile = root_dir_path.join("subfolder/.tag_testspace");
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        let _ = workspace.add_tag_to_file(root_dir_path.join("file1.txt"), "Hello".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("file2.txt"), "Hello".to_string(), None);
+        assert_eq!(workspace.query_exact("Hello", true, false, false).len(), 2);
+        workspace.track_changes(true);
+
+        // Another instance edits one TagFile and creates another
+        let mut other = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        other.scan_for_tagfiles();
+        let _ = other.remove_tag_from_file(root_dir_path.join("file2.txt"), "Hello".to_string(), None);
+        let _ = other.add_tag_to_file(root_dir_path.join("subfolder/nested.txt"), "Hello".to_string(), None);
+
+        let reloaded = workspace.reload_tagfiles(vec![root_tagfile.clone(), nested_tagfile.clone(), root_dir_path.join("file1.txt")]).unwrap();
+        assert_eq!(reloaded, vec![root_tagfile.clone(), nested_tagfile.clone()]);
+        let mut paths: Vec<String> = workspace.query_exact("Hello", true, false, false).into_keys().collect();
+        paths.sort();
+        assert_eq!(paths, vec!["./file1.txt", "./subfolder/nested.txt"]);
+        let mut changed: Vec<String> = workspace.take_changes().into_iter().map(|change| change.path).collect();
+        changed.sort();
+        assert_eq!(changed, vec!["./file2.txt", "./subfolder/nested.txt"]);
+
+        // Unchanged TagFiles are not reported, deleted ones are forgotten
+        assert!(workspace.reload_tagfiles(vec![root_tagfile.clone()]).unwrap().is_empty());
+        std::fs::remove_file(&nested_tagfile).unwrap();
+        assert_eq!(workspace.reload_tagfiles(vec![nested_tagfile.clone()]).unwrap(), vec![nested_tagfile.clone()]);
+        assert!(!workspace.all_tagfiles.contains_key(&nested_tagfile));
+        assert_eq!(workspace.query_exact("Hello", true, false, false).len(), 1);
+
+        // Changes not yet written win over the file on disk
+        workspace.begin_batch();
+        let _ = workspace.add_tag_to_file(root_dir_path.join("file1.txt"), "Pending".to_string(), None);
+        let _ = other.add_tag_to_file(root_dir_path.join("file1.txt"), "Other".to_string(), None);
+        assert!(workspace.reload_tagfiles(vec![root_tagfile.clone()]).unwrap().is_empty());
+        let _ = workspace.commit_batch();
+    }
+
+    #[cfg(feature = "watch")]
+    #[test]
+    fn workspace_watch() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().canonicalize().unwrap();
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        workspace.scan_for_tagfiles();
+        workspace.watch(Duration::from_millis(50)).unwrap();
+
+        let mut other = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        let _ = other.add_tag_to_file(root_dir_path.join("file1.txt"), "Hello".to_string(), None);
+
+        let mut reloaded = Vec::new();
+        for _ in 0..100 {
+            reloaded = workspace.poll_changes().unwrap();
+            if !reloaded.is_empty() {
+                break;
+            }
+            std::thread::sleep(Duration::from_millis(50));
+        }
+        assert_eq!(reloaded, vec![root_dir_path.join(".tag_testspace")]);
+        assert_eq!(workspace.query_exact("Hello", true, false, false).len(), 1);
+    }
+
+    #[test]
+    fn workspace_path_cache() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().canonicalize().unwrap();
+        std::fs::create_dir(root_dir_path.join("subfolder/") ).unwrap();
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        let _ = workspace.add_tag_to_file(root_dir_path.join("subfolder/file1.txt"), "Hello".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("subfolder/file2.txt"), "Hello".to_string(), None);
+        assert_eq!(workspace.path_cache.peek(&root_dir_path.join("subfolder")), Some(&root_dir_path.join("subfolder")));
+        // Relative paths depend on the current directory, so are not cached
+        assert!(workspace.get_tags_for_file_name(PathBuf::from("./file3.txt")).is_ok());
+        assert!(workspace.path_cache.peek(Path::new(".")).is_none());
+
+        // Results use the relative directory computed once per TagFile
+        let mut paths: Vec<String> = workspace.query_exact("Hello", true, false, false).into_keys().collect();
+        paths.sort();
+        assert_eq!(paths, vec!["./subfolder/file1.txt", "./subfolder/file2.txt"]);
+        assert_eq!(workspace.query_exact_unindexed("Hello", true, false, false).len(), 2);
+
+        // The directory moves: a rescan forgets where it was
+        std::fs::rename(root_dir_path.join("subfolder"), root_dir_path.join("moved")).unwrap();
+        workspace.scan_for_tagfiles();
+        assert!(workspace.path_cache.peek(&root_dir_path.join("subfolder")).is_none());
+        assert!(workspace.get_tags_for_file_name(root_dir_path.join("subfolder/file1.txt")).is_err());
+        assert_eq!(workspace.get_tags_for_file_name(root_dir_path.join("moved/file1.txt")).unwrap(), vec![Tag::Simple("Hello".to_string())]);
+    }
+
+    #[test]
+    fn workspace_move_file() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().canonicalize().unwrap();
+        std::fs::create_dir(root_dir_path.join("subfolder/") ).unwrap();
+        std::fs::write(root_dir_path.join("file1.txt"), "").unwrap();
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        let _ = workspace.add_tag_to_file(root_dir_path.join("file1.txt"), "Hello".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("file1.txt"), "Due".to_string(), Some("Today".to_string()));
+        let tags = workspace.get_tags_for_file_name(root_dir_path.join("file1.txt")).unwrap();
+
+        workspace.rename_file(root_dir_path.join("file1.txt"), "renamed.txt").unwrap();
+        assert!(root_dir_path.join("renamed.txt").exists());
+        assert!(workspace.get_tags_for_file_name(root_dir_path.join("file1.txt")).unwrap().is_empty());
+        assert_eq!(workspace.get_tags_for_file_name(root_dir_path.join("renamed.txt")).unwrap(), tags);
+        assert!(workspace.rename_file(root_dir_path.join("renamed.txt"), "subfolder/x").is_err());
+
+        // Into another directory, which has no TagFile yet
+        workspace.move_file(root_dir_path.join("renamed.txt"), root_dir_path.join("subfolder/moved.txt")).unwrap();
+        assert_eq!(workspace.get_tags_for_file_name(root_dir_path.join("subfolder/moved.txt")).unwrap(), tags);
+        assert_eq!(workspace.query_exact("Hello", true, false, false).into_keys().collect::<Vec<String>>(), vec!["./subfolder/moved.txt"]);
+
+        // Both TagFiles were written
+        let mut reopened = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        reopened.scan_for_tagfiles();
+        assert!(reopened.get_tags_for_file_name(root_dir_path.join("renamed.txt")).unwrap().is_empty());
+        assert_eq!(reopened.get_tags_for_file_name(root_dir_path.join("subfolder/moved.txt")).unwrap(), tags);
+
+        // A missing file is not moved, and keeps its tags
+        assert!(workspace.move_file(root_dir_path.join("missing.txt"), root_dir_path.join("other.txt")).is_err());
+    }
+
+    #[cfg(unix)]
+    #[test]
+    fn workspace_reconcile() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().canonicalize().unwrap();
+        std::fs::create_dir(root_dir_path.join("subfolder/") ).unwrap();
+        for (name, contents) in [("file1.txt", "one"), ("file2.txt", "two!"), ("copy_a.txt", "same"), ("kept.txt", "kept")] {
+            std::fs::write(root_dir_path.join(name), contents).unwrap();
+        }
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        workspace.set_scan_threads(2);
+        for name in ["file1.txt", "file2.txt", "copy_a.txt", "kept.txt"] {
+            let _ = workspace.add_tag_to_file(root_dir_path.join(name), "Hello".to_string(), None);
+        }
+        assert!(workspace.reconcile().unwrap().is_empty());
+
+        // Moved and renamed by another program. copy_a.txt gets a hard link, so its fingerprint is ambiguous
+        std::fs::rename(root_dir_path.join("file1.txt"), root_dir_path.join("subfolder/moved.txt")).unwrap();
+        std::fs::rename(root_dir_path.join("file2.txt"), root_dir_path.join("renamed.txt")).unwrap();
+        std::fs::hard_link(root_dir_path.join("copy_a.txt"), root_dir_path.join("subfolder/copy_b.txt")).unwrap();
+        std::fs::rename(root_dir_path.join("copy_a.txt"), root_dir_path.join("copy_c.txt")).unwrap();
+
+        let mut relinked = workspace.reconcile().unwrap();
+        relinked.sort();
+        assert_eq!(relinked, vec![
+            (root_dir_path.join("file1.txt"), root_dir_path.join("subfolder/moved.txt")),
+            (root_dir_path.join("file2.txt"), root_dir_path.join("renamed.txt")),
+        ]);
+        let mut paths: Vec<String> = workspace.query_exact("Hello", true, false, false).into_keys().collect();
+        paths.sort();
+        assert_eq!(paths, vec!["./copy_a.txt", "./kept.txt", "./renamed.txt", "./subfolder/moved.txt"]);
+
+        // Fingerprints were saved with the tags
+        let mut reopened = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        reopened.scan_for_tagfiles();
+        std::fs::rename(root_dir_path.join("renamed.txt"), root_dir_path.join("renamed_again.txt")).unwrap();
+        assert_eq!(reopened.reconcile().unwrap(), vec![(root_dir_path.join("renamed.txt"), root_dir_path.join("renamed_again.txt"))]);
+    }
+
+    #[test]
+    fn workspace_scan_for_tagfiles_cached() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        std::fs::create_dir(root_dir_path.join("subfolder/") ).unwrap();
+        let snapshot_path = root_dir_path.join(".tagsnap_testspace");
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        let _ = workspace.add_tag_to_file(root_dir_path.join("./file1.txt"), "Hello".to_string(), None);
+        let _ = workspace.add_tag_to_file(root_dir_path.join("subfolder/nested.txt"), "Due".to_string(), Some("Today".to_string()));
+
+        let open = |cached: bool| {
+            let mut w = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+            if cached { w.scan_for_tagfiles_cached() } else { w.scan_for_tagfiles() }
+            w
+        };
+        let check = |cached: &mut Workspace, scanned: &mut Workspace| {
+            assert_eq!(cached.all_tagfiles.len(), scanned.all_tagfiles.len());
+            for (path, tf) in &scanned.all_tagfiles {
+                assert_eq!(cached.all_tagfiles[path].get_mapping(), tf.get_mapping());
+            }
+            // Each workspace has its own SymbolTable, so compare the strings
+            assert_eq!(cached.tag_counts(), scanned.tag_counts());
+            assert_eq!(cached.query_exact("Today", true, true, true), scanned.query_exact("Today", true, true, true));
+        };
+
+        // First open writes the snapshot, later opens start from it
+        let mut cached = open(true);
+        assert!(snapshot_path.exists());
+        check(&mut cached, &mut open(false));
+
+        let _ = workspace.add_tag_to_file(root_dir_path.join("subfolder/nested.txt"), "Later".to_string(), None);
+        std::fs::create_dir(root_dir_path.join("new_folder/") ).unwrap();
+        let _ = workspace.add_tag_to_file(root_dir_path.join("new_folder/new.txt"), "Today".to_string(), None);
+        let mut cached = open(true);
+        check(&mut cached, &mut open(false));
+        assert_eq!(cached.query_exact("Today", true, true, true).len(), 2);
+
+        // A corrupt snapshot falls back to a full scan, and is replaced
+        std::fs::write(&snapshot_path, "garbage").unwrap();
+        check(&mut open(true), &mut open(false));
+        assert!(Snapshot::load(&snapshot_path, &SymbolTable::new()).is_ok());
+    }
+
+    #[test]
+    fn workspace_lazy_loading() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        let cannon_root = root_dir_path.canonicalize().unwrap();
+        for dir in ["a", "b", "c"] {
+            std::fs::create_dir(root_dir_path.join(dir)).unwrap();
+        }
+        {
+            let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+            for dir in ["a", "b", "c"] {
+                workspace.add_tag_to_file(root_dir_path.join(dir).join("file.txt"), "Tag".to_string(), Some(dir.to_string())).unwrap();
+            }
+        }
+
+        let mut workspace = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        workspace.enable_lazy_loading(2).unwrap();
+        let lazy_paths = |workspace: &Workspace| -> Vec<&str> {
+            let mut names: Vec<&str> = ["a", "b", "c"].into_iter()
+                .filter(|dir| workspace.lazy_tagfiles.as_ref().unwrap().peek(&cannon_root.join(dir).join(".tag_testspace")).is_some())
+                .collect();
+            names.sort();
+            names
+        };
+
+        // TagFiles are loaded on first access, and the least recently used is dropped
+        let tags = workspace.get_tags_for_file_name(root_dir_path.join("a/file.txt")).unwrap();
+        assert_eq!(tags, vec![Tag::KV("Tag".to_string(), "a".to_string())]);
+        assert!(workspace.get_tags_for_file_name(root_dir_path.join("b/other.txt")).unwrap().is_empty());
+        assert_eq!(lazy_paths(&workspace), vec!["a", "b"]);
+        workspace.get_tags_for_file_name(root_dir_path.join("a/file.txt")).unwrap();
+        workspace.get_tags_for_file_name(root_dir_path.join("c/file.txt")).unwrap();
+        assert_eq!(lazy_paths(&workspace), vec!["a", "c"]);
+        assert!(workspace.all_tagfiles.is_empty());
+
+        // Adding to a TagFile that is not loaded yet keeps its existing tags
+        workspace.add_tag_to_file(root_dir_path.join("b/file.txt"), "New".to_string(), None).unwrap();
+        let tags = workspace.get_tags_for_file_name(root_dir_path.join("b/file.txt")).unwrap();
+        assert_eq!(tags, vec![Tag::KV("Tag".to_string(), "b".to_string()), Tag::Simple("New".to_string())]);
+        // Edits that leave a file's tags as they were change nothing, even in a TagFile that is not loaded yet
+        workspace.track_changes(true);
+        workspace.add_tag_to_file(root_dir_path.join("a/file.txt"), "Tag".to_string(), Some("a".to_string())).unwrap();
+        assert_eq!(lazy_paths(&workspace), vec!["a", "b"]);
+        workspace.remove_tag_from_file(root_dir_path.join("c/file.txt"), "Absent".to_string(), None).unwrap();
+        assert!(workspace.take_changes().is_empty());
+        workspace.track_changes(false);
+        workspace.remove_tag_from_file(root_dir_path.join("a/file.txt"), "Tag".to_string(), Some("a".to_string())).unwrap();
+
+        // A query loads every TagFile
+        let result = workspace.query_exact("Tag", false, true, false);
+        assert!(workspace.lazy_tagfiles.is_none());
+        assert_eq!(workspace.all_tagfiles.len(), 3);
+        let mut files: Vec<String> = result.into_keys().collect();
+        files.sort();
+        assert_eq!(files, vec![Path::new(".").join("b/file.txt").to_string_lossy(), Path::new(".").join("c/file.txt").to_string_lossy()]);
+    }
+
+    #[test]
+    fn workspace_batch() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        for dir in ["a", "b"] {
+            std::fs::create_dir(root_dir_path.join(dir)).unwrap();
+        }
+        let tagfile_a = root_dir_path.join("a/.tag_testspace");
+        let tagfile_b = root_dir_path.join("b/.tag_testspace");
+        let read = |path: &PathBuf| std::fs::read_to_string(path).unwrap_or_default();
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        workspace.add_tag_to_file(root_dir_path.join("a/file.txt"), "First".to_string(), None).unwrap();
+        let before = read(&tagfile_a);
+        assert!(before.contains("First"));
+
+        // Nothing is written until the outermost batch is committed
+        workspace.begin_batch();
+        workspace.add_tag_to_file(root_dir_path.join("a/file.txt"), "Second".to_string(), None).unwrap();
+        workspace.begin_batch();
+        workspace.add_tag_to_file(root_dir_path.join("b/file.txt"), "Third".to_string(), None).unwrap();
+        workspace.remove_tag_from_file(root_dir_path.join("a/file.txt"), "First".to_string(), None).unwrap();
+        workspace.commit_batch().unwrap();
+        assert_eq!(read(&tagfile_a), before);
+        assert!(!tagfile_b.exists());
+        assert_eq!(workspace.query_exact("Third", true, true, true).len(), 1);
+        assert_eq!(workspace.dirty_tagfiles.len(), 2);
+        workspace.commit_batch().unwrap();
+        assert!(read(&tagfile_a).contains("Second") && !read(&tagfile_a).contains("First"));
+        assert!(read(&tagfile_b).contains("Third"));
+        assert!(workspace.dirty_tagfiles.is_empty());
+
+        // Explicit flush, and flush on drop
+        workspace.begin_batch();
+        workspace.add_tag_to_file(root_dir_path.join("a/file.txt"), "Fourth".to_string(), None).unwrap();
+        workspace.flush().unwrap();
+        assert!(read(&tagfile_a).contains("Fourth"));
+        workspace.add_tag_to_file(root_dir_path.join("b/file.txt"), "Fifth".to_string(), None).unwrap();
+        drop(workspace);
+        assert!(read(&tagfile_b).contains("Fifth"));
+
+        // In lazy mode, a TagFile dropped from the cache is written first, and a scan keeps unsaved changes
+        let mut workspace = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        workspace.enable_lazy_loading(1).unwrap();
+        workspace.begin_batch();
+        workspace.add_tag_to_file(root_dir_path.join("a/file.txt"), "Sixth".to_string(), None).unwrap();
+        workspace.add_tag_to_file(root_dir_path.join("b/file.txt"), "Seventh".to_string(), None).unwrap();
+        assert!(read(&tagfile_a).contains("Sixth"));
+        assert!(!read(&tagfile_b).contains("Seventh"));
+        assert_eq!(workspace.query_exact("Seventh", true, true, true).len(), 1);
+        assert_eq!(workspace.query_exact("Sixth", true, true, true).len(), 1);
+        workspace.commit_batch().unwrap();
+        assert!(read(&tagfile_b).contains("Seventh"));
+    }
+
+    #[test]
+    fn workspace_durability() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        for durability in [Durability::None, Durability::FsyncFile, Durability::FsyncFileAndDir] {
+            workspace.set_durability(durability);
+            workspace.add_tag_to_file(root_dir_path.join("file.txt"), durability.to_string(), None).unwrap();
+        }
+        let contents = std::fs::read_to_string(root_dir_path.join(".tag_testspace")).unwrap();
+        assert!(contents.contains("none") && contents.contains("file-and-dir"));
+
+        // Only the workspace file and the TagFile are left, no temporary files
+        assert_eq!(std::fs::read_dir(&root_dir_path).unwrap().count(), 2);
+    }
+
+    #[test]
+    fn workspace_migrate_tagfiles() {
+        use tempdir::TempDir;
+
+        let root_dir: TempDir = TempDir::new("test").unwrap();
+        let root_dir_path = root_dir.path().to_path_buf();
+        for dir in ["a", "b", "c"] {
+            std::fs::create_dir(root_dir_path.join(dir)).unwrap();
+        }
+        let is_binary = |dir: &str| std::fs::read(root_dir_path.join(dir).join(".tag_testspace")).unwrap()[0] == 0xFF;
+
+        let mut workspace = Workspace::create_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        workspace.add_tag_to_file(root_dir_path.join("a/file.txt"), "A".to_string(), None).unwrap();
+        workspace.add_tag_to_file(root_dir_path.join("b/file.txt"), "Due".to_string(), Some("B".to_string())).unwrap();
+        drop(workspace);
+
+        // Every TagFile is converted, and new TagFiles use the new format
+        let mut workspace = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        workspace.enable_lazy_loading(1).unwrap();
+        assert_eq!(workspace.migrate_tagfiles(TagFileFormat::Binary).unwrap(), 2);
+        assert!(is_binary("a") && is_binary("b"));
+        workspace.add_tag_to_file(root_dir_path.join("c/file.txt"), "C".to_string(), None).unwrap();
+        assert!(is_binary("c"));
+        assert_eq!(workspace.migrate_tagfiles(TagFileFormat::Binary).unwrap(), 0);
+        drop(workspace);
+
+        // Binary TagFiles are read transparently, and keep their format when changed
+        let mut workspace = Workspace::open_workspace(root_dir_path.clone(), &"testspace".to_string()).unwrap();
+        workspace.scan_for_tagfiles();
+        assert_eq!(workspace.get_tags_for_file_name(root_dir_path.join("b/file.txt")).unwrap(), vec![Tag::KV("Due".to_string(), "B".to_string())]);
+        workspace.add_tag_to_file(root_dir_path.join("a/file.txt"), "A2".to_string(), None).unwrap();
+        assert!(is_binary("a"));
+        assert_eq!(workspace.migrate_tagfiles(TagFileFormat::Toml).unwrap(), 3);
+        assert!(std::fs::read_to_string(root_dir_path.join("a/.tag_testspace")).unwrap().contains("A2"));
+    }
+}